@@ -0,0 +1,116 @@
+"""
+API de acesso ao arquivo fiscal (XMLs e DANFE)
+"""
+
+import frappe
+from frappe import _
+
+
+@frappe.whitelist()
+def download_xml(chave, tipo="proc", sufixo=None):
+    """
+    Faz download de um XML do arquivo fiscal
+
+    Args:
+        chave: Chave de acesso (ou Id, para inutilização)
+        tipo: nfe, proc, evento ou inut
+        sufixo: Sufixo do documento (ex: evento "110111-01")
+    """
+    from erpnext_fiscal_br.services.archive import ler, ArquivoNaoEncontrado
+
+    _verificar_permissao(chave)
+
+    try:
+        conteudo = ler(chave, tipo, sufixo)
+    except ArquivoNaoEncontrado:
+        frappe.throw(_("XML não encontrado no arquivo fiscal"), frappe.DoesNotExistError)
+
+    frappe.local.response.filename = f"{chave}-{tipo}{'-' + sufixo if sufixo else ''}.xml"
+    frappe.local.response.filecontent = conteudo
+    frappe.local.response.type = "download"
+
+
+@frappe.whitelist()
+def download_danfe(nota_fiscal):
+    """
+    Retorna o DANFE (PDF) da nota, renderizando no primeiro acesso
+
+    Args:
+        nota_fiscal: Nome da Nota Fiscal
+    """
+    from erpnext_fiscal_br.services.danfe_cache import obter_danfe
+
+    nf = frappe.get_doc("Nota Fiscal", nota_fiscal)
+    nf.check_permission("read")
+
+    if not nf.chave_acesso or not nf.protocolo_autorizacao:
+        frappe.throw(_("DANFE disponível apenas para notas autorizadas"))
+
+    # Tipo "pdf" abre no navegador (visualizar/imprimir)
+    frappe.local.response.filename = f"DANFE_{nf.chave_acesso}.pdf"
+    frappe.local.response.filecontent = obter_danfe(nf)
+    frappe.local.response.type = "pdf"
+
+
+@frappe.whitelist()
+def download_danfe_recebido(documento_recebido):
+    """
+    Retorna o DANFE (PDF) de uma NFe recebida de fornecedor, gerado do procNFe
+
+    Args:
+        documento_recebido: Chave de acesso do Documento Recebido
+    """
+    from erpnext_fiscal_br.services.danfe_cache import obter_danfe_recebido
+
+    doc = frappe.get_doc("Documento Recebido", documento_recebido)
+    doc.check_permission("read")
+
+    if not doc.xml_documento:
+        frappe.throw(_("XML completo ainda não recebido. Faça a manifestação da NFe para baixá-lo."))
+
+    frappe.local.response.filename = f"DANFE_{doc.chave_acesso}.pdf"
+    frappe.local.response.filecontent = obter_danfe_recebido(doc)
+    frappe.local.response.type = "pdf"
+
+
+@frappe.whitelist(methods=["POST"])
+def exportar_xmls(empresa, data_inicial, data_final, modelo=None, status_notas=None):
+    """
+    Agenda o pacote de XMLs do período (procNFe, cancelamentos e CC-e com índice CSV)
+
+    Args:
+        empresa: Nome da empresa
+        data_inicial: Início do período (data de autorização)
+        data_final: Fim do período
+        modelo: 55, 65 ou vazio para ambos
+        status_notas: Autorizada, Cancelada ou vazio para ambos
+
+    Returns:
+        dict: Nome da Exportação Fiscal (acompanhar situacao/processadas/arquivo)
+    """
+    doc = frappe.get_doc({
+        "doctype": "Exportacao Fiscal",
+        "tipo": "XML",
+        "empresa": empresa,
+        "data_inicial": data_inicial,
+        "data_final": data_final,
+        "modelo": modelo,
+        "status_notas": status_notas,
+    }).insert()
+
+    return {
+        "success": True,
+        "exportacao": doc.name,
+        "message": _("Exportação de XMLs iniciada")
+    }
+
+
+def _verificar_permissao(chave):
+    """O XML segue a permissão de leitura do documento a que pertence"""
+    nota = frappe.db.get_value("Nota Fiscal", {"chave_acesso": chave}, "name")
+    if nota:
+        frappe.get_doc("Nota Fiscal", nota).check_permission("read")
+    elif frappe.db.exists("Documento Recebido", chave):
+        frappe.get_doc("Documento Recebido", chave).check_permission("read")
+    else:
+        frappe.has_permission("Arquivo Fiscal", "read", throw=True)
@@ -0,0 +1,70 @@
+"""
+API de consulta ao Índice Fiscal (campos extraídos dos XMLs arquivados)
+"""
+
+import frappe
+from frappe import _
+from frappe.utils import cint
+
+
+@frappe.whitelist()
+def consultar(cnpj=None, papel=None, ncm=None, cfop=None, de=None, ate=None, empresa=None,
+        origem=None, tipo_evento=None, itens=0, limite=None):
+    """
+    Busca notas emitidas e recebidas pelos campos do XML, sem abrir os XMLs
+
+    Ex: notas para o CNPJ X com NCM Y no 2º trimestre -
+    consultar(cnpj=X, papel="destinatario", ncm=Y, de="2024-04-01", ate="2024-06-30")
+
+    Args:
+        cnpj: CNPJ/CPF do participante
+        papel: "emitente" ou "destinatario" (padrão: qualquer um)
+        ncm: NCM do item (com menos de 8 dígitos, busca pelo prefixo)
+        cfop: CFOP do item
+        de: Data de emissão inicial (AAAA-MM-DD)
+        ate: Data de emissão final (AAAA-MM-DD)
+        empresa: Empresa emitente ou destinatária
+        origem: "Emitida" ou "Recebida"
+        tipo_evento: Apenas notas com o evento (ex: "110111" - cancelamento)
+        itens: 1 para devolver os itens que atendem ao NCM/CFOP
+        limite: Máximo de linhas
+
+    Returns:
+        dict: success, quantidade e resultados
+    """
+    from erpnext_fiscal_br.services.indice_fiscal import consultar as consultar_indice
+
+    frappe.has_permission("Indice Fiscal", "read", throw=True)
+
+    # A consulta é SQL direto: as permissões de usuário por Company são aplicadas aqui
+    empresas = empresas_permitidas()
+    if empresa and empresas is not None and empresa not in empresas:
+        frappe.throw(
+            _("Sem permissão para consultar as notas da empresa {0}").format(empresa),
+            frappe.PermissionError
+        )
+
+    resultados = consultar_indice(
+        cnpj=cnpj, papel=papel, ncm=ncm, cfop=cfop, de=de, ate=ate, empresa=empresa,
+        origem=origem, tipo_evento=tipo_evento, itens=cint(itens), limite=limite, empresas=empresas
+    )
+
+    return {
+        "success": True,
+        "quantidade": len(resultados),
+        "resultados": resultados,
+    }
+
+
+def empresas_permitidas():
+    """
+    Empresas cujas notas o usuário pode consultar
+
+    Returns:
+        list: Empresas com configuração fiscal visíveis ao usuário, ou None se
+            ele não tiver permissões de usuário restringindo Company
+    """
+    if "Company" not in frappe.get_user_permissions():
+        return None
+
+    return frappe.get_list("Configuracao Fiscal", pluck="empresa")
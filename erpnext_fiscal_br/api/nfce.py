@@ -83,3 +83,34 @@ def get_nfce_config(empresa):
         "has_csc": has_csc,
         "warning": None if has_csc else _("CSC não configurado para NFCe")
     }
+
+
+@frappe.whitelist()
+def danfce_escpos(nota_fiscal, colunas=48):
+    """
+    Retorna o DANFCE em ESC/POS (bytes crus) para o agente de impressão local
+    
+    Args:
+        nota_fiscal: Nome da Nota Fiscal (NFC-e autorizada)
+        colunas: Colunas da impressora (48 para 80mm, 32 para 58mm)
+    """
+    from frappe.utils import cint
+    from erpnext_fiscal_br.services.danfe_cache import xml_nota
+    from erpnext_fiscal_br.services.escpos import gerar_danfce_escpos
+    
+    nf = frappe.get_doc("Nota Fiscal", nota_fiscal)
+    nf.check_permission("read")
+    
+    if nf.modelo != "65":
+        frappe.throw(_("Impressão ESC/POS disponível apenas para NFC-e"))
+    
+    if not nf.chave_acesso or not nf.protocolo_autorizacao:
+        frappe.throw(_("DANFCE disponível apenas para notas autorizadas"))
+    
+    xml, protocolo_nota = xml_nota(nf)
+    if not xml:
+        frappe.throw(_("XML da nota não encontrado para gerar o DANFCE"))
+    
+    frappe.local.response.filename = f"DANFCE_{nf.chave_acesso}.bin"
+    frappe.local.response.filecontent = gerar_danfce_escpos(xml, colunas=cint(colunas) or 48, **protocolo_nota)
+    frappe.local.response.type = "binary"
@@ -616,6 +616,54 @@ def carta_correcao(nota_fiscal, correcao):
         }
 
 
+@frappe.whitelist()
+def cancelar_notas_em_lote(notas, justificativa):
+    """
+    Cancela várias NFe em background, em lotes de até 20 eventos por empresa
+    
+    Args:
+        notas: Lista (ou JSON) com os nomes das Notas Fiscais
+        justificativa: Justificativa do cancelamento, comum a todas
+    
+    Returns:
+        dict: Quantidade de notas enfileiradas por empresa
+    """
+    notas = frappe.parse_json(notas)
+    
+    frappe.has_permission("Nota Fiscal", "write", throw=True)
+    
+    if len(justificativa or "") < 15:
+        return {
+            "success": False,
+            "error": _("Justificativa deve ter no mínimo 15 caracteres")
+        }
+    
+    por_empresa = {}
+    for nota, empresa in frappe.get_all(
+        "Nota Fiscal",
+        filters={"name": ["in", notas], "status": "Autorizada"},
+        fields=["name", "empresa"],
+        as_list=True
+    ):
+        # get_all não aplica permissões: cada nota é verificada antes do envio
+        frappe.has_permission("Nota Fiscal", "write", doc=nota, throw=True)
+        por_empresa.setdefault(empresa, []).append(nota)
+    
+    for empresa, notas_empresa in por_empresa.items():
+        frappe.enqueue(
+            "erpnext_fiscal_br.services.eventos.cancelar_notas",
+            queue="long",
+            empresa=empresa,
+            notas=notas_empresa,
+            justificativa=justificativa
+        )
+    
+    return {
+        "success": bool(por_empresa),
+        "enfileiradas": {empresa: len(notas_empresa) for empresa, notas_empresa in por_empresa.items()}
+    }
+
+
 @frappe.whitelist()
 def inutilizar_numeracao(empresa, serie, numero_inicial, numero_final, justificativa, modelo="55"):
     """
@@ -632,39 +680,25 @@ def inutilizar_numeracao(empresa, serie, numero_inicial, numero_final, justifica
     Returns:
         dict: Resultado da inutilização
     """
-    from erpnext_fiscal_br.services.transmitter import SEFAZTransmitter
-    
     try:
-        transmitter = SEFAZTransmitter(empresa)
-        resultado = transmitter.inutilizar_numeracao(
-            serie, numero_inicial, numero_final, justificativa, modelo
-        )
-        
-        # Cria evento de inutilização
-        if resultado.get("cStat") in ["102"]:
-            for num in range(int(numero_inicial), int(numero_final) + 1):
-                nf = frappe.new_doc("Nota Fiscal")
-                nf.modelo = modelo
-                nf.serie = serie
-                nf.numero = num
-                nf.empresa = empresa
-                nf.status = "Inutilizada"
-                nf.cliente_nome = "INUTILIZADA"
-                nf.cpf_cnpj_destinatario = "00000000000"
-                nf.logradouro = "N/A"
-                nf.numero_endereco = "0"
-                nf.bairro = "N/A"
-                nf.cidade = "N/A"
-                nf.uf = "SP"
-                nf.cep = "00000000"
-                nf.codigo_municipio = "0000000"
-                nf.mensagem_sefaz = justificativa
-                nf.insert(ignore_permissions=True)
+        # Uma faixa registrada em um único documento, sem uma Nota Fiscal por número
+        inutilizacao = frappe.get_doc({
+            "doctype": "Inutilizacao Numeracao",
+            "empresa": empresa,
+            "modelo": modelo,
+            "serie": serie,
+            "numero_inicial": numero_inicial,
+            "numero_final": numero_final,
+            "justificativa": justificativa,
+        })
+        inutilizacao.insert(ignore_permissions=True)
+        resultado = inutilizacao.transmitir()
         
         return {
             "success": resultado.get("cStat") in ["102"],
             "codigo": resultado.get("cStat"),
-            "mensagem": resultado.get("xMotivo")
+            "mensagem": resultado.get("xMotivo"),
+            "inutilizacao": inutilizacao.name
         }
     except Exception as e:
         return {
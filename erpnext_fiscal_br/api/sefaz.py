@@ -91,10 +91,49 @@ def consultar_cadastro(empresa, uf, documento):
     Returns:
         dict: Dados cadastrais
     """
-    # Implementação futura
+    from erpnext_fiscal_br.services.cadastro import consultar_cadastro as consultar
+    from erpnext_fiscal_br.services.transmitter import SEFAZTransmitter
+    
+    try:
+        cadastro = consultar(uf, documento, SEFAZTransmitter(empresa))
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+    
     return {
-        "success": False,
-        "error": _("Funcionalidade não implementada")
+        "success": cadastro.get("encontrado", False),
+        "cadastro": cadastro,
+        "error": None if cadastro.get("encontrado") else cadastro.get("mensagem")
+    }
+
+
+@frappe.whitelist()
+def atualizar_cadastro_clientes(empresa=None):
+    """
+    Enfileira a atualização do cache de situação cadastral dos clientes contribuintes
+    
+    Args:
+        empresa: Empresa cujo certificado será usado (opcional)
+    
+    Returns:
+        dict: Resultado do agendamento
+    """
+    # Consulta todos os clientes contribuintes e consome a cota da SEFAZ
+    frappe.only_for(("System Manager", "Fiscal Manager"))
+    
+    frappe.enqueue(
+        "erpnext_fiscal_br.tasks.atualizar_cadastro_clientes",
+        queue="long",
+        job_id="atualizar_cadastro_clientes",
+        deduplicate=True,
+        empresa=empresa
+    )
+    
+    return {
+        "success": True,
+        "message": _("Atualização do cadastro de clientes iniciada")
     }
 
 
@@ -110,10 +149,60 @@ def download_nfe(empresa, chave_acesso):
     Returns:
         dict: XML da NFe
     """
-    # Implementação futura - requer manifestação do destinatário
+    from erpnext_fiscal_br.services.distribuicao import DistribuicaoDFe
+    
+    # A NFe completa só é distribuída após a manifestação do destinatário;
+    # antes disso a SEFAZ retorna apenas o resumo (resNFe)
+    try:
+        resultado = DistribuicaoDFe(empresa).consultar_chave(chave_acesso)
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+    
+    if resultado.get("cStat") != "138":
+        return {
+            "success": False,
+            "codigo": resultado.get("cStat"),
+            "error": resultado.get("xMotivo")
+        }
+    
+    completo = next(
+        (d for d in resultado["documentos"] if d.get("tipo_documento") == "Completo"),
+        None
+    )
+    
+    return {
+        "success": completo is not None,
+        "documento": chave_acesso if frappe.db.exists("Documento Recebido", chave_acesso) else None,
+        "xml": completo["xml"].decode("utf-8") if completo else None,
+        "error": None if completo else _("SEFAZ retornou apenas o resumo. Manifeste a ciência da operação para obter o XML.")
+    }
+
+
+@frappe.whitelist()
+def reconciliar_notas_processando():
+    """
+    Consulta na SEFAZ, em segundo plano, as notas presas em Processando
+    
+    Returns:
+        dict: Resultado do agendamento
+    """
+    # Consulta as notas de todas as empresas e consome a cota da SEFAZ
+    frappe.only_for(("System Manager", "Fiscal Manager"))
+    
+    frappe.enqueue(
+        "erpnext_fiscal_br.services.reconciliacao.reconciliar_notas_processando",
+        queue="long",
+        job_id="reconciliar_notas_processando",
+        deduplicate=True,
+        idade_minima=0
+    )
+    
     return {
-        "success": False,
-        "error": _("Funcionalidade não implementada")
+        "success": True,
+        "message": _("Reconciliação das notas em processamento iniciada")
     }
 
 
@@ -158,3 +247,37 @@ def get_ambiente_info(empresa):
             "dias_para_expirar": cert.dias_para_expirar if cert else None
         } if cert else None
     }
+
+
+@frappe.whitelist()
+def get_metricas_consumo(empresa=None):
+    """
+    Retorna os contadores do limitador de consumo da SEFAZ
+    (requisições aguardadas, recusadas, reaproveitadas, duplicadas e bloqueios)
+    
+    Args:
+        empresa: Nome da empresa (opcional, filtra pelo CNPJ)
+    
+    Returns:
+        dict: Métricas por CNPJ, autorizador e serviço
+    """
+    from erpnext_fiscal_br.services.rate_limiter import get_metricas
+    
+    frappe.only_for(("System Manager", "Fiscal Manager"))
+    
+    cnpj = None
+    if empresa:
+        from erpnext_fiscal_br.fiscal_br.doctype.configuracao_fiscal.configuracao_fiscal import ConfiguracaoFiscal
+        
+        config = ConfiguracaoFiscal.get_config_for_company(empresa)
+        if not config:
+            return {
+                "success": False,
+                "error": _("Configuração fiscal não encontrada")
+            }
+        cnpj = config.cnpj
+    
+    return {
+        "success": True,
+        "metricas": get_metricas(cnpj)
+    }
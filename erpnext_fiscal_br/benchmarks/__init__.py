@@ -0,0 +1,2 @@
+# Benchmarks module
+# Execute via bench: bench --site <site> execute erpnext_fiscal_br.benchmarks.<modulo>.run
@@ -0,0 +1,103 @@
+"""
+Benchmark da geração do DANFE a partir do procNFe
+Mede tempo, folhas, tamanho do PDF e pico de memória para notas de
+1, 100 e 990 itens (limite de itens da NF-e)
+
+Uso:
+    bench --site <site> execute erpnext_fiscal_br.benchmarks.danfe.run
+"""
+
+import re
+import time
+import tracemalloc
+
+from erpnext_fiscal_br.services.danfe import gerar_danfe_xml
+
+CHAVE = "35240112345678000199550010000012341000012345"
+
+QUANTIDADES = (1, 100, 990)
+
+
+def _det(seq):
+    return (
+        f'<det nItem="{seq}"><prod><cProd>PROD{seq:05d}</cProd><cEAN>SEM GTIN</cEAN>'
+        f'<xProd>PRODUTO DE TESTE NUMERO {seq} COM DESCRICAO LONGA</xProd><NCM>84713012</NCM>'
+        '<CFOP>5102</CFOP><uCom>UN</uCom><qCom>2.0000</qCom><vUnCom>15.5000000000</vUnCom>'
+        '<vProd>31.00</vProd><cEANTrib>SEM GTIN</cEANTrib><uTrib>UN</uTrib><qTrib>2.0000</qTrib>'
+        '<vUnTrib>15.5000000000</vUnTrib><indTot>1</indTot></prod>'
+        '<imposto><ICMS><ICMS00><orig>0</orig><CST>00</CST><modBC>3</modBC><vBC>31.00</vBC>'
+        '<pICMS>18.00</pICMS><vICMS>5.58</vICMS></ICMS00></ICMS></imposto></det>'
+    )
+
+
+def proc_nfe(itens):
+    """Monta um procNFe de teste com a quantidade de itens informada"""
+    total = f"{31 * itens:.2f}"
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"><NFe>'
+        f'<infNFe Id="NFe{CHAVE}" versao="4.00">'
+        '<ide><cUF>35</cUF><natOp>VENDA DE MERCADORIA</natOp><mod>55</mod><serie>1</serie>'
+        '<nNF>1234</nNF><dhEmi>2024-01-15T10:00:00-03:00</dhEmi><tpNF>1</tpNF></ide>'
+        '<emit><CNPJ>12345678000199</CNPJ><xNome>EMPRESA EMITENTE LTDA</xNome>'
+        '<enderEmit><xLgr>AVENIDA INDUSTRIAL</xLgr><nro>1500</nro><xBairro>DISTRITO INDUSTRIAL</xBairro>'
+        '<xMun>CAMPINAS</xMun><UF>SP</UF><CEP>13000000</CEP><fone>1932345678</fone></enderEmit>'
+        '<IE>123456789012</IE></emit>'
+        '<dest><CNPJ>98765432000188</CNPJ><xNome>CLIENTE DESTINATARIO LTDA</xNome>'
+        '<enderDest><xLgr>RUA DAS FLORES</xLgr><nro>100</nro><xBairro>CENTRO</xBairro>'
+        '<xMun>SAO PAULO</xMun><UF>SP</UF></enderDest></dest>'
+        + "".join(_det(i) for i in range(1, itens + 1))
+        + f'<total><ICMSTot><vBC>{total}</vBC><vICMS>0.00</vICMS><vFrete>0.00</vFrete><vSeg>0.00</vSeg>'
+        f'<vDesc>0.00</vDesc><vOutro>0.00</vOutro><vIPI>0.00</vIPI><vProd>{total}</vProd>'
+        f'<vNF>{total}</vNF></ICMSTot></total>'
+        '<infAdic><infCpl>DOCUMENTO EMITIDO POR ME OU EPP OPTANTE PELO SIMPLES NACIONAL</infCpl></infAdic>'
+        '</infNFe></NFe>'
+        f'<protNFe versao="4.00"><infProt><chNFe>{CHAVE}</chNFe>'
+        '<dhRecbto>2024-01-15T10:00:05-03:00</dhRecbto><nProt>135240000012345</nProt>'
+        '<cStat>100</cStat></infProt></protNFe></nfeProc>'
+    ).encode("utf-8")
+
+
+def run(repeticoes=5):
+    """
+    Executa o benchmark e imprime os resultados por quantidade de itens
+
+    Args:
+        repeticoes: Gerações por amostra (o tempo é a média)
+
+    Returns:
+        list: Resultados por amostra
+    """
+    resultados = []
+
+    for itens in QUANTIDADES:
+        xml = proc_nfe(itens)
+
+        inicio = time.perf_counter()
+        for _ in range(repeticoes):
+            pdf = gerar_danfe_xml(xml)
+        tempo = (time.perf_counter() - inicio) / repeticoes
+
+        tracemalloc.start()
+        gerar_danfe_xml(xml)
+        _atual, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        linha = {
+            "itens": itens,
+            "folhas": len(re.findall(rb"/Type /Page\b", pdf)),
+            "tempo_ms": round(tempo * 1000, 1),
+            "pdf_kb": round(len(pdf) / 1024, 1),
+            "pico_memoria_kb": round(pico / 1024, 1),
+        }
+        resultados.append(linha)
+        print(
+            f"{itens:>4} itens | {linha['folhas']:>3} folhas | {linha['tempo_ms']:>8} ms | "
+            f"PDF {linha['pdf_kb']:>7} KB | pico {linha['pico_memoria_kb']:>8} KB"
+        )
+
+    return resultados
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,149 @@
+"""
+Benchmark da EFD-Contribuições
+Gera os trechos de um estabelecimento (0140 e C010) e a totalização por CST
+e alíquota para um mês sintético de 100 mil e 1 milhão de itens, medindo
+tempo, itens por segundo, tamanho do arquivo e pico de memória
+
+As notas são produzidas em memória no formato de sped.documentos (uma por
+vez, como o cursor do servidor entrega), sem acesso ao banco: o resultado
+mede a geração e a totalização, não a leitura do MariaDB. O pico de memória
+deve ficar estável entre os dois volumes.
+
+Uso:
+    bench --site <site> execute erpnext_fiscal_br.benchmarks.efd_contribuicoes.run
+"""
+
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import frappe
+
+from erpnext_fiscal_br.services import sped
+from erpnext_fiscal_br.services.efd_contribuicoes import EstabelecimentoContribuicoes
+from erpnext_fiscal_br.services.sped import ArquivoSPED
+
+QUANTIDADES = (100_000, 1_000_000)
+
+ITENS_POR_NOTA = 10
+
+CONFIG = frappe._dict(
+    empresa="Benchmark EFD",
+    cnpj="12345678000199",
+    uf_emissao="SP",
+    inscricao_estadual="123456789012",
+    codigo_municipio="3509502",
+    inscricao_municipal="",
+)
+
+# (CST PIS, alíquota PIS, CST COFINS, alíquota COFINS)
+TRIBUTACOES = (
+    ("01", 1.65, "01", 7.6),
+    ("01", 1.65, "01", 7.6),
+    ("06", 0, "06", 0),
+    ("04", 0, "04", 0),
+)
+
+
+def _item(seq, idx):
+    cst_pis, aliquota_pis, cst_cofins, aliquota_cofins = TRIBUTACOES[seq % len(TRIBUTACOES)]
+    valor_total = 10 + (seq % 97)
+
+    return frappe._dict(
+        idx=idx, item_code=f"PROD{seq % 5000:05d}", item_name=f"PRODUTO {seq % 5000}",
+        unidade="UN", quantidade=1 + seq % 3, valor_total=valor_total, valor_desconto=0,
+        origem="0", cst_icms="00", cfop="5102", base_icms=valor_total, aliquota_icms=18,
+        valor_icms=valor_total * 0.18, base_icms_st=0, aliquota_icms_st=0, valor_icms_st=0,
+        cst_ipi=None, codigo_enquadramento_ipi=None, base_ipi=0, aliquota_ipi=0, valor_ipi=0,
+        cst_pis=cst_pis, base_pis=valor_total if aliquota_pis else 0, aliquota_pis=aliquota_pis,
+        valor_pis=valor_total * aliquota_pis / 100,
+        cst_cofins=cst_cofins, base_cofins=valor_total if aliquota_cofins else 0,
+        aliquota_cofins=aliquota_cofins, valor_cofins=valor_total * aliquota_cofins / 100,
+    )
+
+
+def documentos(quantidade_itens):
+    """Notas sintéticas com ITENS_POR_NOTA itens (1 em cada 10 é NFC-e)"""
+    inicio = datetime(2024, 1, 1)
+
+    for numero in range(1, quantidade_itens // ITENS_POR_NOTA + 1):
+        itens = [_item(numero * ITENS_POR_NOTA + idx, idx) for idx in range(1, ITENS_POR_NOTA + 1)]
+        total = sum(item.valor_total for item in itens)
+
+        nota = frappe._dict(
+            name=f"NF-{numero}", modelo="65" if numero % 10 == 0 else "55", serie=1, numero=numero,
+            status="Autorizada", chave_acesso=f"{numero:044d}",
+            data_autorizacao=inicio + timedelta(seconds=numero * 25), tipo_operacao="1 - Saída",
+            finalidade="1 - NF-e normal", modalidade_frete="9 - Sem Ocorrência de Transporte",
+            participante=f"CLIENTE {numero % 2000}", valor_total=total, valor_produtos=total,
+            valor_desconto=0, valor_frete=0, valor_seguro=0, valor_outras_despesas=0,
+            valor_icms=sum(item.valor_icms for item in itens), valor_icms_st=0, valor_ipi=0,
+            valor_pis=sum(item.valor_pis for item in itens),
+            valor_cofins=sum(item.valor_cofins for item in itens),
+        )
+        yield nota, itens
+
+
+def gerar(quantidade_itens, diretorio):
+    """Gera os trechos e junta-os em um arquivo; retorna (segundos, bytes)"""
+    valores = sped.parametros(CONFIG.empresa, "2024-01-01", "2024-01-31")
+    prefixo = os.path.join(diretorio, str(quantidade_itens))
+
+    with patch.object(sped, "documentos", lambda _valores: documentos(quantidade_itens)), \
+            patch.object(sped, "inutilizadas", lambda _valores: []), \
+            patch.object(sped, "participantes", lambda _valores: iter(())), \
+            patch.object(sped, "unidades", lambda _valores: iter(())), \
+            patch.object(sped, "itens", lambda _valores: iter(())):
+        inicio = time.perf_counter()
+        trecho = EstabelecimentoContribuicoes(CONFIG, valores).gerar(prefixo)
+
+        destino = f"{prefixo}.txt"
+        with open(destino, "wb") as saida:
+            arquivo = ArquivoSPED(saida)
+            arquivo.incorporar(*trecho["bloco_0"])
+            arquivo.incorporar(*trecho["bloco_c"])
+        segundos = time.perf_counter() - inicio
+
+    return segundos, os.path.getsize(destino)
+
+
+def run():
+    """
+    Executa o benchmark e imprime os resultados por volume de itens
+
+    Returns:
+        list: Resultados por volume (tempo em segundos, memória em MB)
+    """
+    resultados = []
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        for quantidade in QUANTIDADES:
+            segundos, tamanho = gerar(quantidade, diretorio)
+
+            # Segunda passada só para o pico de memória (tracemalloc deixa a geração mais lenta)
+            tracemalloc.start()
+            gerar(quantidade, diretorio)
+            _atual, pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            linha = {
+                "itens": quantidade,
+                "segundos": round(segundos, 2),
+                "itens_por_segundo": round(quantidade / segundos),
+                "arquivo_mb": round(tamanho / 1024 / 1024, 1),
+                "pico_memoria_mb": round(pico / 1024 / 1024, 2),
+            }
+            resultados.append(linha)
+            print(
+                f"{quantidade:>9} itens: {linha['segundos']:>7} s | {linha['itens_por_segundo']:>7} itens/s | "
+                f"{linha['arquivo_mb']:>7} MB | pico {linha['pico_memoria_mb']} MB"
+            )
+
+    return resultados
+
+
+if __name__ == "__main__":
+    run()
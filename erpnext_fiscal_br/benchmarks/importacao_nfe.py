@@ -0,0 +1,161 @@
+"""
+Benchmark da importação de NF-e de entrada
+Lê um ZIP sintético de 10 mil procNFe (10 itens cada) e monta as faturas de
+compra, medindo tempo, notas por segundo e pico de memória
+
+Fornecedores, itens e impostos vêm de índices em memória e a gravação é
+substituída por uma contagem: o resultado mede a leitura dos XMLs e o
+mapeamento, não o MariaDB. O pico de memória cresce apenas com a lista
+de nomes das faturas devolvida, não com o tamanho do ZIP.
+
+Uso:
+    bench --site <site> execute erpnext_fiscal_br.benchmarks.importacao_nfe.run
+"""
+
+import os
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from unittest.mock import patch
+
+import frappe
+
+from erpnext_fiscal_br.services import importacao_nfe
+
+QUANTIDADES = (1_000, 10_000)
+
+ITENS_POR_NOTA = 10
+
+CNPJ_EMPRESA = "98765432000188"
+
+FORNECEDORES = 200
+
+
+def _cnpj_fornecedor(seq):
+    return f"{seq % FORNECEDORES:08d}000199"
+
+
+def _det(seq):
+    return (
+        f'<det nItem="{seq}"><prod><cProd>P{seq:04d}</cProd><cEAN>{7890000000000 + seq}</cEAN>'
+        f'<xProd>PRODUTO {seq}</xProd><NCM>84713012</NCM><CFOP>5102</CFOP><uCom>UN</uCom>'
+        '<qCom>2.0000</qCom><vUnCom>15.50</vUnCom><vProd>31.00</vProd><cEANTrib>SEM GTIN</cEANTrib>'
+        '<uTrib>UN</uTrib><qTrib>2.0000</qTrib><vUnTrib>15.50</vUnTrib><indTot>1</indTot></prod>'
+        '<imposto><ICMS><ICMS00><orig>0</orig><CST>00</CST><modBC>3</modBC><vBC>31.00</vBC>'
+        '<pICMS>18.00</pICMS><vICMS>5.58</vICMS></ICMS00></ICMS>'
+        '<IPI><cEnq>999</cEnq><IPITrib><CST>50</CST><vBC>31.00</vBC><pIPI>5.00</pIPI><vIPI>1.55</vIPI>'
+        '</IPITrib></IPI></imposto></det>'
+    )
+
+
+def proc_nfe(numero):
+    """procNFe sintético de ITENS_POR_NOTA itens de um dos FORNECEDORES"""
+    chave = f"3524{_cnpj_fornecedor(numero)}55001{numero:09d}1{numero:08d}000"
+    produtos = 31 * ITENS_POR_NOTA
+    ipi = 1.55 * ITENS_POR_NOTA
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"><NFe>'
+        f'<infNFe Id="NFe{chave}" versao="4.00">'
+        f'<ide><cUF>35</cUF><natOp>VENDA</natOp><mod>55</mod><serie>1</serie><nNF>{numero}</nNF>'
+        '<dhEmi>2024-01-15T10:00:00-03:00</dhEmi><tpNF>1</tpNF></ide>'
+        f'<emit><CNPJ>{_cnpj_fornecedor(numero)}</CNPJ><xNome>FORNECEDOR {numero % FORNECEDORES}</xNome></emit>'
+        f'<dest><CNPJ>{CNPJ_EMPRESA}</CNPJ><xNome>EMPRESA BENCHMARK</xNome></dest>'
+        + "".join(_det(i) for i in range(1, ITENS_POR_NOTA + 1))
+        + f'<total><ICMSTot><vBC>{produtos:.2f}</vBC><vICMS>{5.58 * ITENS_POR_NOTA:.2f}</vICMS>'
+        f'<vST>0.00</vST><vFrete>0.00</vFrete><vSeg>0.00</vSeg><vDesc>0.00</vDesc><vIPI>{ipi:.2f}</vIPI>'
+        f'<vPIS>0.00</vPIS><vCOFINS>0.00</vCOFINS><vOutro>0.00</vOutro><vProd>{produtos:.2f}</vProd>'
+        f'<vNF>{produtos + ipi:.2f}</vNF></ICMSTot></total>'
+        '<cobr><dup><nDup>001</nDup><dVenc>2024-02-15</dVenc><vDup>325.50</vDup></dup></cobr>'
+        '</infNFe></NFe>'
+        f'<protNFe versao="4.00"><infProt><chNFe>{chave}</chNFe><dhRecbto>2024-01-15T10:00:05-03:00</dhRecbto>'
+        f'<nProt>1352400{numero:08d}</nProt><cStat>100</cStat></infProt></protNFe></nfeProc>'
+    ).encode("utf-8")
+
+
+def gerar_zip(quantidade, diretorio):
+    """ZIP com quantidade procNFe; retorna o caminho"""
+    caminho = os.path.join(diretorio, f"{quantidade}.zip")
+    with zipfile.ZipFile(caminho, "w", zipfile.ZIP_DEFLATED) as pacote:
+        for numero in range(1, quantidade + 1):
+            pacote.writestr(f"{numero:06d}-procNFe.xml", proc_nfe(numero))
+    return caminho
+
+
+def importar(caminho):
+    """Importa o ZIP com índices em memória; retorna (segundos, faturas montadas)"""
+    fornecedores = {_cnpj_fornecedor(seq): (f"FORN-{seq}", f"FORNECEDOR {seq}") for seq in range(FORNECEDORES)}
+    itens = {
+        (f"FORN-{fornecedor}", f"P{seq:04d}"): (f"ITEM-{seq}", f"ITEM {seq}", "Unit")
+        for fornecedor in range(FORNECEDORES) for seq in range(1, ITENS_POR_NOTA // 2 + 1)
+    }
+    gtins = {str(7890000000000 + seq): (f"ITEM-{seq}", f"ITEM {seq}", "Unit") for seq in range(1, ITENS_POR_NOTA + 1)}
+    linhas_impostos = [
+        frappe._dict(category="Total", add_deduct_tax="Add", account_head="IPI - BENCH",
+                     description="IPI", cost_center=None, total_nfe="valor_ipi"),
+        frappe._dict(category="Valuation", add_deduct_tax="Add", account_head="ICMS a Recuperar - BENCH",
+                     description="ICMS", cost_center=None, total_nfe="valor_icms"),
+    ]
+    montadas = []
+
+    def gravar_faturas(faturas, serie=None):
+        montadas.append(len(faturas))
+        return [fatura["fatura"]["chave_acesso_nfe"] for fatura in faturas], 0
+
+    with patch.object(importacao_nfe, "dados_empresa", lambda _empresa: (CNPJ_EMPRESA, "BRL")), \
+            patch.object(importacao_nfe, "fornecedores", lambda: fornecedores), \
+            patch.object(importacao_nfe, "itens_por_fornecedor", lambda: itens), \
+            patch.object(importacao_nfe, "itens_por_gtin", lambda: gtins), \
+            patch.object(importacao_nfe, "unidades", lambda: {"Unit"}), \
+            patch.object(importacao_nfe, "modelo_impostos", lambda _empresa: ("Compras - BENCH", linhas_impostos)), \
+            patch.object(importacao_nfe, "gravar_faturas", gravar_faturas):
+        inicio = time.perf_counter()
+        resultado = importacao_nfe.importar_arquivos("Benchmark Compras", [caminho])
+        segundos = time.perf_counter() - inicio
+
+    if resultado["falhas"]:
+        raise AssertionError(resultado["falhas"][:5])
+
+    return segundos, sum(montadas)
+
+
+def run():
+    """
+    Executa o benchmark e imprime os resultados por quantidade de notas
+
+    Returns:
+        list: Resultados por quantidade (tempo em segundos, memória em MB)
+    """
+    resultados = []
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        for quantidade in QUANTIDADES:
+            caminho = gerar_zip(quantidade, diretorio)
+            segundos, faturas = importar(caminho)
+
+            # Segunda passada só para o pico de memória (tracemalloc deixa a leitura mais lenta)
+            tracemalloc.start()
+            importar(caminho)
+            _atual, pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            linha = {
+                "notas": quantidade,
+                "faturas": faturas,
+                "segundos": round(segundos, 2),
+                "notas_por_segundo": round(quantidade / segundos),
+                "zip_mb": round(os.path.getsize(caminho) / 1024 / 1024, 1),
+                "pico_memoria_mb": round(pico / 1024 / 1024, 2),
+            }
+            resultados.append(linha)
+            print(
+                f"{quantidade:>6} notas: {linha['segundos']:>6} s | {linha['notas_por_segundo']:>6} notas/s | "
+                f"ZIP {linha['zip_mb']:>5} MB | pico {linha['pico_memoria_mb']} MB"
+            )
+
+    return resultados
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,137 @@
+"""
+Benchmark do Índice Fiscal
+Mede a extração dos campos indexados de procNFe sintéticos (10 e 100 itens)
+e, se o índice do site já tiver notas, o tempo das consultas típicas de
+auditoria (participante + NCM + trimestre, CFOP, eventos)
+
+A extração é medida sem acesso ao banco; as consultas usam o índice do site
+com parâmetros sorteados das próprias notas indexadas.
+
+Uso:
+    bench --site <site> execute erpnext_fiscal_br.benchmarks.indice_fiscal.run
+"""
+
+import statistics
+import time
+from datetime import timedelta
+
+import frappe
+
+from erpnext_fiscal_br.services import indice_fiscal
+
+CHAVE = "35240112345678000199550010000012341000012345"
+
+NOTAS = 2000
+
+ITENS = (10, 100)
+
+REPETICOES = 50
+
+
+def _det(seq):
+    return (
+        f'<det nItem="{seq}"><prod><cProd>PROD{seq:05d}</cProd><cEAN>SEM GTIN</cEAN>'
+        f'<xProd>PRODUTO DE TESTE {seq}</xProd><NCM>{84713012 + seq % 7}</NCM><CFOP>5102</CFOP>'
+        '<uCom>UN</uCom><qCom>2.0000</qCom><vUnCom>15.50</vUnCom><vProd>31.00</vProd></prod>'
+        '<imposto><ICMS><ICMS00><orig>0</orig><CST>00</CST><modBC>3</modBC><vBC>31.00</vBC>'
+        '<pICMS>18.00</pICMS><vICMS>5.58</vICMS></ICMS00></ICMS></imposto></det>'
+    )
+
+
+def proc_nfe(itens):
+    """procNFe de teste com a quantidade de itens informada"""
+    total = f"{31 * itens:.2f}"
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"><NFe>'
+        f'<infNFe Id="NFe{CHAVE}" versao="4.00">'
+        '<ide><cUF>35</cUF><natOp>VENDA</natOp><mod>55</mod><serie>1</serie><nNF>1234</nNF>'
+        '<dhEmi>2024-05-15T10:00:00-03:00</dhEmi><tpNF>1</tpNF></ide>'
+        '<emit><CNPJ>12345678000199</CNPJ><xNome>EMITENTE LTDA</xNome><enderEmit><UF>SP</UF></enderEmit></emit>'
+        '<dest><CNPJ>98765432000188</CNPJ><xNome>DESTINATARIO LTDA</xNome><enderDest><UF>RJ</UF></enderDest></dest>'
+        + "".join(_det(i) for i in range(1, itens + 1))
+        + f'<total><ICMSTot><vBC>{total}</vBC><vICMS>0.00</vICMS><vST>0.00</vST><vFrete>0.00</vFrete>'
+        f'<vDesc>0.00</vDesc><vIPI>0.00</vIPI><vPIS>0.00</vPIS><vCOFINS>0.00</vCOFINS>'
+        f'<vProd>{total}</vProd><vNF>{total}</vNF></ICMSTot></total>'
+        '</infNFe></NFe>'
+        f'<protNFe versao="4.00"><infProt><chNFe>{CHAVE}</chNFe>'
+        '<dhRecbto>2024-05-15T10:00:05-03:00</dhRecbto><nProt>135240000012345</nProt><cStat>100</cStat>'
+        '</infProt></protNFe></nfeProc>'
+    ).encode("utf-8")
+
+
+def extracao():
+    """Notas por segundo na extração, por quantidade de itens"""
+    resultados = []
+    for itens in ITENS:
+        xml = proc_nfe(itens)
+        inicio = time.perf_counter()
+        for _ in range(NOTAS):
+            indice_fiscal.ler_proc(xml)
+        segundos = time.perf_counter() - inicio
+
+        linha = {"itens": itens, "notas_por_segundo": round(NOTAS / segundos)}
+        resultados.append(linha)
+        print(f"Extração {itens:>4} itens: {linha['notas_por_segundo']:>7} notas/s")
+
+    return resultados
+
+
+def consultas():
+    """Tempo (ms) das consultas típicas com parâmetros do índice do site"""
+    amostra = frappe.db.sql("""
+        SELECT f.cnpj_destinatario, f.cnpj_emitente, f.data_emissao, i.ncm, i.cfop
+        FROM `tabIndice Fiscal` f
+        INNER JOIN `tabIndice Fiscal Item` i ON i.parent = f.name
+        ORDER BY f.modified DESC
+        LIMIT 1
+    """, as_dict=True)
+    if not amostra:
+        print("Índice fiscal vazio: consultas não medidas")
+        return []
+
+    amostra = amostra[0]
+    de = amostra.data_emissao - timedelta(days=45)
+    ate = amostra.data_emissao + timedelta(days=45)
+    casos = {
+        "destinatário + NCM + trimestre": dict(
+            cnpj=amostra.cnpj_destinatario, papel="destinatario", ncm=amostra.ncm, de=de, ate=ate
+        ),
+        "emitente + CFOP (itens)": dict(cnpj=amostra.cnpj_emitente, cfop=amostra.cfop, itens=True),
+        "prefixo de NCM + trimestre": dict(ncm=(amostra.ncm or "")[:4], de=de, ate=ate),
+        "canceladas no trimestre": dict(tipo_evento=indice_fiscal.EVENTO_CANCELAMENTO, de=de, ate=ate),
+    }
+
+    resultados = []
+    for nome, filtros in casos.items():
+        tempos = []
+        for _ in range(REPETICOES):
+            inicio = time.perf_counter()
+            linhas = indice_fiscal.consultar(**filtros)
+            tempos.append((time.perf_counter() - inicio) * 1000)
+
+        tempos.sort()
+        linha = {
+            "consulta": nome,
+            "linhas": len(linhas),
+            "mediana_ms": round(statistics.median(tempos), 2),
+            "p95_ms": round(tempos[int(len(tempos) * 0.95) - 1], 2),
+        }
+        resultados.append(linha)
+        print(f"{nome:<32} {linha['linhas']:>6} linhas | mediana {linha['mediana_ms']} ms | p95 {linha['p95_ms']} ms")
+
+    return resultados
+
+
+def run():
+    """
+    Executa o benchmark e imprime os resultados
+
+    Returns:
+        dict: "extracao" e "consultas"
+    """
+    return {"extracao": extracao(), "consultas": consultas()}
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,164 @@
+"""
+Micro-benchmark do parser de respostas da SEFAZ
+Compara o parser de passada única com a implementação anterior (regex + buscas .//)
+
+A implementação anterior extrai apenas o primeiro protNFe/retEvento de cada
+resposta; o parser atual extrai todos, então nos lotes o ganho por entrada
+é maior do que o ganho por resposta mostrado.
+
+Uso:
+    bench --site <site> execute erpnext_fiscal_br.benchmarks.sefaz_parser.run
+"""
+
+import re
+import timeit
+
+from lxml import etree
+
+from erpnext_fiscal_br.services.sefaz_response import parse_resposta
+
+SOAP_ENVELOPE = (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<soap:Envelope xmlns:soap="http://www.w3.org/2003/05/soap-envelope" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">'
+    '<soap:Body><nfeResultMsg xmlns="http://www.portalfiscal.inf.br/nfe/wsdl/{servico}">'
+    '{corpo}</nfeResultMsg></soap:Body></soap:Envelope>'
+)
+
+
+def _prot_nfe(seq):
+    chave = f"3524011234567800019055001{seq:09d}1{seq:08d}"[:43] + "0"
+    return (
+        '<protNFe versao="4.00"><infProt Id="ID135240000%06d">' % seq
+        + '<tpAmb>2</tpAmb><verAplic>SP_NFE_PL009_V4</verAplic>'
+        + f'<chNFe>{chave}</chNFe><dhRecbto>2024-01-15T10:00:00-03:00</dhRecbto>'
+        + f'<nProt>1352400000{seq:05d}</nProt><digVal>q2JKu2Yq3Gk1u4yOazrJ2Kq3FQ0=</digVal>'
+        + '<cStat>100</cStat><xMotivo>Autorizado o uso da NF-e</xMotivo></infProt></protNFe>'
+    )
+
+
+def _ret_evento(seq):
+    chave = f"3524011234567800019055001{seq:09d}1{seq:08d}"[:43] + "0"
+    return (
+        '<retEvento versao="1.00"><infEvento>'
+        '<tpAmb>2</tpAmb><verAplic>SP_EVENTOS_PL_100</verAplic><cOrgao>35</cOrgao>'
+        '<cStat>135</cStat><xMotivo>Evento registrado e vinculado a NF-e</xMotivo>'
+        f'<chNFe>{chave}</chNFe><tpEvento>110111</tpEvento><xEvento>Cancelamento</xEvento>'
+        f'<nSeqEvento>1</nSeqEvento><dhRegEvento>2024-01-15T10:00:00-03:00</dhRegEvento>'
+        f'<nProt>1352400000{seq:05d}</nProt></infEvento></retEvento>'
+    )
+
+
+def amostras():
+    """Retorna as respostas usadas no benchmark: (nome, tag_retorno, bytes)"""
+    ret_envi = (
+        '<retEnviNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">'
+        '<tpAmb>2</tpAmb><verAplic>SP_NFE_PL009_V4</verAplic><cStat>104</cStat>'
+        '<xMotivo>Lote processado</xMotivo><cUF>35</cUF><dhRecbto>2024-01-15T10:00:00-03:00</dhRecbto>'
+        + _prot_nfe(1) + '</retEnviNFe>'
+    )
+    ret_reci = (
+        '<retConsReciNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">'
+        '<tpAmb>2</tpAmb><verAplic>SP_NFE_PL009_V4</verAplic><nRec>351000000000001</nRec>'
+        '<cStat>104</cStat><xMotivo>Lote processado</xMotivo><cUF>35</cUF>'
+        + "".join(_prot_nfe(i) for i in range(1, 51)) + '</retConsReciNFe>'
+    )
+    ret_evento = (
+        '<retEnvEvento xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.00">'
+        '<idLote>1</idLote><tpAmb>2</tpAmb><verAplic>SP_EVENTOS_PL_100</verAplic><cOrgao>35</cOrgao>'
+        '<cStat>128</cStat><xMotivo>Lote de Evento Processado</xMotivo>'
+        + "".join(_ret_evento(i) for i in range(1, 21)) + '</retEnvEvento>'
+    )
+
+    return [
+        ("retEnviNFe (1 protNFe)", "retEnviNFe",
+         SOAP_ENVELOPE.format(servico="NFeAutorizacao4", corpo=ret_envi).encode("utf-8")),
+        ("retConsReciNFe (50 protNFe)", "retConsReciNFe",
+         SOAP_ENVELOPE.format(servico="NFeRetAutorizacao4", corpo=ret_reci).encode("utf-8")),
+        ("retEnvEvento (20 retEvento)", "retEnvEvento",
+         SOAP_ENVELOPE.format(servico="NFeRecepcaoEvento4", corpo=ret_evento).encode("utf-8")),
+    ]
+
+
+def parse_legado(response_xml, tag_retorno):
+    """
+    Implementação anterior de SEFAZTransmitter._parse_response, incluindo
+    o segundo parse feito por enviar_nfe para extrair o protNFe
+    """
+    clean_xml = re.sub(r'\sxmlns[^=]*="[^"]*"', '', response_xml)
+    clean_xml = re.sub(r'<(/?)[\w]+:', r'<\1', clean_xml)
+
+    root = etree.fromstring(clean_xml.encode('utf-8'))
+
+    retorno = root.find(f'.//{tag_retorno}')
+    if retorno is None:
+        for elem in root.iter():
+            if elem.tag == tag_retorno or elem.tag.endswith(tag_retorno):
+                retorno = elem
+                break
+
+    resultado = {}
+    for campo in ['cStat', 'xMotivo', 'nProt', 'dhRecbto', 'chNFe', 'cUF', 'tpAmb', 'nRec']:
+        elem = retorno.find(f'.//{campo}')
+        if elem is not None and elem.text:
+            resultado[campo] = elem.text
+
+    prot_nfe = retorno.find('.//protNFe')
+    if prot_nfe is not None:
+        inf_prot = prot_nfe.find('.//infProt')
+        if inf_prot is not None:
+            for campo in ['cStat', 'xMotivo', 'nProt', 'dhRecbto', 'chNFe', 'digVal']:
+                elem = inf_prot.find(f'.//{campo}')
+                if elem is not None and elem.text:
+                    resultado[campo] = elem.text
+
+    if resultado.get("cStat") in ["100", "150"]:
+        root = etree.fromstring(response_xml.encode('utf-8'))
+        proc_nfe = root.find('.//{http://www.portalfiscal.inf.br/nfe}protNFe')
+        if proc_nfe is not None:
+            resultado["xml_prot"] = etree.tostring(proc_nfe, encoding='unicode')
+
+    return resultado
+
+
+def parse_atual(response, tag_retorno):
+    """Parser atual, incluindo a serialização do protNFe para o procNFe"""
+    resultado = parse_resposta(response, tag_retorno)
+    if resultado.get("cStat") in ["100", "150"] and resultado["prot_nfe"] is not None:
+        resultado["xml_prot"] = etree.tostring(resultado["prot_nfe"], encoding='unicode')
+    return resultado
+
+
+def run(repeticoes=2000):
+    """
+    Executa o benchmark e imprime o tempo médio por resposta
+
+    Args:
+        repeticoes: Número de parses por amostra
+
+    Returns:
+        list: Resultados por amostra (tempos em microssegundos)
+    """
+    resultados = []
+
+    for nome, tag, response in amostras():
+        # A implementação anterior recebia o texto da resposta (response.text)
+        response_texto = response.decode("utf-8")
+
+        legado = timeit.timeit(lambda: parse_legado(response_texto, tag), number=repeticoes)
+        atual = timeit.timeit(lambda: parse_atual(response, tag), number=repeticoes)
+
+        linha = {
+            "amostra": nome,
+            "legado_us": round(legado / repeticoes * 1e6, 1),
+            "atual_us": round(atual / repeticoes * 1e6, 1),
+            "ganho": round(legado / atual, 2) if atual else None,
+        }
+        resultados.append(linha)
+        print(f"{nome:32} legado {linha['legado_us']:>9} us | atual {linha['atual_us']:>9} us | {linha['ganho']}x")
+
+    return resultados
+
+
+if __name__ == "__main__":
+    run()
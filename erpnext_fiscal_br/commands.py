@@ -0,0 +1,230 @@
+"""
+Comandos do bench
+"""
+
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("exportar-xml-fiscal")
+@click.option("--empresa", required=True, help="Nome da empresa")
+@click.option("--de", "data_inicial", required=True, help="Data inicial (AAAA-MM-DD)")
+@click.option("--ate", "data_final", required=True, help="Data final (AAAA-MM-DD)")
+@click.option("--modelo", type=click.Choice(["55", "65"]), help="Modelo (padrão: ambos)")
+@click.option("--status", "status_notas", type=click.Choice(["Autorizada", "Cancelada"]),
+              help="Status das notas (padrão: ambos)")
+@pass_context
+def exportar_xml_fiscal(context, empresa, data_inicial, data_final, modelo=None, status_notas=None):
+    """Gera o ZIP de XMLs do período (procNFe, cancelamentos e CC-e) com índice CSV"""
+    import frappe
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        doc = frappe.get_doc({
+            "doctype": "Exportacao Fiscal",
+            "tipo": "XML",
+            "empresa": empresa,
+            "data_inicial": data_inicial,
+            "data_final": data_final,
+            "modelo": modelo,
+            "status_notas": status_notas,
+        })
+        doc.flags.processar_agora = True
+        doc.insert(ignore_permissions=True)
+        frappe.db.commit()
+
+        _processar(doc.name)
+    finally:
+        frappe.destroy()
+
+
+@click.command("gerar-efd-icms-ipi")
+@click.option("--empresa", required=True, help="Nome da empresa")
+@click.option("--de", "data_inicial", required=True, help="Data inicial (AAAA-MM-DD)")
+@click.option("--ate", "data_final", required=True, help="Data final (AAAA-MM-DD, no mesmo mês)")
+@pass_context
+def gerar_efd_icms_ipi(context, empresa, data_inicial, data_final):
+    """Gera o arquivo da EFD ICMS/IPI (SPED Fiscal) do período"""
+    _gerar_sped(context, "EFD ICMS/IPI", empresa, data_inicial, data_final)
+
+
+@click.command("gerar-efd-contribuicoes")
+@click.option("--empresa", required=True, help="Nome da empresa (matriz ou filial)")
+@click.option("--de", "data_inicial", required=True, help="Data inicial (AAAA-MM-DD)")
+@click.option("--ate", "data_final", required=True, help="Data final (AAAA-MM-DD, no mesmo mês)")
+@pass_context
+def gerar_efd_contribuicoes(context, empresa, data_inicial, data_final):
+    """Gera o arquivo da EFD-Contribuições do período (todos os estabelecimentos do CNPJ)"""
+    _gerar_sped(context, "EFD Contribuições", empresa, data_inicial, data_final)
+
+
+def _gerar_sped(context, tipo, empresa, data_inicial, data_final):
+    import frappe
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        doc = frappe.get_doc({
+            "doctype": "Exportacao Fiscal",
+            "tipo": tipo,
+            "empresa": empresa,
+            "data_inicial": data_inicial,
+            "data_final": data_final,
+        })
+        doc.flags.processar_agora = True
+        doc.insert(ignore_permissions=True)
+        frappe.db.commit()
+
+        _processar(doc.name)
+    finally:
+        frappe.destroy()
+
+
+@click.command("retomar-exportacao-fiscal")
+@click.argument("exportacao")
+@pass_context
+def retomar_exportacao_fiscal(context, exportacao):
+    """Continua uma exportação de XML interrompida a partir do último lote gravado"""
+    import frappe
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        _processar(exportacao, retomar=True)
+    finally:
+        frappe.destroy()
+
+
+@click.command("reconstruir-resumo-fiscal")
+@click.option("--empresa", help="Nome da empresa (padrão: todas)")
+@pass_context
+def reconstruir_resumo_fiscal(context, empresa=None):
+    """Recalcula o Resumo Fiscal Diario a partir das notas"""
+    import frappe
+    from erpnext_fiscal_br.services.resumo_fiscal import reconstruir
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        reconstruir(empresa)
+        frappe.db.commit()
+        linhas = frappe.db.count("Resumo Fiscal Diario", {"empresa": empresa} if empresa else None)
+        click.echo(f"Resumo fiscal reconstruído: {linhas} linhas")
+    finally:
+        frappe.destroy()
+
+
+@click.command("inutilizar-lacunas")
+@click.option("--empresa", required=True, help="Nome da empresa")
+@click.option("--listar", is_flag=True, help="Apenas lista as faixas, sem enviar à SEFAZ")
+@pass_context
+def inutilizar_lacunas(context, empresa, listar=False):
+    """Inutiliza na SEFAZ as lacunas da numeração das notas, uma faixa por pedido"""
+    import frappe
+    from erpnext_fiscal_br.services import inutilizacao
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        if listar:
+            for faixa in inutilizacao.lacunas(empresa):
+                click.echo(
+                    f"{faixa.ambiente} - modelo {faixa.modelo} série {faixa.serie}: "
+                    f"{faixa.numero_inicial} a {faixa.numero_final}"
+                )
+            return
+
+        resultado = inutilizacao.inutilizar_lacunas(empresa)
+        click.echo(f"Faixas por status: {resultado or 'nenhuma lacuna'}")
+    finally:
+        frappe.destroy()
+
+
+@click.command("importar-nfe-entrada")
+@click.option("--empresa", required=True, help="Nome da empresa destinatária")
+@click.option("--arquivo", "caminhos", multiple=True, type=click.Path(exists=True, dir_okay=False),
+    help="procNFe (.xml) ou ZIP com vários XMLs; pode ser repetido")
+@click.option("--recebidos", is_flag=True, help="Importa as NF-e completas da Distribuição DF-e ainda sem fatura")
+@pass_context
+def importar_nfe_entrada(context, empresa, caminhos=(), recebidos=False):
+    """Cria faturas de compra em rascunho a partir das NF-e de fornecedores"""
+    import frappe
+    from erpnext_fiscal_br.services import importacao_nfe
+
+    if not caminhos and not recebidos:
+        raise click.UsageError("Informe --arquivo ou --recebidos")
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        resultados = []
+        if caminhos:
+            resultados.append(importacao_nfe.importar_arquivos(empresa, caminhos))
+        if recebidos:
+            resultados.append(importacao_nfe.importar_documentos_recebidos(empresa))
+
+        for resultado in resultados:
+            click.echo(
+                f"{resultado['importadas']} faturas criadas, {resultado['duplicadas']} já importadas, "
+                f"{resultado['ignorados']} XMLs que não são NF-e, {len(resultado['falhas'])} falhas"
+            )
+            for falha in resultado["falhas"][:20]:
+                click.echo(f"  {falha}", err=True)
+    finally:
+        frappe.destroy()
+
+
+@click.command("indexar-xmls-fiscais")
+@click.option("--reindexar", is_flag=True, help="Devolve à fila os XMLs já indexados antes de indexar")
+@click.option("--empresa", help="Com --reindexar, limita às notas da empresa (padrão: todas)")
+@pass_context
+def indexar_xmls_fiscais(context, reindexar=False, empresa=None):
+    """Extrai para o Índice Fiscal os XMLs arquivados ainda não indexados"""
+    import frappe
+    from erpnext_fiscal_br.services import indice_fiscal
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        if reindexar:
+            pendentes = indice_fiscal.reindexar(empresa)
+            frappe.db.commit()
+            click.echo(f"{pendentes} XMLs na fila do índice")
+
+        total = 0
+        while True:
+            processadas = indice_fiscal.indexar_pendentes()
+            total += processadas
+            if processadas < indice_fiscal.MAX_POR_EXECUCAO:
+                break
+            click.echo(f"{total} XMLs indexados...")
+
+        click.echo(f"Índice fiscal atualizado: {total} XMLs indexados")
+    finally:
+        frappe.destroy()
+
+
+def _processar(exportacao, retomar=False):
+    import frappe
+    from erpnext_fiscal_br.services.exportacao import processar
+
+    processar(exportacao, retomar=retomar)
+
+    doc = frappe.get_doc("Exportacao Fiscal", exportacao)
+    if doc.situacao == "Concluída":
+        click.echo(f"{doc.name}: {doc.processadas} notas ({doc.falhas} sem XML) -> {doc.arquivo}")
+    else:
+        click.echo(f"{doc.name}: {doc.situacao} - {doc.erro}", err=True)
+
+
+commands = [
+    exportar_xml_fiscal,
+    gerar_efd_icms_ipi,
+    gerar_efd_contribuicoes,
+    retomar_exportacao_fiscal,
+    reconstruir_resumo_fiscal,
+    inutilizar_lacunas,
+    importar_nfe_entrada,
+    indexar_xmls_fiscais,
+]
@@ -40,3 +40,19 @@ def validate(doc, method):
                 indicator="orange",
                 alert=True
             )
+        
+        # Situação cadastral na SEFAZ (somente cache)
+        uf = get_uf_cliente(doc)
+        if uf and doc.get("cpf_cnpj"):
+            from erpnext_fiscal_br.services.cadastro import verificar_destinatario
+            
+            erros, avisos = verificar_destinatario(uf, doc.cpf_cnpj, doc.get("inscricao_estadual_cliente"))
+            for mensagem in erros + avisos:
+                frappe.msgprint(mensagem, indicator="orange", alert=True)
+
+
+def get_uf_cliente(doc):
+    """Retorna a UF do endereço principal do cliente"""
+    if not doc.get("customer_primary_address"):
+        return None
+    return frappe.db.get_value("Address", doc.customer_primary_address, "state")
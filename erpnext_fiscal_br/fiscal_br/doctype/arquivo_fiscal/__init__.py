@@ -0,0 +1 @@
+# Arquivo Fiscal DocType
@@ -0,0 +1,16 @@
+"""
+Arquivo Fiscal
+Índice dos XMLs guardados nos segmentos do arquivo fiscal (services/archive.py)
+"""
+
+import frappe
+from frappe.model.document import Document
+
+
+class ArquivoFiscal(Document):
+    pass
+
+
+def on_doctype_update():
+    # XMLs pendentes do Índice Fiscal, na ordem dos segmentos
+    frappe.db.add_index("Arquivo Fiscal", ["indexado", "segmento", "posicao"])
@@ -0,0 +1,80 @@
+// Copyright (c) 2024, Bruno Bueno and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on('Documento Recebido', {
+    refresh: function(frm) {
+        // Botão DANFE - gerado do procNFe do fornecedor
+        if (frm.doc.xml_documento) {
+            frm.add_custom_button(__('DANFE'), function() {
+                window.open(
+                    '/api/method/erpnext_fiscal_br.api.arquivo.download_danfe_recebido?documento_recebido='
+                    + encodeURIComponent(frm.doc.name)
+                );
+            });
+        }
+        
+        // Fatura de compra (rascunho) a partir do procNFe
+        if (frm.doc.tipo_documento === 'Completo' && frm.doc.situacao === 'Autorizada') {
+            frm.add_custom_button(__('Fatura de Compra'), function() {
+                frappe.call({
+                    method: 'erpnext_fiscal_br.fiscal_br.doctype.documento_recebido.documento_recebido.criar_faturas_compra',
+                    args: {
+                        documentos: [frm.doc.name]
+                    },
+                    callback: function(r) {
+                        if (r.message) {
+                            frappe.show_alert({message: r.message.message, indicator: 'blue'});
+                        }
+                    }
+                });
+            }, __('Criar'));
+        }
+        
+        // Manifestação do destinatário
+        if (!frm.is_new() && frm.doc.situacao === 'Autorizada') {
+            [
+                'Ciência da Operação',
+                'Confirmação da Operação',
+                'Desconhecimento da Operação',
+                'Operação não Realizada'
+            ].forEach(function(tipo) {
+                frm.add_custom_button(__(tipo), function() {
+                    manifestar(frm, tipo);
+                }, __('Manifestar'));
+            });
+        }
+    }
+});
+
+function manifestar(frm, tipo) {
+    var enviar = function(justificativa) {
+        frappe.call({
+            method: 'erpnext_fiscal_br.fiscal_br.doctype.documento_recebido.documento_recebido.manifestar',
+            args: {
+                documentos: [frm.doc.name],
+                tipo: tipo,
+                justificativa: justificativa
+            },
+            freeze: true,
+            freeze_message: __('Enviando manifestação...'),
+            callback: function() {
+                frm.reload_doc();
+            }
+        });
+    };
+    
+    if (tipo === 'Operação não Realizada') {
+        frappe.prompt({
+            fieldname: 'justificativa',
+            fieldtype: 'Small Text',
+            label: __('Justificativa'),
+            reqd: 1
+        }, function(values) {
+            enviar(values.justificativa);
+        }, __(tipo));
+    } else {
+        frappe.confirm(__('Enviar a manifestação "{0}"?', [__(tipo)]), function() {
+            enviar();
+        });
+    }
+}
@@ -0,0 +1,248 @@
+"""
+Documento Recebido
+Índice por chave de acesso dos documentos obtidos pela Distribuição DF-e
+"""
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import cint
+
+# Campos copiados do resumo (resNFe) ou da NFe completa (procNFe)
+CAMPOS_NFE = (
+    "tipo_documento", "nsu", "cnpj_emitente", "nome_emitente", "ie_emitente",
+    "numero", "serie", "data_emissao", "tipo_operacao", "valor_total",
+    "protocolo", "data_autorizacao",
+)
+
+
+class DocumentoRecebido(Document):
+    def aplicar_nfe(self, dados):
+        """
+        Aplica um resNFe ou procNFe ao documento
+
+        Args:
+            dados: Documento lido pela distribuição
+
+        Returns:
+            bool: True se o documento foi alterado
+        """
+        from erpnext_fiscal_br.services import archive
+        from erpnext_fiscal_br.services.distribuicao import SITUACAO_POR_EVENTO
+
+        situacao = dados.get("situacao")
+        cancelada_por_evento = self.situacao in SITUACAO_POR_EVENTO.values()
+
+        # Resumo não substitui a NFe completa, apenas atualiza a situação
+        if self.tipo_documento == "Completo" and dados["tipo_documento"] == "Resumo":
+            if situacao and situacao != self.situacao and not cancelada_por_evento:
+                self.situacao = situacao
+                return True
+            return False
+
+        # Mesmo documento recebido novamente
+        if self.nsu == dados.get("nsu") and self.tipo_documento == dados["tipo_documento"]:
+            return False
+
+        for campo in CAMPOS_NFE:
+            valor = dados.get(campo)
+            if valor not in (None, ""):
+                self.set(campo, valor)
+
+        if situacao and not cancelada_por_evento:
+            self.situacao = situacao
+
+        if dados.get("xml"):
+            self.xml_documento = archive.gravar(self.chave_acesso, "proc", dados["xml"])
+
+        return True
+
+    def aplicar_evento(self, dados):
+        """
+        Aplica um resEvento ou procEventoNFe ao documento
+
+        Args:
+            dados: Evento lido pela distribuição
+
+        Returns:
+            bool: True se o documento foi alterado
+        """
+        from erpnext_fiscal_br.services.distribuicao import SITUACAO_POR_EVENTO
+
+        for row in self.eventos:
+            if row.tipo_evento == dados["tipo_evento"] and cint(row.sequencia) == dados["sequencia"]:
+                # Evento já registrado pelo resumo: completa com o XML
+                if dados.get("xml") and not row.xml_evento:
+                    row.protocolo = dados.get("protocolo") or row.protocolo
+                    row.xml_evento = self._arquivar_evento(dados)
+                    return True
+                return False
+
+        row = self.append("eventos", {
+            "tipo_evento": dados["tipo_evento"],
+            "descricao_evento": dados.get("descricao_evento"),
+            "sequencia": dados["sequencia"],
+            "data_evento": dados.get("data_evento"),
+            "protocolo": dados.get("protocolo"),
+            "nsu": dados.get("nsu"),
+        })
+
+        if dados["tipo_evento"] in SITUACAO_POR_EVENTO:
+            self.situacao = SITUACAO_POR_EVENTO[dados["tipo_evento"]]
+
+        if dados.get("xml"):
+            row.xml_evento = self._arquivar_evento(dados)
+
+        return True
+
+    def _arquivar_evento(self, dados):
+        """Grava o XML do evento no arquivo fiscal"""
+        from erpnext_fiscal_br.services import archive
+
+        return archive.gravar(
+            self.chave_acesso,
+            "evento",
+            dados["xml"],
+            sufixo=f"{dados['tipo_evento']}-{str(dados['sequencia']).zfill(2)}"
+        )
+
+
+@frappe.whitelist()
+def sincronizar_agora(empresa):
+    """
+    Enfileira a sincronização da Distribuição DF-e de uma empresa
+
+    Args:
+        empresa: Nome da empresa
+
+    Returns:
+        dict: Resultado do agendamento
+    """
+    frappe.has_permission("Documento Recebido", "write", throw=True)
+
+    # Permissão na configuração fiscal da empresa (respeita as permissões de usuário por Company)
+    config = frappe.db.get_value("Configuracao Fiscal", {"empresa": empresa}, "name")
+    if not config:
+        frappe.throw(_("Configuração fiscal não encontrada para a empresa {0}").format(empresa))
+    frappe.has_permission("Configuracao Fiscal", "read", doc=config, throw=True)
+
+    frappe.enqueue(
+        "erpnext_fiscal_br.tasks.sincronizar_distribuicao_empresa",
+        queue="long",
+        job_id=f"distribuicao_dfe::{empresa}",
+        deduplicate=True,
+        empresa=empresa
+    )
+
+    return {
+        "success": True,
+        "message": _("Sincronização de documentos recebidos iniciada")
+    }
+
+
+@frappe.whitelist()
+def manifestar(documentos, tipo, justificativa=None):
+    """
+    Envia a manifestação do destinatário de um ou mais documentos
+
+    Até 20 documentos são enviados na hora (um lote por empresa); acima
+    disso, a manifestação é enfileirada.
+
+    Args:
+        documentos: Lista (ou JSON) com as chaves de acesso
+        tipo: Tipo de manifestação (ex: "Confirmação da Operação")
+        justificativa: Obrigatória para "Operação não Realizada"
+
+    Returns:
+        dict: Resultado por empresa (quantidade por status) ou agendamento
+    """
+    from erpnext_fiscal_br.services.manifestacao import manifestar as enviar_manifestacao
+    from erpnext_fiscal_br.services.transmitter import MAX_EVENTOS_LOTE
+
+    documentos = frappe.parse_json(documentos)
+    if isinstance(documentos, str):
+        documentos = [documentos]
+
+    frappe.has_permission("Documento Recebido", "write", throw=True)
+
+    por_empresa = {}
+    for chave, empresa in frappe.get_all(
+        "Documento Recebido",
+        filters={"name": ["in", documentos]},
+        fields=["name", "empresa"],
+        as_list=True
+    ):
+        frappe.has_permission("Documento Recebido", "write", doc=chave, throw=True)
+        por_empresa.setdefault(empresa, []).append(chave)
+
+    if len(documentos) > MAX_EVENTOS_LOTE:
+        for empresa, chaves in por_empresa.items():
+            frappe.enqueue(
+                "erpnext_fiscal_br.services.manifestacao.manifestar",
+                queue="long",
+                empresa=empresa,
+                chaves=chaves,
+                tipo=tipo,
+                justificativa=justificativa
+            )
+        return {
+            "success": True,
+            "message": _("Manifestação de {0} documentos enfileirada").format(len(documentos))
+        }
+
+    return {
+        "success": True,
+        "resultado": {
+            empresa: enviar_manifestacao(empresa, chaves, tipo, justificativa)
+            for empresa, chaves in por_empresa.items()
+        }
+    }
+
+
+@frappe.whitelist()
+def criar_faturas_compra(documentos):
+    """
+    Enfileira a criação das faturas de compra (rascunho) dos documentos
+
+    Args:
+        documentos: Lista (ou JSON) com as chaves de acesso das NF-e completas
+
+    Returns:
+        dict: Resultado do agendamento
+    """
+    documentos = frappe.parse_json(documentos)
+    if isinstance(documentos, str):
+        documentos = [documentos]
+
+    frappe.has_permission("Purchase Invoice", "create", throw=True)
+
+    por_empresa = {}
+    for chave, empresa in frappe.get_all(
+        "Documento Recebido",
+        filters={"name": ["in", documentos], "tipo_documento": "Completo"},
+        fields=["name", "empresa"],
+        as_list=True
+    ):
+        por_empresa.setdefault(empresa, []).append(chave)
+
+    if not por_empresa:
+        frappe.throw(_("Nenhuma NF-e completa (com XML) entre os documentos selecionados"))
+
+    for empresa, chaves in por_empresa.items():
+        frappe.enqueue(
+            "erpnext_fiscal_br.services.importacao_nfe.importar_documentos_recebidos",
+            queue="long",
+            empresa=empresa,
+            chaves=chaves
+        )
+
+    return {
+        "success": True,
+        "message": _("Criação das faturas de compra de {0} documentos enfileirada").format(
+            sum(len(chaves) for chaves in por_empresa.values())
+        )
+    }
+
+
+def on_doctype_update():
+    frappe.db.add_index("Documento Recebido", ["empresa", "manifestacao"])
@@ -0,0 +1 @@
+# Documento Recebido Evento DocType
@@ -0,0 +1,9 @@
+"""
+Evento de Documento Recebido
+"""
+
+from frappe.model.document import Document
+
+
+class DocumentoRecebidoEvento(Document):
+    pass
@@ -0,0 +1,46 @@
+// Copyright (c) 2024, Bruno Bueno and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on('Exportacao Fiscal', {
+    refresh: function(frm) {
+        if (frm.doc.arquivo && frm.doc.situacao === 'Concluída') {
+            frm.add_custom_button(__('Baixar'), function() {
+                window.open(frm.doc.arquivo);
+            });
+        }
+
+        if (!frm.is_new() && ['Erro', 'Concluída'].includes(frm.doc.situacao)) {
+            frm.add_custom_button(__('Exportar Novamente'), function() {
+                frappe.call({
+                    method: 'erpnext_fiscal_br.fiscal_br.doctype.exportacao_fiscal.exportacao_fiscal.reprocessar',
+                    args: { exportacao: frm.doc.name },
+                    callback: function() {
+                        frm.reload_doc();
+                    }
+                });
+            });
+        }
+
+        // XML: continua do último lote gravado (job interrompido ou com erro)
+        if (frm.doc.tipo === 'XML' && frm.doc.processadas && ['Erro', 'Processando'].includes(frm.doc.situacao)) {
+            frm.add_custom_button(__('Retomar'), function() {
+                frappe.call({
+                    method: 'erpnext_fiscal_br.fiscal_br.doctype.exportacao_fiscal.exportacao_fiscal.retomar',
+                    args: { exportacao: frm.doc.name },
+                    callback: function() {
+                        frm.reload_doc();
+                    }
+                });
+            });
+        }
+
+        // Andamento publicado pelo job (frappe.publish_progress)
+        if (['Na Fila', 'Processando'].includes(frm.doc.situacao)) {
+            frm.dashboard.show_progress(
+                __('Exportação'),
+                frm.doc.total ? (frm.doc.processadas / frm.doc.total) * 100 : 0,
+                __('{0} de {1} notas', [frm.doc.processadas || 0, frm.doc.total || 0])
+            );
+        }
+    }
+});
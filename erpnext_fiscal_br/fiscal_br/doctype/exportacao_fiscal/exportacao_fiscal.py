@@ -0,0 +1,89 @@
+"""
+Exportação Fiscal
+Pacote de DANFEs ou XMLs, ou arquivo SPED, de um período gerado em background
+(services/exportacao.py)
+"""
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import getdate
+
+
+class ExportacaoFiscal(Document):
+    def validate(self):
+        if getdate(self.data_final) < getdate(self.data_inicial):
+            frappe.throw(_("Data final deve ser maior ou igual à data inicial"))
+
+        # Arquivos SPED são mensais
+        if self.tipo in ("EFD ICMS/IPI", "EFD Contribuições"):
+            inicio, fim = getdate(self.data_inicial), getdate(self.data_final)
+            if (inicio.year, inicio.month) != (fim.year, fim.month):
+                frappe.throw(_("O período da EFD deve estar dentro de um único mês"))
+
+    def after_insert(self):
+        # Exportação pelo comando do bench: processada na hora, sem fila
+        if not self.flags.processar_agora:
+            self.enfileirar()
+
+    def enfileirar(self, retomar=False):
+        """Agenda a exportação na fila longa (após o commit)"""
+        frappe.enqueue(
+            "erpnext_fiscal_br.services.exportacao.processar",
+            queue="long",
+            timeout=4 * 3600,
+            job_id=self.job_id,
+            deduplicate=True,
+            enqueue_after_commit=True,
+            exportacao=self.name,
+            retomar=retomar
+        )
+
+    @property
+    def job_id(self):
+        return f"exportacao_fiscal::{self.name}"
+
+
+@frappe.whitelist()
+def reprocessar(exportacao):
+    """
+    Reenfileira uma exportação que terminou com erro
+
+    Args:
+        exportacao: Nome da Exportação Fiscal
+    """
+    doc = frappe.get_doc("Exportacao Fiscal", exportacao)
+    doc.check_permission("write")
+
+    if doc.situacao not in ("Erro", "Concluída"):
+        frappe.throw(_("Exportação ainda em andamento"))
+
+    doc.db_set({"situacao": "Na Fila", "erro": None})
+    doc.enfileirar()
+
+    return {"success": True, "message": _("Exportação reenfileirada")}
+
+
+@frappe.whitelist()
+def retomar(exportacao):
+    """
+    Continua uma exportação de XML interrompida a partir do último lote gravado
+
+    Args:
+        exportacao: Nome da Exportação Fiscal
+    """
+    from frappe.utils.background_jobs import is_job_enqueued
+
+    doc = frappe.get_doc("Exportacao Fiscal", exportacao)
+    doc.check_permission("write")
+
+    if doc.tipo != "XML":
+        frappe.throw(_("Apenas exportações de XML podem ser retomadas"))
+
+    if doc.situacao == "Concluída" or is_job_enqueued(doc.job_id):
+        frappe.throw(_("Exportação concluída ou em andamento"))
+
+    doc.db_set({"situacao": "Na Fila", "erro": None})
+    doc.enfileirar(retomar=True)
+
+    return {"success": True, "message": _("Exportação retomada")}
@@ -0,0 +1,21 @@
+"""
+Índice Fiscal
+Campos extraídos dos XMLs do arquivo fiscal (notas emitidas e recebidas),
+mantidos pelo indexador de services/indice_fiscal.py
+"""
+
+import frappe
+from frappe.model.document import Document
+
+
+class IndiceFiscal(Document):
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("Indice Fiscal", ["cnpj_destinatario", "data_emissao"])
+    frappe.db.add_index("Indice Fiscal", ["cnpj_emitente", "data_emissao"])
+    frappe.db.add_index("Indice Fiscal", ["empresa", "data_emissao"])
+    frappe.db.add_index("Indice Fiscal Item", ["ncm", "parent"])
+    frappe.db.add_index("Indice Fiscal Item", ["cfop", "parent"])
+    frappe.db.add_index("Indice Fiscal Evento", ["tipo_evento", "parent"])
@@ -0,0 +1 @@
+# Indice Fiscal Evento DocType
@@ -0,0 +1,9 @@
+"""
+Evento do Índice Fiscal
+"""
+
+from frappe.model.document import Document
+
+
+class IndiceFiscalEvento(Document):
+    pass
@@ -0,0 +1 @@
+# Indice Fiscal Item DocType
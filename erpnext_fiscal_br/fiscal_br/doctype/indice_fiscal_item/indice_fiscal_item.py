@@ -0,0 +1,9 @@
+"""
+Item do Índice Fiscal
+"""
+
+from frappe.model.document import Document
+
+
+class IndiceFiscalItem(Document):
+    pass
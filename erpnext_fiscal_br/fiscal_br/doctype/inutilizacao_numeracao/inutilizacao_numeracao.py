@@ -0,0 +1,106 @@
+"""
+Inutilização de Numeração
+Faixa de números (empresa, modelo, série) inutilizada na SEFAZ, registrada
+em um único documento (services/inutilizacao.py)
+"""
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import cint, now_datetime
+
+
+class InutilizacaoNumeracao(Document):
+    def validate(self):
+        self.numero_inicial = cint(self.numero_inicial)
+        self.numero_final = cint(self.numero_final)
+
+        if self.numero_inicial < 1 or self.numero_final < self.numero_inicial:
+            frappe.throw(_("Faixa de numeração inválida"))
+
+        if self.numero_final > 999999999:
+            frappe.throw(_("Número final deve ter no máximo 9 dígitos"))
+
+        justificativa = (self.justificativa or "").strip()
+        if not 15 <= len(justificativa) <= 255:
+            frappe.throw(_("Justificativa deve ter entre 15 e 255 caracteres"))
+
+        self.quantidade = self.numero_final - self.numero_inicial + 1
+
+        if self.is_new():
+            self.validar_faixa_livre()
+
+    def validar_faixa_livre(self):
+        """Nenhuma nota nem outra faixa ativa (homologada ou pendente recente) na faixa"""
+        from erpnext_fiscal_br.services.inutilizacao import pendente_desde
+
+        valores = {
+            "empresa": self.empresa, "modelo": self.modelo, "serie": self.serie,
+            "inicial": self.numero_inicial, "final": self.numero_final,
+            "pendente_desde": pendente_desde(),
+        }
+
+        nota = frappe.db.sql("""
+            SELECT name FROM `tabNota Fiscal`
+            WHERE empresa = %(empresa)s AND modelo = %(modelo)s AND serie = %(serie)s
+                AND numero BETWEEN %(inicial)s AND %(final)s
+            LIMIT 1
+        """, valores)
+        if nota:
+            frappe.throw(_("A faixa inclui a nota {0}").format(nota[0][0]))
+
+        faixa = frappe.db.sql("""
+            SELECT name FROM `tabInutilizacao Numeracao`
+            WHERE empresa = %(empresa)s AND modelo = %(modelo)s AND serie = %(serie)s
+                AND (status = 'Homologada'
+                    OR (status = 'Pendente' AND modified >= %(pendente_desde)s))
+                AND numero_inicial <= %(final)s AND numero_final >= %(inicial)s
+            LIMIT 1
+        """, valores)
+        if faixa:
+            frappe.throw(_("A faixa se sobrepõe à inutilização {0}").format(faixa[0][0]))
+
+    def transmitir(self, transmitter=None):
+        """
+        Envia a faixa à SEFAZ e grava o retorno
+
+        Args:
+            transmitter: SEFAZTransmitter da empresa (reaproveitado entre faixas)
+
+        Returns:
+            dict: Resultado da inutilização (cStat, xMotivo, nProt)
+        """
+        from erpnext_fiscal_br.services.inutilizacao import CSTAT_ERRO
+        from erpnext_fiscal_br.services.transmitter import SEFAZTransmitter
+
+        try:
+            # Falha ao preparar o envio (ex: certificado) também grava a faixa com Erro
+            transmitter = transmitter or SEFAZTransmitter(self.empresa)
+            self.ambiente = transmitter.config.ambiente
+
+            resultado = transmitter.inutilizar_numeracao(
+                self.serie, self.numero_inicial, self.numero_final,
+                self.justificativa.strip(), self.modelo
+            )
+        except Exception as e:
+            resultado = {"cStat": "", "xMotivo": str(e)}
+
+        if resultado.get("cStat") == "102":
+            self.status = "Homologada"
+            self.protocolo = resultado.get("nProt")
+            self.data_inutilizacao = now_datetime()
+        elif resultado.get("cStat") in CSTAT_ERRO:
+            # Falha de comunicação ou SEFAZ indisponível: a faixa volta a ser lacuna
+            self.status = "Erro"
+        else:
+            self.status = "Rejeitada"
+
+        self.codigo_status = resultado.get("cStat")
+        self.mensagem = resultado.get("xMotivo")
+        self.save(ignore_permissions=True)
+
+        return resultado
+
+
+def on_doctype_update():
+    frappe.db.add_index("Inutilizacao Numeracao", ["empresa", "modelo", "serie", "numero_inicial"])
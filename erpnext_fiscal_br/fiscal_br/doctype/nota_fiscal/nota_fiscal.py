@@ -25,6 +25,16 @@ class NotaFiscal(Document):
         # Sempre obtém próximo número disponível para novas notas
         self.obter_proximo_numero()
     
+    def on_update(self):
+        from erpnext_fiscal_br.services import resumo_fiscal
+        
+        resumo_fiscal.atualizar([(self.get_doc_before_save(), self)])
+    
+    def on_trash(self):
+        from erpnext_fiscal_br.services import resumo_fiscal
+        
+        resumo_fiscal.atualizar([(self, None)])
+    
     def definir_ambiente(self):
         """Define o ambiente a partir da configuração fiscal da empresa"""
         if not self.empresa:
@@ -96,6 +106,7 @@ class NotaFiscal(Document):
     def obter_proximo_numero(self):
         """Obtém o próximo número da nota fiscal"""
         from erpnext_fiscal_br.fiscal_br.doctype.configuracao_fiscal.configuracao_fiscal import ConfiguracaoFiscal
+        from erpnext_fiscal_br.services.inutilizacao import pendente_desde
         
         config = ConfiguracaoFiscal.get_config_for_company(self.empresa)
         if not config:
@@ -104,12 +115,24 @@ class NotaFiscal(Document):
         self.serie = config.get_serie(self.modelo)
         self.ambiente = config.ambiente
         
-        # Busca o maior número já usado para esta série/modelo/empresa
+        # Busca o maior número já usado para esta série/modelo/empresa, incluindo
+        # as faixas inutilizadas (ou em inutilização) acima da última nota
         maior_numero = frappe.db.sql("""
-            SELECT MAX(numero) as max_num
-            FROM `tabNota Fiscal`
-            WHERE empresa = %s AND modelo = %s AND serie = %s
-        """, (self.empresa, self.modelo, self.serie), as_dict=True)
+            SELECT GREATEST(
+                COALESCE((
+                    SELECT MAX(numero) FROM `tabNota Fiscal`
+                    WHERE empresa = %(empresa)s AND modelo = %(modelo)s AND serie = %(serie)s
+                ), 0),
+                COALESCE((
+                    SELECT MAX(numero_final) FROM `tabInutilizacao Numeracao`
+                    WHERE empresa = %(empresa)s AND modelo = %(modelo)s AND serie = %(serie)s
+                        AND (status = 'Homologada' OR (status = 'Pendente' AND modified >= %(pendente_desde)s))
+                ), 0)
+            ) as max_num
+        """, {
+            "empresa": self.empresa, "modelo": self.modelo, "serie": self.serie,
+            "pendente_desde": pendente_desde(),
+        }, as_dict=True)
         
         numero_existente = maior_numero[0].max_num if maior_numero and maior_numero[0].max_num else 0
         
@@ -155,14 +178,28 @@ class NotaFiscal(Document):
         return chave
     
     def emitir(self):
-        """Emite a nota fiscal para a SEFAZ"""
+        """
+        Emite a nota fiscal para a SEFAZ
+        
+        Antes da transmissão grava apenas um marcador (status, chave e XML
+        assinado) com commit, para que a reconciliação encontre a nota em caso
+        de falha. XMLs e DANFE são gerados em memória e o estado final da
+        nota, os anexos e a Sales Invoice são gravados juntos em _persistir().
+        """
         from erpnext_fiscal_br.services.xml_builder import XMLBuilder
         from erpnext_fiscal_br.services.signer import XMLSigner
-        from erpnext_fiscal_br.services.transmitter import SEFAZTransmitter
+        from erpnext_fiscal_br.services.transmitter import FalhaComunicacao, SEFAZTransmitter
+        from erpnext_fiscal_br.services.rate_limiter import LimiteConsumoExcedido, RequisicaoDuplicada
+        
+        enviada = False
         
         try:
+            # Mesmas validações do save(): campos obrigatórios, links e validate
+            self._action = "save"
+            self._validate_mandatory()
+            self._validate_links()
+            self.run_method("validate")
             self.status = "Processando"
-            self.save(ignore_permissions=True)
             
             # Gera chave de acesso
             self.gerar_chave_acesso()
@@ -175,23 +212,68 @@ class NotaFiscal(Document):
             signer = XMLSigner(self.empresa)
             xml_assinado = signer.sign(xml_nfe)
             
-            # Salva XML assinado
+            # Salva XML assinado no arquivo fiscal (segmento comprimido + índice Arquivo Fiscal)
             self.salvar_xml(xml_assinado, "xml_nfe")
             
+            # Marcador pré-envio
+            self.gravar_marcador_envio()
+            
             # Transmite para SEFAZ
             transmitter = SEFAZTransmitter(self.empresa)
             resultado = transmitter.enviar_nfe(xml_assinado)
+            enviada = True
             
             # Processa resultado
             self.processar_retorno_sefaz(resultado)
             
+        except RequisicaoDuplicada:
+            # Outro processo está transmitindo esta nota
+            raise
+            
+        except FalhaComunicacao as e:
+            # Sem resposta, mas a SEFAZ pode ter recebido: o marcador "Processando"
+            # já confirmado fica para a reconciliação
+            frappe.db.rollback()
+            frappe.log_error(f"Falha de comunicação ao emitir a NFe {self.name}: {str(e)}", "Emissão NFe")
+            raise
+            
+        except LimiteConsumoExcedido as e:
+            # Não foi enviada: fica pendente para o próximo reenvio
+            self.status = "Pendente"
+            self.motivo_rejeicao = str(e)
+            self._persistir()
+            raise
+            
         except Exception as e:
+            if enviada:
+                # A SEFAZ pode ter autorizado: mantém o marcador "Processando" para a reconciliação
+                frappe.db.rollback()
+                frappe.log_error(f"Erro ao gravar retorno da NFe {self.name}: {str(e)}", "Emissão NFe")
+                raise
+            
             self.status = "Rejeitada"
             self.motivo_rejeicao = str(e)
-            self.save(ignore_permissions=True)
+            self._persistir()
             frappe.log_error(f"Erro ao emitir NFe: {str(e)}", "Emissão NFe")
             raise
     
+    def gravar_marcador_envio(self):
+        """Grava o estado mínimo antes da transmissão (um UPDATE e commit)"""
+        from erpnext_fiscal_br.services import resumo_fiscal
+        
+        self.modified = now_datetime()
+        anterior = resumo_fiscal.estado_atual(self.name)
+        
+        frappe.db.set_value("Nota Fiscal", self.name, {
+            "status": self.status,
+            "chave_acesso": self.chave_acesso,
+            "xml_nfe": self.xml_nfe,
+            "modified": self.modified
+        }, update_modified=False)
+        # Só o status muda no banco: os totais do resumo são os gravados na nota
+        resumo_fiscal.atualizar([(anterior, dict(anterior, status=self.status))])
+        frappe.db.commit()
+    
     def processar_retorno_sefaz(self, resultado):
         """Processa o retorno da SEFAZ"""
         self.codigo_status = resultado.get("cStat")
@@ -206,13 +288,11 @@ class NotaFiscal(Document):
             # Salva XML autorizado (procNFe)
             if resultado.get("xml_proc"):
                 self.salvar_xml(resultado.get("xml_proc"), "xml_autorizado")
+                self.agendar_indice_fiscal()
             
             # Gera DANFE
             self.gerar_danfe()
             
-            # Atualiza Sales Invoice
-            self.atualizar_sales_invoice()
-            
         elif self.codigo_status in ["204", "205", "206"]:
             # Duplicidade - já autorizada
             self.status = "Autorizada"
@@ -222,48 +302,61 @@ class NotaFiscal(Document):
             self.status = "Rejeitada"
             self.motivo_rejeicao = f"[{self.codigo_status}] {self.mensagem_sefaz}"
         
-        self.save(ignore_permissions=True)
+        self._persistir()
     
-    def salvar_xml(self, xml_content, field_name):
-        """Salva o XML como anexo"""
-        file_name = f"{self.chave_acesso}_{field_name}.xml"
+    def _persistir(self):
+        """
+        Grava o estado da nota em uma única transação: um UPDATE da nota
+        (sem versão nem regravação dos itens), o resumo fiscal e a Sales Invoice
+        """
+        from erpnext_fiscal_br.services import resumo_fiscal
+        
+        self.modified = now_datetime()
+        self.modified_by = frappe.session.user
+        anterior = resumo_fiscal.estado_atual(self.name)
+        self.db_update()
+        resumo_fiscal.atualizar([(anterior, self)])
+        
+        if self.status == "Autorizada":
+            self.atualizar_sales_invoice()
         
-        file_doc = frappe.get_doc({
-            "doctype": "File",
-            "file_name": file_name,
-            "attached_to_doctype": self.doctype,
-            "attached_to_name": self.name,
-            "content": xml_content,
-            "is_private": 1
-        })
-        file_doc.insert(ignore_permissions=True)
+        self.notify_update()
+    
+    def salvar_xml(self, xml_content, field_name):
+        """Salva o XML no arquivo fiscal (o campo guarda a URL de download)"""
+        from erpnext_fiscal_br.services import archive
         
-        self.set(field_name, file_doc.file_url)
+        tipo = {"xml_nfe": "nfe", "xml_autorizado": "proc"}[field_name]
+        self.set(field_name, archive.gravar(self.chave_acesso, tipo, xml_content))
     
     def gerar_danfe(self):
-        """Gera o DANFE (PDF) da nota fiscal"""
-        from erpnext_fiscal_br.services.danfe import DANFEGenerator
+        """
+        Aponta o DANFE para o endpoint de download; o PDF é renderizado no primeiro
+        acesso ou, se configurado, por um job de baixa prioridade após o commit
+        """
+        from erpnext_fiscal_br.services import danfe_cache
+        
+        self.danfe = danfe_cache.url_danfe(self.name)
+        danfe_cache.enfileirar_pre_renderizacao(self.name, self.empresa)
+    
+    def ler_arquivo(self, field_name):
+        """Lê o conteúdo de um anexo (XML/PDF) do arquivo fiscal ou direto do disco"""
+        from erpnext_fiscal_br.services import archive
         
-        try:
-            generator = DANFEGenerator(self)
-            pdf_content = generator.generate()
-            
-            file_name = f"DANFE_{self.chave_acesso}.pdf"
-            
-            file_doc = frappe.get_doc({
-                "doctype": "File",
-                "file_name": file_name,
-                "attached_to_doctype": self.doctype,
-                "attached_to_name": self.name,
-                "content": pdf_content,
-                "is_private": 0
-            })
-            file_doc.insert(ignore_permissions=True)
-            
-            self.danfe = file_doc.file_url
-            
-        except Exception as e:
-            frappe.log_error(f"Erro ao gerar DANFE: {str(e)}", "DANFE")
+        file_url = self.get(field_name)
+        if not file_url:
+            return None
+        
+        if archive.is_url_arquivo(file_url):
+            return archive.ler_url(file_url)
+        
+        # /private/files/x -> site/private/files/x; /files/x -> site/public/files/x
+        partes = file_url.lstrip("/").split("/")
+        if partes[0] != "private":
+            partes.insert(0, "public")
+        
+        with open(frappe.get_site_path(*partes), "rb") as f:
+            return f.read()
     
     def atualizar_sales_invoice(self):
         """Atualiza a Sales Invoice com os dados da NFe"""
@@ -280,10 +373,27 @@ class NotaFiscal(Document):
     
     def cancelar(self, justificativa):
         """Cancela a nota fiscal"""
+        self.validar_cancelamento(justificativa)
+        
+        from erpnext_fiscal_br.services.transmitter import SEFAZTransmitter
+        
+        transmitter = SEFAZTransmitter(self.empresa)
+        resultado = transmitter.cancelar_nfe(self.chave_acesso, self.protocolo_autorizacao, justificativa)
+        
+        if resultado.get("cStat") in ["135", "155"]:
+            self.registrar_cancelamento(justificativa, resultado)
+        else:
+            frappe.throw(_("Erro ao cancelar: [{0}] {1}").format(
+                resultado.get("cStat"),
+                resultado.get("xMotivo")
+            ))
+    
+    def validar_cancelamento(self, justificativa):
+        """Valida se a nota pode ser cancelada com a justificativa"""
         if self.status != "Autorizada":
             frappe.throw(_("Apenas notas autorizadas podem ser canceladas"))
         
-        if len(justificativa) < 15:
+        if len(justificativa or "") < 15:
             frappe.throw(_("Justificativa deve ter no mínimo 15 caracteres"))
         
         # Verifica prazo de cancelamento (24 horas)
@@ -291,59 +401,67 @@ class NotaFiscal(Document):
             data_limite = self.data_autorizacao + timedelta(hours=24)
             if now_datetime() > data_limite:
                 frappe.throw(_("Prazo de cancelamento expirado (24 horas)"))
+    
+    def registrar_cancelamento(self, justificativa, resultado):
+        """Grava o cancelamento aceito pela SEFAZ (nota, evento e Sales Invoice)"""
+        self.status = "Cancelada"
+        self.mensagem_sefaz = resultado.get("xMotivo")
+        self.save(ignore_permissions=True)
+        
+        # Cria evento fiscal
+        evento = self.criar_evento("Cancelamento", justificativa, resultado)
+        
+        # Atualiza Sales Invoice
+        if self.sales_invoice:
+            frappe.db.set_value("Sales Invoice", self.sales_invoice, "status_fiscal", "Cancelada")
+        
+        return evento
+    
+    def carta_correcao(self, correcao):
+        """Envia carta de correção (CCe)"""
+        seq_evento = self.validar_carta_correcao(correcao)
         
         from erpnext_fiscal_br.services.transmitter import SEFAZTransmitter
         
         transmitter = SEFAZTransmitter(self.empresa)
-        resultado = transmitter.cancelar_nfe(self.chave_acesso, self.protocolo_autorizacao, justificativa)
+        resultado = transmitter.carta_correcao(self.chave_acesso, correcao, seq_evento)
         
         if resultado.get("cStat") in ["135", "155"]:
-            self.status = "Cancelada"
-            self.mensagem_sefaz = resultado.get("xMotivo")
-            self.save(ignore_permissions=True)
-            
-            # Cria evento fiscal
-            self.criar_evento("Cancelamento", justificativa, resultado)
-            
-            # Atualiza Sales Invoice
-            if self.sales_invoice:
-                frappe.db.set_value("Sales Invoice", self.sales_invoice, "status_fiscal", "Cancelada")
+            self.criar_evento("Carta de Correção", correcao, resultado, seq_evento)
+            return True
         else:
-            frappe.throw(_("Erro ao cancelar: [{0}] {1}").format(
+            frappe.throw(_("Erro ao enviar CCe: [{0}] {1}").format(
                 resultado.get("cStat"),
                 resultado.get("xMotivo")
             ))
     
-    def carta_correcao(self, correcao):
-        """Envia carta de correção (CCe)"""
+    def validar_carta_correcao(self, correcao, pendentes=0):
+        """
+        Valida a carta de correção e retorna a sua sequência
+        
+        Args:
+            correcao: Texto da correção
+            pendentes: Cartas da nota já enviadas no mesmo lote (ainda sem Evento Fiscal)
+        
+        Returns:
+            int: Número sequencial do evento
+        """
         if self.status != "Autorizada":
             frappe.throw(_("Apenas notas autorizadas podem receber carta de correção"))
         
-        if len(correcao) < 15:
+        if len(correcao or "") < 15:
             frappe.throw(_("Correção deve ter no mínimo 15 caracteres"))
         
         # Conta sequência de eventos
         seq_evento = frappe.db.count("Evento Fiscal", {
             "nota_fiscal": self.name,
             "tipo_evento": "Carta de Correção"
-        }) + 1
+        }) + pendentes + 1
         
         if seq_evento > 20:
             frappe.throw(_("Limite de 20 cartas de correção atingido"))
         
-        from erpnext_fiscal_br.services.transmitter import SEFAZTransmitter
-        
-        transmitter = SEFAZTransmitter(self.empresa)
-        resultado = transmitter.carta_correcao(self.chave_acesso, correcao, seq_evento)
-        
-        if resultado.get("cStat") in ["135", "155"]:
-            self.criar_evento("Carta de Correção", correcao, resultado, seq_evento)
-            return True
-        else:
-            frappe.throw(_("Erro ao enviar CCe: [{0}] {1}").format(
-                resultado.get("cStat"),
-                resultado.get("xMotivo")
-            ))
+        return seq_evento
     
     def criar_evento(self, tipo, descricao, resultado, sequencia=1):
         """Cria um registro de evento fiscal"""
@@ -356,9 +474,30 @@ class NotaFiscal(Document):
         evento.data_evento = resultado.get("dhRegEvento")
         evento.codigo_status = resultado.get("cStat")
         evento.mensagem = resultado.get("xMotivo")
+        
+        # Retorno do evento (retEvento) no arquivo fiscal
+        if resultado.get("eventos") and resultado["eventos"][0].get("tpEvento"):
+            from erpnext_fiscal_br.services import archive
+            from erpnext_fiscal_br.services.sefaz_response import serializar_elemento
+            
+            ret_evento = resultado["eventos"][0]
+            evento.xml_retorno = archive.gravar(
+                self.chave_acesso,
+                "evento",
+                serializar_elemento(ret_evento["elemento"]),
+                sufixo=f"{ret_evento.get('tpEvento')}-{str(sequencia).zfill(2)}"
+            )
+            self.agendar_indice_fiscal()
+        
         evento.insert(ignore_permissions=True)
         
         return evento
+    
+    def agendar_indice_fiscal(self):
+        """Enfileira a indexação do XML recém-arquivado (após o commit)"""
+        from erpnext_fiscal_br.services import indice_fiscal
+        
+        indice_fiscal.agendar()
 
 
 @frappe.whitelist()
@@ -496,3 +635,10 @@ def duplicar_nota_fiscal(nota_fiscal):
         "numero": nova_nf.numero,
         "serie": nova_nf.serie
     }
+
+
+def on_doctype_update():
+    """Índices compostos usados pelo relatório Notas Emitidas, pelas exportações e pela numeração"""
+    frappe.db.add_index("Nota Fiscal", ["empresa", "status", "creation"])
+    frappe.db.add_index("Nota Fiscal", ["empresa", "data_autorizacao"])
+    frappe.db.add_index("Nota Fiscal", ["empresa", "modelo", "serie", "numero"])
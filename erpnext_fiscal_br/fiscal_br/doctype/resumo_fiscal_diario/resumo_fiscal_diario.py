@@ -0,0 +1,15 @@
+"""
+Resumo Fiscal Diário
+Totais das notas por empresa, modelo, série, dia e status (services/resumo_fiscal.py)
+"""
+
+import frappe
+from frappe.model.document import Document
+
+
+class ResumoFiscalDiario(Document):
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("Resumo Fiscal Diario", ["empresa", "dia"])
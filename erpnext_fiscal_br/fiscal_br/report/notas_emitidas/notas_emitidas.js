@@ -30,6 +30,19 @@ frappe.query_reports["Notas Emitidas"] = {
             "label": __("Até"),
             "fieldtype": "Date",
             "default": frappe.datetime.get_today()
+        },
+        {
+            "fieldname": "page",
+            "label": __("Página"),
+            "fieldtype": "Int",
+            "default": 1
+        },
+        {
+            "fieldname": "page_length",
+            "label": __("Notas por Página"),
+            "fieldtype": "Select",
+            "options": "100\n500\n1000\n5000",
+            "default": "500"
         }
     ],
     
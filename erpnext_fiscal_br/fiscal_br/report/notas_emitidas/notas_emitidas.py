@@ -4,16 +4,23 @@ Relatório de Notas Fiscais Emitidas
 
 import frappe
 from frappe import _
-from frappe.utils import flt
+from frappe.utils import add_days, cint, flt, getdate
+
+# Linhas por página do relatório
+PAGE_LENGTH = 500
 
 
 def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    
     columns = get_columns()
+    totais = get_totais(filters)
     data = get_data(filters)
-    chart = get_chart(data)
-    summary = get_summary(data)
+    chart = get_chart(totais)
+    summary = get_summary(totais)
+    message = get_message(filters, totais, len(data))
     
-    return columns, data, None, chart, summary
+    return columns, data, message, chart, summary
 
 
 def get_columns():
@@ -86,6 +93,10 @@ def get_columns():
 def get_data(filters):
     conditions = get_conditions(filters)
     
+    page_length = cint(filters.get("page_length")) or PAGE_LENGTH
+    filters["limit"] = page_length
+    filters["offset"] = (max(cint(filters.get("page")), 1) - 1) * page_length
+    
     data = frappe.db.sql("""
         SELECT
             name,
@@ -104,11 +115,25 @@ def get_data(filters):
             1=1 {conditions}
         ORDER BY
             creation DESC
+        LIMIT %(limit)s OFFSET %(offset)s
     """.format(conditions=conditions), filters, as_dict=1)
     
     return data
 
 
+def get_totais(filters):
+    """Quantidade e valor por status, lidos do Resumo Fiscal Diario"""
+    from erpnext_fiscal_br.services.resumo_fiscal import totais_por_status
+    
+    return totais_por_status(
+        empresa=filters.get("empresa"),
+        modelo=filters.get("modelo"),
+        status=filters.get("status"),
+        de=filters.get("from_date"),
+        ate=filters.get("to_date")
+    )
+
+
 def get_conditions(filters):
     conditions = ""
     
@@ -121,32 +146,29 @@ def get_conditions(filters):
     if filters.get("status"):
         conditions += " AND status = %(status)s"
     
+    # Intervalos em creation (sem DATE()) para usar o índice (empresa, status, creation)
     if filters.get("from_date"):
-        conditions += " AND DATE(creation) >= %(from_date)s"
+        filters["from_datetime"] = getdate(filters.from_date)
+        conditions += " AND creation >= %(from_datetime)s"
     
     if filters.get("to_date"):
-        conditions += " AND DATE(creation) <= %(to_date)s"
+        filters["to_datetime"] = add_days(getdate(filters.to_date), 1)
+        conditions += " AND creation < %(to_datetime)s"
     
     return conditions
 
 
-def get_chart(data):
-    if not data:
+def get_chart(totais):
+    if not totais:
         return None
     
-    # Agrupa por status
-    status_count = {}
-    for row in data:
-        status = row.get("status", "Outros")
-        status_count[status] = status_count.get(status, 0) + 1
-    
     return {
         "data": {
-            "labels": list(status_count.keys()),
+            "labels": [row.status or _("Outros") for row in totais],
             "datasets": [
                 {
                     "name": _("Quantidade"),
-                    "values": list(status_count.values())
+                    "values": [row.quantidade for row in totais]
                 }
             ]
         },
@@ -155,36 +177,45 @@ def get_chart(data):
     }
 
 
-def get_summary(data):
-    if not data:
+def get_summary(totais):
+    if not totais:
         return []
     
-    total_notas = len(data)
-    total_valor = sum(flt(row.get("valor_total", 0)) for row in data)
-    autorizadas = len([row for row in data if row.get("status") == "Autorizada"])
-    canceladas = len([row for row in data if row.get("status") == "Cancelada"])
+    por_status = {row.status: row.quantidade for row in totais}
     
     return [
         {
-            "value": total_notas,
+            "value": sum(row.quantidade for row in totais),
             "label": _("Total de Notas"),
             "datatype": "Int"
         },
         {
-            "value": total_valor,
+            "value": sum(flt(row.valor_total) for row in totais),
             "label": _("Valor Total"),
             "datatype": "Currency"
         },
         {
-            "value": autorizadas,
+            "value": por_status.get("Autorizada", 0),
             "label": _("Autorizadas"),
             "datatype": "Int",
             "indicator": "green"
         },
         {
-            "value": canceladas,
+            "value": por_status.get("Cancelada", 0),
             "label": _("Canceladas"),
             "datatype": "Int",
             "indicator": "red"
         }
     ]
+
+
+def get_message(filters, totais, linhas):
+    """Posição da página exibida no total de notas filtradas"""
+    total = sum(row.quantidade for row in totais)
+    if total <= linhas:
+        return None
+    
+    inicio = filters.offset + 1 if linhas else 0
+    return _("Exibindo notas {0} a {1} de {2}. Use o filtro Página para ver as demais.").format(
+        inicio, filters.offset + linhas, total
+    )
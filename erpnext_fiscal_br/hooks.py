@@ -162,11 +162,25 @@ doc_events = {
 scheduler_events = {
     "daily": [
         "erpnext_fiscal_br.tasks.check_certificate_expiry",
+        "erpnext_fiscal_br.tasks.inutilizar_lacunas_numeracao",
     ],
     "hourly": [
         "erpnext_fiscal_br.tasks.retry_pending_notes",
     ],
+    "weekly_long": [
+        "erpnext_fiscal_br.tasks.atualizar_cadastro_clientes",
+    ],
+    "monthly_long": [
+        "erpnext_fiscal_br.tasks.cleanup_old_xml_files",
+    ],
     "cron": {
+        "*/10 * * * *": [
+            "erpnext_fiscal_br.tasks.reconciliar_notas_processando",
+            "erpnext_fiscal_br.tasks.indexar_xmls_fiscais",
+        ],
+        "*/15 * * * *": [
+            "erpnext_fiscal_br.tasks.sincronizar_distribuicao_dfe",
+        ],
         "0 6 * * *": [
             "erpnext_fiscal_br.tasks.daily_fiscal_report",
         ],
@@ -353,6 +353,27 @@ def get_custom_fields():
             },
         ],
         
+        # Campos na Purchase Invoice
+        "Purchase Invoice": [
+            {
+                "fieldname": "fiscal_br_section",
+                "label": "Nota Fiscal Eletrônica",
+                "fieldtype": "Section Break",
+                "insert_after": "amended_from",
+                "collapsible": 1,
+            },
+            {
+                "fieldname": "chave_acesso_nfe",
+                "label": "Chave NFe",
+                "fieldtype": "Data",
+                "insert_after": "fiscal_br_section",
+                "read_only": 1,
+                "unique": 1,
+                "no_copy": 1,
+                "description": "Chave de acesso da NFe do fornecedor (44 dígitos)",
+            },
+        ],
+        
         # Campos no Sales Invoice Item
         "Sales Invoice Item": [
             {
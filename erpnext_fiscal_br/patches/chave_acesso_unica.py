@@ -0,0 +1,55 @@
+"""
+Prepara a Nota Fiscal para o índice único em chave_acesso
+
+Chaves vazias passam a NULL (o índice único aceita vários NULL). Em chaves
+repetidas, a nota autorizada/cancelada (ou a mais recente) mantém a chave e
+as demais, ainda não autorizadas, ficam sem chave: ela é recalculada no
+próximo envio.
+
+Mais de uma nota autorizada com a mesma chave não tem correção automática:
+o patch para com a lista dessas notas, antes que a sincronização do modelo
+falhe ao criar o índice único.
+"""
+
+import frappe
+from frappe import _
+
+
+def execute():
+    if not frappe.db.table_exists("Nota Fiscal"):
+        return
+
+    frappe.db.sql("UPDATE `tabNota Fiscal` SET chave_acesso = NULL WHERE chave_acesso = ''")
+
+    duplicadas = frappe.db.sql("""
+        SELECT chave_acesso
+        FROM `tabNota Fiscal`
+        WHERE chave_acesso IS NOT NULL
+        GROUP BY chave_acesso
+        HAVING COUNT(*) > 1
+    """, pluck=True)
+
+    conflitos = []
+    for chave in duplicadas:
+        notas = frappe.db.sql("""
+            SELECT name, status
+            FROM `tabNota Fiscal`
+            WHERE chave_acesso = %s
+            ORDER BY status IN ('Autorizada', 'Cancelada', 'Denegada') DESC, modified DESC
+        """, (chave,), as_dict=True)
+
+        for nota in notas[1:]:
+            if nota.status in ("Autorizada", "Cancelada", "Denegada"):
+                conflitos.append(f"{chave}: {', '.join(n.name for n in notas)}")
+                break
+
+            frappe.db.set_value("Nota Fiscal", nota.name, "chave_acesso", None, update_modified=False)
+
+    if conflitos:
+        frappe.throw(
+            _(
+                "Chave de acesso usada por mais de uma nota autorizada. Corrija estas notas antes de "
+                "migrar (o índice único de chave_acesso não pode ser criado):\n{0}"
+            ).format("\n".join(conflitos)),
+            title=_("Chave de Acesso Duplicada")
+        )
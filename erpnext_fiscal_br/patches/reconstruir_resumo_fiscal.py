@@ -0,0 +1,12 @@
+"""
+Preenche o Resumo Fiscal Diario com as notas já existentes
+"""
+
+import frappe
+
+
+def execute():
+    from erpnext_fiscal_br.services.resumo_fiscal import reconstruir
+
+    reconstruir()
+    frappe.db.commit()
@@ -0,0 +1,514 @@
+"""
+Archive - Armazenamento dos XMLs fiscais
+Blobs comprimidos (zstd, ou zlib sem o pacote zstandard) em segmentos
+append-only por mês de emissão, com índice no DocType Arquivo Fiscal
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import zlib
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import frappe
+from frappe import _
+from frappe.utils import now_datetime
+
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+TIPOS = ("nfe", "proc", "evento", "inut")
+
+PASTA = "fiscal_archive"
+
+# Tamanho máximo de um segmento antes de abrir o próximo
+TAMANHO_SEGMENTO = 256 * 1024 * 1024
+
+# Segmentos fechados com menos desta fração de dados válidos são compactados
+LIMIAR_COMPACTACAO = 0.6
+
+# Anos de guarda após o ano de emissão (CTN art. 173: 5 anos a partir do exercício seguinte)
+RETENCAO_ANOS = 5
+
+URL_DOWNLOAD = "/api/method/erpnext_fiscal_br.api.arquivo.download_xml"
+
+# Cabeçalho de cada blob: magic, compressão, tamanho do nome, tamanho dos dados, crc32
+CABECALHO = struct.Struct(">4sBHII")
+MAGIC = b"FBA1"
+
+COMPRESSAO = {"zlib": 1, "zstd": 2}
+
+# Segmentos mapeados em memória neste processo: {segmento: (arquivo, mmap)}
+_mapas = {}
+
+# Threads do mesmo processo (reconciliação, cadastro, exportação) compartilham os
+# mapas: a troca, a leitura e o fechamento de um mapa acontecem sob este lock
+_lock_mapas = threading.RLock()
+
+
+class ArquivoNaoEncontrado(Exception):
+    """XML não encontrado no arquivo fiscal"""
+
+
+def _nome(chave, tipo, sufixo=None):
+    return f"{chave}:{tipo}:{sufixo}" if sufixo else f"{chave}:{tipo}"
+
+
+def _ano_mes(chave):
+    """AAAAMM de emissão a partir da chave de acesso (posições 3-6 = AAMM)"""
+    if chave and len(chave) == 44 and chave.isdigit():
+        return "20" + chave[2:6]
+    return now_datetime().strftime("%Y%m")
+
+
+def _caminho(segmento):
+    return frappe.get_site_path("private", PASTA, *segmento.split("/"))
+
+
+def _comprimir(conteudo):
+    if HAS_ZSTD:
+        return "zstd", zstandard.ZstdCompressor(level=9).compress(conteudo)
+    return "zlib", zlib.compress(conteudo, 9)
+
+
+def _descomprimir(dados, compressao):
+    if compressao == "zstd":
+        if not HAS_ZSTD:
+            frappe.throw(_("Pacote zstandard necessário para ler este XML do arquivo fiscal"))
+        return zstandard.ZstdDecompressor().decompress(dados)
+    return zlib.decompress(dados)
+
+
+def url_arquivo(chave, tipo, sufixo=None):
+    """URL de download de um XML do arquivo fiscal"""
+    parametros = {"chave": chave, "tipo": tipo}
+    if sufixo:
+        parametros["sufixo"] = sufixo
+    return f"{URL_DOWNLOAD}?{urlencode(parametros)}"
+
+
+def is_url_arquivo(url):
+    return bool(url) and url.startswith(URL_DOWNLOAD)
+
+
+def gravar(chave, tipo, conteudo, sufixo=None, ano_mes=None):
+    """
+    Grava um XML no arquivo fiscal
+
+    O blob é anexado ao segmento do mês de emissão e o índice é gravado na
+    transação corrente. Conteúdo idêntico ao já arquivado não é regravado.
+
+    Args:
+        chave: Chave de acesso (ou Id, para inutilização)
+        tipo: nfe, proc, evento ou inut
+        conteudo: XML (str ou bytes)
+        sufixo: Diferencia documentos do mesmo tipo (ex: evento "110111-01")
+        ano_mes: AAAAMM de emissão (padrão: extraído da chave)
+
+    Returns:
+        str: URL de download do XML
+    """
+    if tipo not in TIPOS:
+        frappe.throw(_("Tipo de XML inválido: {0}").format(tipo))
+
+    if isinstance(conteudo, str):
+        conteudo = conteudo.encode("utf-8")
+
+    nome = _nome(chave, tipo, sufixo)
+    sha256 = hashlib.sha256(conteudo).hexdigest()
+
+    if frappe.db.get_value("Arquivo Fiscal", nome, "sha256") == sha256:
+        return url_arquivo(chave, tipo, sufixo)
+
+    ano_mes = ano_mes or _ano_mes(chave)
+    compressao, dados = _comprimir(conteudo)
+    segmento, posicao = _anexar(ano_mes, nome, compressao, dados)
+
+    _gravar_indice([{
+        "name": nome,
+        "chave": chave,
+        "tipo": tipo,
+        "sufixo": sufixo,
+        "ano_mes": ano_mes,
+        "segmento": segmento,
+        "posicao": posicao,
+        "tamanho": len(dados),
+        "tamanho_original": len(conteudo),
+        "compressao": compressao,
+        "sha256": sha256,
+    }])
+
+    return url_arquivo(chave, tipo, sufixo)
+
+
+def _anexar(ano_mes, nome, compressao, dados):
+    """Anexa um blob ao segmento aberto do mês, com lock exclusivo"""
+    pasta = _caminho(ano_mes[:4])
+    os.makedirs(pasta, exist_ok=True)
+
+    nome_bytes = nome.encode("utf-8")
+    registro = CABECALHO.pack(MAGIC, COMPRESSAO[compressao], len(nome_bytes), len(dados), zlib.crc32(dados))
+
+    numero = _ultimo_segmento(pasta, ano_mes)
+    while True:
+        segmento = f"{ano_mes[:4]}/{ano_mes}-{numero:04d}.seg"
+        with open(_caminho(segmento), "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                inicio = f.seek(0, os.SEEK_END)
+                if inicio and inicio + len(registro) + len(nome_bytes) + len(dados) > TAMANHO_SEGMENTO:
+                    numero += 1
+                    continue
+
+                f.write(registro)
+                f.write(nome_bytes)
+                f.write(dados)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+        return segmento, inicio + len(registro) + len(nome_bytes)
+
+
+def _ultimo_segmento(pasta, ano_mes):
+    numeros = [
+        int(nome[len(ano_mes) + 1:-4])
+        for nome in os.listdir(pasta)
+        if nome.startswith(ano_mes + "-") and nome.endswith(".seg")
+    ]
+    return max(numeros) if numeros else 1
+
+
+def _gravar_indice(registros):
+    """Insere ou atualiza as entradas do índice em um único comando"""
+    agora = now_datetime()
+    usuario = frappe.session.user
+
+    valores = []
+    for r in registros:
+        valores.append((
+            r["name"], agora, agora, usuario, usuario,
+            r["chave"], r["tipo"], r.get("sufixo"), r["ano_mes"], r["segmento"], r["posicao"],
+            r["tamanho"], r["tamanho_original"], r["compressao"], r["sha256"],
+        ))
+
+    frappe.db.sql("""
+        INSERT INTO `tabArquivo Fiscal`
+            (name, creation, modified, owner, modified_by,
+            chave, tipo, sufixo, ano_mes, segmento, posicao,
+            tamanho, tamanho_original, compressao, sha256)
+        VALUES {0}
+        ON DUPLICATE KEY UPDATE
+            modified = VALUES(modified), indexado = 0, ano_mes = VALUES(ano_mes),
+            segmento = VALUES(segmento), posicao = VALUES(posicao),
+            tamanho = VALUES(tamanho), tamanho_original = VALUES(tamanho_original),
+            compressao = VALUES(compressao), sha256 = VALUES(sha256)
+    """.format(", ".join(["(%s)" % ", ".join(["%s"] * 15)] * len(valores))),
+        [v for linha in valores for v in linha])
+
+
+def ler(chave, tipo, sufixo=None):
+    """
+    Lê um XML do arquivo fiscal
+
+    Args:
+        chave: Chave de acesso (ou Id, para inutilização)
+        tipo: nfe, proc, evento ou inut
+        sufixo: Sufixo usado na gravação
+
+    Returns:
+        bytes: XML
+
+    Raises:
+        ArquivoNaoEncontrado: Se o XML não estiver arquivado
+    """
+    nome = _nome(chave, tipo, sufixo)
+
+    for _tentativa in range(2):
+        entrada = frappe.db.get_value(
+            "Arquivo Fiscal", nome, ["segmento", "posicao", "tamanho", "compressao"], as_dict=True
+        )
+        if not entrada:
+            raise ArquivoNaoEncontrado(nome)
+
+        try:
+            dados = _ler_blob(entrada.segmento, entrada.posicao, entrada.tamanho)
+            return _descomprimir(dados, entrada.compressao)
+        except FileNotFoundError:
+            # Segmento removido por uma compactação concluída após a leitura do índice
+            _fechar_mapa(entrada.segmento)
+
+    raise ArquivoNaoEncontrado(nome)
+
+
+def iterar_xmls(chaves, tipos=TIPOS):
+    """
+    Lê os XMLs arquivados de várias chaves de acesso
+
+    As entradas são lidas na ordem em que estão nos segmentos (leitura
+    sequencial do disco), uma de cada vez.
+
+    Args:
+        chaves: Chaves de acesso
+        tipos: Tipos de XML a incluir
+
+    Yields:
+        tuple: (entrada do índice com chave/tipo/sufixo, XML em bytes)
+    """
+    if not chaves:
+        return
+
+    entradas = frappe.get_all(
+        "Arquivo Fiscal",
+        filters={"chave": ["in", list(chaves)], "tipo": ["in", list(tipos)]},
+        fields=["chave", "tipo", "sufixo", "segmento", "posicao", "tamanho", "compressao"],
+        order_by="segmento asc, posicao asc"
+    )
+
+    yield from ler_entradas(entradas)
+
+
+def ler_entradas(entradas):
+    """
+    Lê os XMLs de entradas do índice já consultadas
+
+    Args:
+        entradas: Entradas do Arquivo Fiscal com chave, tipo, sufixo, segmento,
+            posicao, tamanho e compressao, de preferência na ordem dos segmentos
+
+    Yields:
+        tuple: (entrada, XML em bytes)
+    """
+    for entrada in entradas:
+        try:
+            dados = _ler_blob(entrada.segmento, entrada.posicao, entrada.tamanho)
+            conteudo = _descomprimir(dados, entrada.compressao)
+        except FileNotFoundError:
+            # Segmento compactado durante a leitura: busca a posição nova no índice
+            _fechar_mapa(entrada.segmento)
+            conteudo = ler(entrada.chave, entrada.tipo, entrada.sufixo)
+
+        yield entrada, conteudo
+
+
+def ler_url(url):
+    """Lê o XML a partir da URL gravada no campo do documento"""
+    parametros = parse_qs(urlparse(url).query)
+    return ler(
+        parametros["chave"][0],
+        parametros["tipo"][0],
+        (parametros.get("sufixo") or [None])[0]
+    )
+
+
+def _ler_blob(segmento, posicao, tamanho):
+    """Lê os bytes do blob pelo mapeamento em memória do segmento"""
+    with _lock_mapas:
+        mapa = _mapas.get(segmento)
+        if mapa is None or posicao + tamanho > len(mapa[1]):
+            # Segmento ainda não mapeado ou cresceu desde o mapeamento
+            _fechar_mapa(segmento)
+            arquivo = open(_caminho(segmento), "rb")
+            mapa = (arquivo, mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ))
+            _mapas[segmento] = mapa
+
+        # O fatiamento copia os bytes: o mapa pode ser fechado depois de liberado o lock
+        return mapa[1][posicao:posicao + tamanho]
+
+
+def _fechar_mapa(segmento):
+    with _lock_mapas:
+        mapa = _mapas.pop(segmento, None)
+        if mapa:
+            mapa[1].close()
+            mapa[0].close()
+
+
+def aplicar_retencao(anos=None):
+    """
+    Remove os XMLs cujo prazo legal de guarda terminou
+
+    Documentos emitidos no ano A são mantidos até o fim do ano A + anos.
+
+    Args:
+        anos: Anos de guarda (padrão: site_config fiscal_br_retencao_anos ou RETENCAO_ANOS)
+
+    Returns:
+        list: Anos removidos
+    """
+    import shutil
+
+    anos = int(anos or frappe.conf.get("fiscal_br_retencao_anos") or RETENCAO_ANOS)
+    ano_limite = now_datetime().year - anos - 1
+
+    raiz = _caminho("")
+    if not os.path.isdir(raiz):
+        return []
+
+    removidos = []
+    for pasta in sorted(os.listdir(raiz)):
+        if not pasta.isdigit() or int(pasta) > ano_limite:
+            continue
+
+        frappe.db.delete("Arquivo Fiscal", {"ano_mes": ["like", f"{pasta}%"]})
+        frappe.db.commit()
+
+        with _lock_mapas:
+            for segmento in list(_mapas):
+                if segmento.startswith(pasta + "/"):
+                    _fechar_mapa(segmento)
+        shutil.rmtree(os.path.join(raiz, pasta))
+        removidos.append(pasta)
+
+    return removidos
+
+
+def compactar(limiar=LIMIAR_COMPACTACAO):
+    """
+    Reescreve os segmentos fechados com muitos blobs substituídos
+
+    Os blobs ainda referenciados pelo índice são copiados para o segmento
+    aberto do mesmo mês; o índice é atualizado e o segmento antigo removido.
+
+    Args:
+        limiar: Fração mínima de dados válidos para manter o segmento
+
+    Returns:
+        dict: Segmentos compactados e bytes liberados
+    """
+    raiz = _caminho("")
+    if not os.path.isdir(raiz):
+        return {"segmentos": 0, "bytes_liberados": 0}
+
+    uso = {
+        r.segmento: r.bytes_validos
+        for r in frappe.db.sql("""
+            SELECT segmento, SUM(tamanho) AS bytes_validos
+            FROM `tabArquivo Fiscal`
+            GROUP BY segmento
+        """, as_dict=True)
+    }
+
+    compactados = 0
+    liberados = 0
+
+    for pasta in sorted(os.listdir(raiz)):
+        caminho_pasta = os.path.join(raiz, pasta)
+        if not os.path.isdir(caminho_pasta):
+            continue
+
+        for nome in sorted(os.listdir(caminho_pasta)):
+            if not nome.endswith(".seg"):
+                continue
+
+            ano_mes = nome.split("-", 1)[0]
+            segmento = f"{pasta}/{nome}"
+
+            # O último segmento do mês recebe gravações: não é compactado
+            if int(nome[len(ano_mes) + 1:-4]) >= _ultimo_segmento(caminho_pasta, ano_mes):
+                continue
+
+            tamanho = os.path.getsize(os.path.join(caminho_pasta, nome))
+            if tamanho and (uso.get(segmento) or 0) / tamanho >= limiar:
+                continue
+
+            liberados += _reescrever_segmento(segmento, ano_mes)
+            compactados += 1
+
+    return {"segmentos": compactados, "bytes_liberados": liberados}
+
+
+def _reescrever_segmento(segmento, ano_mes):
+    """Move os blobs válidos de um segmento para o segmento aberto e remove o antigo"""
+    tamanho_antes = os.path.getsize(_caminho(segmento))
+
+    entradas = frappe.get_all(
+        "Arquivo Fiscal",
+        filters={"segmento": segmento},
+        fields=["name", "posicao", "tamanho", "compressao"]
+    )
+
+    for entrada in entradas:
+        dados = _ler_blob(segmento, entrada.posicao, entrada.tamanho)
+        novo_segmento, nova_posicao = _anexar(ano_mes, entrada.name, entrada.compressao, dados)
+
+        # Só atualiza se o XML não foi regravado durante a compactação
+        frappe.db.sql("""
+            UPDATE `tabArquivo Fiscal`
+            SET segmento = %s, posicao = %s
+            WHERE name = %s AND segmento = %s AND posicao = %s
+        """, (novo_segmento, nova_posicao, entrada.name, segmento, entrada.posicao))
+
+    frappe.db.commit()
+
+    _fechar_mapa(segmento)
+    os.unlink(_caminho(segmento))
+
+    return tamanho_antes - sum(e.tamanho for e in entradas)
+
+
+def migrar_anexos_xml(limite=1000):
+    """
+    Move para o arquivo fiscal os XMLs de notas ainda gravados como File
+
+    Sem o registro File, o XML é lido direto do disco; se nem o arquivo
+    existir, o campo é limpo (com log) para que a nota não volte a ser
+    selecionada nas execuções seguintes.
+
+    Args:
+        limite: Quantidade máxima de notas nesta execução
+
+    Returns:
+        int: Notas migradas
+    """
+    notas = frappe.db.sql("""
+        SELECT name, chave_acesso, xml_nfe, xml_autorizado
+        FROM `tabNota Fiscal`
+        WHERE chave_acesso IS NOT NULL AND chave_acesso != ''
+            AND (xml_nfe LIKE '/private/files/%%' OR xml_autorizado LIKE '/private/files/%%')
+        LIMIT %s
+    """, (limite,), as_dict=True)
+
+    for nota in notas:
+        valores = {}
+        orfaos = []
+        for campo, tipo in (("xml_nfe", "nfe"), ("xml_autorizado", "proc")):
+            file_url = nota.get(campo)
+            if not file_url or not file_url.startswith("/private/files/"):
+                continue
+
+            file_name = frappe.db.get_value("File", {"file_url": file_url, "attached_to_name": nota.name}, "name")
+            if file_name:
+                file_doc = frappe.get_doc("File", file_name)
+                valores[campo] = gravar(nota.chave_acesso, tipo, file_doc.get_content())
+                frappe.delete_doc("File", file_name, ignore_permissions=True)
+                continue
+
+            caminho = frappe.get_site_path(*file_url.lstrip("/").split("/"))
+            if os.path.exists(caminho):
+                with open(caminho, "rb") as f:
+                    valores[campo] = gravar(nota.chave_acesso, tipo, f.read())
+                orfaos.append(caminho)
+            else:
+                valores[campo] = None
+                frappe.log_error(
+                    f"XML {file_url} da nota {nota.name} não encontrado (sem File nem arquivo em disco)",
+                    "Migração de XMLs"
+                )
+
+        if valores:
+            frappe.db.set_value("Nota Fiscal", nota.name, valores, update_modified=False)
+        frappe.db.commit()
+
+        # Arquivos sem registro File só são apagados depois de arquivados e confirmados
+        for caminho in orfaos:
+            os.remove(caminho)
+
+    return len(notas)
@@ -0,0 +1,313 @@
+"""
+Consulta Cadastro - CadConsultaCadastro4 com cache no Redis
+Situação cadastral (IE habilitada) de contribuintes, por UF e CNPJ/IE
+"""
+
+from datetime import datetime
+
+import frappe
+from frappe import _
+from lxml import etree
+
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+
+# Web Services de consulta cadastro (produção) por autorizador
+URL_CADASTRO = {
+    "AM": "https://nfe.sefaz.am.gov.br/services2/services/cadconsultacadastro4",
+    "BA": "https://nfe.sefaz.ba.gov.br/webservices/CadConsultaCadastro4/CadConsultaCadastro4.asmx",
+    "GO": "https://nfe.sefaz.go.gov.br/nfe/services/CadConsultaCadastro4",
+    "MG": "https://nfe.fazenda.mg.gov.br/nfe2/services/CadConsultaCadastro4",
+    "MS": "https://nfe.sefaz.ms.gov.br/ws/CadConsultaCadastro4",
+    "MT": "https://nfe.sefaz.mt.gov.br/nfews/v2/services/CadConsultaCadastro4",
+    "PE": "https://nfe.sefaz.pe.gov.br/nfe-service/services/CadConsultaCadastro4",
+    "PR": "https://nfe.sefa.pr.gov.br/nfe/CadConsultaCadastro4",
+    "RS": "https://cad.sefazrs.rs.gov.br/ws/cadconsultacadastro/cadconsultacadastro4.asmx",
+    "SP": "https://nfe.fazenda.sp.gov.br/ws/cadconsultacadastro4.asmx",
+    "SVRS": "https://cad.svrs.rs.gov.br/ws/cadconsultacadastro/cadconsultacadastro4.asmx",
+}
+
+SOAP_ACTION = "http://www.portalfiscal.inf.br/nfe/wsdl/CadConsultaCadastro4/consultaCadastro"
+
+# Validade do cache (segundos)
+TTL_CADASTRO = 7 * 24 * 3600
+TTL_NAO_CADASTRADO = 24 * 3600
+
+# Consultas mais recentes que isto não são repetidas na atualização em lote (segundos)
+IDADE_MINIMA_ATUALIZACAO = 24 * 3600
+
+PREFIXO = "fiscal_br:cadastro"
+
+SITUACAO_CADASTRO = {"0": "Não habilitado", "1": "Habilitado"}
+
+
+def _chave_cache(uf, documento):
+    return f"{PREFIXO}:{uf.upper()}:{_limpar(documento)}"
+
+
+def _limpar(documento):
+    return "".join(filter(str.isalnum, documento or "")).upper()
+
+
+def _texto(elem, nome):
+    encontrado = elem.find("{%s}%s" % (NS_NFE, nome))
+    return encontrado.text if encontrado is not None else None
+
+
+def get_cadastro_cache(uf, documento):
+    """
+    Retorna a situação cadastral em cache, sem consultar a SEFAZ
+
+    Args:
+        uf: Sigla da UF do contribuinte
+        documento: CNPJ, CPF ou IE
+
+    Returns:
+        dict: Situação cadastral ou None se não houver consulta válida em cache
+    """
+    if not uf or not documento:
+        return None
+    return frappe.cache().get_value(_chave_cache(uf, documento))
+
+
+def _guardar_cache(uf, documento, cadastro):
+    ttl = TTL_CADASTRO if cadastro.get("encontrado") else TTL_NAO_CADASTRADO
+    frappe.cache().set_value(_chave_cache(uf, documento), cadastro, expires_in_sec=ttl)
+
+    # Consulta por CNPJ também responde pelas IEs encontradas
+    for item in cadastro.get("cadastros") or []:
+        if item.get("ie") and _limpar(item["ie"]) != _limpar(documento):
+            frappe.cache().set_value(_chave_cache(uf, item["ie"]), cadastro, expires_in_sec=ttl)
+
+
+def parse_retorno_cadastro(response):
+    """
+    Faz o parse do retConsCad
+
+    Args:
+        response: Resposta da SEFAZ (bytes)
+
+    Returns:
+        dict: Situação cadastral com a lista de cadastros (infCad)
+    """
+    root = etree.fromstring(response)
+    inf_cons = next(root.iter("{%s}infCons" % NS_NFE), None)
+    if inf_cons is None:
+        return {"cStat": "999", "xMotivo": _("Resposta inválida da SEFAZ - tag infCons não encontrada")}
+
+    cadastros = []
+    for inf_cad in inf_cons.iter("{%s}infCad" % NS_NFE):
+        cadastros.append({
+            "ie": _texto(inf_cad, "IE"),
+            "cnpj": _texto(inf_cad, "CNPJ"),
+            "cpf": _texto(inf_cad, "CPF"),
+            "uf": _texto(inf_cad, "UF"),
+            "situacao": SITUACAO_CADASTRO.get(_texto(inf_cad, "cSit"), _texto(inf_cad, "cSit")),
+            "habilitado": _texto(inf_cad, "cSit") == "1",
+            "ind_cred_nfe": _texto(inf_cad, "indCredNFe"),
+            "nome": _texto(inf_cad, "xNome"),
+            "fantasia": _texto(inf_cad, "xFant"),
+            "regime": _texto(inf_cad, "xRegApur"),
+            "cnae": _texto(inf_cad, "CNAE"),
+            "data_situacao": _texto(inf_cad, "dUltSit"),
+            "data_baixa": _texto(inf_cad, "dBaixa"),
+        })
+
+    return {
+        "cStat": _texto(inf_cons, "cStat"),
+        "xMotivo": _texto(inf_cons, "xMotivo"),
+        "cadastros": cadastros,
+    }
+
+
+def _montar_cadastro(uf, documento, retorno):
+    """Monta o registro guardado em cache a partir do retorno da SEFAZ"""
+    cadastros = retorno.get("cadastros") or []
+
+    # Com mais de uma IE para o CNPJ, prevalece a habilitada
+    principal = next((c for c in cadastros if c["habilitado"]), cadastros[0] if cadastros else {})
+
+    return {
+        "uf": uf.upper(),
+        "documento": _limpar(documento),
+        "encontrado": bool(cadastros),
+        "habilitado": bool(principal.get("habilitado")),
+        "situacao": principal.get("situacao") or _("Não cadastrado"),
+        "ie": principal.get("ie"),
+        "nome": principal.get("nome"),
+        "regime": principal.get("regime"),
+        "cadastros": cadastros,
+        "codigo": retorno.get("cStat"),
+        "mensagem": retorno.get("xMotivo"),
+        "consultado_em": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def consultar_cadastro(uf, documento, transmitter, usar_cache=True):
+    """
+    Consulta a situação cadastral na SEFAZ da UF do contribuinte
+
+    Args:
+        uf: Sigla da UF do contribuinte
+        documento: CNPJ, CPF ou IE
+        transmitter: SEFAZTransmitter da empresa consulente (certificado da consulta)
+        usar_cache: Retorna a consulta em cache, se houver
+
+    Returns:
+        dict: Situação cadastral
+
+    Raises:
+        LimiteConsumoExcedido: Se o limite de consultas da UF foi atingido
+    """
+    from erpnext_fiscal_br.services.transmitter import UF_AUTORIZADOR
+
+    uf = (uf or "").upper()
+    documento = _limpar(documento)
+
+    if usar_cache:
+        cadastro = get_cadastro_cache(uf, documento)
+        if cadastro:
+            return cadastro
+
+    autorizador = UF_AUTORIZADOR.get(uf)
+    url = URL_CADASTRO.get(uf) or URL_CADASTRO.get(autorizador)
+    if not url:
+        frappe.throw(_("Consulta cadastro não disponível para a UF {0}").format(uf))
+
+    if documento.isdigit() and len(documento) == 14:
+        filtro = f"<CNPJ>{documento}</CNPJ>"
+    elif documento.isdigit() and len(documento) == 11:
+        filtro = f"<CPF>{documento}</CPF>"
+    else:
+        filtro = f"<IE>{documento}</IE>"
+
+    xml_body = (
+        '<nfeDadosMsg xmlns="http://www.portalfiscal.inf.br/nfe/wsdl/CadConsultaCadastro4">'
+        '<ConsCad xmlns="http://www.portalfiscal.inf.br/nfe" versao="2.00">'
+        f'<infCons><xServ>CONS-CAD</xServ><UF>{uf}</UF>{filtro}</infCons></ConsCad></nfeDadosMsg>'
+    )
+
+    response = transmitter._send_request(
+        url,
+        xml_body,
+        SOAP_ACTION,
+        servico="CadConsultaCadastro",
+        autorizador=uf if uf in URL_CADASTRO else autorizador
+    )
+
+    try:
+        retorno = parse_retorno_cadastro(response)
+    except Exception as e:
+        frappe.log_error(
+            f"Erro ao parsear retorno da consulta cadastro: {str(e)}\n{transmitter._trecho_resposta(response)}",
+            "Consulta Cadastro"
+        )
+        retorno = {"cStat": "999", "xMotivo": _("Erro ao processar resposta: {0}").format(str(e))}
+
+    cstat = retorno.get("cStat")
+    if cstat == "656":
+        transmitter._get_limitador(uf if uf in URL_CADASTRO else autorizador).registrar_consumo_indevido("CadConsultaCadastro")
+
+    cadastro = _montar_cadastro(uf, documento, retorno)
+
+    # 111/112: cadastro localizado; 259/264: não cadastrado como contribuinte
+    if cstat in ("111", "112", "259", "264"):
+        _guardar_cache(uf, documento, cadastro)
+
+    return cadastro
+
+
+def atualizar_cadastros(empresa, consultas, max_workers=4):
+    """
+    Atualiza em paralelo o cache de uma lista de contribuintes
+
+    As consultas passam pelo limitador de consumo de cada UF, de forma que o
+    paralelismo não ultrapassa o limite da SEFAZ. Consultas feitas há menos de
+    IDADE_MINIMA_ATUALIZACAO são mantidas.
+
+    Args:
+        empresa: Empresa cujo certificado será usado
+        consultas: Lista de tuplas (uf, documento)
+        max_workers: Número de consultas simultâneas
+
+    Returns:
+        dict: Totais de consultas atualizadas, mantidas e com erro
+    """
+    from erpnext_fiscal_br.services.rate_limiter import LimiteConsumoExcedido
+    from erpnext_fiscal_br.services.transmitter import SEFAZTransmitter
+    from erpnext_fiscal_br.utils.concurrency import executar_em_paralelo
+
+    pendentes = []
+    mantidas = 0
+    agora = datetime.now()
+    for uf, documento in dict.fromkeys((uf.upper(), _limpar(doc)) for uf, doc in consultas if uf and doc):
+        cadastro = get_cadastro_cache(uf, documento)
+        if cadastro and (agora - datetime.fromisoformat(cadastro["consultado_em"])).total_seconds() < IDADE_MINIMA_ATUALIZACAO:
+            mantidas += 1
+        else:
+            pendentes.append((uf, documento))
+
+    def consultar(consulta, transmitter):
+        uf, documento = consulta
+        return consultar_cadastro(uf, documento, transmitter, usar_cache=False)
+
+    resultados = executar_em_paralelo(
+        consultar,
+        pendentes,
+        max_workers=max_workers,
+        preparar_thread=lambda: SEFAZTransmitter(empresa)
+    )
+
+    erros = [(item, erro) for item, _resultado, erro in resultados if erro is not None]
+    limitadas = [item for item, erro in erros if isinstance(erro, LimiteConsumoExcedido)]
+
+    for (uf, documento), erro in erros:
+        if not isinstance(erro, LimiteConsumoExcedido):
+            frappe.log_error(
+                f"Erro na consulta cadastro {uf} {documento}: {str(erro)}",
+                "Consulta Cadastro"
+            )
+
+    return {
+        "atualizadas": len(pendentes) - len(erros),
+        "mantidas": mantidas,
+        "limitadas": len(limitadas),
+        "erros": len(erros) - len(limitadas),
+    }
+
+
+def verificar_destinatario(uf, cnpj, ie=None):
+    """
+    Verifica a situação do destinatário usando apenas o cache
+
+    Args:
+        uf: Sigla da UF do destinatário
+        cnpj: CNPJ do destinatário
+        ie: IE informada na nota/cliente (opcional)
+
+    Returns:
+        tuple: (erros, avisos) - listas de mensagens; vazias se não houver cache
+    """
+    erros, avisos = [], []
+
+    cadastro = get_cadastro_cache(uf, cnpj) if cnpj else None
+    if not cadastro and ie:
+        cadastro = get_cadastro_cache(uf, ie)
+    if not cadastro or not cadastro.get("encontrado"):
+        return erros, avisos
+
+    if ie:
+        item = next((c for c in cadastro["cadastros"] if _limpar(c.get("ie")) == _limpar(ie)), None)
+        if item is None:
+            avisos.append(_("IE {0} não consta no cadastro da SEFAZ/{1} para este CNPJ (consulta de {2})").format(
+                ie, uf, cadastro["consultado_em"]
+            ))
+        elif not item["habilitado"]:
+            erros.append(_("IE {0} do destinatário está {1} na SEFAZ/{2} (consulta de {3})").format(
+                ie, item["situacao"], uf, cadastro["consultado_em"]
+            ))
+    elif not cadastro["habilitado"]:
+        erros.append(_("Destinatário está {0} na SEFAZ/{1} (consulta de {2})").format(
+            cadastro["situacao"], uf, cadastro["consultado_em"]
+        ))
+
+    return erros, avisos
@@ -1,13 +1,17 @@
 """
 DANFE Generator - Gerador de DANFE (PDF)
-Gera o Documento Auxiliar da Nota Fiscal Eletrônica
+Gera o Documento Auxiliar da Nota Fiscal Eletrônica a partir do XML
+autorizado (procNFe), sem acessar o banco de dados
 """
 
 import frappe
 from frappe import _
-from frappe.utils import flt, fmt_money
+from frappe.utils import flt
+from itertools import groupby
 from io import BytesIO
 
+from erpnext_fiscal_br.services.danfe_xml import ler_dados_danfe, formatar_data_hora
+
 try:
     from reportlab.lib import colors
     from reportlab.lib.pagesizes import A4
@@ -15,37 +19,82 @@ try:
     from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
     from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
     from reportlab.pdfgen import canvas
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfbase.pdfmetrics import stringWidth
     from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+    from reportlab.graphics.barcode import qrencoder
+    from reportlab.graphics.barcode.code128 import Code128
     HAS_REPORTLAB = True
 except ImportError:
     HAS_REPORTLAB = False
 
-try:
-    import qrcode
-    from qrcode.image.pil import PilImage
-    HAS_QRCODE = True
-except ImportError:
-    HAS_QRCODE = False
+# Alturas dos quadros do DANFE (mm), incluindo o espaçamento abaixo de cada um
+ALTURA_CABECALHO = 37
+ALTURA_NATUREZA = 14
+ALTURA_DESTINATARIO = 27
+ALTURA_IMPOSTO = 17
+ALTURA_INFO_ADICIONAIS = 22
+ALTURA_CABECALHO_PRODUTOS = 8
+ALTURA_LINHA_PRODUTO = 4
 
-try:
-    from barcode import Code128
-    from barcode.writer import ImageWriter
-    HAS_BARCODE = True
-except ImportError:
-    HAS_BARCODE = False
+# Colunas do quadro "Cálculo do imposto": (rótulo, campo de DadosDANFE.totais)
+CAMPOS_IMPOSTO = (
+    ("BASE ICMS", "base_icms"),
+    ("VALOR ICMS", "valor_icms"),
+    ("VALOR FRETE", "valor_frete"),
+    ("VALOR SEGURO", "valor_seguro"),
+    ("DESCONTO", "valor_desconto"),
+    ("OUTRAS DESP.", "valor_outras_despesas"),
+    ("VALOR IPI", "valor_ipi"),
+    ("TOTAL PRODUTOS", "valor_produtos"),
+    ("TOTAL NOTA", "valor_total"),
+)
+
+# Logos já lidos neste processo, por caminho
+_LOGOS = {}
+
+
+def _imagem(caminho):
+    """ImageReader do logo, lido uma vez por processo"""
+    if caminho not in _LOGOS:
+        _LOGOS[caminho] = ImageReader(caminho)
+    return _LOGOS[caminho]
+
+
+def gerar_danfe_xml(xml, protocolo=None, data_autorizacao=None, logo=None):
+    """
+    Gera o DANFE de um procNFe (emitido ou recebido de fornecedor)
+    
+    Args:
+        xml: Conteúdo do procNFe (bytes ou str)
+        protocolo: Protocolo de autorização, se o XML não tiver o protNFe
+        data_autorizacao: Data da autorização, se o XML não tiver o protNFe
+        logo: Caminho da imagem do logo do emitente
+    
+    Returns:
+        bytes: Conteúdo do PDF
+    """
+    dados = ler_dados_danfe(xml)
+    if not dados.protocolo:
+        dados.protocolo = protocolo or ""
+        dados.data_autorizacao = data_autorizacao or ""
+    
+    return DANFEGenerator(dados, logo=logo).generate()
 
 
 class DANFEGenerator:
     """Gerador de DANFE para NFe e NFCe"""
     
-    def __init__(self, nota_fiscal):
+    def __init__(self, dados, logo=None):
         """
         Inicializa o gerador
         
         Args:
-            nota_fiscal: Documento Nota Fiscal
+            dados: DadosDANFE lidos do XML (ver danfe_xml.ler_dados_danfe)
+            logo: Caminho da imagem do logo do emitente
         """
-        self.nf = nota_fiscal
+        self.dados = dados
+        self.logo = logo
         self.width, self.height = A4
         self.margin = 10 * mm
     
@@ -59,38 +108,47 @@ class DANFEGenerator:
         if not HAS_REPORTLAB:
             frappe.throw(_("Biblioteca reportlab não instalada. Execute: pip install reportlab"))
         
-        if self.nf.modelo == "65":
+        if self.dados.modelo == "65":
             return self._generate_danfce()
         else:
             return self._generate_danfe()
     
     def _generate_danfe(self):
-        """Gera DANFE para NFe (modelo 55)"""
+        """
+        Gera DANFE para NFe (modelo 55)
+        
+        A primeira folha traz todos os quadros e os primeiros itens; as folhas
+        seguintes repetem o cabeçalho e o quadro de produtos com a continuação
+        dos itens. A parte fixa de cada tipo de folha (quadros, rótulos e dados
+        do emitente) é uma moldura (form XObject) desenhada uma vez por PDF e
+        referenciada em cada folha, que só preenche os campos variáveis.
+        """
         buffer = BytesIO()
         
         # Cria canvas
         c = canvas.Canvas(buffer, pagesize=A4)
         
-        # Posição inicial
-        y = self.height - self.margin
-        
-        # Cabeçalho
-        y = self._draw_header(c, y)
-        
-        # Dados do emitente
-        y = self._draw_emitente(c, y)
-        
-        # Dados do destinatário
-        y = self._draw_destinatario(c, y)
-        
-        # Dados dos produtos
-        y = self._draw_produtos(c, y)
-        
-        # Totais
-        y = self._draw_totais(c, y)
-        
-        # Informações adicionais
-        y = self._draw_info_adicionais(c, y)
+        paginas = self._paginar(len(self.dados.itens))
+        topo = self.height - self.margin
+        
+        for folha, (inicio, fim) in enumerate(paginas, 1):
+            if folha == 1:
+                self._usar_moldura(c, "moldura_folha1", self._draw_moldura_folha1)
+                
+                y = self._draw_header(c, topo, folha, len(paginas))
+                y = self._draw_emitente(c, y)
+                y = self._draw_destinatario(c, y)
+                y = self._draw_totais(c, y)
+                self._draw_info_adicionais(c, self.margin + (ALTURA_INFO_ADICIONAIS - 2) * mm)
+            else:
+                self._usar_moldura(c, "moldura_continuacao", self._draw_moldura_continuacao)
+                
+                y = self._draw_header(c, topo, folha, len(paginas))
+            
+            # Itens desta folha
+            self._draw_produtos(c, y, self.dados.itens[inicio:fim])
+            
+            c.showPage()
         
         c.save()
         
@@ -103,9 +161,9 @@ class DANFEGenerator:
         """Gera DANFE para NFCe (modelo 65) - formato simplificado"""
         buffer = BytesIO()
         
-        # Tamanho de cupom (80mm de largura)
+        # Tamanho de cupom (80mm de largura); altura conforme os itens, até uma folha A4
         page_width = 80 * mm
-        page_height = 297 * mm  # Altura variável
+        page_height = min(150 + 7 * len(self.dados.itens), 297) * mm
         
         c = canvas.Canvas(buffer, pagesize=(page_width, page_height))
         
@@ -122,13 +180,13 @@ class DANFEGenerator:
         y -= 8 * mm
         
         # Dados do emitente
-        company = frappe.get_doc("Company", self.nf.empresa)
+        emitente = self.dados.emitente
         c.setFont("Helvetica-Bold", 8)
-        c.drawCentredString(page_width / 2, y, company.company_name[:40])
+        c.drawCentredString(page_width / 2, y, emitente["nome"][:40])
         y -= 4 * mm
         
         c.setFont("Helvetica", 7)
-        c.drawCentredString(page_width / 2, y, f"CNPJ: {self._format_cnpj(self.nf.cpf_cnpj_destinatario)}")
+        c.drawCentredString(page_width / 2, y, f"CNPJ: {self._format_cnpj(emitente['cnpj'])}")
         y -= 8 * mm
         
         # Linha separadora
@@ -143,12 +201,23 @@ class DANFEGenerator:
         y -= 4 * mm
         
         c.setFont("Helvetica", 6)
-        for idx, item in enumerate(self.nf.itens, 1):
-            c.drawString(x_margin, y, f"{idx:03d}   {item.item_name[:25]}")
+        for idx, item in enumerate(self.dados.itens, 1):
+            # Continua os itens na próxima folha do rolo
+            if y < 10 * mm:
+                c.showPage()
+                c.setFont("Helvetica", 6)
+                y = page_height - 5 * mm
+            
+            c.drawString(x_margin, y, f"{idx:03d}   {item['descricao'][:25]}")
             y -= 3 * mm
-            c.drawString(x_margin, y, f"{flt(item.quantidade):.2f}  {item.unidade}  {flt(item.valor_unitario):.2f}  {flt(item.valor_total):.2f}")
+            c.drawString(x_margin, y, f"{flt(item['quantidade']):.2f}  {item['unidade']}  {flt(item['valor_unitario']):.2f}  {flt(item['valor_total']):.2f}")
             y -= 4 * mm
         
+        # Totais, QR Code e chave não são divididos entre folhas
+        if y < 90 * mm:
+            c.showPage()
+            y = page_height - 5 * mm
+        
         # Linha separadora
         y -= 2 * mm
         c.line(x_margin, y, page_width - x_margin, y)
@@ -157,7 +226,7 @@ class DANFEGenerator:
         # Totais
         c.setFont("Helvetica-Bold", 8)
         c.drawString(x_margin, y, "TOTAL R$")
-        c.drawRightString(page_width - x_margin, y, f"{flt(self.nf.valor_total):.2f}")
+        c.drawRightString(page_width - x_margin, y, f"{flt(self.dados.totais['valor_total']):.2f}")
         y -= 8 * mm
         
         # Forma de pagamento
@@ -170,18 +239,16 @@ class DANFEGenerator:
         y -= 5 * mm
         
         # QR Code
-        if self.nf.qrcode_url and HAS_QRCODE:
-            qr_img = self._generate_qrcode(self.nf.qrcode_url)
-            if qr_img:
-                c.drawImage(qr_img, (page_width - 30*mm) / 2, y - 30*mm, 30*mm, 30*mm)
-                y -= 35 * mm
+        if self.dados.qrcode_url:
+            self._draw_qrcode(c, (page_width - 30*mm) / 2, y - 30*mm, 30*mm)
+            y -= 35 * mm
         
         # Chave de acesso
         c.setFont("Helvetica", 6)
         c.drawCentredString(page_width / 2, y, "Chave de Acesso:")
         y -= 3 * mm
         
-        chave = self.nf.chave_acesso or ""
+        chave = self.dados.chave_acesso or ""
         # Divide em grupos de 4
         chave_formatada = " ".join([chave[i:i+4] for i in range(0, len(chave), 4)])
         c.drawCentredString(page_width / 2, y, chave_formatada[:44])
@@ -190,9 +257,9 @@ class DANFEGenerator:
         y -= 5 * mm
         
         # Protocolo
-        c.drawCentredString(page_width / 2, y, f"Protocolo: {self.nf.protocolo_autorizacao or ''}")
+        c.drawCentredString(page_width / 2, y, f"Protocolo: {self.dados.protocolo}")
         y -= 3 * mm
-        c.drawCentredString(page_width / 2, y, f"Data: {self.nf.data_autorizacao or ''}")
+        c.drawCentredString(page_width / 2, y, f"Data: {formatar_data_hora(self.dados.data_autorizacao)}")
         
         c.save()
         
@@ -201,8 +268,108 @@ class DANFEGenerator:
         
         return pdf_content
     
-    def _draw_header(self, c, y):
-        """Desenha o cabeçalho do DANFE"""
+    def _paginar(self, total_itens):
+        """
+        Divide os itens entre as folhas
+        
+        Args:
+            total_itens: Quantidade de itens da nota
+        
+        Returns:
+            list: Faixas (inicio, fim) dos itens de cada folha
+        """
+        area_util = self.height / mm - 2 * self.margin / mm - ALTURA_CABECALHO - ALTURA_CABECALHO_PRODUTOS
+        
+        por_folha = int(area_util // ALTURA_LINHA_PRODUTO)
+        primeira = int(
+            (area_util - ALTURA_NATUREZA - ALTURA_DESTINATARIO - ALTURA_IMPOSTO - ALTURA_INFO_ADICIONAIS)
+            // ALTURA_LINHA_PRODUTO
+        )
+        
+        paginas = [(0, min(primeira, total_itens))]
+        inicio = primeira
+        while inicio < total_itens:
+            paginas.append((inicio, min(inicio + por_folha, total_itens)))
+            inicio += por_folha
+        
+        return paginas
+    
+    def _usar_moldura(self, c, nome, desenhar):
+        """
+        Desenha a moldura na folha atual como form XObject
+        
+        O form é desenhado na primeira folha que o usa; as demais folhas do
+        PDF apenas o referenciam.
+        
+        Args:
+            c: Canvas
+            nome: Nome da moldura (form XObject)
+            desenhar: Função que desenha a moldura no canvas
+        """
+        if not c.hasForm(nome):
+            c.beginForm(nome)
+            desenhar(c)
+            
+            if self.logo:
+                topo = self.height - self.margin
+                c.drawImage(
+                    _imagem(self.logo), self.margin + 2*mm, topo - 22*mm, 18*mm, 18*mm,
+                    preserveAspectRatio=True, mask="auto"
+                )
+            c.endForm()
+        
+        c.doForm(nome)
+    
+    def _draw_moldura_folha1(self, c):
+        """Parte fixa da primeira folha: cabeçalho, quadros e rótulos"""
+        y = self._draw_moldura_cabecalho(c, self.height - self.margin)
+        
+        x = self.margin
+        largura = self.width - 2 * self.margin
+        
+        # Natureza da operação e protocolo
+        c.rect(x, y - 12*mm, largura, 12*mm)
+        c.setFont("Helvetica", 6)
+        c.drawString(x + 2*mm, y - 3*mm, "NATUREZA DA OPERAÇÃO")
+        c.drawString(x + 120*mm, y - 3*mm, "PROTOCOLO DE AUTORIZAÇÃO")
+        y -= ALTURA_NATUREZA * mm
+        
+        # Destinatário
+        c.rect(x, y - 25*mm, largura, 25*mm)
+        c.setFont("Helvetica-Bold", 7)
+        c.drawString(x + 2*mm, y - 3*mm, "DESTINATÁRIO/REMETENTE")
+        c.setFont("Helvetica", 6)
+        c.drawString(x + 2*mm, y - 8*mm, "NOME/RAZÃO SOCIAL")
+        c.drawString(x + 120*mm, y - 8*mm, "CNPJ/CPF")
+        c.drawString(x + 2*mm, y - 18*mm, "ENDEREÇO")
+        c.drawString(x + 120*mm, y - 18*mm, "MUNICÍPIO/UF")
+        y -= ALTURA_DESTINATARIO * mm
+        
+        # Cálculo do imposto
+        c.rect(x, y - 15*mm, largura, 15*mm)
+        c.setFont("Helvetica-Bold", 7)
+        c.drawString(x + 2*mm, y - 3*mm, "CÁLCULO DO IMPOSTO")
+        c.setFont("Helvetica", 6)
+        col_width = largura / len(CAMPOS_IMPOSTO)
+        for i, (rotulo, _campo) in enumerate(CAMPOS_IMPOSTO):
+            c.drawString(x + i * col_width + 1*mm, y - 8*mm, rotulo)
+        y -= ALTURA_IMPOSTO * mm
+        
+        # Produtos até as informações adicionais
+        self._draw_moldura_produtos(c, y, self.margin + ALTURA_INFO_ADICIONAIS * mm)
+        
+        # Informações adicionais
+        c.rect(x, self.margin, largura, 20*mm)
+        c.setFont("Helvetica-Bold", 7)
+        c.drawString(x + 2*mm, self.margin + 17*mm, "INFORMAÇÕES COMPLEMENTARES")
+    
+    def _draw_moldura_continuacao(self, c):
+        """Parte fixa das folhas seguintes: cabeçalho e quadro de produtos"""
+        y = self._draw_moldura_cabecalho(c, self.height - self.margin)
+        self._draw_moldura_produtos(c, y, self.margin)
+    
+    def _draw_moldura_cabecalho(self, c, y):
+        """Quadro do cabeçalho com os dados do emitente e os títulos do DANFE"""
         x = self.margin
         box_height = 35 * mm
         
@@ -210,21 +377,38 @@ class DANFEGenerator:
         c.rect(x, y - box_height, self.width - 2 * self.margin, box_height)
         
         # Divisões internas
-        col1 = 60 * mm  # Logo/Emitente
-        col2 = 45 * mm  # DANFE
-        col3 = self.width - 2 * self.margin - col1 - col2  # Código de barras
+        col1, col2, col3 = self._colunas_cabecalho()
         
         c.line(x + col1, y, x + col1, y - box_height)
         c.line(x + col1 + col2, y, x + col1 + col2, y - box_height)
         
-        # Coluna 1 - Identificação do emitente
-        company = frappe.get_doc("Company", self.nf.empresa)
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(x + 2*mm, y - 8*mm, company.company_name[:35])
+        # Coluna 1 - Identificação do emitente (à direita do logo, se houver)
+        emitente = self.dados.emitente
+        x_texto = x + (22*mm if self.logo else 2*mm)
+        caracteres = 28 if self.logo else 35
+        
+        c.setFont("Helvetica-Bold", 7 if self.logo else 9)
+        c.drawString(x_texto, y - 6*mm, emitente["nome"][:caracteres])
+        
+        c.setFont("Helvetica", 6)
+        cep = emitente.get("cep") or ""
+        endereco = [
+            ", ".join(filter(None, (emitente.get("logradouro"), emitente.get("numero")))),
+            emitente.get("bairro"),
+            " - ".join(filter(None, (
+                f"CEP {cep[:5]}-{cep[5:]}" if len(cep) == 8 else cep,
+                "/".join(filter(None, (emitente.get("municipio"), emitente.get("uf")))),
+            ))),
+            f"Fone: {emitente['fone']}" if emitente.get("fone") else "",
+        ]
+        y_texto = y - 10*mm
+        for linha in filter(None, endereco):
+            c.drawString(x_texto, y_texto, linha[:caracteres + 4])
+            y_texto -= 3*mm
         
         c.setFont("Helvetica", 7)
-        c.drawString(x + 2*mm, y - 14*mm, f"CNPJ: {self._format_cnpj(self.config_cnpj)}")
-        c.drawString(x + 2*mm, y - 18*mm, f"IE: {self.config_ie}")
+        c.drawString(x + 2*mm, y - 27*mm, f"CNPJ: {self._format_cnpj(emitente['cnpj'])}")
+        c.drawString(x + 2*mm, y - 31*mm, f"IE: {emitente['ie']}")
         
         # Coluna 2 - DANFE
         c.setFont("Helvetica-Bold", 14)
@@ -234,189 +418,176 @@ class DANFEGenerator:
         c.drawCentredString(x + col1 + col2/2, y - 14*mm, "Documento Auxiliar da")
         c.drawCentredString(x + col1 + col2/2, y - 18*mm, "Nota Fiscal Eletrônica")
         
+        # Coluna 3 - Rótulo da chave de acesso
+        c.setFont("Helvetica", 6)
+        c.drawCentredString(x + col1 + col2 + col3/2, y - 24*mm, "CHAVE DE ACESSO")
+        
+        return y - ALTURA_CABECALHO * mm
+    
+    def _draw_moldura_produtos(self, c, y, limite):
+        """
+        Quadro de produtos com o cabeçalho das colunas
+        
+        Args:
+            c: Canvas
+            y: Topo do quadro
+            limite: Base do quadro (o quadro ocupa até aqui)
+        """
+        x = self.margin
+        
+        # Quadro de continuação: ocupa toda a área até o limite da folha
+        c.rect(x, limite, self.width - 2 * self.margin, y - limite)
+        
+        # Cabeçalho
+        header_height = ALTURA_CABECALHO_PRODUTOS * mm
+        c.rect(x, y - header_height, self.width - 2 * self.margin, header_height)
+        
+        c.setFont("Helvetica-Bold", 6)
+        cols = [
+            (x + 2*mm, "CÓDIGO"),
+            (x + 25*mm, "DESCRIÇÃO"),
+            (x + 90*mm, "NCM"),
+            (x + 105*mm, "CFOP"),
+            (x + 118*mm, "UN"),
+            (x + 128*mm, "QTD"),
+            (x + 145*mm, "VL.UNIT"),
+            (x + 165*mm, "VL.TOTAL"),
+        ]
+        
+        for col_x, col_name in cols:
+            c.drawString(col_x, y - 5*mm, col_name)
+    
+    def _colunas_cabecalho(self):
+        """Larguras das colunas do cabeçalho: emitente, DANFE e código de barras"""
+        col1 = 60 * mm
+        col2 = 45 * mm
+        return col1, col2, self.width - 2 * self.margin - col1 - col2
+    
+    def _draw_header(self, c, y, folha=1, total_folhas=1):
+        """Preenche o cabeçalho: tipo, número, folha, código de barras e chave"""
+        x = self.margin
+        col1, col2, col3 = self._colunas_cabecalho()
+        
         # Entrada/Saída
-        tipo = "SAÍDA" if self.nf.tipo_operacao and "1" in self.nf.tipo_operacao else "ENTRADA"
+        tipo_nf = self.dados.tipo_operacao
+        tipo = "SAÍDA" if tipo_nf == "1" else "ENTRADA"
         c.setFont("Helvetica-Bold", 8)
-        c.drawCentredString(x + col1 + col2/2, y - 26*mm, f"0 - {tipo}")
+        c.drawCentredString(x + col1 + col2/2, y - 26*mm, f"{tipo_nf} - {tipo}")
         
-        # Número e série
+        # Número, série e folha
         c.setFont("Helvetica", 7)
-        c.drawCentredString(x + col1 + col2/2, y - 31*mm, f"Nº {self.nf.numero} - Série {self.nf.serie}")
+        c.drawCentredString(x + col1 + col2/2, y - 30*mm, f"Nº {self.dados.numero} - Série {self.dados.serie}")
+        c.drawCentredString(x + col1 + col2/2, y - 33*mm, f"Folha {folha}/{total_folhas}")
         
         # Coluna 3 - Código de barras
-        if self.nf.chave_acesso and HAS_BARCODE:
-            barcode_img = self._generate_barcode(self.nf.chave_acesso)
-            if barcode_img:
-                c.drawImage(barcode_img, x + col1 + col2 + 2*mm, y - 20*mm, col3 - 4*mm, 15*mm)
+        if self.dados.chave_acesso:
+            self._draw_codigo_barras(c, x + col1 + col2 + 2*mm, y - 20*mm, col3 - 4*mm, 15*mm)
         
         # Chave de acesso
         c.setFont("Helvetica", 6)
-        chave = self.nf.chave_acesso or ""
+        chave = self.dados.chave_acesso or ""
         c.drawCentredString(x + col1 + col2 + col3/2, y - 28*mm, chave[:22])
         c.drawCentredString(x + col1 + col2 + col3/2, y - 32*mm, chave[22:])
         
-        return y - box_height - 2*mm
+        return y - ALTURA_CABECALHO * mm
     
     def _draw_emitente(self, c, y):
-        """Desenha dados do emitente"""
-        # Simplificado - apenas natureza da operação e protocolo
+        """Preenche natureza da operação e protocolo"""
         x = self.margin
-        box_height = 12 * mm
-        
-        c.rect(x, y - box_height, self.width - 2 * self.margin, box_height)
-        
-        c.setFont("Helvetica", 6)
-        c.drawString(x + 2*mm, y - 3*mm, "NATUREZA DA OPERAÇÃO")
-        c.setFont("Helvetica-Bold", 8)
-        c.drawString(x + 2*mm, y - 9*mm, self.nf.natureza_operacao or "Venda de mercadoria")
         
-        # Protocolo
-        c.setFont("Helvetica", 6)
-        c.drawString(x + 120*mm, y - 3*mm, "PROTOCOLO DE AUTORIZAÇÃO")
         c.setFont("Helvetica-Bold", 8)
-        c.drawString(x + 120*mm, y - 9*mm, f"{self.nf.protocolo_autorizacao or ''} - {self.nf.data_autorizacao or ''}")
+        c.drawString(x + 2*mm, y - 9*mm, self.dados.natureza_operacao or "Venda de mercadoria")
+        c.drawString(x + 120*mm, y - 9*mm, f"{self.dados.protocolo} - {formatar_data_hora(self.dados.data_autorizacao)}")
         
-        return y - box_height - 2*mm
+        return y - ALTURA_NATUREZA * mm
     
     def _draw_destinatario(self, c, y):
-        """Desenha dados do destinatário"""
+        """Preenche os dados do destinatário"""
         x = self.margin
-        box_height = 25 * mm
-        
-        c.rect(x, y - box_height, self.width - 2 * self.margin, box_height)
-        
-        # Título
-        c.setFont("Helvetica-Bold", 7)
-        c.drawString(x + 2*mm, y - 3*mm, "DESTINATÁRIO/REMETENTE")
+        destinatario = self.dados.destinatario
         
-        # Nome
-        c.setFont("Helvetica", 6)
-        c.drawString(x + 2*mm, y - 8*mm, "NOME/RAZÃO SOCIAL")
         c.setFont("Helvetica-Bold", 8)
-        c.drawString(x + 2*mm, y - 13*mm, self.nf.cliente_nome[:50])
+        c.drawString(x + 2*mm, y - 13*mm, destinatario["nome"][:50])
         
-        # CNPJ/CPF
-        c.setFont("Helvetica", 6)
-        c.drawString(x + 120*mm, y - 8*mm, "CNPJ/CPF")
-        c.setFont("Helvetica-Bold", 8)
-        doc = self.nf.cpf_cnpj_destinatario
+        doc = destinatario["documento"]
         if len(doc) == 11:
             doc = self._format_cpf(doc)
         else:
             doc = self._format_cnpj(doc)
         c.drawString(x + 120*mm, y - 13*mm, doc)
         
-        # Endereço
-        c.setFont("Helvetica", 6)
-        c.drawString(x + 2*mm, y - 18*mm, "ENDEREÇO")
         c.setFont("Helvetica-Bold", 7)
-        endereco = f"{self.nf.logradouro}, {self.nf.numero_endereco} - {self.nf.bairro}"
+        endereco = f"{destinatario['logradouro']}, {destinatario['numero']} - {destinatario['bairro']}"
         c.drawString(x + 2*mm, y - 22*mm, endereco[:60])
+        c.drawString(x + 120*mm, y - 22*mm, f"{destinatario['municipio']}/{destinatario['uf']}")
         
-        # Cidade/UF
-        c.setFont("Helvetica", 6)
-        c.drawString(x + 120*mm, y - 18*mm, "MUNICÍPIO/UF")
-        c.setFont("Helvetica-Bold", 7)
-        c.drawString(x + 120*mm, y - 22*mm, f"{self.nf.cidade}/{self.nf.uf}")
-        
-        return y - box_height - 2*mm
+        return y - ALTURA_DESTINATARIO * mm
     
-    def _draw_produtos(self, c, y):
-        """Desenha tabela de produtos"""
-        x = self.margin
-        
-        # Cabeçalho
-        header_height = 8 * mm
-        c.rect(x, y - header_height, self.width - 2 * self.margin, header_height)
-        
-        c.setFont("Helvetica-Bold", 6)
-        cols = [
-            (x + 2*mm, "CÓDIGO"),
-            (x + 25*mm, "DESCRIÇÃO"),
-            (x + 90*mm, "NCM"),
-            (x + 105*mm, "CFOP"),
-            (x + 118*mm, "UN"),
-            (x + 128*mm, "QTD"),
-            (x + 145*mm, "VL.UNIT"),
-            (x + 165*mm, "VL.TOTAL"),
-        ]
-        
-        for col_x, col_name in cols:
-            c.drawString(col_x, y - 5*mm, col_name)
-        
-        y -= header_height
-        
-        # Itens
-        c.setFont("Helvetica", 6)
-        line_height = 4 * mm
-        
-        for item in self.nf.itens:
-            if y < self.margin + 50*mm:  # Nova página se necessário
-                c.showPage()
-                y = self.height - self.margin
-            
-            c.drawString(x + 2*mm, y - 3*mm, str(item.item_code or "")[:12])
-            c.drawString(x + 25*mm, y - 3*mm, str(item.item_name or "")[:35])
-            c.drawString(x + 90*mm, y - 3*mm, str(item.ncm or ""))
-            c.drawString(x + 105*mm, y - 3*mm, str(item.cfop or ""))
-            c.drawString(x + 118*mm, y - 3*mm, str(item.unidade or "UN"))
-            c.drawRightString(x + 143*mm, y - 3*mm, f"{flt(item.quantidade):.2f}")
-            c.drawRightString(x + 163*mm, y - 3*mm, f"{flt(item.valor_unitario):.2f}")
-            c.drawRightString(x + 185*mm, y - 3*mm, f"{flt(item.valor_total):.2f}")
-            
-            y -= line_height
-        
-        # Linha final
-        c.line(x, y, self.width - self.margin, y)
+    def _draw_produtos(self, c, y, itens):
+        """
+        Preenche os itens de uma folha no quadro de produtos
         
-        return y - 2*mm
+        Args:
+            c: Canvas
+            y: Topo do quadro de produtos
+            itens: Itens desta folha
+        """
+        x = self.margin
+        y -= ALTURA_CABECALHO_PRODUTOS * mm
+        
+        line_height = ALTURA_LINHA_PRODUTO * mm
+        primeira_linha = y - 3*mm
+        
+        # Um único objeto de texto por folha: drawString monta um BT/ET por
+        # célula e domina o tempo em notas grandes. As colunas alinhadas à
+        # esquerda descem uma linha por item a partir de uma só origem.
+        texto = c.beginText()
+        texto.setFont("Helvetica", 6, leading=line_height)
+        
+        for col_x, campo, tamanho in (
+            (x + 2*mm, "codigo", 12),
+            (x + 25*mm, "descricao", 35),
+            (x + 90*mm, "ncm", None),
+            (x + 105*mm, "cfop", None),
+            (x + 118*mm, "unidade", None),
+        ):
+            texto.setTextOrigin(col_x, primeira_linha)
+            for item in itens:
+                texto.textLine((item[campo] or "")[:tamanho])
+        
+        # Valores alinhados à direita das colunas
+        for col_x, campo in (
+            (x + 143*mm, "quantidade"),
+            (x + 163*mm, "valor_unitario"),
+            (x + 185*mm, "valor_total"),
+        ):
+            linha = primeira_linha
+            for item in itens:
+                valor = f"{flt(item[campo]):.2f}"
+                texto.setTextOrigin(col_x - stringWidth(valor, "Helvetica", 6), linha)
+                texto.textLine(valor)
+                linha -= line_height
+        
+        c.drawText(texto)
     
     def _draw_totais(self, c, y):
-        """Desenha totais da nota"""
+        """Preenche os valores do cálculo do imposto"""
         x = self.margin
-        box_height = 15 * mm
-        
-        c.rect(x, y - box_height, self.width - 2 * self.margin, box_height)
+        totais = self.dados.totais
         
         c.setFont("Helvetica-Bold", 7)
-        c.drawString(x + 2*mm, y - 3*mm, "CÁLCULO DO IMPOSTO")
+        col_width = (self.width - 2 * self.margin) / len(CAMPOS_IMPOSTO)
+        for i, (_rotulo, campo) in enumerate(CAMPOS_IMPOSTO):
+            c.drawString(x + i * col_width + 1*mm, y - 12*mm, f"{flt(totais[campo]):.2f}")
         
-        # Valores
-        c.setFont("Helvetica", 6)
-        valores = [
-            ("BASE ICMS", self.nf.valor_icms),
-            ("VALOR ICMS", self.nf.valor_icms),
-            ("VALOR FRETE", self.nf.valor_frete),
-            ("VALOR SEGURO", self.nf.valor_seguro),
-            ("DESCONTO", self.nf.valor_desconto),
-            ("OUTRAS DESP.", self.nf.valor_outras_despesas),
-            ("VALOR IPI", self.nf.valor_ipi),
-            ("TOTAL PRODUTOS", self.nf.valor_produtos),
-            ("TOTAL NOTA", self.nf.valor_total),
-        ]
-        
-        col_width = (self.width - 2 * self.margin) / len(valores)
-        for i, (label, value) in enumerate(valores):
-            col_x = x + i * col_width
-            c.drawString(col_x + 1*mm, y - 8*mm, label)
-            c.setFont("Helvetica-Bold", 7)
-            c.drawString(col_x + 1*mm, y - 12*mm, f"{flt(value):.2f}")
-            c.setFont("Helvetica", 6)
-        
-        return y - box_height - 2*mm
+        return y - ALTURA_IMPOSTO * mm
     
     def _draw_info_adicionais(self, c, y):
-        """Desenha informações adicionais"""
+        """Preenche as informações complementares"""
         x = self.margin
-        box_height = 20 * mm
-        
-        c.rect(x, y - box_height, self.width - 2 * self.margin, box_height)
-        
-        c.setFont("Helvetica-Bold", 7)
-        c.drawString(x + 2*mm, y - 3*mm, "INFORMAÇÕES COMPLEMENTARES")
         
         c.setFont("Helvetica", 6)
-        info = self.nf.informacoes_complementares or ""
+        info = self.dados.informacoes_complementares or ""
         
         # Quebra texto em linhas
         max_chars = 120
@@ -426,40 +597,59 @@ class DANFEGenerator:
         for line in lines[:3]:  # Máximo 3 linhas
             c.drawString(x + 2*mm, y_text, line)
             y_text -= 4*mm
-        
-        return y - box_height
     
-    def _generate_barcode(self, code):
-        """Gera código de barras"""
-        if not HAS_BARCODE:
-            return None
-        
-        try:
-            buffer = BytesIO()
-            barcode = Code128(code, writer=ImageWriter())
-            barcode.write(buffer)
-            buffer.seek(0)
-            return buffer
-        except:
-            return None
-    
-    def _generate_qrcode(self, data):
-        """Gera QR Code"""
-        if not HAS_QRCODE:
-            return None
-        
-        try:
-            qr = qrcode.QRCode(version=1, box_size=10, border=1)
-            qr.add_data(data)
-            qr.make(fit=True)
+    def _draw_codigo_barras(self, c, x, y, largura, altura):
+        """
+        Desenha em vetor o Code128 (conjunto C) da chave de acesso
+        
+        Na primeira folha o código vira um form XObject, reaproveitado nas demais.
+        
+        Args:
+            c: Canvas
+            x, y: Canto inferior esquerdo
+            largura, altura: Área do código de barras
+        """
+        if not c.hasForm("codigo_barras"):
+            chave = self.dados.chave_acesso
             
-            img = qr.make_image(fill_color="black", back_color="white")
-            buffer = BytesIO()
-            img.save(buffer, format='PNG')
-            buffer.seek(0)
-            return buffer
-        except:
-            return None
+            # Largura das barras para ocupar a área (44 dígitos = 277 módulos)
+            modulos = Code128(chave, barWidth=1, quiet=False).width
+            barcode = Code128(chave, barWidth=largura / modulos, barHeight=altura, quiet=False)
+            
+            c.beginForm("codigo_barras")
+            barcode.drawOn(c, x, y)
+            c.endForm()
+        
+        c.doForm("codigo_barras")
+    
+    def _draw_qrcode(self, c, x, y, tamanho):
+        """
+        Desenha em vetor o QR Code da NFC-e
+        
+        Args:
+            c: Canvas
+            x, y: Canto inferior esquerdo
+            tamanho: Lado do QR Code
+        """
+        qr = qrencoder.QRCode(None, qrencoder.QRErrorCorrectLevel.M)
+        qr.addData(self.dados.qrcode_url)
+        qr.make()
+        
+        # Módulos + 1 de margem de cada lado; cada sequência escura da linha vira um retângulo
+        modulos = qr.getModuleCount()
+        lado = tamanho / (modulos + 2)
+        
+        caminho = c.beginPath()
+        for linha, modulos_linha in enumerate(qr.modules):
+            topo = y + tamanho - (linha + 2) * lado
+            coluna = 0
+            for escuro, sequencia in groupby(modulos_linha, bool):
+                largura = len(list(sequencia))
+                if escuro:
+                    caminho.rect(x + (coluna + 1) * lado, topo, largura * lado, lado)
+                coluna += largura
+        
+        c.drawPath(caminho, stroke=0, fill=1)
     
     def _format_cnpj(self, cnpj):
         """Formata CNPJ"""
@@ -472,17 +662,3 @@ class DANFEGenerator:
         if not cpf or len(cpf) != 11:
             return cpf or ""
         return f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
-    
-    @property
-    def config_cnpj(self):
-        """Obtém CNPJ da configuração"""
-        from erpnext_fiscal_br.fiscal_br.doctype.configuracao_fiscal.configuracao_fiscal import ConfiguracaoFiscal
-        config = ConfiguracaoFiscal.get_config_for_company(self.nf.empresa)
-        return config.cnpj if config else ""
-    
-    @property
-    def config_ie(self):
-        """Obtém IE da configuração"""
-        from erpnext_fiscal_br.fiscal_br.doctype.configuracao_fiscal.configuracao_fiscal import ConfiguracaoFiscal
-        config = ConfiguracaoFiscal.get_config_for_company(self.nf.empresa)
-        return config.inscricao_estadual if config else ""
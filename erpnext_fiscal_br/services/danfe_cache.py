@@ -0,0 +1,214 @@
+"""
+Cache do DANFE - PDF renderizado sob demanda
+O DANFE é gerado a partir do XML autorizado no primeiro download/impressão (ou
+por um job de baixa prioridade) e guardado em disco pela chave de acesso e
+protocolo de autorização
+"""
+
+import os
+import tempfile
+import time
+
+import frappe
+from frappe import _
+
+PASTA = "danfe_cache"
+
+URL_DOWNLOAD = "/api/method/erpnext_fiscal_br.api.arquivo.download_danfe"
+
+# PDFs não acessados há mais tempo que isso são removidos pela limpeza mensal
+DIAS_CACHE = 180
+
+
+def url_danfe(nota_fiscal):
+    """URL de download do DANFE (renderizado no primeiro acesso)"""
+    from urllib.parse import urlencode
+
+    return f"{URL_DOWNLOAD}?{urlencode({'nota_fiscal': nota_fiscal})}"
+
+
+def is_url_danfe(url):
+    return bool(url) and url.startswith(URL_DOWNLOAD)
+
+
+def caminho_pdf(chave, protocolo):
+    """Caminho do PDF no cache (pasta por AAMM da chave de acesso)"""
+    return frappe.get_site_path(
+        "private", PASTA, "20" + chave[2:6], f"{chave}-{protocolo or 'sem-protocolo'}.pdf"
+    )
+
+
+def obter_danfe(nf):
+    """
+    Retorna o PDF do DANFE de uma Nota Fiscal, renderizando se necessário
+
+    Args:
+        nf: Documento Nota Fiscal
+
+    Returns:
+        bytes: Conteúdo do PDF
+    """
+    return _obter(nf.chave_acesso, nf.protocolo_autorizacao, lambda: xml_nota(nf), logo=logo_empresa(nf.empresa))
+
+
+def obter_danfe_recebido(doc):
+    """
+    Retorna o PDF do DANFE de um Documento Recebido (procNFe do fornecedor)
+
+    Args:
+        doc: Documento Recebido
+
+    Returns:
+        bytes: Conteúdo do PDF
+    """
+    from erpnext_fiscal_br.services import archive
+
+    return _obter(doc.chave_acesso, doc.protocolo, lambda: (archive.ler_url(doc.xml_documento), {}))
+
+
+def _obter(chave, protocolo, carregar_xml, logo=None):
+    caminho = caminho_pdf(chave, protocolo)
+
+    try:
+        with open(caminho, "rb") as f:
+            conteudo = f.read()
+        # Marca o acesso para a limpeza do cache
+        os.utime(caminho)
+        return conteudo
+    except FileNotFoundError:
+        pass
+
+    xml, protocolo_nota = carregar_xml()
+    return renderizar(xml, caminho, logo=logo, **protocolo_nota)
+
+
+def xml_nota(nf):
+    """
+    procNFe da nota; sem ele (ex: autorizada por duplicidade), a NFe
+    assinada com o protocolo gravado na nota
+
+    Returns:
+        tuple: (xml, dict com protocolo/data_autorizacao quando fora do XML)
+    """
+    if nf.xml_autorizado:
+        return nf.ler_arquivo("xml_autorizado"), {}
+
+    return nf.ler_arquivo("xml_nfe"), {
+        "protocolo": nf.protocolo_autorizacao,
+        "data_autorizacao": nf.data_autorizacao,
+    }
+
+
+def logo_empresa(empresa):
+    """Caminho do logo da empresa (company_logo), se houver"""
+    logo = frappe.db.get_value("Company", empresa, "company_logo")
+    if not logo:
+        return None
+
+    # /private/files/x -> site/private/files/x; /files/x -> site/public/files/x
+    partes = logo.lstrip("/").split("/")
+    if partes[0] != "private":
+        partes.insert(0, "public")
+    caminho = frappe.get_site_path(*partes)
+
+    return caminho if os.path.exists(caminho) else None
+
+
+def renderizar(xml, caminho, protocolo=None, data_autorizacao=None, logo=None):
+    """
+    Renderiza o DANFE a partir do XML e grava no cache
+
+    Args:
+        xml: procNFe (ou NFe assinada)
+        caminho: Caminho do PDF no cache
+        protocolo: Protocolo, se o XML não tiver o protNFe
+        data_autorizacao: Data da autorização, se o XML não tiver o protNFe
+        logo: Caminho do logo do emitente
+
+    Returns:
+        bytes: Conteúdo do PDF
+    """
+    from erpnext_fiscal_br.services.danfe import gerar_danfe_xml
+
+    if not xml:
+        frappe.throw(_("XML da nota não encontrado para gerar o DANFE"))
+
+    conteudo = gerar_danfe_xml(xml, protocolo=protocolo, data_autorizacao=data_autorizacao, logo=logo)
+
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+
+    # Grava em arquivo temporário e renomeia: leitores concorrentes nunca veem PDF parcial.
+    # Nome único por chamada: threads do mesmo processo podem renderizar a mesma chave
+    descritor, temporario = tempfile.mkstemp(
+        dir=os.path.dirname(caminho), prefix=os.path.basename(caminho) + ".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(descritor, "wb") as f:
+            f.write(conteudo)
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+    return conteudo
+
+
+def enfileirar_pre_renderizacao(nota_fiscal, empresa):
+    """
+    Agenda a renderização do DANFE na fila de baixa prioridade (após o commit),
+    se a empresa estiver configurada para gerar o DANFE automaticamente
+    """
+    from erpnext_fiscal_br.fiscal_br.doctype.configuracao_fiscal.configuracao_fiscal import ConfiguracaoFiscal
+
+    config = ConfiguracaoFiscal.get_config_for_company(empresa)
+    if not config or not config.gerar_danfe_automatico:
+        return
+
+    frappe.enqueue(
+        "erpnext_fiscal_br.services.danfe_cache.pre_renderizar",
+        queue="long",
+        job_id=f"danfe::{nota_fiscal}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        nota_fiscal=nota_fiscal
+    )
+
+
+def pre_renderizar(nota_fiscal):
+    """Renderiza o DANFE em background se ainda não estiver no cache"""
+    nf = frappe.get_doc("Nota Fiscal", nota_fiscal)
+    if nf.status != "Autorizada" or not nf.chave_acesso:
+        return
+
+    try:
+        obter_danfe(nf)
+    except Exception as e:
+        frappe.log_error(f"Erro ao gerar DANFE da nota {nota_fiscal}: {str(e)}", "DANFE")
+
+
+def limpar_cache(dias=DIAS_CACHE):
+    """
+    Remove os PDFs do cache sem acesso há mais de `dias` dias
+
+    Returns:
+        int: Quantidade de arquivos removidos
+    """
+    pasta = frappe.get_site_path("private", PASTA)
+    if not os.path.isdir(pasta):
+        return 0
+
+    limite = time.time() - dias * 86400
+    removidos = 0
+
+    for raiz, _pastas, arquivos in os.walk(pasta):
+        for nome in arquivos:
+            caminho = os.path.join(raiz, nome)
+            try:
+                if os.stat(caminho).st_mtime < limite:
+                    os.remove(caminho)
+                    removidos += 1
+            except FileNotFoundError:
+                continue
+
+    return removidos
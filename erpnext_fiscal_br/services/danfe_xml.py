@@ -0,0 +1,214 @@
+"""
+Leitura do procNFe para o DANFE
+Extrai em uma passada (iterparse) apenas os campos impressos no DANFE,
+sem acessar o banco: serve para as notas emitidas, as recebidas de
+fornecedores e a reimpressão em lote em processos separados
+"""
+
+from datetime import datetime
+from io import BytesIO
+
+from lxml import etree
+
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+
+
+def _tag(nome):
+    return "{%s}%s" % (NS_NFE, nome)
+
+
+# Caminhos com namespace já montados ("prod/xProd" -> "{ns}prod/{ns}xProd")
+_CAMINHOS = {}
+
+
+def _texto(elem, caminho, padrao=""):
+    caminho_ns = _CAMINHOS.get(caminho)
+    if caminho_ns is None:
+        caminho_ns = _CAMINHOS[caminho] = "/".join(_tag(p) for p in caminho.split("/"))
+    encontrado = elem.find(caminho_ns)
+    if encontrado is None or encontrado.text is None:
+        return padrao
+    return encontrado.text.strip()
+
+
+def _valor(elem, caminho):
+    try:
+        return float(_texto(elem, caminho, "0") or 0)
+    except ValueError:
+        return 0.0
+
+
+def formatar_data_hora(valor):
+    """Converte data/hora ISO 8601 da SEFAZ para DD/MM/AAAA HH:MM:SS"""
+    if not valor:
+        return ""
+    if isinstance(valor, datetime):
+        return valor.strftime("%d/%m/%Y %H:%M:%S")
+    try:
+        return datetime.fromisoformat(str(valor)).strftime("%d/%m/%Y %H:%M:%S")
+    except ValueError:
+        return str(valor)
+
+
+class DadosDANFE:
+    """Campos da NFe/NFCe impressos no DANFE"""
+
+    def __init__(self):
+        self.modelo = "55"
+        self.numero = ""
+        self.serie = ""
+        self.tipo_operacao = "1"
+        self.natureza_operacao = ""
+        self.data_emissao = ""
+        self.chave_acesso = ""
+        self.protocolo = ""
+        self.data_autorizacao = ""
+
+        self.emitente = {
+            "nome": "", "cnpj": "", "ie": "", "logradouro": "", "numero": "",
+            "bairro": "", "municipio": "", "uf": "", "cep": "", "fone": "",
+        }
+        self.destinatario = {
+            "nome": "", "documento": "", "logradouro": "", "numero": "",
+            "bairro": "", "municipio": "", "uf": "",
+        }
+
+        # Cada item: codigo, descricao, ncm, cfop, unidade, quantidade, valor_unitario, valor_total
+        self.itens = []
+
+        self.totais = {
+            "base_icms": 0.0, "valor_icms": 0.0, "valor_frete": 0.0, "valor_seguro": 0.0,
+            "valor_desconto": 0.0, "valor_outras_despesas": 0.0, "valor_ipi": 0.0,
+            "valor_produtos": 0.0, "valor_total": 0.0,
+        }
+
+        self.informacoes_complementares = ""
+        self.qrcode_url = ""
+        self.url_consulta = ""
+
+
+def ler_dados_danfe(xml):
+    """
+    Lê os campos do DANFE de um procNFe (ou NFe assinada, sem protocolo)
+
+    Args:
+        xml: Conteúdo do XML (bytes ou str)
+
+    Returns:
+        DadosDANFE: Dados para o gerador do DANFE
+    """
+    if isinstance(xml, str):
+        xml = xml.encode("utf-8")
+
+    dados = DadosDANFE()
+    leitores = {_tag(nome): leitor for nome, leitor in LEITORES.items()}
+
+    for _evento, elem in etree.iterparse(BytesIO(xml), events=("end",), tag=list(leitores)):
+        leitores[elem.tag](dados, elem)
+
+        # Libera o grupo já lido e os irmãos anteriores (itens em notas grandes)
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    return dados
+
+
+def _ler_ide(dados, elem):
+    dados.modelo = _texto(elem, "mod", "55")
+    dados.numero = _texto(elem, "nNF")
+    dados.serie = _texto(elem, "serie")
+    dados.tipo_operacao = _texto(elem, "tpNF", "1")
+    dados.natureza_operacao = _texto(elem, "natOp")
+    dados.data_emissao = _texto(elem, "dhEmi")
+
+    # Chave de acesso pelo Id do infNFe (sobrescrita pelo protocolo, se houver)
+    inf_nfe = elem.getparent()
+    if inf_nfe is not None and not dados.chave_acesso:
+        dados.chave_acesso = (inf_nfe.get("Id") or "")[3:]
+
+
+def _ler_emit(dados, elem):
+    dados.emitente = {
+        "nome": _texto(elem, "xNome"),
+        "cnpj": _texto(elem, "CNPJ") or _texto(elem, "CPF"),
+        "ie": _texto(elem, "IE"),
+        "logradouro": _texto(elem, "enderEmit/xLgr"),
+        "numero": _texto(elem, "enderEmit/nro"),
+        "bairro": _texto(elem, "enderEmit/xBairro"),
+        "municipio": _texto(elem, "enderEmit/xMun"),
+        "uf": _texto(elem, "enderEmit/UF"),
+        "cep": _texto(elem, "enderEmit/CEP"),
+        "fone": _texto(elem, "enderEmit/fone"),
+    }
+
+
+def _ler_dest(dados, elem):
+    dados.destinatario = {
+        "nome": _texto(elem, "xNome"),
+        "documento": _texto(elem, "CNPJ") or _texto(elem, "CPF") or _texto(elem, "idEstrangeiro"),
+        "logradouro": _texto(elem, "enderDest/xLgr"),
+        "numero": _texto(elem, "enderDest/nro"),
+        "bairro": _texto(elem, "enderDest/xBairro"),
+        "municipio": _texto(elem, "enderDest/xMun"),
+        "uf": _texto(elem, "enderDest/UF"),
+    }
+
+
+def _ler_det(dados, elem):
+    dados.itens.append({
+        "codigo": _texto(elem, "prod/cProd"),
+        "descricao": _texto(elem, "prod/xProd"),
+        "ncm": _texto(elem, "prod/NCM"),
+        "cfop": _texto(elem, "prod/CFOP"),
+        "unidade": _texto(elem, "prod/uCom", "UN"),
+        "quantidade": _valor(elem, "prod/qCom"),
+        "valor_unitario": _valor(elem, "prod/vUnCom"),
+        "valor_total": _valor(elem, "prod/vProd"),
+    })
+
+
+def _ler_ICMSTot(dados, elem):
+    dados.totais = {
+        "base_icms": _valor(elem, "vBC"),
+        "valor_icms": _valor(elem, "vICMS"),
+        "valor_frete": _valor(elem, "vFrete"),
+        "valor_seguro": _valor(elem, "vSeg"),
+        "valor_desconto": _valor(elem, "vDesc"),
+        "valor_outras_despesas": _valor(elem, "vOutro"),
+        "valor_ipi": _valor(elem, "vIPI"),
+        "valor_produtos": _valor(elem, "vProd"),
+        "valor_total": _valor(elem, "vNF"),
+    }
+
+
+def _ler_infAdic(dados, elem):
+    dados.informacoes_complementares = _texto(elem, "infCpl")
+
+
+def _ler_infNFeSupl(dados, elem):
+    qrcode = _texto(elem, "qrCode")
+    # qrCode gravado como texto "<![CDATA[...]]>" (escapado) em vez de seção CDATA
+    if qrcode.startswith("<![CDATA[") and qrcode.endswith("]]>"):
+        qrcode = qrcode[9:-3]
+    dados.qrcode_url = qrcode
+    dados.url_consulta = _texto(elem, "urlChave")
+
+
+def _ler_infProt(dados, elem):
+    dados.chave_acesso = _texto(elem, "chNFe") or dados.chave_acesso
+    dados.protocolo = _texto(elem, "nProt")
+    dados.data_autorizacao = _texto(elem, "dhRecbto")
+
+
+# Grupos do XML lidos (e descartados) assim que terminam
+LEITORES = {
+    "ide": _ler_ide,
+    "emit": _ler_emit,
+    "dest": _ler_dest,
+    "det": _ler_det,
+    "ICMSTot": _ler_ICMSTot,
+    "infAdic": _ler_infAdic,
+    "infNFeSupl": _ler_infNFeSupl,
+    "infProt": _ler_infProt,
+}
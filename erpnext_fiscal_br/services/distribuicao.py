@@ -0,0 +1,469 @@
+"""
+Distribuição DF-e - Sincronização incremental por NSU (NFeDistribuicaoDFe)
+Baixa resumos, NFe completas e eventos destinados ao CNPJ da empresa
+"""
+
+import base64
+import zlib
+from datetime import datetime, timedelta
+
+import frappe
+from frappe import _
+from frappe.utils import now_datetime, get_datetime, flt, cint
+from lxml import etree
+
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+
+# Web Service nacional (Ambiente Nacional) por ambiente
+URL_DISTRIBUICAO = {
+    "1": "https://www1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx",
+    "2": "https://hom1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx",
+}
+
+SOAP_ACTION = "http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe/nfeDistDFeInteresse"
+
+# Sem documentos novos (cStat 137 ou ultNSU == maxNSU) a SEFAZ exige 1 hora até a próxima consulta
+INTERVALO_SEM_DOCUMENTOS = timedelta(hours=1)
+
+# Limite de lotes (até 50 documentos cada) por execução
+MAX_LOTES_POR_EXECUCAO = 100
+
+# NSUs com falha de gravação consultados novamente (consNSU) por execução
+MAX_NSU_REPROCESSADOS = 20
+
+# Tamanho dos blocos na descompressão do docZip
+TAMANHO_BLOCO = 16 * 1024
+
+SITUACAO_NFE = {"1": "Autorizada", "2": "Denegada", "3": "Cancelada"}
+
+# Eventos que alteram a situação da NFe
+SITUACAO_POR_EVENTO = {"110111": "Cancelada"}
+
+
+def _tag(nome):
+    return "{%s}%s" % (NS_NFE, nome)
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _texto(elem, caminho):
+    """Texto do primeiro elemento no caminho (nomes locais separados por /)"""
+    if elem is None:
+        return None
+    encontrado = elem.find("/".join(_tag(p) for p in caminho.split("/")))
+    return encontrado.text if encontrado is not None else None
+
+
+def _data_hora(valor):
+    """Converte data/hora da SEFAZ (ISO 8601 com fuso) para datetime local sem fuso"""
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def descompactar_doc_zip(conteudo_base64):
+    """
+    Descompacta um docZip (base64 + gzip) em blocos, alimentando o parser
+    enquanto descompacta, sem montar o XML descompactado antes do parse
+
+    Args:
+        conteudo_base64: Texto do elemento docZip
+
+    Returns:
+        tuple: (elemento raiz, bytes do XML)
+    """
+    compactado = base64.b64decode(conteudo_base64)
+    descompactador = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    parser = etree.XMLParser(remove_blank_text=True)
+    partes = []
+
+    for inicio in range(0, len(compactado), TAMANHO_BLOCO):
+        bloco = descompactador.decompress(compactado[inicio:inicio + TAMANHO_BLOCO])
+        if bloco:
+            parser.feed(bloco)
+            partes.append(bloco)
+
+    restante = descompactador.flush()
+    if restante:
+        parser.feed(restante)
+        partes.append(restante)
+
+    return parser.close(), b"".join(partes)
+
+
+def ler_documento(root, conteudo, nsu):
+    """
+    Extrai os dados de um documento distribuído
+
+    Args:
+        root: Elemento raiz (resNFe, nfeProc, resEvento ou procEventoNFe)
+        conteudo: Bytes do XML
+        nsu: NSU do documento
+
+    Returns:
+        dict: Dados do documento ou None se o tipo não for tratado
+    """
+    tipo = _local(root.tag)
+
+    if tipo == "resNFe":
+        return {
+            "tipo": "nfe",
+            "tipo_documento": "Resumo",
+            "nsu": nsu,
+            "chave_acesso": _texto(root, "chNFe"),
+            "cnpj_emitente": _texto(root, "CNPJ") or _texto(root, "CPF"),
+            "nome_emitente": _texto(root, "xNome"),
+            "ie_emitente": _texto(root, "IE"),
+            "data_emissao": _data_hora(_texto(root, "dhEmi")),
+            "tipo_operacao": "Saída" if _texto(root, "tpNF") == "1" else "Entrada",
+            "valor_total": flt(_texto(root, "vNF")),
+            "protocolo": _texto(root, "nProt"),
+            "data_autorizacao": _data_hora(_texto(root, "dhRecbto")),
+            "situacao": SITUACAO_NFE.get(_texto(root, "cSitNFe")),
+        }
+
+    if tipo == "nfeProc":
+        inf_nfe = root.find("%s/%s" % (_tag("NFe"), _tag("infNFe")))
+        inf_prot = root.find("%s/%s" % (_tag("protNFe"), _tag("infProt")))
+        chave = _texto(inf_prot, "chNFe")
+        if not chave and inf_nfe is not None:
+            chave = (inf_nfe.get("Id") or "")[3:]
+        return {
+            "tipo": "nfe",
+            "tipo_documento": "Completo",
+            "nsu": nsu,
+            "chave_acesso": chave,
+            "cnpj_emitente": _texto(inf_nfe, "emit/CNPJ") or _texto(inf_nfe, "emit/CPF"),
+            "nome_emitente": _texto(inf_nfe, "emit/xNome"),
+            "ie_emitente": _texto(inf_nfe, "emit/IE"),
+            "numero": _texto(inf_nfe, "ide/nNF"),
+            "serie": _texto(inf_nfe, "ide/serie"),
+            "data_emissao": _data_hora(_texto(inf_nfe, "ide/dhEmi")),
+            "tipo_operacao": "Saída" if _texto(inf_nfe, "ide/tpNF") == "1" else "Entrada",
+            "valor_total": flt(_texto(inf_nfe, "total/ICMSTot/vNF")),
+            "protocolo": _texto(inf_prot, "nProt"),
+            "data_autorizacao": _data_hora(_texto(inf_prot, "dhRecbto")),
+            "situacao": "Autorizada" if _texto(inf_prot, "cStat") in ("100", "150") else None,
+            "xml": conteudo,
+        }
+
+    if tipo == "resEvento":
+        return {
+            "tipo": "evento",
+            "nsu": nsu,
+            "chave_acesso": _texto(root, "chNFe"),
+            "tipo_evento": _texto(root, "tpEvento"),
+            "sequencia": cint(_texto(root, "nSeqEvento")),
+            "descricao_evento": _texto(root, "xEvento"),
+            "data_evento": _data_hora(_texto(root, "dhEvento")),
+            "protocolo": _texto(root, "nProt"),
+        }
+
+    if tipo == "procEventoNFe":
+        inf_evento = root.find("%s/%s" % (_tag("evento"), _tag("infEvento")))
+        inf_ret = root.find("%s/%s" % (_tag("retEvento"), _tag("infEvento")))
+        return {
+            "tipo": "evento",
+            "nsu": nsu,
+            "chave_acesso": _texto(inf_evento, "chNFe"),
+            "tipo_evento": _texto(inf_evento, "tpEvento"),
+            "sequencia": cint(_texto(inf_evento, "nSeqEvento")),
+            "descricao_evento": _texto(inf_evento, "detEvento/descEvento") or _texto(inf_ret, "xEvento"),
+            "data_evento": _data_hora(_texto(inf_evento, "dhEvento")),
+            "protocolo": _texto(inf_ret, "nProt"),
+            "xml": conteudo,
+        }
+
+    return None
+
+
+def parse_retorno_distribuicao(response):
+    """
+    Faz o parse do retDistDFeInt
+
+    Args:
+        response: Resposta da SEFAZ (bytes)
+
+    Returns:
+        dict: cStat, xMotivo, ultNSU, maxNSU e a lista de documentos
+    """
+    root = etree.fromstring(response)
+    retorno = next(root.iter(_tag("retDistDFeInt")), None)
+    if retorno is None:
+        return {"cStat": "999", "xMotivo": _("Resposta inválida da SEFAZ - tag retDistDFeInt não encontrada"), "documentos": []}
+
+    documentos = []
+    lote = retorno.find(_tag("loteDistDFeInt"))
+    if lote is not None:
+        for doc_zip in lote.iter(_tag("docZip")):
+            nsu = doc_zip.get("NSU")
+            try:
+                doc_root, conteudo = descompactar_doc_zip(doc_zip.text)
+                documento = ler_documento(doc_root, conteudo, nsu)
+            except Exception as e:
+                frappe.log_error(
+                    f"Erro ao ler docZip NSU {nsu} ({doc_zip.get('schema')}): {str(e)}",
+                    "Distribuição DF-e"
+                )
+                continue
+            if documento and documento.get("chave_acesso"):
+                documentos.append(documento)
+
+    return {
+        "cStat": _texto(retorno, "cStat"),
+        "xMotivo": _texto(retorno, "xMotivo"),
+        "ultNSU": _texto(retorno, "ultNSU"),
+        "maxNSU": _texto(retorno, "maxNSU"),
+        "documentos": documentos,
+    }
+
+
+class DistribuicaoDFe:
+    """Cliente do NFeDistribuicaoDFe para uma empresa"""
+
+    def __init__(self, empresa):
+        """
+        Inicializa o cliente
+
+        Args:
+            empresa: Nome da empresa
+        """
+        from erpnext_fiscal_br.services.transmitter import SEFAZTransmitter
+
+        self.empresa = empresa
+        self.transmitter = SEFAZTransmitter(empresa)
+        self.config = self.transmitter.config
+
+    def _consultar(self, consulta):
+        """Envia um distDFeInt (distNSU ou consChNFe) e retorna o retorno já processado"""
+        ambiente = self.config.get_ambiente_codigo()
+
+        xml_body = (
+            '<nfeDistDFeInteresse xmlns="http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe">'
+            '<nfeDadosMsg><distDFeInt xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.01">'
+            f'<tpAmb>{ambiente}</tpAmb><cUFAutor>{self.config.codigo_uf}</cUFAutor>'
+            f'<CNPJ>{self.config.cnpj}</CNPJ>{consulta}</distDFeInt></nfeDadosMsg></nfeDistDFeInteresse>'
+        )
+
+        response = self.transmitter._send_request(
+            URL_DISTRIBUICAO.get(ambiente, URL_DISTRIBUICAO["2"]),
+            xml_body,
+            SOAP_ACTION,
+            servico="NFeDistribuicaoDFe",
+            autorizador="AN"
+        )
+
+        try:
+            resultado = parse_retorno_distribuicao(response)
+        except Exception as e:
+            frappe.log_error(
+                f"Erro ao parsear retorno da distribuição: {str(e)}\n{self.transmitter._trecho_resposta(response)}",
+                "Distribuição DF-e"
+            )
+            return {"cStat": "999", "xMotivo": _("Erro ao processar resposta: {0}").format(str(e)), "documentos": []}
+
+        if resultado.get("cStat") == "656":
+            self.transmitter._get_limitador("AN").registrar_consumo_indevido("NFeDistribuicaoDFe")
+
+        return resultado
+
+    def sincronizar(self, max_lotes=MAX_LOTES_POR_EXECUCAO):
+        """
+        Busca os documentos novos a partir do último NSU
+
+        Cada lote é gravado e o NSU salvo em seguida (commit por lote), de forma
+        que uma interrupção retoma do último lote processado. Os NSUs dos
+        documentos que não puderam ser gravados ficam em nsus_falha_dfe e são
+        consultados um a um (consNSU) no início das execuções seguintes.
+
+        Args:
+            max_lotes: Número máximo de consultas nesta execução
+
+        Returns:
+            dict: Quantidade de documentos gravados, último NSU e próxima consulta
+        """
+        from erpnext_fiscal_br.services.rate_limiter import LimiteConsumoExcedido
+
+        proxima = self.config.get("proxima_consulta_dfe")
+        if proxima and get_datetime(proxima) > now_datetime():
+            return {"documentos": 0, "ultimo_nsu": self.config.get("ultimo_nsu_dfe"), "proxima_consulta": proxima}
+
+        ult_nsu = (self.config.get("ultimo_nsu_dfe") or "0").zfill(15)
+        proxima = None
+
+        falhas = frappe.parse_json(self.config.get("nsus_falha_dfe") or "[]")
+        total, falhas = self._reprocessar(falhas)
+
+        for _lote in range(max_lotes):
+            try:
+                resultado = self._consultar(f"<distNSU><ultNSU>{ult_nsu}</ultNSU></distNSU>")
+            except LimiteConsumoExcedido:
+                # Continua na próxima execução a partir do NSU já gravado
+                break
+
+            cstat = resultado.get("cStat")
+
+            if cstat == "138":
+                total += gravar_documentos(self.empresa, resultado["documentos"], falhas)
+
+            if cstat not in ("137", "138"):
+                frappe.log_error(
+                    f"Distribuição DF-e {self.empresa}: [{cstat}] {resultado.get('xMotivo')}",
+                    "Distribuição DF-e"
+                )
+                proxima = now_datetime() + INTERVALO_SEM_DOCUMENTOS
+                break
+
+            ult_nsu = (resultado.get("ultNSU") or ult_nsu).zfill(15)
+            max_nsu = (resultado.get("maxNSU") or ult_nsu).zfill(15)
+
+            if cstat == "137" or ult_nsu >= max_nsu:
+                proxima = now_datetime() + INTERVALO_SEM_DOCUMENTOS
+                break
+
+            self._salvar_nsu(ult_nsu, None, falhas)
+            frappe.db.commit()
+
+        self._salvar_nsu(ult_nsu, proxima, falhas)
+        frappe.db.commit()
+
+        return {"documentos": total, "ultimo_nsu": ult_nsu, "proxima_consulta": proxima}
+
+    def consultar_chave(self, chave_acesso):
+        """
+        Consulta um documento específico pela chave de acesso (consChNFe)
+
+        Args:
+            chave_acesso: Chave de acesso da NFe
+
+        Returns:
+            dict: Retorno da SEFAZ com os documentos gravados
+        """
+        resultado = self._consultar(f"<consChNFe><chNFe>{chave_acesso}</chNFe></consChNFe>")
+
+        if resultado.get("cStat") == "138":
+            gravar_documentos(self.empresa, resultado["documentos"])
+            frappe.db.commit()
+
+        return resultado
+
+    def _reprocessar(self, nsus):
+        """
+        Consulta novamente (consNSU) os documentos cuja gravação falhou
+
+        Args:
+            nsus: NSUs com falha de gravação
+
+        Returns:
+            tuple: (documentos gravados, NSUs ainda com falha)
+        """
+        from erpnext_fiscal_br.services.rate_limiter import LimiteConsumoExcedido
+
+        gravados = 0
+        restantes = []
+
+        for indice, nsu in enumerate(nsus):
+            if indice >= MAX_NSU_REPROCESSADOS:
+                restantes.extend(nsus[indice:])
+                break
+
+            try:
+                resultado = self._consultar(f"<consNSU><NSU>{nsu}</NSU></consNSU>")
+            except LimiteConsumoExcedido:
+                restantes.extend(nsus[indice:])
+                break
+
+            cstat = resultado.get("cStat")
+            if cstat == "138":
+                gravados += gravar_documentos(self.empresa, resultado["documentos"], restantes)
+            elif cstat != "137":
+                # 137: NSU sem documento (não há o que gravar); demais códigos, nova tentativa depois
+                restantes.append(nsu)
+
+        return gravados, restantes
+
+    def _salvar_nsu(self, ult_nsu, proxima, falhas=None):
+        valores = {"ultimo_nsu_dfe": ult_nsu, "proxima_consulta_dfe": proxima}
+        if falhas is not None:
+            valores["nsus_falha_dfe"] = frappe.as_json(sorted(set(falhas))) if falhas else None
+
+        frappe.db.set_value("Configuracao Fiscal", self.config.name, valores, update_modified=False)
+
+
+def gravar_documentos(empresa, documentos, falhas=None):
+    """
+    Grava os documentos de um lote no índice por chave de acesso
+
+    Idempotente: NSUs já gravados são ignorados, um resumo nunca substitui a
+    NFe completa e eventos são identificados por (tipo, sequência). Cada
+    chave é gravada dentro de um savepoint: uma falha desfaz apenas as
+    gravações daquela chave.
+
+    Args:
+        empresa: Nome da empresa
+        documentos: Lista de documentos de ler_documento()
+        falhas: Lista que recebe os NSUs dos documentos não gravados
+
+    Returns:
+        int: Quantidade de documentos gravados ou atualizados
+    """
+    if not documentos:
+        return 0
+
+    # Uma consulta para todo o lote
+    chaves = list({d["chave_acesso"] for d in documentos})
+    existentes = set(frappe.get_all(
+        "Documento Recebido",
+        filters={"name": ["in", chaves]},
+        pluck="name"
+    ))
+
+    por_chave = {}
+    for documento in documentos:
+        por_chave.setdefault(documento["chave_acesso"], []).append(documento)
+
+    gravados = 0
+    for chave, docs_chave in por_chave.items():
+        frappe.db.savepoint("documento_recebido")
+        try:
+            if chave in existentes:
+                doc = frappe.get_doc("Documento Recebido", chave)
+            else:
+                doc = frappe.new_doc("Documento Recebido")
+                doc.chave_acesso = chave
+                doc.empresa = empresa
+
+            alterado = False
+            for documento in docs_chave:
+                if documento["tipo"] == "nfe":
+                    alterado = doc.aplicar_nfe(documento) or alterado
+                else:
+                    alterado = doc.aplicar_evento(documento) or alterado
+
+            if not alterado:
+                continue
+
+            doc.flags.ignore_permissions = True
+            doc.flags.ignore_version = True
+            if doc.is_new():
+                doc.insert()
+            else:
+                doc.save()
+
+            gravados += 1
+
+        except Exception as e:
+            frappe.db.rollback(save_point="documento_recebido")
+            if falhas is not None:
+                falhas.extend(documento["nsu"] for documento in docs_chave if documento.get("nsu"))
+            frappe.log_error(
+                f"Erro ao gravar documento recebido {chave}: {str(e)}",
+                "Distribuição DF-e"
+            )
+
+    return gravados
@@ -0,0 +1,411 @@
+"""
+EFD-Contribuições (PIS/COFINS)
+Gera o arquivo mensal da pessoa jurídica (matriz e filiais com a mesma raiz
+de CNPJ) a partir do CST, base e alíquota de PIS/COFINS dos itens das notas.
+
+Cada estabelecimento é lido com cursor do servidor e gravado em trechos à
+parte (0140 com seus 0150/0190/0200 e C010 com os documentos), em um processo
+por CNPJ; na mesma passada os itens são totalizados por CST e alíquota. O
+processo principal junta os trechos na ordem do arquivo e grava a apuração
+do bloco M a partir dos totais.
+"""
+
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import frappe
+from frappe import _
+from frappe.utils import flt, getdate
+
+from erpnext_fiscal_br.services import sped
+from erpnext_fiscal_br.services.sped import ArquivoSPED, data, somente_digitos, valor
+
+# Leiaute (COD_VER) vigente a partir de 01/01/2020
+VERSAO_LEIAUTE = "006"
+
+# Processos de geração (um por estabelecimento)
+MAX_PROCESSOS = 4
+
+# CST com contribuição apurada (M210/M610) e o código da contribuição
+# (tabela 4.3.5) nos regimes não cumulativo e cumulativo
+CODIGOS_CONTRIBUICAO = {
+    "01": ("01", "51"),
+    "02": ("02", "52"),
+    "03": ("03", "53"),
+    "05": ("31", "31"),
+}
+
+# Códigos da contribuição apurada por unidade de medida (QUANT_BC/ALIQ_QUANT no M210/M610)
+CODIGOS_QUANTIDADE = ("03", "53")
+
+# CST de receitas sem contribuição (M400/M800)
+CST_NAO_TRIBUTADOS = ("04", "06", "07", "08", "09")
+
+# Regime tributário (Configuração Fiscal) com incidência cumulativa
+REGIMES_CUMULATIVOS = ("3", "5")
+
+TRIBUTOS = ("pis", "cofins")
+
+
+class EFDContribuicoes:
+    """Gerador do arquivo da EFD-Contribuições da raiz de CNPJ de uma empresa em um mês"""
+
+    def __init__(self, empresa, data_inicial, data_final, arquivo, processos=None, andamento=None):
+        """
+        Args:
+            empresa: Nome de qualquer empresa da pessoa jurídica (matriz ou filial)
+            data_inicial: Início do período
+            data_final: Fim do período (inclusivo, no mesmo mês)
+            arquivo: Arquivo binário aberto para escrita
+            processos: Processos de geração (padrão: um por estabelecimento, até MAX_PROCESSOS)
+            andamento: Função chamada com a quantidade de notas já gravadas
+        """
+        from erpnext_fiscal_br.fiscal_br.doctype.configuracao_fiscal.configuracao_fiscal import ConfiguracaoFiscal
+
+        config = ConfiguracaoFiscal.get_config_for_company(empresa)
+        if not config:
+            frappe.throw(_("Configuração fiscal não encontrada para a empresa"))
+
+        self.inicio = getdate(data_inicial)
+        self.fim = getdate(data_final)
+        self.arquivo = ArquivoSPED(arquivo)
+        self.processos = processos
+        self.andamento = andamento
+
+        # Estabelecimentos da raiz do CNPJ, matriz primeiro
+        raiz = somente_digitos(config.cnpj)[:8]
+        self.estabelecimentos = sorted(
+            (
+                frappe.get_doc("Configuracao Fiscal", nome)
+                for nome, cnpj in frappe.get_all("Configuracao Fiscal", fields=["name", "cnpj"], as_list=True)
+                if somente_digitos(cnpj)[:8] == raiz
+            ),
+            key=lambda estabelecimento: somente_digitos(estabelecimento.cnpj)
+        )
+        self.matriz = self.estabelecimentos[0]
+
+        self.total = 0
+        for estabelecimento in self.estabelecimentos:
+            valores = sped.parametros(estabelecimento.empresa, self.inicio, self.fim)
+            self.total += sped.contar_documentos(valores) + len(sped.inutilizadas(valores))
+
+        self.cumulativo = (self.matriz.regime_tributario or "")[:1] in REGIMES_CUMULATIVOS
+        self.gravadas = 0
+
+    def gerar(self):
+        """
+        Grava o arquivo completo
+
+        Returns:
+            int: Quantidade de documentos (C100) gravados
+        """
+        with tempfile.TemporaryDirectory(dir=frappe.get_site_path("private")) as diretorio:
+            trechos = self._gerar_trechos(diretorio)
+
+            self._bloco_0(trechos)
+            self.arquivo.bloco_vazio("A")
+
+            self.arquivo.abrir_bloco("C", com_dados=bool(self.gravadas))
+            for trecho in trechos:
+                self.arquivo.incorporar(*trecho["bloco_c"])
+            self.arquivo.fechar_bloco()
+
+        for bloco in ("D", "F", "I"):
+            self.arquivo.bloco_vazio(bloco)
+        self._bloco_m(trechos)
+        self.arquivo.bloco_vazio("P")
+        self.arquivo.bloco_vazio("1")
+        self.arquivo.encerrar()
+
+        return self.gravadas
+
+    def _gerar_trechos(self, diretorio):
+        """
+        Gera os trechos de cada estabelecimento, em paralelo quando há mais de um
+
+        Returns:
+            list: Resultado de gerar_estabelecimento, na ordem dos estabelecimentos
+        """
+        tarefas = [
+            (estabelecimento.empresa, self.inicio, self.fim, os.path.join(diretorio, str(indice)))
+            for indice, estabelecimento in enumerate(self.estabelecimentos)
+        ]
+        processos = min(self.processos or MAX_PROCESSOS, len(tarefas))
+
+        if processos <= 1:
+            trechos = []
+            for tarefa in tarefas:
+                trechos.append(gerar_estabelecimento(*tarefa))
+                self._concluido(trechos[-1])
+            return trechos
+
+        # spawn: cada processo abre a própria conexão (_iniciar_processo)
+        trechos = [None] * len(tarefas)
+        with ProcessPoolExecutor(
+            max_workers=processos,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_iniciar_processo,
+            initargs=(frappe.local.site, frappe.local.sites_path)
+        ) as pool:
+            futuros = {pool.submit(gerar_estabelecimento, *tarefa): indice for indice, tarefa in enumerate(tarefas)}
+            for futuro in as_completed(futuros):
+                trechos[futuros[futuro]] = futuro.result()
+                self._concluido(trechos[futuros[futuro]])
+
+        return trechos
+
+    def _concluido(self, trecho):
+        self.gravadas += trecho["documentos"]
+        if self.andamento:
+            self.andamento(self.gravadas)
+
+    def _bloco_0(self, trechos):
+        matriz = self.matriz
+        company = frappe.get_doc("Company", matriz.empresa)
+
+        self.arquivo.registro(
+            "0000", VERSAO_LEIAUTE, "0", "", "", data(self.inicio), data(self.fim),
+            company.company_name[:100], somente_digitos(matriz.cnpj), matriz.uf_emissao,
+            matriz.codigo_municipio, "", "00",
+            # Industrial ou equiparado (0); demais, comércio (2)
+            "0" if (matriz.atividade_sped or "").startswith("0") else "2"
+        )
+        self.arquivo.abrir_bloco("0")
+
+        sped.registro_0100(self.arquivo, matriz)
+
+        # Incidência: 1 não cumulativa, 2 cumulativa (regime de competência detalhado)
+        if self.cumulativo:
+            self.arquivo.registro("0110", "2", "", "1", "9")
+        else:
+            self.arquivo.registro("0110", "1", "1", "1", "")
+
+        for trecho in trechos:
+            self.arquivo.incorporar(*trecho["bloco_0"])
+
+        self.arquivo.fechar_bloco()
+
+    def _bloco_m(self, trechos):
+        """Apuração do PIS (M200/M210/M400) e da COFINS (M600/M610/M800)"""
+        totais = {tributo: {} for tributo in TRIBUTOS}
+        for trecho in trechos:
+            for tributo in TRIBUTOS:
+                for chave, valores in trecho[tributo].items():
+                    acumulado = totais[tributo].setdefault(chave, [0.0] * 3)
+                    for i, parcela in enumerate(valores):
+                        acumulado[i] += parcela
+
+        self.arquivo.abrir_bloco("M", com_dados=bool(self.gravadas))
+        if self.gravadas:
+            for tributo, (consolidacao, detalhe, nao_tributadas) in (
+                ("pis", ("M200", "M210", "M400")),
+                ("cofins", ("M600", "M610", "M800")),
+            ):
+                self._apuracao(totais[tributo], consolidacao, detalhe, nao_tributadas)
+        self.arquivo.fechar_bloco()
+
+    def _apuracao(self, totais, consolidacao, detalhe, nao_tributadas):
+        """
+        Consolidação (M200/M600), detalhamento por código da contribuição e
+        alíquota (M210/M610) e receitas sem contribuição por CST (M400/M800)
+
+        Args:
+            totais: (cst, aliquota) -> [receita, base (quantidade no CST 03), contribuição]
+        """
+        contribuicoes = {}
+        receitas_sem_contribuicao = {}
+
+        for (cst, aliquota), (receita, base, contribuicao) in sorted(totais.items()):
+            if cst in CODIGOS_CONTRIBUICAO:
+                codigo = CODIGOS_CONTRIBUICAO[cst][1 if self.cumulativo else 0]
+                acumulado = contribuicoes.setdefault((codigo, aliquota), [0.0] * 3)
+                acumulado[0] += receita
+                acumulado[1] += base
+                acumulado[2] += contribuicao
+            elif cst in CST_NAO_TRIBUTADOS:
+                receitas_sem_contribuicao[cst] = receitas_sem_contribuicao.get(cst, 0.0) + receita
+
+        total = flt(sum(contribuicao for _r, _b, contribuicao in contribuicoes.values()), 2)
+        nao_cumulativa = 0 if self.cumulativo else total
+        cumulativa = total if self.cumulativo else 0
+
+        self.arquivo.registro(
+            consolidacao, valor(nao_cumulativa), valor(0), valor(0), valor(nao_cumulativa), valor(0),
+            valor(0), valor(nao_cumulativa), valor(cumulativa), valor(0), valor(0), valor(cumulativa),
+            valor(total)
+        )
+        for (codigo, aliquota), (receita, base, contribuicao) in sorted(contribuicoes.items()):
+            if codigo in CODIGOS_QUANTIDADE:
+                # VL_BC_CONT zerada; quantidade e alíquota em reais por unidade
+                bases = (valor(0), valor(0), valor(0), valor(0), "", valor(base, 3), valor(aliquota, 4))
+            else:
+                bases = (valor(base), valor(0), valor(0), valor(base), valor(aliquota, 4), "", "")
+
+            self.arquivo.registro(
+                detalhe, codigo, valor(receita), *bases, valor(contribuicao), valor(0), valor(0), valor(0),
+                valor(0), valor(contribuicao)
+            )
+
+        for cst, receita in sorted(receitas_sem_contribuicao.items()):
+            self.arquivo.registro(nao_tributadas, cst, valor(receita), "", "")
+
+
+class EstabelecimentoContribuicoes:
+    """Trechos de um estabelecimento (0140 e C010) e seus totais de PIS/COFINS"""
+
+    def __init__(self, config, valores):
+        """
+        Args:
+            config: Configuração Fiscal do estabelecimento
+            valores: sped.parametros do estabelecimento no período
+        """
+        self.config = config
+        self.valores = valores
+        self.documentos = 0
+        self.totais = {tributo: {} for tributo in TRIBUTOS}
+
+    def gerar(self, prefixo):
+        """
+        Grava os trechos do bloco 0 e do bloco C em `prefixo`-0.txt e `prefixo`-C.txt
+
+        Returns:
+            dict: documentos, bloco_0 e bloco_c (caminho, contagem) e os totais
+                por (cst, aliquota) de pis e cofins
+        """
+        inutilizadas = sped.inutilizadas(self.valores)
+
+        caminho_0 = f"{prefixo}-0.txt"
+        with open(caminho_0, "wb") as saida:
+            arquivo_0 = ArquivoSPED(saida)
+            self._bloco_0(arquivo_0)
+
+        caminho_c = f"{prefixo}-C.txt"
+        with open(caminho_c, "wb") as saida:
+            arquivo_c = ArquivoSPED(saida)
+            self._bloco_c(arquivo_c, inutilizadas)
+
+        return {
+            "documentos": self.documentos,
+            "bloco_0": (caminho_0, arquivo_0.contagem),
+            "bloco_c": (caminho_c, arquivo_c.contagem),
+            "pis": self.totais["pis"],
+            "cofins": self.totais["cofins"],
+        }
+
+    def _bloco_0(self, arquivo):
+        config = self.config
+        company_name = frappe.db.get_value("Company", config.empresa, "company_name") or config.empresa
+
+        arquivo.registro(
+            "0140", "", company_name[:100], somente_digitos(config.cnpj), config.uf_emissao,
+            somente_digitos(config.inscricao_estadual), config.codigo_municipio,
+            config.inscricao_municipal, ""
+        )
+
+        for participante in sped.participantes(self.valores):
+            sped.registro_0150(arquivo, participante)
+
+        for unidade in sped.unidades(self.valores):
+            arquivo.registro("0190", unidade[:6], unidade)
+
+        for item in sped.itens(self.valores):
+            ncm = somente_digitos(item.ncm)
+            arquivo.registro(
+                "0200", item.codigo[:60], item.descricao, "", "", item.unidade[:6], "00",
+                ncm, "", ncm[:2], "", ""
+            )
+
+    def _bloco_c(self, arquivo, inutilizadas):
+        for nota, itens in sped.documentos(self.valores):
+            self._escrituracao(arquivo)
+            self._documento(arquivo, nota, itens)
+
+        for nota in inutilizadas:
+            self._escrituracao(arquivo)
+            arquivo.registro(*sped.campos_c100(nota))
+            self.documentos += 1
+
+    def _escrituracao(self, arquivo):
+        """C010 do estabelecimento (escrituração individualizada), antes do primeiro documento"""
+        if not arquivo.contagem.get("C010"):
+            arquivo.registro("C010", somente_digitos(self.config.cnpj), "2")
+
+    def _documento(self, arquivo, nota, itens):
+        """C100 com os C170 (NF-e) ou o C175 por CFOP, CST e alíquota (NFC-e)"""
+        modelo = str(nota.modelo)
+        ind_oper = (nota.tipo_operacao or "1")[0]
+        self.documentos += 1
+
+        arquivo.registro(*sped.campos_c100(nota, itens))
+        if nota.status != "Autorizada":
+            return
+
+        analitico = {}
+        for numero, item in enumerate(itens, 1):
+            # Entradas emitidas pela empresa (devoluções) não geram contribuição
+            if ind_oper == "1":
+                self._acumular(item)
+
+            if modelo == "55":
+                arquivo.registro(*sped.campos_c170(numero, item))
+            else:
+                chave = (
+                    item.cfop, item.cst_pis, flt(item.aliquota_pis, 4),
+                    item.cst_cofins, flt(item.aliquota_cofins, 4),
+                )
+                # VL_OPR, VL_DESC, VL_BC_PIS, VL_PIS, VL_BC_COFINS, VL_COFINS, quantidade
+                totais = analitico.setdefault(chave, [0.0] * 7)
+                totais[0] += flt(item.valor_total)
+                totais[1] += flt(item.valor_desconto)
+                totais[2] += flt(item.base_pis)
+                totais[3] += flt(item.valor_pis)
+                totais[4] += flt(item.base_cofins)
+                totais[5] += flt(item.valor_cofins)
+                totais[6] += flt(item.quantidade)
+
+        for (cfop, cst_pis, aliquota_pis, cst_cofins, aliquota_cofins), totais in analitico.items():
+            arquivo.registro(
+                "C175", cfop, valor(totais[0]), valor(totais[1]),
+                *sped.campos_contribuicao(cst_pis, totais[2], aliquota_pis, totais[6], totais[3]),
+                *sped.campos_contribuicao(cst_cofins, totais[4], aliquota_cofins, totais[6], totais[5]),
+                "", ""
+            )
+
+    def _acumular(self, item):
+        """Soma o item aos totais por CST e alíquota de cada tributo"""
+        receita = flt(item.valor_total) - flt(item.valor_desconto)
+
+        for tributo in TRIBUTOS:
+            cst = (item.get(f"cst_{tributo}") or "").strip()
+            if not cst:
+                continue
+            chave = (cst, flt(item.get(f"aliquota_{tributo}"), 4))
+            totais = self.totais[tributo].setdefault(chave, [0.0] * 3)
+            totais[0] += receita
+            if cst in sped.CST_ALIQUOTA_QUANTIDADE:
+                totais[1] += flt(item.quantidade)
+            else:
+                totais[1] += flt(item.get(f"base_{tributo}"))
+            totais[2] += flt(item.get(f"valor_{tributo}"))
+
+
+def gerar_estabelecimento(empresa, data_inicial, data_final, prefixo):
+    """
+    Gera os trechos de um estabelecimento (executado nos processos do pool)
+
+    Returns:
+        dict: Ver EstabelecimentoContribuicoes.gerar
+    """
+    from erpnext_fiscal_br.fiscal_br.doctype.configuracao_fiscal.configuracao_fiscal import ConfiguracaoFiscal
+
+    config = ConfiguracaoFiscal.get_config_for_company(empresa)
+    valores = sped.parametros(empresa, data_inicial, data_final)
+
+    return EstabelecimentoContribuicoes(config, valores).gerar(prefixo)
+
+
+def _iniciar_processo(site, sites_path):
+    frappe.init(site=site, sites_path=sites_path)
+    frappe.connect()
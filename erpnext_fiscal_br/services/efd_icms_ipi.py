@@ -0,0 +1,229 @@
+"""
+EFD ICMS/IPI (SPED Fiscal)
+Gera o arquivo do período a partir das notas emitidas em produção: bloco 0
+(participantes, unidades e itens), C100/C170/C190, apuração E100/E110 e o
+bloco 9. Notas e itens são lidos com cursor do servidor na ordem do índice
+(empresa, data_autorizacao) e gravados nota a nota; em memória ficam só os
+itens e o C190 da nota corrente e os totais da apuração.
+"""
+
+import frappe
+from frappe import _
+from frappe.utils import flt, getdate
+
+from erpnext_fiscal_br.services import sped
+from erpnext_fiscal_br.services.sped import ArquivoSPED, data, somente_digitos, valor
+
+# Leiaute (COD_VER) vigente a partir de 01/01/2025
+VERSAO_LEIAUTE = "019"
+
+# Notas gravadas entre as publicações de andamento
+INTERVALO_ANDAMENTO = 500
+
+
+class EFDICMSIPI:
+    """Gerador do arquivo da EFD ICMS/IPI de uma empresa em um período (mês)"""
+
+    def __init__(self, empresa, data_inicial, data_final, arquivo, incluir_itens=True, andamento=None):
+        """
+        Args:
+            empresa: Nome da empresa
+            data_inicial: Início do período
+            data_final: Fim do período (inclusivo, no mesmo mês)
+            arquivo: Arquivo binário aberto para escrita
+            incluir_itens: Grava o C170 (e os itens e unidades do bloco 0) das NF-e
+            andamento: Função chamada com a quantidade de notas já gravadas
+        """
+        from erpnext_fiscal_br.fiscal_br.doctype.configuracao_fiscal.configuracao_fiscal import ConfiguracaoFiscal
+
+        self.config = ConfiguracaoFiscal.get_config_for_company(empresa)
+        if not self.config:
+            frappe.throw(_("Configuração fiscal não encontrada para a empresa"))
+
+        self.empresa = empresa
+        self.inicio = getdate(data_inicial)
+        self.fim = getdate(data_final)
+        self.arquivo = ArquivoSPED(arquivo)
+        self.incluir_itens = incluir_itens
+        self.andamento = andamento
+
+        self.valores = sped.parametros(empresa, self.inicio, self.fim)
+        self.inutilizadas = sped.inutilizadas(self.valores)
+        self.total = sped.contar_documentos(self.valores) + len(self.inutilizadas)
+
+        self.gravadas = 0
+        self.debitos = 0.0
+        self.creditos = 0.0
+
+    def gerar(self):
+        """
+        Grava o arquivo completo
+
+        Returns:
+            int: Quantidade de documentos (C100) gravados
+        """
+        self._bloco_0()
+        self.arquivo.bloco_vazio("B")
+        self._bloco_c()
+        self.arquivo.bloco_vazio("D")
+        self._bloco_e()
+        for bloco in ("G", "H", "K"):
+            self.arquivo.bloco_vazio(bloco)
+        self._bloco_1()
+        self.arquivo.encerrar()
+
+        return self.gravadas
+
+    def _bloco_0(self):
+        company = frappe.get_doc("Company", self.empresa)
+
+        self.arquivo.registro(
+            "0000", VERSAO_LEIAUTE, "0", data(self.inicio), data(self.fim),
+            company.company_name[:100], somente_digitos(self.config.cnpj), "",
+            self.config.uf_emissao, somente_digitos(self.config.inscricao_estadual),
+            self.config.codigo_municipio, self.config.inscricao_municipal, "",
+            self.config.perfil_sped or "A", (self.config.atividade_sped or "1")[0]
+        )
+        self.arquivo.abrir_bloco("0")
+
+        endereco = frappe._dict()
+        if company.get("company_address"):
+            endereco = frappe.get_doc("Address", company.company_address)
+
+        self.arquivo.registro(
+            "0005", (company.abbr or "")[:60], somente_digitos(endereco.get("pincode")),
+            (endereco.get("address_line1") or "")[:60], endereco.get("numero_endereco") or "S/N",
+            (endereco.get("complemento") or "")[:60], (endereco.get("bairro") or endereco.get("city") or "")[:60],
+            somente_digitos(endereco.get("phone"))[-11:], "", endereco.get("email_id")
+        )
+
+        sped.registro_0100(self.arquivo, self.config)
+
+        self._participantes()
+        if self.incluir_itens:
+            self._unidades_e_itens()
+
+        self.arquivo.fechar_bloco()
+
+    def _participantes(self):
+        """0150 dos destinatários das NF-e autorizadas"""
+        for participante in sped.participantes(self.valores):
+            sped.registro_0150(self.arquivo, participante)
+
+    def _unidades_e_itens(self):
+        """0190 das unidades e 0200 dos itens usados nos C170"""
+        for unidade in sped.unidades(self.valores):
+            self.arquivo.registro("0190", unidade[:6], unidade)
+
+        for item in sped.itens(self.valores):
+            ncm = somente_digitos(item.ncm)
+            self.arquivo.registro(
+                "0200", item.codigo[:60], item.descricao, "", "",
+                item.unidade[:6], "00", ncm, "", ncm[:2], "", "", somente_digitos(item.cest)
+            )
+
+    def _bloco_c(self):
+        self.arquivo.abrir_bloco("C", com_dados=bool(self.total))
+
+        for nota, itens in sped.documentos(self.valores):
+            self._documento(nota, itens)
+
+        for nota in self.inutilizadas:
+            self.arquivo.registro(*sped.campos_c100(nota))
+            self._gravada()
+
+        self.arquivo.fechar_bloco()
+
+    def _documento(self, nota, itens):
+        """C100 da nota com os C170 dos itens e o C190 por CST, CFOP e alíquota"""
+        modelo = str(nota.modelo)
+
+        self.arquivo.registro(*sped.campos_c100(nota, itens))
+        if nota.status != "Autorizada":
+            # Cancelada/denegada: só a identificação do documento
+            self._gravada()
+            return
+
+        # NFC-e: sem C170
+        if self.incluir_itens and modelo == "55":
+            for numero, item in enumerate(itens, 1):
+                self._registro_c170(numero, item)
+
+        for (cst, cfop, aliquota), totais in _analitico(nota, itens).items():
+            self.arquivo.registro(
+                "C190", cst, cfop, valor(aliquota), *[valor(total) for total in totais], ""
+            )
+            if cfop[:1] in ("5", "6", "7"):
+                self.debitos += totais[2]
+            elif cfop[:1] in ("1", "2", "3"):
+                self.creditos += totais[2]
+
+        self._gravada()
+
+    def _registro_c170(self, numero, item):
+        # VL_ABAT_NT ao final
+        self.arquivo.registro(*sped.campos_c170(numero, item), "")
+
+    def _gravada(self):
+        self.gravadas += 1
+        if self.andamento and self.gravadas % INTERVALO_ANDAMENTO == 0:
+            self.andamento(self.gravadas)
+
+    def _bloco_e(self):
+        """Apuração do ICMS próprio: débitos das saídas e créditos das entradas emitidas"""
+        debitos = flt(self.debitos, 2)
+        creditos = flt(self.creditos, 2)
+        saldo = flt(debitos - creditos, 2)
+
+        self.arquivo.abrir_bloco("E")
+        self.arquivo.registro("E100", data(self.inicio), data(self.fim))
+        self.arquivo.registro(
+            "E110", valor(debitos), valor(0), valor(0), valor(0), valor(creditos), valor(0), valor(0),
+            valor(0), valor(0), valor(max(saldo, 0)), valor(0), valor(max(saldo, 0)),
+            valor(max(-saldo, 0)), valor(0)
+        )
+        self.arquivo.fechar_bloco()
+
+    def _bloco_1(self):
+        self.arquivo.abrir_bloco("1")
+        # 1010: nenhuma das obrigações específicas do bloco 1
+        self.arquivo.registro("1010", *["N"] * 13)
+        self.arquivo.fechar_bloco()
+
+
+def _analitico(nota, itens):
+    """
+    Totais do C190 da nota por (CST, CFOP, alíquota)
+
+    Frete, seguro, outras despesas e desconto da nota são rateados pelo valor
+    dos itens (o último recebe a diferença), de modo que a soma de VL_OPR
+    seja o valor do documento.
+
+    Returns:
+        dict: (cst, cfop, aliquota) -> [VL_OPR, VL_BC_ICMS, VL_ICMS,
+            VL_BC_ICMS_ST, VL_ICMS_ST, VL_RED_BC, VL_IPI]
+    """
+    ajuste = (
+        flt(nota.valor_frete) + flt(nota.valor_seguro)
+        + flt(nota.valor_outras_despesas) - flt(nota.valor_desconto)
+    )
+    base_rateio = sum(flt(item.valor_total) for item in itens)
+    restante = ajuste
+
+    analitico = {}
+    for numero, item in enumerate(itens, 1):
+        if numero == len(itens):
+            rateio = restante
+        else:
+            rateio = flt(ajuste * flt(item.valor_total) / base_rateio, 2) if base_rateio else 0
+            restante -= rateio
+
+        totais = analitico.setdefault((sped.cst_icms(item), item.cfop, flt(item.aliquota_icms)), [0.0] * 7)
+        totais[0] += flt(item.valor_total) + flt(item.valor_icms_st) + flt(item.valor_ipi) + rateio
+        totais[1] += flt(item.base_icms)
+        totais[2] += flt(item.valor_icms)
+        totais[3] += flt(item.base_icms_st)
+        totais[4] += flt(item.valor_icms_st)
+        totais[6] += flt(item.valor_ipi)
+
+    return analitico
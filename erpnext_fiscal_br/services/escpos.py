@@ -0,0 +1,232 @@
+"""
+DANFCE em ESC/POS
+Gera o cupom da NFC-e como sequência de comandos para impressoras térmicas,
+usando o QR Code e o código de barras nativos da impressora (sem PDF)
+"""
+
+from frappe.utils import flt
+
+from erpnext_fiscal_br.services.danfe_xml import ler_dados_danfe, formatar_data_hora
+
+# Colunas da fonte A por largura de papel
+COLUNAS_80MM = 48
+COLUNAS_58MM = 32
+
+ESC = b"\x1b"
+GS = b"\x1d"
+
+INICIALIZAR = ESC + b"@"
+# Página de código PC860 (português)
+PAGINA_CODIGO = ESC + b"t\x03"
+CODIFICACAO = "cp860"
+
+ALINHAR_ESQUERDA = ESC + b"a\x00"
+ALINHAR_CENTRO = ESC + b"a\x01"
+NEGRITO = ESC + b"E\x01"
+SEM_NEGRITO = ESC + b"E\x00"
+ALTURA_DUPLA = GS + b"!\x01"
+TAMANHO_NORMAL = GS + b"!\x00"
+AVANCAR_E_CORTAR = GS + b"V\x42\x00"
+
+
+def gerar_danfce_escpos(xml, protocolo=None, data_autorizacao=None, colunas=COLUNAS_80MM):
+    """
+    Gera o DANFCE em ESC/POS a partir do procNFe da NFC-e
+
+    Args:
+        xml: Conteúdo do procNFe (bytes ou str)
+        protocolo: Protocolo de autorização, se o XML não tiver o protNFe
+        data_autorizacao: Data da autorização, se o XML não tiver o protNFe
+        colunas: Colunas da impressora (48 para 80mm, 32 para 58mm)
+
+    Returns:
+        bytes: Comandos ESC/POS para envio direto à impressora
+    """
+    dados = ler_dados_danfe(xml)
+    if not dados.protocolo:
+        dados.protocolo = protocolo or ""
+        dados.data_autorizacao = data_autorizacao or ""
+
+    return DANFCEEscPos(dados, colunas=colunas).generate()
+
+
+class DANFCEEscPos:
+    """Gerador do DANFCE em ESC/POS"""
+
+    def __init__(self, dados, colunas=COLUNAS_80MM):
+        """
+        Inicializa o gerador
+
+        Args:
+            dados: DadosDANFE lidos do XML (ver danfe_xml.ler_dados_danfe)
+            colunas: Colunas da impressora
+        """
+        self.dados = dados
+        self.colunas = colunas
+        self._partes = []
+
+    def generate(self):
+        """
+        Gera o cupom
+
+        Returns:
+            bytes: Comandos ESC/POS
+        """
+        self._partes = [INICIALIZAR, PAGINA_CODIGO]
+
+        self._cabecalho()
+        self._itens()
+        self._totais()
+        self._consulta()
+
+        self._partes.append(AVANCAR_E_CORTAR)
+        return b"".join(self._partes)
+
+    def _cabecalho(self):
+        emitente = self.dados.emitente
+
+        self._comando(ALINHAR_CENTRO, NEGRITO)
+        self._linha(emitente["nome"])
+        self._comando(SEM_NEGRITO)
+        self._linha(f"CNPJ: {_formatar_cnpj(emitente['cnpj'])}  IE: {emitente['ie']}")
+
+        endereco = ", ".join(p for p in (emitente["logradouro"], emitente["numero"], emitente["bairro"]) if p)
+        if endereco:
+            self._linha(endereco)
+        if emitente["municipio"]:
+            self._linha(f"{emitente['municipio']} - {emitente['uf']}")
+
+        self._separador()
+        self._linha("Documento Auxiliar da Nota Fiscal")
+        self._linha("de Consumidor Eletrônica")
+        self._separador()
+
+    def _itens(self):
+        self._comando(ALINHAR_ESQUERDA, NEGRITO)
+        self._linha("ITEM CÓDIGO DESCRIÇÃO")
+        self._linha(self._colunas_direita("QTD UN x VL.UNIT", "VL.TOTAL"))
+        self._comando(SEM_NEGRITO)
+
+        for idx, item in enumerate(self.dados.itens, 1):
+            self._linha(f"{idx:03d} {item['codigo']} {item['descricao']}")
+            self._linha(self._colunas_direita(
+                f"    {flt(item['quantidade']):.3f} {item['unidade']} x {flt(item['valor_unitario']):.2f}",
+                f"{flt(item['valor_total']):.2f}"
+            ))
+
+        self._separador()
+
+    def _totais(self):
+        totais = self.dados.totais
+
+        self._linha(self._colunas_direita("QTD. TOTAL DE ITENS", str(len(self.dados.itens))))
+        if flt(totais["valor_desconto"]):
+            self._linha(self._colunas_direita("DESCONTOS R$", f"{flt(totais['valor_desconto']):.2f}"))
+
+        self._comando(NEGRITO, ALTURA_DUPLA)
+        self._linha(self._colunas_direita("VALOR TOTAL R$", f"{flt(totais['valor_total']):.2f}"))
+        self._comando(TAMANHO_NORMAL, SEM_NEGRITO)
+
+        self._linha("FORMA DE PAGAMENTO: DINHEIRO")
+        self._separador()
+
+    def _consulta(self):
+        dados = self.dados
+        chave = dados.chave_acesso or ""
+
+        self._comando(ALINHAR_CENTRO)
+        if dados.url_consulta:
+            self._linha("Consulte pela Chave de Acesso em")
+            self._linha(dados.url_consulta)
+
+        # 11 grupos de 4 dígitos (54 caracteres) em duas linhas
+        grupos = [chave[i:i + 4] for i in range(0, len(chave), 4)]
+        self._linha(" ".join(grupos[:6]))
+        self._linha(" ".join(grupos[6:]))
+
+        destinatario = dados.destinatario
+        if destinatario["documento"]:
+            documento = destinatario["documento"]
+            documento = _formatar_cnpj(documento) if len(documento) == 14 else _formatar_cpf(documento)
+            self._linha(f"CONSUMIDOR: {documento}")
+            if destinatario["nome"]:
+                self._linha(destinatario["nome"])
+        else:
+            self._linha("CONSUMIDOR NÃO IDENTIFICADO")
+
+        self._linha(f"NFC-e nº {dados.numero} Série {dados.serie} {formatar_data_hora(dados.data_emissao)}")
+        self._linha(f"Protocolo: {dados.protocolo}")
+        self._linha(f"Data: {formatar_data_hora(dados.data_autorizacao)}")
+
+        if dados.qrcode_url:
+            self._partes.append(_qrcode(dados.qrcode_url, 5 if self.colunas >= COLUNAS_80MM else 4))
+
+        # Code128 da chave (277 módulos) só cabe com 2 pontos por módulo no papel de 80mm
+        if len(chave) == 44 and self.colunas >= COLUNAS_80MM:
+            self._partes.append(_codigo_barras(chave))
+
+    def _linha(self, texto):
+        self._partes.append(texto[:self.colunas].encode(CODIFICACAO, "replace") + b"\n")
+
+    def _comando(self, *comandos):
+        self._partes.extend(comandos)
+
+    def _separador(self):
+        self._partes.append(b"-" * self.colunas + b"\n")
+
+    def _colunas_direita(self, esquerda, direita):
+        """Texto à esquerda e valor alinhado à direita na mesma linha"""
+        esquerda = esquerda[:self.colunas - len(direita) - 1]
+        return esquerda + direita.rjust(self.colunas - len(esquerda))
+
+
+def _qrcode(conteudo, tamanho_modulo):
+    """
+    QR Code nativo (GS ( k): modelo 2, correção M, armazena e imprime
+
+    Args:
+        conteudo: Texto do QR Code
+        tamanho_modulo: Pontos por módulo (1 a 16)
+    """
+    dados = conteudo.encode("ascii", "replace")
+    tamanho = len(dados) + 3
+
+    return b"".join((
+        GS + b"(k\x04\x00\x31\x41\x32\x00",
+        GS + b"(k\x03\x00\x31\x43" + bytes((tamanho_modulo,)),
+        GS + b"(k\x03\x00\x31\x45\x31",
+        GS + b"(k" + bytes((tamanho & 0xFF, tamanho >> 8)) + b"\x31\x50\x30" + dados,
+        GS + b"(k\x03\x00\x31\x51\x30",
+        b"\n",
+    ))
+
+
+def _codigo_barras(chave):
+    """
+    Code128 nativo (GS k 73) da chave de acesso no conjunto C (pares de dígitos)
+
+    Args:
+        chave: Chave de acesso (44 dígitos)
+    """
+    pares = bytes(int(chave[i:i + 2]) for i in range(0, len(chave), 2))
+    dados = b"{C" + pares
+
+    return b"".join((
+        GS + b"h\x50",          # altura: 80 pontos
+        GS + b"w\x02",          # largura do módulo: 2 pontos
+        GS + b"H\x00",          # sem texto legível (a chave já foi impressa)
+        GS + b"k\x49" + bytes((len(dados),)) + dados,
+        b"\n",
+    ))
+
+
+def _formatar_cnpj(cnpj):
+    if not cnpj or len(cnpj) != 14:
+        return cnpj or ""
+    return f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}"
+
+
+def _formatar_cpf(cpf):
+    if not cpf or len(cpf) != 11:
+        return cpf or ""
+    return f"{cpf[:3]}.{cpf[3:6]}.{cpf[6:9]}-{cpf[9:]}"
@@ -0,0 +1,279 @@
+"""
+Eventos - Envio em lote de eventos da NF-e
+Os eventos são assinados em paralelo e enviados em lotes de até 20 por
+envEvento (um autorizador por lote); cada retEvento da resposta volta para o
+evento correspondente. Cancelamentos e cartas de correção das notas emitidas
+são gravados no Evento Fiscal e na Nota Fiscal de cada evento.
+"""
+
+import frappe
+from frappe import _
+
+from erpnext_fiscal_br.services.transmitter import MAX_EVENTOS_LOTE
+
+# Evento registrado (135) ou registrado fora de prazo (155)
+CSTAT_REGISTRADO = ("135", "155")
+
+# Código (tpEvento) dos eventos das notas emitidas
+TIPOS_EVENTO = {
+    "Cancelamento": "110111",
+    "Carta de Correção": "110110",
+}
+
+# Threads de assinatura
+MAX_ASSINATURAS_PARALELAS = 4
+
+
+def assinar(empresa, xmls, max_workers=MAX_ASSINATURAS_PARALELAS):
+    """
+    Assina os XMLs em paralelo, com um XMLSigner por thread
+
+    Returns:
+        list: Tuplas (xml assinado, erro) na ordem dos XMLs
+    """
+    from erpnext_fiscal_br.services.signer import XMLSigner
+    from erpnext_fiscal_br.utils.concurrency import executar_em_paralelo
+
+    # Um só evento: sem o custo de abrir conexões nas threads
+    if len(xmls) == 1:
+        try:
+            return [(XMLSigner(empresa).sign(xmls[0]), None)]
+        except Exception as e:
+            return [(None, e)]
+
+    resultados = executar_em_paralelo(
+        lambda xml, signer: signer.sign(xml),
+        xmls,
+        max_workers=max_workers,
+        preparar_thread=lambda: XMLSigner(empresa)
+    )
+    return [(assinado, erro) for _xml, assinado, erro in resultados]
+
+
+def montar_lotes(eventos):
+    """
+    Distribui os eventos em lotes de até MAX_EVENTOS_LOTE
+
+    Cada lote tem no máximo um evento por chave de acesso, e os eventos de
+    uma mesma chave ficam em lotes sucessivos na ordem recebida (ex: a carta
+    de correção antes do cancelamento).
+
+    Args:
+        eventos: Dicts com "chave"
+
+    Returns:
+        list: Listas de eventos, na ordem de envio
+    """
+    lotes = []
+    ultimo_lote = {}
+
+    for evento in eventos:
+        inicio = ultimo_lote.get(evento["chave"], -1) + 1
+        indice = next(
+            (i for i in range(inicio, len(lotes)) if len(lotes[i]) < MAX_EVENTOS_LOTE),
+            len(lotes)
+        )
+        if indice == len(lotes):
+            lotes.append([])
+
+        lotes[indice].append(evento)
+        ultimo_lote[evento["chave"]] = indice
+
+    return lotes
+
+
+def enviar(transmitter, eventos, url=None, autorizador=None):
+    """
+    Assina e envia os eventos em lotes, devolvendo o retorno de cada um
+
+    Args:
+        transmitter: SEFAZTransmitter da empresa
+        eventos: Dicts com chave, id_evento e xml (SEFAZTransmitter.montar_evento)
+        url: URL do RecepcaoEvento (padrão: autorizador da UF)
+        autorizador: Autorizador da URL, se diferente do da UF (ex: AN)
+
+    Returns:
+        list: Um dict por evento, na ordem recebida, com os campos do retEvento
+            (cStat, xMotivo, nProt, dhRegEvento...) e "eventos" = [retEvento],
+            ou o cStat/xMotivo do lote quando ele é rejeitado por inteiro
+    """
+    retornos = [None] * len(eventos)
+    pendentes = []
+
+    assinaturas = assinar(transmitter.empresa, [evento["xml"] for evento in eventos])
+    for indice, (evento, (assinado, erro)) in enumerate(zip(eventos, assinaturas)):
+        if erro is not None:
+            retornos[indice] = _falha(erro)
+        else:
+            pendentes.append(dict(evento, indice=indice, assinado=assinado))
+
+    for lote in montar_lotes(pendentes):
+        try:
+            resultado = transmitter.enviar_eventos(
+                [(evento["id_evento"], evento["assinado"]) for evento in lote],
+                url=url,
+                autorizador=autorizador
+            )
+        except Exception as e:
+            for evento in lote:
+                retornos[evento["indice"]] = _falha(e)
+            continue
+
+        # Uma chave por lote: o retEvento é identificado pelo chNFe
+        por_chave = {ret.get("chNFe"): ret for ret in resultado.get("eventos", []) if ret.get("chNFe")}
+
+        # cStat/xMotivo do próprio retEnvEvento (os de nível superior vêm do primeiro retEvento)
+        retorno_lote = resultado.get("retorno", resultado)
+
+        for evento in lote:
+            ret = por_chave.get(evento["chave"])
+            if ret is None:
+                # Lote rejeitado por inteiro (ex: 656) ou evento sem retorno
+                retornos[evento["indice"]] = {
+                    "cStat": retorno_lote.get("cStat"),
+                    "xMotivo": retorno_lote.get("xMotivo"),
+                    "eventos": [],
+                }
+            else:
+                retornos[evento["indice"]] = dict(ret, eventos=[ret])
+
+    return retornos
+
+
+def _falha(erro):
+    return {"cStat": "", "xMotivo": str(erro), "eventos": []}
+
+
+def enviar_eventos_notas(empresa, eventos):
+    """
+    Envia em lote cancelamentos e cartas de correção de notas de uma empresa
+
+    As validações são as mesmas do envio individual (Nota Fiscal.cancelar e
+    carta_correcao). Cada evento registrado é gravado (Evento Fiscal, status
+    da nota e da Sales Invoice) e confirmado antes do seguinte.
+
+    Args:
+        empresa: Nome da empresa emitente
+        eventos: Dicts com nota_fiscal, tipo_evento ("Cancelamento" ou
+            "Carta de Correção") e descricao (justificativa ou correção)
+
+    Returns:
+        list: Um dict por evento, na ordem recebida, com nota_fiscal,
+            tipo_evento, success, codigo, mensagem e evento (Evento Fiscal)
+    """
+    from erpnext_fiscal_br.services.transmitter import (
+        SEFAZTransmitter,
+        detalhe_cancelamento,
+        detalhe_carta_correcao,
+    )
+
+    transmitter = SEFAZTransmitter(empresa)
+
+    resultados = []
+    montados = []
+    notas = {}
+    cartas_no_lote = {}
+
+    for pedido in eventos:
+        nome, tipo, descricao = pedido["nota_fiscal"], pedido["tipo_evento"], pedido["descricao"]
+        resultado = {"nota_fiscal": nome, "tipo_evento": tipo, "success": False}
+        resultados.append(resultado)
+
+        try:
+            if nome not in notas:
+                notas[nome] = frappe.get_doc("Nota Fiscal", nome)
+            nf = notas[nome]
+
+            if nf.empresa != empresa:
+                frappe.throw(_("Nota {0} não pertence à empresa {1}").format(nome, empresa))
+
+            if tipo == "Cancelamento":
+                nf.validar_cancelamento(descricao)
+                sequencia = 1
+                detalhe = detalhe_cancelamento(nf.protocolo_autorizacao, descricao)
+            elif tipo == "Carta de Correção":
+                sequencia = nf.validar_carta_correcao(descricao, cartas_no_lote.get(nome, 0))
+                cartas_no_lote[nome] = cartas_no_lote.get(nome, 0) + 1
+                detalhe = detalhe_carta_correcao(descricao)
+            else:
+                frappe.throw(_("Tipo de evento não suportado em lote: {0}").format(tipo))
+        except Exception as e:
+            resultado["mensagem"] = str(e)
+            continue
+
+        id_evento, xml = transmitter.montar_evento(nf.chave_acesso, TIPOS_EVENTO[tipo], sequencia, detalhe)
+        montados.append({
+            "resultado": resultado,
+            "nota": nf,
+            "tipo": tipo,
+            "descricao": descricao,
+            "sequencia": sequencia,
+            "chave": nf.chave_acesso,
+            "id_evento": id_evento,
+            "xml": xml,
+        })
+
+    if not montados:
+        return resultados
+
+    for evento, retorno in zip(montados, enviar(transmitter, montados)):
+        resultado = evento["resultado"]
+        resultado["codigo"] = retorno.get("cStat")
+        resultado["mensagem"] = retorno.get("xMotivo")
+
+        # Sem retEvento do evento o cStat é o do lote: nunca registrado
+        if not retorno.get("eventos") or retorno.get("cStat") not in CSTAT_REGISTRADO:
+            continue
+
+        try:
+            if evento["tipo"] == "Cancelamento":
+                evento_fiscal = evento["nota"].registrar_cancelamento(evento["descricao"], retorno)
+            else:
+                evento_fiscal = evento["nota"].criar_evento(
+                    evento["tipo"], evento["descricao"], retorno, evento["sequencia"]
+                )
+            frappe.db.commit()
+        except Exception as e:
+            frappe.db.rollback()
+            frappe.log_error(
+                f"Evento {evento['id_evento']} registrado na SEFAZ (protocolo {retorno.get('nProt')}) "
+                f"mas não gravado: {str(e)}",
+                "Eventos em Lote"
+            )
+            resultado["mensagem"] = str(e)
+            continue
+
+        resultado["success"] = True
+        resultado["evento"] = evento_fiscal.name
+
+    return resultados
+
+
+def cancelar_notas(empresa, notas, justificativa):
+    """
+    Cancela as notas de uma empresa em lotes (executado na fila longa)
+
+    Args:
+        empresa: Nome da empresa emitente
+        notas: Nomes das Notas Fiscais
+        justificativa: Justificativa do cancelamento (mín. 15 caracteres)
+
+    Returns:
+        list: Ver enviar_eventos_notas
+    """
+    resultados = enviar_eventos_notas(empresa, [
+        {"nota_fiscal": nota, "tipo_evento": "Cancelamento", "descricao": justificativa}
+        for nota in notas
+    ])
+
+    falhas = [resultado for resultado in resultados if not resultado["success"]]
+    if falhas:
+        frappe.log_error(
+            "\n".join(
+                f"{falha['nota_fiscal']}: [{falha.get('codigo') or '-'}] {falha.get('mensagem')}"
+                for falha in falhas
+            ),
+            "Cancelamento em Lote"
+        )
+
+    return resultados
@@ -0,0 +1,490 @@
+"""
+Exportação Fiscal - pacotes de documentos de um período
+Gera em background, gravando a saída direto no arquivo final, nota a nota:
+- DANFE: ZIP (ou PDF único) com os DANFEs, renderizando em paralelo os que
+  ainda não estão no cache
+- XML: ZIP com os procNFe, cancelamentos e CC-e lidos do arquivo fiscal e um
+  índice CSV, retomável do último lote gravado
+- EFD ICMS/IPI: arquivo do SPED Fiscal do mês (services/efd_icms_ipi.py)
+- EFD Contribuições: arquivo de PIS/COFINS do mês da raiz do CNPJ
+  (services/efd_contribuicoes.py)
+"""
+
+import csv
+import io
+import os
+import struct
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, cint, getdate
+
+# Notas lidas do banco e renderizadas por vez
+LOTE = 200
+
+# Processos de renderização do DANFE
+MAX_PROCESSOS = 4
+
+CAMPOS_NOTA = [
+    "name", "empresa", "chave_acesso", "protocolo_autorizacao",
+    "data_autorizacao", "xml_autorizado", "xml_nfe",
+]
+
+# Eventos incluídos no pacote de XMLs: CC-e e cancelamento
+EVENTOS_XML = ("110110", "110111")
+
+CAMPOS_INDICE = ["chave_acesso", "modelo", "serie", "numero", "data_autorizacao", "valor_total", "status"]
+
+
+def processar(exportacao, retomar=False):
+    """
+    Executa uma Exportação Fiscal (job da fila longa)
+
+    Args:
+        exportacao: Nome da Exportação Fiscal
+        retomar: Continua do último lote gravado (exportação de XML interrompida)
+    """
+    doc = frappe.get_doc("Exportacao Fiscal", exportacao)
+    if retomar:
+        doc.db_set({"situacao": "Processando", "erro": None}, commit=True)
+    else:
+        doc.db_set({
+            "situacao": "Processando", "processadas": 0, "falhas": 0,
+            "posicao_arquivo": None, "erro": None,
+        }, commit=True)
+
+    # Exportação refeita: remove o arquivo anterior antes de gerar o novo
+    for anterior in frappe.get_all(
+        "File",
+        filters={"attached_to_doctype": doc.doctype, "attached_to_name": doc.name},
+        pluck="name"
+    ):
+        frappe.delete_doc("File", anterior, ignore_permissions=True)
+
+    try:
+        caminho = EXPORTADORES[doc.tipo](doc, retomar=retomar)
+        arquivo = _anexar(doc, caminho)
+    except Exception as e:
+        frappe.db.rollback()
+        doc.db_set({"situacao": "Erro", "erro": str(e)}, commit=True)
+        frappe.log_error(
+            f"Erro na exportação {exportacao}: {str(e)}\n{frappe.get_traceback()}",
+            "Exportação Fiscal"
+        )
+        return
+
+    doc.db_set({"situacao": "Concluída", "arquivo": arquivo}, commit=True)
+    _publicar_andamento(doc, doc.total, doc.total)
+
+
+def filtros_notas(doc):
+    """Filtros da Nota Fiscal pelo período (data de autorização), modelo e status"""
+    filtros = [
+        ["empresa", "=", doc.empresa],
+        ["status", "in", [doc.status_notas] if doc.status_notas else ["Autorizada", "Cancelada"]],
+        ["chave_acesso", "is", "set"],
+        ["protocolo_autorizacao", "is", "set"],
+        # Intervalo semiaberto na data/hora de autorização
+        ["data_autorizacao", ">=", getdate(doc.data_inicial)],
+        ["data_autorizacao", "<", add_days(getdate(doc.data_final), 1)],
+    ]
+    if doc.modelo:
+        filtros.append(["modelo", "=", doc.modelo])
+
+    return filtros
+
+
+def iterar_notas(doc, campos=CAMPOS_NOTA, inicio=0):
+    """
+    Percorre as notas da exportação em lotes de LOTE
+
+    Yields:
+        list: Notas do lote (dicts com `campos`)
+    """
+    filtros = filtros_notas(doc)
+
+    while True:
+        notas = frappe.get_all(
+            "Nota Fiscal",
+            filters=filtros,
+            fields=campos,
+            order_by="data_autorizacao asc, name asc",
+            limit_start=inicio,
+            limit_page_length=LOTE
+        )
+        if not notas:
+            return
+
+        yield notas
+
+        inicio += len(notas)
+        if len(notas) < LOTE:
+            return
+
+
+def exportar_danfes(doc, retomar=False):
+    """
+    Gera o pacote de DANFEs da exportação
+
+    Os DANFEs já em cache são copiados do disco; os demais são renderizados
+    em um pool de processos (que também preenche o cache). Cada PDF vai para
+    o arquivo final assim que fica pronto. Não é retomável: uma nova execução
+    recomeça, aproveitando os DANFEs já renderizados no cache.
+
+    Args:
+        doc: Exportação Fiscal
+        retomar: Ignorado
+
+    Returns:
+        str: Caminho do arquivo gerado
+    """
+    from erpnext_fiscal_br.services.danfe_cache import caminho_pdf, logo_empresa
+    from erpnext_fiscal_br.utils.pdf import ConcatenadorPDF
+
+    total = frappe.db.count("Nota Fiscal", filtros_notas(doc))
+    doc.db_set("total", total, commit=True)
+
+    logo = logo_empresa(doc.empresa)
+    extensao = "pdf" if doc.formato == "PDF" else "zip"
+    destino = frappe.get_site_path("private", "files", f"{doc.name}-danfe.{extensao}")
+    temporario = f"{destino}.{os.getpid()}.tmp"
+
+    processadas = falhas = 0
+
+    with open(temporario, "wb") as saida, ProcessPoolExecutor(max_workers=_processos()) as pool:
+        if extensao == "pdf":
+            concatenador = ConcatenadorPDF(saida)
+        else:
+            # PDFs já comprimidos: sem nova compressão no ZIP
+            pacote = zipfile.ZipFile(saida, "w", zipfile.ZIP_STORED, allowZip64=True)
+
+        def adicionar(nota, caminho):
+            if extensao == "pdf":
+                with open(caminho, "rb") as f:
+                    concatenador.adicionar(f.read())
+            else:
+                pacote.write(caminho, f"DANFE_{nota.chave_acesso}.pdf")
+
+        for notas in iterar_notas(doc):
+            caminhos = [caminho_pdf(nota.chave_acesso, nota.protocolo_autorizacao) for nota in notas]
+
+            # Renderiza no pool só o que falta no cache
+            tarefas = []
+            for nota, caminho in zip(notas, caminhos):
+                if os.path.exists(caminho):
+                    continue
+                tarefa = _tarefa_renderizacao(nota, caminho, logo)
+                if tarefa:
+                    tarefas.append(tarefa)
+
+            for caminho, erro in pool.map(_renderizar, tarefas):
+                if erro:
+                    frappe.log_error(f"Erro ao gerar DANFE ({caminho}): {erro}", "Exportação Fiscal")
+
+            for nota, caminho in zip(notas, caminhos):
+                if os.path.exists(caminho):
+                    adicionar(nota, caminho)
+                else:
+                    falhas += 1
+
+            processadas += len(notas)
+            doc.db_set({"processadas": processadas, "falhas": falhas}, commit=True)
+            _publicar_andamento(doc, processadas, total)
+
+        if extensao == "pdf":
+            concatenador.fechar()
+        else:
+            pacote.close()
+
+    os.replace(temporario, destino)
+    return destino
+
+
+def exportar_xmls(doc, retomar=False):
+    """
+    Gera o pacote de XMLs da exportação
+
+    Os XMLs são lidos do arquivo fiscal e comprimidos direto no ZIP, sem
+    cópias temporárias. Após cada lote o ZIP é gravado em disco e a posição
+    é salva; uma execução retomada descarta o que passou dessa posição e
+    continua do lote seguinte. O índice CSV é gravado ao final.
+
+    Args:
+        doc: Exportação Fiscal
+        retomar: Continua do último lote gravado
+
+    Returns:
+        str: Caminho do arquivo gerado
+    """
+    filtros = filtros_notas(doc)
+    total = frappe.db.count("Nota Fiscal", filtros)
+    doc.db_set("total", total, commit=True)
+
+    destino = frappe.get_site_path("private", "files", f"{doc.name}-xml.zip")
+    parcial = f"{destino}.parcial"
+
+    posicao = cint(doc.posicao_arquivo)
+    if not (retomar and posicao and os.path.exists(parcial)):
+        posicao = 0
+        doc.processadas = doc.falhas = 0
+
+    processadas, falhas = cint(doc.processadas), cint(doc.falhas)
+
+    with open(parcial, "r+b" if posicao else "w+b") as saida:
+        if posicao:
+            pacote = _zip_retomado(saida, posicao)
+        else:
+            pacote = zipfile.ZipFile(saida, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+
+        for notas in iterar_notas(doc, campos=["name", "chave_acesso"], inicio=processadas):
+            falhas += _gravar_xmls(pacote, [nota.chave_acesso for nota in notas])
+
+            # Ponto de retomada: tudo até aqui está no disco
+            saida.flush()
+            os.fsync(saida.fileno())
+
+            processadas += len(notas)
+            doc.db_set({
+                "processadas": processadas, "falhas": falhas, "posicao_arquivo": str(saida.tell())
+            }, commit=True)
+            _publicar_andamento(doc, processadas, total)
+
+        _gravar_indice_csv(pacote, filtros)
+        pacote.close()
+
+    os.replace(parcial, destino)
+    return destino
+
+
+def exportar_efd_icms_ipi(doc, retomar=False):
+    """
+    Gera o arquivo da EFD ICMS/IPI do período da exportação
+
+    Args:
+        doc: Exportação Fiscal
+        retomar: Ignorado
+
+    Returns:
+        str: Caminho do arquivo gerado
+    """
+    from erpnext_fiscal_br.services.efd_icms_ipi import EFDICMSIPI
+
+    return _exportar_sped(doc, EFDICMSIPI, "efd-icms-ipi")
+
+
+def exportar_efd_contribuicoes(doc, retomar=False):
+    """
+    Gera o arquivo da EFD-Contribuições do período da exportação, com todos
+    os estabelecimentos da raiz do CNPJ da empresa
+
+    Args:
+        doc: Exportação Fiscal
+        retomar: Ignorado
+
+    Returns:
+        str: Caminho do arquivo gerado
+    """
+    from erpnext_fiscal_br.services.efd_contribuicoes import EFDContribuicoes
+
+    return _exportar_sped(doc, EFDContribuicoes, "efd-contribuicoes")
+
+
+def _exportar_sped(doc, gerador, sufixo):
+    destino = frappe.get_site_path("private", "files", f"{doc.name}-{sufixo}.txt")
+    parcial = f"{destino}.parcial"
+
+    with open(parcial, "wb") as saida:
+        arquivo = gerador(
+            doc.empresa, doc.data_inicial, doc.data_final, saida,
+            andamento=lambda gravadas: _publicar_andamento(doc, gravadas, arquivo.total)
+        )
+        doc.db_set("total", arquivo.total, commit=True)
+        # Antes dos cursores do servidor: a conexão fica ocupada até o fim da geração
+        _publicar_andamento(doc, 0, arquivo.total)
+
+        gravadas = arquivo.gerar()
+
+    os.replace(parcial, destino)
+    doc.db_set("processadas", gravadas, commit=True)
+    return destino
+
+
+def _gravar_xmls(pacote, chaves):
+    """
+    Grava no ZIP o procNFe (ou a NFe assinada, sem ele) e os eventos de cada chave
+
+    Returns:
+        int: Chaves sem XML no arquivo fiscal
+    """
+    from erpnext_fiscal_br.services import archive
+
+    nfe_assinada = {}
+    com_proc = set()
+
+    for entrada, conteudo in archive.iterar_xmls(chaves, tipos=("proc", "nfe", "evento")):
+        pasta = "20" + entrada.chave[2:6]
+
+        if entrada.tipo == "proc":
+            pacote.writestr(f"{pasta}/{entrada.chave}-procNFe.xml", conteudo)
+            com_proc.add(entrada.chave)
+        elif entrada.tipo == "nfe":
+            nfe_assinada[entrada.chave] = (pasta, conteudo)
+        elif (entrada.sufixo or "")[:6] in EVENTOS_XML:
+            pacote.writestr(f"{pasta}/{entrada.chave}-evento-{entrada.sufixo}.xml", conteudo)
+
+    # Autorizadas sem procNFe arquivado (ex: por duplicidade): NFe assinada
+    for chave, (pasta, conteudo) in nfe_assinada.items():
+        if chave not in com_proc:
+            pacote.writestr(f"{pasta}/{chave}-nfe.xml", conteudo)
+            com_proc.add(chave)
+
+    return len(set(chaves) - com_proc)
+
+
+def _gravar_indice_csv(pacote, filtros):
+    """Índice (chave, número, valor, status...) de todas as notas da exportação"""
+    with pacote.open("indice.csv", "w", force_zip64=True) as arquivo:
+        texto = io.TextIOWrapper(arquivo, encoding="utf-8", newline="")
+        escritor = csv.writer(texto, delimiter=";")
+        escritor.writerow(CAMPOS_INDICE)
+
+        inicio = 0
+        while True:
+            notas = frappe.get_all(
+                "Nota Fiscal",
+                filters=filtros,
+                fields=CAMPOS_INDICE,
+                order_by="data_autorizacao asc, name asc",
+                limit_start=inicio,
+                limit_page_length=LOTE * 10,
+                as_list=True
+            )
+            escritor.writerows(notas)
+            if len(notas) < LOTE * 10:
+                break
+            inicio += len(notas)
+
+        texto.flush()
+        texto.detach()
+
+
+# Cabeçalho local de cada arquivo do ZIP (APPNOTE 4.3.7)
+_CABECALHO_LOCAL = struct.Struct("<4s2B4HL2L2H")
+
+
+def _zip_retomado(saida, posicao):
+    """
+    Reabre um ZIP interrompido a partir do último ponto de retomada
+
+    O arquivo é truncado na posição salva e a lista de arquivos (diretório
+    central, que só é gravado no fechamento) é reconstruída dos cabeçalhos
+    locais; os próximos arquivos são anexados no fim.
+    """
+    saida.truncate(posicao)
+    saida.seek(0)
+
+    arquivos = []
+    while saida.tell() < posicao:
+        inicio = saida.tell()
+        (assinatura, _versao, _sistema, flags, compressao, hora, data, crc,
+         tamanho_comprimido, tamanho, tamanho_nome, tamanho_extra) = _CABECALHO_LOCAL.unpack(
+            saida.read(_CABECALHO_LOCAL.size)
+        )
+        if assinatura != zipfile.stringFileHeader:
+            break
+
+        nome = saida.read(tamanho_nome).decode("utf-8" if flags & 0x800 else "cp437")
+        extra = saida.read(tamanho_extra)
+
+        info = zipfile.ZipInfo(nome, (
+            (data >> 9) + 1980, (data >> 5) & 0xF, data & 0x1F,
+            hora >> 11, (hora >> 5) & 0x3F, (hora & 0x1F) * 2,
+        ))
+        info.flag_bits = flags
+        info.compress_type = compressao
+        info.CRC = crc
+        info.compress_size = tamanho_comprimido
+        info.file_size = tamanho
+        info.extra = extra
+        info.header_offset = inicio
+        info.external_attr = 0o600 << 16
+        arquivos.append(info)
+
+        saida.seek(tamanho_comprimido, os.SEEK_CUR)
+
+    # Sem diretório central o zipfile trata o conteúdo como prefixo e anexa no fim
+    pacote = zipfile.ZipFile(saida, "a", zipfile.ZIP_DEFLATED, allowZip64=True)
+    for info in arquivos:
+        pacote.filelist.append(info)
+        pacote.NameToInfo[info.filename] = info
+
+    return pacote
+
+
+def _tarefa_renderizacao(nota, caminho, logo):
+    """Argumentos de danfe_cache.renderizar para o pool (XML lido no processo principal)"""
+    from erpnext_fiscal_br.services.danfe_cache import xml_nota
+
+    try:
+        xml, protocolo_nota = xml_nota(frappe.get_doc(dict(nota, doctype="Nota Fiscal")))
+    except FileNotFoundError:
+        xml = None
+
+    if not xml:
+        frappe.log_error(f"XML não encontrado para o DANFE da nota {nota.name}", "Exportação Fiscal")
+        return None
+
+    return xml, caminho, protocolo_nota.get("protocolo"), protocolo_nota.get("data_autorizacao"), logo
+
+
+def _renderizar(tarefa):
+    """Executado nos processos do pool: renderiza e grava no cache, sem acesso ao banco"""
+    from erpnext_fiscal_br.services.danfe_cache import renderizar
+
+    xml, caminho, protocolo, data_autorizacao, logo = tarefa
+    try:
+        renderizar(xml, caminho, protocolo=protocolo, data_autorizacao=data_autorizacao, logo=logo)
+        return caminho, None
+    except Exception as e:
+        return caminho, str(e)
+
+
+def _processos():
+    return max(1, min(MAX_PROCESSOS, (os.cpu_count() or 1) - 1))
+
+
+def _publicar_andamento(doc, processadas, total):
+    frappe.publish_progress(
+        processadas * 100 / total if total else 100,
+        title=_("Exportação Fiscal"),
+        doctype=doc.doctype,
+        docname=doc.name,
+        description=_("{0} de {1} notas").format(processadas, total)
+    )
+
+
+def _anexar(doc, caminho):
+    """Registra o arquivo gerado (já em private/files) como anexo da exportação"""
+    file_url = "/private/files/" + os.path.basename(caminho)
+
+    frappe.get_doc({
+        "doctype": "File",
+        "file_name": os.path.basename(caminho),
+        "file_url": file_url,
+        "is_private": 1,
+        "attached_to_doctype": doc.doctype,
+        "attached_to_name": doc.name,
+        "attached_to_field": "arquivo",
+    }).insert(ignore_permissions=True)
+
+    return file_url
+
+
+EXPORTADORES = {
+    "DANFE": exportar_danfes,
+    "XML": exportar_xmls,
+    "EFD ICMS/IPI": exportar_efd_icms_ipi,
+    "EFD Contribuições": exportar_efd_contribuicoes,
+}
@@ -0,0 +1,655 @@
+"""
+Importação de NF-e de entrada - procNFe de fornecedores em Faturas de Compra
+Lê os XMLs (avulsos, em ZIP ou do arquivo fiscal) com iterparse, um de cada
+vez; fornecedor, itens e impostos são resolvidos por índices carregados uma
+única vez, e as Purchase Invoice em rascunho são gravadas com inserções em
+lote. A chave de acesso (campo único chave_acesso_nfe) impede importar a
+mesma nota duas vezes.
+"""
+
+import zipfile
+from datetime import datetime
+from io import BytesIO
+
+import frappe
+from frappe.utils import flt, getdate, now_datetime, nowdate, nowtime
+from lxml import etree
+
+from erpnext_fiscal_br.utils.cnpj_cpf import limpar_documento
+
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+
+# Faturas gravadas (e confirmadas) por vez
+TAMANHO_LOTE = 500
+
+# Unidade das linhas sem item cadastrado quando a uCom da nota não existe como UOM
+UOM_PADRAO = "Unit"
+
+# Protocolo de autorização válido: autorizada (100) ou autorizada fora de prazo (150)
+CSTAT_AUTORIZADA = ("100", "150")
+
+# Linhas do modelo de impostos de compra reconhecidas pela descrição ou conta,
+# da mais específica para a mais geral, e o total do ICMSTot que recebem
+TOTAIS_POR_IMPOSTO = (
+    (("ICMS ST", "ICMS-ST", "SUBSTITUI"), "valor_icms_st"),
+    (("ICMS",), "valor_icms"),
+    (("IPI",), "valor_ipi"),
+    (("COFINS",), "valor_cofins"),
+    (("PIS",), "valor_pis"),
+    (("FRETE",), "valor_frete"),
+    (("SEGURO",), "valor_seguro"),
+    (("OUTRAS DESPESAS", "DESPESAS ACESS"), "valor_outras_despesas"),
+)
+
+# Campos comuns a todas as linhas gravadas
+CAMPOS_PADRAO = ("name", "owner", "creation", "modified", "modified_by", "docstatus")
+
+CAMPOS_FATURA = CAMPOS_PADRAO + (
+    "naming_series", "title", "company", "supplier", "supplier_name", "posting_date",
+    "posting_time", "set_posting_time", "bill_no", "bill_date", "due_date", "currency",
+    "conversion_rate", "price_list_currency", "plc_conversion_rate", "taxes_and_charges",
+    "total_qty", "total", "base_total", "net_total", "base_net_total",
+    "taxes_and_charges_added", "base_taxes_and_charges_added",
+    "taxes_and_charges_deducted", "base_taxes_and_charges_deducted",
+    "total_taxes_and_charges", "base_total_taxes_and_charges",
+    "grand_total", "base_grand_total", "rounded_total", "base_rounded_total",
+    "outstanding_amount", "status", "chave_acesso_nfe",
+)
+
+CAMPOS_ITEM = CAMPOS_PADRAO + (
+    "parent", "parenttype", "parentfield", "idx", "item_code", "item_name", "description",
+    "qty", "stock_qty", "received_qty", "uom", "stock_uom", "conversion_factor",
+    "rate", "amount", "base_rate", "base_amount", "net_rate", "net_amount",
+    "base_net_rate", "base_net_amount",
+)
+
+CAMPOS_IMPOSTO = CAMPOS_PADRAO + (
+    "parent", "parenttype", "parentfield", "idx", "category", "add_deduct_tax",
+    "charge_type", "account_head", "description", "cost_center", "rate",
+    "tax_amount", "base_tax_amount", "tax_amount_after_discount_amount",
+    "base_tax_amount_after_discount_amount", "total", "base_total",
+)
+
+
+class NotaNaoImportavel(Exception):
+    """NF-e que não pode virar fatura de compra (motivo na mensagem)"""
+
+
+def _tag(nome):
+    return "{%s}%s" % (NS_NFE, nome)
+
+
+_CAMINHOS = {}
+
+
+def _texto(elem, caminho, padrao=""):
+    caminho_ns = _CAMINHOS.get(caminho)
+    if caminho_ns is None:
+        caminho_ns = _CAMINHOS[caminho] = "/".join(_tag(p) for p in caminho.split("/"))
+    encontrado = elem.find(caminho_ns)
+    if encontrado is None or encontrado.text is None:
+        return padrao
+    return encontrado.text.strip()
+
+
+def _valor(elem, caminho):
+    try:
+        return float(_texto(elem, caminho, "0") or 0)
+    except ValueError:
+        return 0.0
+
+
+def _data(valor):
+    """Data de um campo da SEFAZ (AAAA-MM-DD ou data/hora ISO 8601)"""
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor[:10]).date()
+    except ValueError:
+        return None
+
+
+def ler_nfe(arquivo):
+    """
+    Lê de um procNFe apenas os campos usados na fatura de compra
+
+    Cada grupo é descartado assim que lido, de modo que a memória não cresce
+    com a quantidade de itens da nota.
+
+    Args:
+        arquivo: Caminho ou arquivo binário aberto (ex: membro de um ZIP)
+
+    Returns:
+        frappe._dict: Dados da nota, ou None se o XML não for uma NF-e
+            (evento, resumo, inutilização...)
+    """
+    nota = frappe._dict(
+        chave="", numero="", serie="", data_emissao=None, vencimento=None,
+        cnpj_emitente="", nome_emitente="", cnpj_destinatario="",
+        cstat="", protocolo="", itens=[], totais={},
+    )
+    leitores = {_tag(nome): leitor for nome, leitor in LEITORES.items()}
+
+    for _evento, elem in etree.iterparse(arquivo, events=("end",), tag=list(leitores)):
+        leitores[elem.tag](nota, elem)
+
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    return nota if nota.chave else None
+
+
+def _ler_ide(nota, elem):
+    nota.numero = _texto(elem, "nNF")
+    nota.serie = _texto(elem, "serie")
+    nota.data_emissao = _data(_texto(elem, "dhEmi") or _texto(elem, "dEmi"))
+
+    inf_nfe = elem.getparent()
+    if inf_nfe is not None and not nota.chave:
+        nota.chave = (inf_nfe.get("Id") or "")[3:]
+
+
+def _ler_emit(nota, elem):
+    nota.cnpj_emitente = _texto(elem, "CNPJ") or _texto(elem, "CPF")
+    nota.nome_emitente = _texto(elem, "xNome")
+
+
+def _ler_dest(nota, elem):
+    nota.cnpj_destinatario = _texto(elem, "CNPJ") or _texto(elem, "CPF")
+
+
+def _ler_det(nota, elem):
+    gtin = _texto(elem, "prod/cEAN") or _texto(elem, "prod/cEANTrib")
+    nota.itens.append(frappe._dict(
+        codigo=_texto(elem, "prod/cProd"),
+        gtin="" if gtin.upper() == "SEM GTIN" else gtin,
+        descricao=_texto(elem, "prod/xProd"),
+        unidade=_texto(elem, "prod/uCom").upper(),
+        quantidade=_valor(elem, "prod/qCom"),
+        valor_total=_valor(elem, "prod/vProd"),
+        valor_desconto=_valor(elem, "prod/vDesc"),
+    ))
+
+
+def _ler_ICMSTot(nota, elem):
+    nota.totais = {
+        "valor_produtos": _valor(elem, "vProd"),
+        "valor_desconto": _valor(elem, "vDesc"),
+        "valor_icms": _valor(elem, "vICMS"),
+        "valor_icms_st": _valor(elem, "vST"),
+        "valor_ipi": _valor(elem, "vIPI"),
+        "valor_pis": _valor(elem, "vPIS"),
+        "valor_cofins": _valor(elem, "vCOFINS"),
+        "valor_frete": _valor(elem, "vFrete"),
+        "valor_seguro": _valor(elem, "vSeg"),
+        "valor_outras_despesas": _valor(elem, "vOutro"),
+        "valor_total": _valor(elem, "vNF"),
+    }
+
+
+def _ler_cobr(nota, elem):
+    nota.vencimento = _data(_texto(elem, "dup/dVenc"))
+
+
+def _ler_infProt(nota, elem):
+    nota.chave = _texto(elem, "chNFe") or nota.chave
+    nota.cstat = _texto(elem, "cStat")
+    nota.protocolo = _texto(elem, "nProt")
+
+
+# Grupos do XML lidos (e descartados) assim que terminam
+LEITORES = {
+    "ide": _ler_ide,
+    "emit": _ler_emit,
+    "dest": _ler_dest,
+    "det": _ler_det,
+    "ICMSTot": _ler_ICMSTot,
+    "cobr": _ler_cobr,
+    "infProt": _ler_infProt,
+}
+
+
+def arquivos(caminhos):
+    """
+    Percorre XMLs avulsos e ZIPs, abrindo um XML por vez
+
+    Args:
+        caminhos: Caminhos de arquivos .xml ou .zip
+
+    Yields:
+        tuple: (nome do XML, arquivo binário aberto)
+    """
+    for caminho in caminhos:
+        if zipfile.is_zipfile(caminho):
+            with zipfile.ZipFile(caminho) as pacote:
+                for info in pacote.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith(".xml"):
+                        continue
+                    with pacote.open(info) as arquivo:
+                        yield f"{caminho}:{info.filename}", arquivo
+        else:
+            with open(caminho, "rb") as arquivo:
+                yield caminho, arquivo
+
+
+def documentos_recebidos(chaves):
+    """
+    Percorre os procNFe arquivados dos Documentos Recebidos
+
+    Yields:
+        tuple: (chave de acesso, arquivo em memória)
+    """
+    from erpnext_fiscal_br.services import archive
+
+    for entrada, conteudo in archive.iterar_xmls(chaves, ("proc",)):
+        yield entrada.chave, BytesIO(conteudo)
+
+
+def recebidos_sem_fatura(empresa):
+    """Chaves das NF-e completas autorizadas da empresa ainda sem fatura de compra"""
+    return frappe.db.sql("""
+        SELECT dr.name
+        FROM `tabDocumento Recebido` dr
+        LEFT JOIN `tabPurchase Invoice` pi ON pi.chave_acesso_nfe = dr.name
+        WHERE dr.empresa = %s AND dr.tipo_documento = 'Completo'
+            AND dr.situacao = 'Autorizada' AND pi.name IS NULL
+        ORDER BY dr.data_emissao
+    """, (empresa,), pluck=True)
+
+
+def dados_empresa(empresa):
+    """(CNPJ apenas números, moeda padrão) da empresa destinatária"""
+    cnpj = frappe.db.get_value("Configuracao Fiscal", {"empresa": empresa}, "cnpj")
+    cnpj = cnpj or frappe.db.get_value("Company", empresa, "cnpj") or ""
+    return limpar_documento(cnpj), frappe.db.get_value("Company", empresa, "default_currency")
+
+
+def unidades():
+    """Nomes das unidades de medida (UOM) cadastradas"""
+    return set(frappe.get_all("UOM", pluck="name"))
+
+
+def fornecedores():
+    """Fornecedores ativos por CNPJ/CPF (tax_id, apenas números)"""
+    indice = {}
+    for nome, razao_social, documento in frappe.get_all(
+        "Supplier",
+        filters={"disabled": 0, "tax_id": ["is", "set"]},
+        fields=["name", "supplier_name", "tax_id"],
+        as_list=True
+    ):
+        indice.setdefault(limpar_documento(documento), (nome, razao_social))
+    return indice
+
+
+def itens_por_fornecedor():
+    """Itens por (fornecedor, código do fornecedor) - tabela Item Supplier"""
+    return {
+        (fornecedor, codigo.strip()): (item, nome, unidade)
+        for fornecedor, codigo, item, nome, unidade in frappe.db.sql("""
+            SELECT isup.supplier, isup.supplier_part_no, i.name, i.item_name, i.stock_uom
+            FROM `tabItem Supplier` isup
+            INNER JOIN `tabItem` i ON i.name = isup.parent
+            WHERE i.disabled = 0 AND IFNULL(isup.supplier_part_no, '') != ''
+        """)
+    }
+
+
+def itens_por_gtin():
+    """Itens por código de barras (GTIN/EAN) - tabela Item Barcode"""
+    return {
+        codigo.strip(): (item, nome, unidade)
+        for codigo, item, nome, unidade in frappe.db.sql("""
+            SELECT ib.barcode, i.name, i.item_name, i.stock_uom
+            FROM `tabItem Barcode` ib
+            INNER JOIN `tabItem` i ON i.name = ib.parent
+            WHERE i.disabled = 0
+        """)
+    }
+
+
+def modelo_impostos(empresa):
+    """
+    Modelo padrão de impostos de compra da empresa e suas linhas reconhecidas
+
+    Returns:
+        tuple: (nome do modelo ou None, linhas com o campo "total_nfe")
+    """
+    modelo = frappe.db.get_value(
+        "Purchase Taxes and Charges Template",
+        {"company": empresa, "is_default": 1, "disabled": 0},
+        "name"
+    )
+    if not modelo:
+        return None, []
+
+    linhas = []
+    for linha in frappe.get_all(
+        "Purchase Taxes and Charges",
+        filters={"parent": modelo, "parenttype": "Purchase Taxes and Charges Template"},
+        fields=["category", "add_deduct_tax", "account_head", "description", "cost_center"],
+        order_by="idx asc"
+    ):
+        texto = f"{linha.description or ''} {linha.account_head or ''}".upper()
+        linha.total_nfe = next(
+            (total for termos, total in TOTAIS_POR_IMPOSTO if any(termo in texto for termo in termos)),
+            None
+        )
+        if linha.total_nfe:
+            linhas.append(linha)
+
+    return modelo, linhas
+
+
+class IndiceCompras:
+    """Dados da empresa, fornecedores, itens e impostos, carregados uma única vez"""
+
+    def __init__(self, empresa):
+        self.empresa = empresa
+        self.cnpj, self.moeda = dados_empresa(empresa)
+        self.fornecedores = fornecedores()
+        self.itens_fornecedor = itens_por_fornecedor()
+        self.itens_gtin = itens_por_gtin()
+        self.unidades = unidades()
+        self.modelo_impostos, self.linhas_impostos = modelo_impostos(empresa)
+
+    def item(self, fornecedor, item_nota):
+        """(item_code, item_name, stock_uom) do item da nota, ou None"""
+        return (
+            self.itens_fornecedor.get((fornecedor, item_nota.codigo))
+            or (item_nota.gtin and self.itens_gtin.get(item_nota.gtin))
+            or None
+        )
+
+    def montar_fatura(self, nota):
+        """
+        Converte a nota em uma fatura de compra (ainda sem nome)
+
+        Os totais seguem o cálculo do ERPNext (linhas de impostos com valor
+        "Actual" do ICMSTot); ao salvar o rascunho, o ERPNext completa contas
+        e recalcula a fatura.
+
+        Returns:
+            dict: "fatura" (campos de CAMPOS_FATURA), "itens" e "impostos"
+
+        Raises:
+            NotaNaoImportavel: Nota sem protocolo, de outro destinatário ou
+                de fornecedor não cadastrado
+        """
+        if nota.cstat not in CSTAT_AUTORIZADA:
+            raise NotaNaoImportavel(f"Nota {nota.chave} sem protocolo de autorização")
+
+        if self.cnpj and limpar_documento(nota.cnpj_destinatario) != self.cnpj:
+            raise NotaNaoImportavel(f"Nota {nota.chave} não é destinada à empresa {self.empresa}")
+
+        fornecedor = self.fornecedores.get(limpar_documento(nota.cnpj_emitente))
+        if not fornecedor:
+            raise NotaNaoImportavel(
+                f"Nota {nota.chave}: fornecedor {nota.cnpj_emitente} ({nota.nome_emitente}) não cadastrado"
+            )
+        fornecedor, nome_fornecedor = fornecedor
+
+        itens = []
+        for idx, item_nota in enumerate(nota.itens, 1):
+            cadastro = self.item(fornecedor, item_nota)
+            if cadastro:
+                item_code, item_name, unidade = cadastro
+            else:
+                item_code, item_name = None, item_nota.descricao[:140]
+                unidade = item_nota.unidade if item_nota.unidade in self.unidades else UOM_PADRAO
+
+            quantidade = item_nota.quantidade or 1
+            valor = flt(item_nota.valor_total - item_nota.valor_desconto, 2)
+            preco = flt(valor / quantidade, 9)
+
+            itens.append({
+                "idx": idx, "item_code": item_code, "item_name": item_name,
+                "description": item_nota.descricao, "qty": quantidade, "stock_qty": quantidade,
+                "received_qty": quantidade, "uom": unidade, "stock_uom": unidade,
+                "conversion_factor": 1, "rate": preco, "amount": valor, "base_rate": preco,
+                "base_amount": valor, "net_rate": preco, "net_amount": valor,
+                "base_net_rate": preco, "base_net_amount": valor,
+            })
+
+        total = flt(sum(item["amount"] for item in itens), 2)
+        acumulado, adicionados, deduzidos = total, 0.0, 0.0
+
+        impostos = []
+        for linha in self.linhas_impostos:
+            valor = flt(nota.totais.get(linha.total_nfe), 2)
+            if not valor:
+                continue
+
+            if linha.category != "Valuation":
+                if linha.add_deduct_tax == "Deduct":
+                    deduzidos += valor
+                    acumulado -= valor
+                else:
+                    adicionados += valor
+                    acumulado += valor
+
+            impostos.append({
+                "idx": len(impostos) + 1, "category": linha.category,
+                "add_deduct_tax": linha.add_deduct_tax, "charge_type": "Actual",
+                "account_head": linha.account_head, "description": linha.description,
+                "cost_center": linha.cost_center, "rate": 0, "tax_amount": valor,
+                "base_tax_amount": valor, "tax_amount_after_discount_amount": valor,
+                "base_tax_amount_after_discount_amount": valor,
+                "total": flt(acumulado, 2), "base_total": flt(acumulado, 2),
+            })
+
+        adicionados, deduzidos = flt(adicionados, 2), flt(deduzidos, 2)
+        impostos_total = flt(adicionados - deduzidos, 2)
+        grand_total = flt(total + impostos_total, 2)
+        data_emissao = nota.data_emissao or getdate(nowdate())
+
+        fatura = {
+            "title": nome_fornecedor, "company": self.empresa, "supplier": fornecedor,
+            "supplier_name": nome_fornecedor, "posting_date": nowdate(), "posting_time": nowtime(),
+            "set_posting_time": 1, "bill_no": nota.numero, "bill_date": data_emissao,
+            "due_date": max(nota.vencimento or data_emissao, getdate(nowdate())),
+            "currency": self.moeda, "conversion_rate": 1, "price_list_currency": self.moeda,
+            "plc_conversion_rate": 1, "taxes_and_charges": self.modelo_impostos if impostos else None,
+            "total_qty": sum(item["qty"] for item in itens), "total": total, "base_total": total,
+            "net_total": total, "base_net_total": total,
+            "taxes_and_charges_added": adicionados, "base_taxes_and_charges_added": adicionados,
+            "taxes_and_charges_deducted": deduzidos, "base_taxes_and_charges_deducted": deduzidos,
+            "total_taxes_and_charges": impostos_total, "base_total_taxes_and_charges": impostos_total,
+            "grand_total": grand_total, "base_grand_total": grand_total,
+            "rounded_total": grand_total, "base_rounded_total": grand_total,
+            "outstanding_amount": grand_total, "status": "Draft", "chave_acesso_nfe": nota.chave,
+        }
+
+        return {"fatura": fatura, "itens": itens, "impostos": impostos}
+
+
+def _serie_fatura():
+    """Primeira série de nomes da Purchase Invoice (ex: ACC-PINV-.YYYY.-)"""
+    campo = frappe.get_meta("Purchase Invoice").get_field("naming_series")
+    opcoes = [opcao.strip() for opcao in (campo.options or "").split("\n") if opcao.strip()]
+    return opcoes[0] if opcoes else "ACC-PINV-.YYYY.-"
+
+
+def reservar_nomes(serie, quantidade):
+    """
+    Reserva de uma vez os próximos números de uma série de nomes
+
+    Equivale a chamar make_autoname quantidade vezes, com uma única
+    atualização da tabSeries (bloqueada até o fim da transação).
+
+    Returns:
+        list: Nomes reservados, em ordem
+    """
+    from frappe.model.naming import parse_naming_series
+
+    partes = serie.split(".")
+    digitos = 5
+    if partes and partes[-1].startswith("#"):
+        digitos = len(partes.pop())
+    prefixo = parse_naming_series(".".join(partes))
+
+    frappe.db.sql("INSERT IGNORE INTO `tabSeries` (name, current) VALUES (%s, 0)", (prefixo,))
+    atual = frappe.db.sql("SELECT current FROM `tabSeries` WHERE name = %s FOR UPDATE", (prefixo,))[0][0]
+    frappe.db.sql("UPDATE `tabSeries` SET current = %s WHERE name = %s", (atual + quantidade, prefixo))
+
+    return [f"{prefixo}{numero:0{digitos}d}" for numero in range(atual + 1, atual + quantidade + 1)]
+
+
+def gravar_faturas(faturas, serie=None):
+    """
+    Grava um lote de faturas em rascunho (cabeçalho, itens e impostos)
+
+    Chaves já importadas (ou repetidas no lote) são descartadas antes da
+    gravação; o índice único de chave_acesso_nfe protege de importações
+    simultâneas. Roda na transação corrente.
+
+    Args:
+        faturas: Retornos de IndiceCompras.montar_fatura
+        serie: Série de nomes (padrão: a primeira da Purchase Invoice)
+
+    Returns:
+        tuple: (nomes das faturas gravadas, quantidade de duplicadas)
+    """
+    por_chave = {}
+    for fatura in faturas:
+        por_chave.setdefault(fatura["fatura"]["chave_acesso_nfe"], fatura)
+
+    existentes = set(frappe.get_all(
+        "Purchase Invoice",
+        filters={"chave_acesso_nfe": ["in", list(por_chave)]},
+        pluck="chave_acesso_nfe"
+    )) if por_chave else set()
+
+    novas = [fatura for chave, fatura in por_chave.items() if chave not in existentes]
+    duplicadas = len(faturas) - len(novas)
+    if not novas:
+        return [], duplicadas
+
+    serie = serie or _serie_fatura()
+    nomes = reservar_nomes(serie, len(novas))
+    agora = now_datetime()
+    usuario = frappe.session.user
+    padrao = {"owner": usuario, "creation": agora, "modified": agora, "modified_by": usuario, "docstatus": 0}
+
+    linhas_fatura, linhas_item, linhas_imposto = [], [], []
+    for nome, fatura in zip(nomes, novas):
+        linhas_fatura.append(_linha(
+            CAMPOS_FATURA, padrao, fatura["fatura"], name=nome, naming_series=serie
+        ))
+        for item in fatura["itens"]:
+            linhas_item.append(_linha(
+                CAMPOS_ITEM, padrao, item, name=frappe.generate_hash(length=10),
+                parent=nome, parenttype="Purchase Invoice", parentfield="items"
+            ))
+        for imposto in fatura["impostos"]:
+            linhas_imposto.append(_linha(
+                CAMPOS_IMPOSTO, padrao, imposto, name=frappe.generate_hash(length=10),
+                parent=nome, parenttype="Purchase Invoice", parentfield="taxes"
+            ))
+
+    frappe.db.bulk_insert("Purchase Invoice", CAMPOS_FATURA, linhas_fatura)
+    frappe.db.bulk_insert("Purchase Invoice Item", CAMPOS_ITEM, linhas_item)
+    if linhas_imposto:
+        frappe.db.bulk_insert("Purchase Taxes and Charges", CAMPOS_IMPOSTO, linhas_imposto)
+
+    return nomes, duplicadas
+
+
+def _linha(campos, padrao, valores, **extras):
+    return tuple(
+        extras[campo] if campo in extras else valores.get(campo, padrao.get(campo))
+        for campo in campos
+    )
+
+
+def importar(empresa, origens, tamanho_lote=TAMANHO_LOTE):
+    """
+    Importa NF-e de entrada como faturas de compra em rascunho
+
+    Cada lote de faturas é gravado e confirmado de uma vez; uma falha de
+    gravação desfaz apenas o lote em que ocorreu.
+
+    Args:
+        empresa: Empresa destinatária
+        origens: Pares (nome, arquivo) - ver arquivos e documentos_recebidos
+        tamanho_lote: Faturas por gravação
+
+    Returns:
+        dict: importadas, duplicadas, ignorados (XMLs que não são NF-e),
+            faturas (nomes) e falhas (lista de "origem: motivo")
+    """
+    indice = IndiceCompras(empresa)
+    resultado = {"importadas": 0, "duplicadas": 0, "ignorados": 0, "faturas": [], "falhas": []}
+    lote = []
+
+    def gravar():
+        try:
+            nomes, duplicadas = gravar_faturas(lote)
+            frappe.db.commit()
+        except Exception as e:
+            frappe.db.rollback()
+            resultado["falhas"].extend(
+                f"{fatura['fatura']['chave_acesso_nfe']}: {str(e)}" for fatura in lote
+            )
+        else:
+            resultado["importadas"] += len(nomes)
+            resultado["duplicadas"] += duplicadas
+            resultado["faturas"].extend(nomes)
+        lote.clear()
+
+    for nome, arquivo in origens:
+        try:
+            nota = ler_nfe(arquivo)
+            if nota is None:
+                resultado["ignorados"] += 1
+                continue
+            lote.append(indice.montar_fatura(nota))
+        except (NotaNaoImportavel, etree.XMLSyntaxError) as e:
+            resultado["falhas"].append(f"{nome}: {str(e)}")
+            continue
+
+        if len(lote) >= tamanho_lote:
+            gravar()
+
+    if lote:
+        gravar()
+
+    if resultado["falhas"]:
+        frappe.log_error(
+            "\n".join(resultado["falhas"][:1000]),
+            f"Importação de NF-e de Entrada ({len(resultado['falhas'])} falhas)"
+        )
+
+    return resultado
+
+
+def importar_arquivos(empresa, caminhos):
+    """
+    Importa procNFe de arquivos XML ou ZIP (milhares de XMLs por ZIP)
+
+    Args:
+        empresa: Empresa destinatária
+        caminhos: Caminhos dos arquivos
+
+    Returns:
+        dict: Ver importar
+    """
+    return importar(empresa, arquivos(caminhos))
+
+
+def importar_documentos_recebidos(empresa, chaves=None):
+    """
+    Importa os procNFe baixados pela Distribuição DF-e (Documento Recebido)
+
+    Args:
+        empresa: Empresa destinatária
+        chaves: Chaves de acesso (padrão: todas as NF-e completas sem fatura)
+
+    Returns:
+        dict: Ver importar
+    """
+    if chaves is None:
+        chaves = recebidos_sem_fatura(empresa)
+
+    return importar(empresa, documentos_recebidos(chaves))
@@ -0,0 +1,534 @@
+"""
+Índice Fiscal - Busca estruturada nos XMLs arquivados
+Extrai de cada procNFe e evento do arquivo fiscal um conjunto fixo de campos
+(participantes, NCM, CFOP, valores, datas e tipos de evento) para as tabelas
+Indice Fiscal, Indice Fiscal Item e Indice Fiscal Evento. O indexador lê em
+lotes apenas as entradas do Arquivo Fiscal ainda não indexadas; as consultas
+respondem pelos índices dessas tabelas, sem abrir nenhum XML.
+"""
+
+from datetime import datetime
+from io import BytesIO
+
+import frappe
+from frappe import _
+from frappe.utils import cint, getdate, now_datetime
+from lxml import etree
+
+from erpnext_fiscal_br.utils.cnpj_cpf import limpar_documento
+
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+
+# Tipos de XML do arquivo fiscal que alimentam o índice
+TIPOS_INDEXADOS = ("proc", "evento")
+
+# Entradas lidas e gravadas por transação
+TAMANHO_LOTE = 500
+
+# Entradas indexadas por execução do job
+MAX_POR_EXECUCAO = 20000
+
+# Linhas de item por INSERT (notas de até 990 itens)
+LINHAS_POR_INSERT = 1000
+
+EVENTO_CANCELAMENTO = "110111"
+
+# Linhas devolvidas por consulta: padrão e máximo
+LIMITE_CONSULTA = 500
+MAX_LIMITE_CONSULTA = 10000
+
+CAMPOS_NOTA = (
+    "origem", "empresa", "modelo", "serie", "numero", "tipo_operacao",
+    "data_emissao", "data_autorizacao", "protocolo",
+    "cnpj_emitente", "nome_emitente", "uf_emitente",
+    "cnpj_destinatario", "nome_destinatario", "uf_destinatario",
+    "valor_produtos", "valor_desconto", "valor_frete", "valor_total",
+    "valor_icms", "valor_icms_st", "valor_ipi", "valor_pis", "valor_cofins",
+)
+
+CAMPOS_ITEM = ("codigo", "descricao", "ncm", "cfop", "cst_icms", "quantidade", "valor_total", "valor_icms")
+
+CAMPOS_EVENTO = ("tipo_evento", "descricao_evento", "sequencia", "data_evento", "protocolo")
+
+TIPO_OPERACAO = {"0": "0 - Entrada", "1": "1 - Saída"}
+
+
+def _tag(nome):
+    return "{%s}%s" % (NS_NFE, nome)
+
+
+_CAMINHOS = {}
+
+
+def _texto(elem, caminho, padrao=""):
+    caminho_ns = _CAMINHOS.get(caminho)
+    if caminho_ns is None:
+        caminho_ns = _CAMINHOS[caminho] = "/".join(_tag(p) for p in caminho.split("/"))
+    encontrado = elem.find(caminho_ns)
+    if encontrado is None or encontrado.text is None:
+        return padrao
+    return encontrado.text.strip()
+
+
+def _valor(elem, caminho):
+    try:
+        return float(_texto(elem, caminho, "0") or 0)
+    except ValueError:
+        return 0.0
+
+
+def _data_hora(valor):
+    """Data/hora da SEFAZ (ISO 8601 com fuso) como datetime local sem fuso"""
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def _iterar(xml, leitores, dados):
+    """Aplica os leitores aos grupos do XML, descartando cada grupo lido"""
+    if isinstance(xml, str):
+        xml = xml.encode("utf-8")
+
+    tags = {_tag(nome): leitor for nome, leitor in leitores.items()}
+    for _evento, elem in etree.iterparse(BytesIO(xml), events=("end",), tag=list(tags)):
+        tags[elem.tag](dados, elem)
+
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    return dados
+
+
+def ler_proc(xml):
+    """
+    Extrai os campos indexados de um procNFe
+
+    Returns:
+        dict: CAMPOS_NOTA (sem origem/empresa), "chave" e "itens", ou None
+            se o XML não tiver chave de acesso
+    """
+    nota = _iterar(xml, LEITORES_PROC, {"chave": "", "itens": []})
+    return nota if nota["chave"] else None
+
+
+def _ler_ide(nota, elem):
+    emissao = _data_hora(_texto(elem, "dhEmi")) or _data_hora(_texto(elem, "dEmi"))
+    nota.update({
+        "modelo": _texto(elem, "mod"),
+        "serie": cint(_texto(elem, "serie")),
+        "numero": cint(_texto(elem, "nNF")),
+        "tipo_operacao": TIPO_OPERACAO.get(_texto(elem, "tpNF")),
+        "data_emissao": emissao.date() if emissao else None,
+    })
+
+    inf_nfe = elem.getparent()
+    if inf_nfe is not None and not nota["chave"]:
+        nota["chave"] = (inf_nfe.get("Id") or "")[3:]
+
+
+def _ler_emit(nota, elem):
+    nota.update({
+        "cnpj_emitente": _texto(elem, "CNPJ") or _texto(elem, "CPF"),
+        "nome_emitente": _texto(elem, "xNome")[:140],
+        "uf_emitente": _texto(elem, "enderEmit/UF"),
+    })
+
+
+def _ler_dest(nota, elem):
+    nota.update({
+        "cnpj_destinatario": _texto(elem, "CNPJ") or _texto(elem, "CPF") or _texto(elem, "idEstrangeiro"),
+        "nome_destinatario": _texto(elem, "xNome")[:140],
+        "uf_destinatario": _texto(elem, "enderDest/UF"),
+    })
+
+
+def _ler_det(nota, elem):
+    # Grupo do ICMS varia com a tributação (ICMS00, ICMS20, ICMSSN102...)
+    icms = elem.find(f"{_tag('imposto')}/{_tag('ICMS')}")
+    grupo = icms[0] if icms is not None and len(icms) else None
+
+    nota["itens"].append({
+        "idx": cint(elem.get("nItem")) or len(nota["itens"]) + 1,
+        "codigo": _texto(elem, "prod/cProd")[:140],
+        "descricao": _texto(elem, "prod/xProd")[:140],
+        "ncm": _texto(elem, "prod/NCM"),
+        "cfop": _texto(elem, "prod/CFOP"),
+        "cst_icms": (_texto(grupo, "CST") or _texto(grupo, "CSOSN")) if grupo is not None else "",
+        "quantidade": _valor(elem, "prod/qCom"),
+        "valor_total": _valor(elem, "prod/vProd"),
+        "valor_icms": _valor(grupo, "vICMS") if grupo is not None else 0.0,
+    })
+
+
+def _ler_ICMSTot(nota, elem):
+    nota.update({
+        "valor_produtos": _valor(elem, "vProd"),
+        "valor_desconto": _valor(elem, "vDesc"),
+        "valor_frete": _valor(elem, "vFrete"),
+        "valor_total": _valor(elem, "vNF"),
+        "valor_icms": _valor(elem, "vICMS"),
+        "valor_icms_st": _valor(elem, "vST"),
+        "valor_ipi": _valor(elem, "vIPI"),
+        "valor_pis": _valor(elem, "vPIS"),
+        "valor_cofins": _valor(elem, "vCOFINS"),
+    })
+
+
+def _ler_infProt(nota, elem):
+    nota["chave"] = _texto(elem, "chNFe") or nota["chave"]
+    nota["protocolo"] = _texto(elem, "nProt")
+    nota["data_autorizacao"] = _data_hora(_texto(elem, "dhRecbto"))
+
+
+LEITORES_PROC = {
+    "ide": _ler_ide,
+    "emit": _ler_emit,
+    "dest": _ler_dest,
+    "det": _ler_det,
+    "ICMSTot": _ler_ICMSTot,
+    "infProt": _ler_infProt,
+}
+
+
+def ler_evento(xml):
+    """
+    Extrai os campos indexados de um evento (retEvento ou procEventoNFe)
+
+    No procEventoNFe o infEvento do pedido traz a descrição e a data do
+    evento; o do retorno, o protocolo e a data de registro.
+
+    Returns:
+        dict: "chave" e CAMPOS_EVENTO, ou None se não houver tpEvento
+    """
+    evento = _iterar(xml, {"infEvento": _ler_infEvento}, {})
+    return evento if evento.get("tipo_evento") and evento.get("chave") else None
+
+
+def _ler_infEvento(evento, elem):
+    valores = {
+        "chave": _texto(elem, "chNFe"),
+        "tipo_evento": _texto(elem, "tpEvento"),
+        "sequencia": cint(_texto(elem, "nSeqEvento")) or None,
+        "descricao_evento": _texto(elem, "detEvento/descEvento") or _texto(elem, "xEvento"),
+        "data_evento": _data_hora(_texto(elem, "dhEvento") or _texto(elem, "dhRegEvento")),
+        "protocolo": _texto(elem, "nProt"),
+    }
+    for campo, valor in valores.items():
+        if valor and not evento.get(campo):
+            evento[campo] = valor
+
+
+def empresas_por_cnpj():
+    """Empresas com configuração fiscal por CNPJ (apenas números)"""
+    return {
+        limpar_documento(cnpj): empresa
+        for empresa, cnpj in frappe.get_all(
+            "Configuracao Fiscal",
+            filters={"cnpj": ["is", "set"]},
+            fields=["empresa", "cnpj"],
+            as_list=True
+        )
+    }
+
+
+def agendar():
+    """Enfileira o indexador após o commit (uma execução por vez)"""
+    frappe.enqueue(
+        "erpnext_fiscal_br.services.indice_fiscal.indexar_pendentes",
+        queue="long",
+        job_id="indice_fiscal",
+        deduplicate=True,
+        enqueue_after_commit=True
+    )
+
+
+def pendentes(limite=TAMANHO_LOTE):
+    """Entradas do Arquivo Fiscal ainda não indexadas, na ordem dos segmentos"""
+    return frappe.get_all(
+        "Arquivo Fiscal",
+        filters={"indexado": 0, "tipo": ["in", TIPOS_INDEXADOS]},
+        fields=["name", "chave", "tipo", "sufixo", "segmento", "posicao", "tamanho", "compressao", "sha256"],
+        order_by="segmento asc, posicao asc",
+        limit_page_length=limite
+    )
+
+
+def indexar_pendentes(limite=MAX_POR_EXECUCAO, tamanho_lote=TAMANHO_LOTE):
+    """
+    Indexa os XMLs arquivados ainda não indexados, um lote por transação
+
+    Args:
+        limite: Máximo de entradas nesta execução (o restante fica para a próxima)
+        tamanho_lote: Entradas por transação
+
+    Returns:
+        int: Quantidade de entradas processadas
+    """
+    empresas = empresas_por_cnpj()
+    processadas = 0
+
+    while processadas < limite:
+        entradas = pendentes(min(tamanho_lote, limite - processadas))
+        if not entradas:
+            break
+
+        indexar(entradas, empresas)
+        frappe.db.commit()
+        processadas += len(entradas)
+
+    return processadas
+
+
+def indexar(entradas, empresas=None):
+    """
+    Extrai e grava no índice um lote de entradas do Arquivo Fiscal
+
+    Notas são regravadas por inteiro (cabeçalho e itens) e eventos por
+    (chave, tipo, sequência). As entradas saem da fila mesmo quando o XML
+    não pode ser lido (falha registrada no log), exceto as regravadas no
+    arquivo durante a indexação. Roda na transação corrente.
+
+    Args:
+        entradas: Retorno de pendentes
+        empresas: Ver empresas_por_cnpj (padrão: consultado)
+    """
+    from erpnext_fiscal_br.services import archive
+
+    empresas = empresas if empresas is not None else empresas_por_cnpj()
+    notas, eventos, falhas = {}, {}, []
+
+    for entrada in entradas:
+        try:
+            _entrada, conteudo = next(archive.ler_entradas([entrada]))
+            if entrada.tipo == "proc":
+                nota = ler_proc(conteudo)
+                if nota:
+                    notas[nota["chave"]] = nota
+            else:
+                evento = ler_evento(conteudo)
+                if evento:
+                    evento["sequencia"] = evento.get("sequencia") or 1
+                    eventos[(evento["chave"], evento["tipo_evento"], evento["sequencia"])] = evento
+        except Exception as e:
+            falhas.append(f"{entrada.name}: {str(e)}")
+
+    agora = now_datetime()
+    usuario = frappe.session.user
+    padrao = (agora, agora, usuario, usuario)
+
+    if notas:
+        linhas = []
+        for chave, nota in notas.items():
+            nota["origem"], nota["empresa"] = _origem(nota, empresas)
+            linhas.append((chave,) + padrao + tuple(nota.get(campo) for campo in CAMPOS_NOTA))
+        _inserir("Indice Fiscal", CAMPOS_NOTA, linhas, atualizar=True)
+
+        frappe.db.sql(
+            "DELETE FROM `tabIndice Fiscal Item` WHERE parent IN %(chaves)s",
+            {"chaves": tuple(notas)}
+        )
+        linhas = [
+            (f"{chave}-{item['idx']}",) + padrao + (chave, "Indice Fiscal", "itens", item["idx"])
+            + tuple(item[campo] for campo in CAMPOS_ITEM)
+            for chave, nota in notas.items()
+            for item in nota["itens"]
+        ]
+        for inicio in range(0, len(linhas), LINHAS_POR_INSERT):
+            _inserir("Indice Fiscal Item", CAMPOS_ITEM, linhas[inicio:inicio + LINHAS_POR_INSERT], filho=True)
+
+    if eventos:
+        linhas = [
+            (f"{chave}-{tipo}-{sequencia:02d}",) + padrao + (chave, "Indice Fiscal", "eventos", sequencia)
+            + tuple(evento.get(campo) for campo in CAMPOS_EVENTO)
+            for (chave, tipo, sequencia), evento in eventos.items()
+        ]
+        _inserir("Indice Fiscal Evento", CAMPOS_EVENTO, linhas, atualizar=True, filho=True)
+
+    # Só sai da fila o conteúdo que foi lido (o sha256 muda se o XML for regravado)
+    frappe.db.sql(
+        "UPDATE `tabArquivo Fiscal` SET indexado = 1 WHERE (name, sha256) IN ({0})".format(
+            ", ".join(["(%s, %s)"] * len(entradas))
+        ),
+        [valor for entrada in entradas for valor in (entrada.name, entrada.sha256)]
+    )
+
+    if falhas:
+        frappe.log_error("\n".join(falhas), "Índice Fiscal")
+
+
+def _origem(nota, empresas):
+    """(origem, empresa) da nota: emitida ou recebida por uma das empresas"""
+    empresa = empresas.get(limpar_documento(nota.get("cnpj_emitente") or ""))
+    if empresa:
+        return "Emitida", empresa
+
+    empresa = empresas.get(limpar_documento(nota.get("cnpj_destinatario") or ""))
+    if empresa:
+        return "Recebida", empresa
+
+    return None, None
+
+
+def _inserir(doctype, campos, linhas, atualizar=False, filho=False):
+    """INSERT de várias linhas (name, creation, modified, owner, modified_by[, parent...], campos)"""
+    colunas = ("name", "creation", "modified", "owner", "modified_by")
+    if filho:
+        colunas += ("parent", "parenttype", "parentfield", "idx")
+    colunas += tuple(campos)
+
+    marcadores = "(%s)" % ", ".join(["%s"] * len(colunas))
+    sql = f"""
+        INSERT INTO `tab{doctype}` ({", ".join(colunas)})
+        VALUES {", ".join([marcadores] * len(linhas))}
+    """
+    if atualizar:
+        sql += " ON DUPLICATE KEY UPDATE modified = VALUES(modified), " + ", ".join(
+            f"{campo} = VALUES({campo})" for campo in campos
+        )
+
+    frappe.db.sql(sql, [valor for linha in linhas for valor in linha])
+
+
+def reindexar(empresa=None):
+    """
+    Devolve à fila do indexador os XMLs arquivados (todos ou de uma empresa)
+
+    Args:
+        empresa: Limita às chaves já indexadas da empresa (padrão: todas)
+
+    Returns:
+        int: Entradas marcadas para nova indexação
+    """
+    if empresa:
+        frappe.db.sql("""
+            UPDATE `tabArquivo Fiscal` af
+            INNER JOIN `tabIndice Fiscal` f ON f.name = af.chave
+            SET af.indexado = 0
+            WHERE f.empresa = %s AND af.tipo IN %s
+        """, (empresa, TIPOS_INDEXADOS))
+    else:
+        frappe.db.sql(
+            "UPDATE `tabArquivo Fiscal` SET indexado = 0 WHERE tipo IN %s",
+            (TIPOS_INDEXADOS,)
+        )
+
+    return frappe.db.count("Arquivo Fiscal", {"indexado": 0, "tipo": ["in", TIPOS_INDEXADOS]})
+
+
+def consultar(cnpj=None, papel=None, ncm=None, cfop=None, de=None, ate=None, empresa=None,
+        origem=None, tipo_evento=None, itens=False, limite=LIMITE_CONSULTA, empresas=None):
+    """
+    Busca notas (ou itens de notas) no índice
+
+    Ex: consultar(cnpj="12345678000199", papel="destinatario", ncm="84713012",
+    de="2024-04-01", ate="2024-06-30") - notas para o CNPJ com o NCM no 2º trimestre.
+
+    Args:
+        cnpj: CNPJ/CPF do participante (com ou sem formatação)
+        papel: "emitente" ou "destinatario" (padrão: qualquer um dos dois)
+        ncm: NCM do item; com menos de 8 dígitos, busca pelo prefixo (ex: "8471")
+        cfop: CFOP do item
+        de: Data de emissão inicial (inclusiva)
+        ate: Data de emissão final (inclusiva)
+        empresa: Empresa emitente ou destinatária
+        origem: "Emitida" ou "Recebida"
+        tipo_evento: Apenas notas com um evento do tipo (ex: "110111")
+        itens: Devolve os itens que atendem ao NCM/CFOP em vez das notas
+        limite: Máximo de linhas (até MAX_LIMITE_CONSULTA)
+        empresas: Restringe às notas dessas empresas (None: sem restrição)
+
+    Returns:
+        list: Notas (chave, participantes, datas, valores e "cancelada") ou
+            itens (chave, número, data, participantes e campos do item),
+            pela data de emissão
+    """
+    condicoes, condicoes_item, valores = [], [], {}
+
+    if cnpj:
+        valores["cnpj"] = limpar_documento(cnpj)
+        if papel == "emitente":
+            condicoes.append("f.cnpj_emitente = %(cnpj)s")
+        elif papel == "destinatario":
+            condicoes.append("f.cnpj_destinatario = %(cnpj)s")
+        elif papel:
+            frappe.throw(_("Papel inválido: {0}").format(papel))
+        else:
+            condicoes.append("(f.cnpj_emitente = %(cnpj)s OR f.cnpj_destinatario = %(cnpj)s)")
+
+    if de:
+        valores["de"] = getdate(de)
+        condicoes.append("f.data_emissao >= %(de)s")
+    if ate:
+        valores["ate"] = getdate(ate)
+        condicoes.append("f.data_emissao <= %(ate)s")
+    if empresa:
+        valores["empresa"] = empresa
+        condicoes.append("f.empresa = %(empresa)s")
+    if empresas is not None:
+        if not empresas:
+            return []
+        valores["empresas"] = tuple(empresas)
+        condicoes.append("f.empresa IN %(empresas)s")
+    if origem:
+        valores["origem"] = origem
+        condicoes.append("f.origem = %(origem)s")
+    if tipo_evento:
+        valores["tipo_evento"] = tipo_evento
+        condicoes.append("""f.name IN (
+            SELECT e.parent FROM `tabIndice Fiscal Evento` e WHERE e.tipo_evento = %(tipo_evento)s
+        )""")
+
+    if ncm:
+        ncm = limpar_documento(ncm)
+        if len(ncm) < 8:
+            valores["ncm"] = f"{ncm}%"
+            condicoes_item.append("i.ncm LIKE %(ncm)s")
+        else:
+            valores["ncm"] = ncm
+            condicoes_item.append("i.ncm = %(ncm)s")
+    if cfop:
+        valores["cfop"] = limpar_documento(cfop)
+        condicoes_item.append("i.cfop = %(cfop)s")
+
+    valores["limite"] = min(cint(limite) or LIMITE_CONSULTA, MAX_LIMITE_CONSULTA)
+
+    if itens:
+        where = " AND ".join(condicoes + condicoes_item) or "1 = 1"
+        return frappe.db.sql(f"""
+            SELECT f.name AS chave, f.modelo, f.serie, f.numero, f.data_emissao,
+                f.cnpj_emitente, f.nome_emitente, f.cnpj_destinatario, f.nome_destinatario,
+                i.idx AS item, i.codigo, i.descricao, i.ncm, i.cfop, i.cst_icms,
+                i.quantidade, i.valor_total, i.valor_icms
+            FROM `tabIndice Fiscal` f
+            INNER JOIN `tabIndice Fiscal Item` i ON i.parent = f.name
+            WHERE {where}
+            ORDER BY f.data_emissao, f.name, i.idx
+            LIMIT %(limite)s
+        """, valores, as_dict=True)
+
+    if condicoes_item:
+        # Semi-join: o otimizador parte do índice de NCM/CFOP ou do de participante/data
+        condicoes.append(f"""f.name IN (
+            SELECT i.parent FROM `tabIndice Fiscal Item` i WHERE {" AND ".join(condicoes_item)}
+        )""")
+
+    valores["cancelamento"] = EVENTO_CANCELAMENTO
+    where = " AND ".join(condicoes) or "1 = 1"
+    return frappe.db.sql(f"""
+        SELECT f.name AS chave, f.origem, f.empresa, f.modelo, f.serie, f.numero,
+            f.data_emissao, f.data_autorizacao, f.cnpj_emitente, f.nome_emitente,
+            f.cnpj_destinatario, f.nome_destinatario, f.valor_total, f.valor_icms,
+            f.valor_icms_st, f.valor_ipi, f.valor_pis, f.valor_cofins,
+            EXISTS (
+                SELECT 1 FROM `tabIndice Fiscal Evento` c
+                WHERE c.parent = f.name AND c.tipo_evento = %(cancelamento)s
+            ) AS cancelada
+        FROM `tabIndice Fiscal` f
+        WHERE {where}
+        ORDER BY f.data_emissao, f.name
+        LIMIT %(limite)s
+    """, valores, as_dict=True)
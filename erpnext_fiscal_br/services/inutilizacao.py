@@ -0,0 +1,134 @@
+"""
+Inutilização - Lacunas da numeração das notas
+Encontra os números pulados por (empresa, ambiente, modelo, série) em uma única
+consulta com funções de janela e inutiliza cada faixa contígua em um só
+pedido à SEFAZ, registrado como um documento Inutilizacao Numeracao.
+"""
+
+from datetime import timedelta
+
+import frappe
+from frappe.utils import now_datetime
+
+# Justificativa das faixas inutilizadas automaticamente (xJust: 15 a 255 caracteres)
+JUSTIFICATIVA_AUTOMATICA = "Numeração não utilizada por falha na emissão da nota fiscal"
+
+# A nota posterior à lacuna deve ter sido criada há pelo menos este tempo (minutos)
+IDADE_MINIMA = 60
+
+# Falha de comunicação (""), serviço paralisado (108, 109), consumo indevido (656)
+# ou erro não catalogado (999): a faixa fica com status Erro e volta a ser lacuna
+CSTAT_ERRO = ("", "108", "109", "656", "999")
+
+# Faixa ainda "Pendente" após este tempo (minutos) não chegou a ser transmitida
+# (processo interrompido entre a gravação e o envio) e deixa de ocupar a numeração
+VALIDADE_PENDENTE = 30
+
+
+def pendente_desde():
+    """Criação/alteração mínima de uma faixa "Pendente" para que ainda ocupe a numeração"""
+    return now_datetime() - timedelta(minutes=VALIDADE_PENDENTE)
+
+
+def lacunas(empresa=None, idade_minima=IDADE_MINIMA, ambiente=None):
+    """
+    Faixas de números não usados entre a menor e a maior nota de cada série
+
+    A numeração de produção e a de homologação são independentes. Notas (em
+    qualquer status) e faixas já inutilizadas, rejeitadas ou pendentes há
+    menos de VALIDADE_PENDENTE contam como usadas; faixas com erro de
+    comunicação ou pendentes antigas voltam a aparecer. Cada linha é
+    ordenada pelo início e comparada com o maior fim das anteriores
+    (MAX ... OVER), de modo que números adjacentes saem juntos em uma única
+    faixa, sem percorrer a numeração em Python.
+
+    Args:
+        empresa: Restringe a uma empresa (padrão: todas)
+        idade_minima: Minutos desde a criação da nota que fecha a lacuna
+        ambiente: Restringe a um ambiente (ex: "1 - Produção"; padrão: todos)
+
+    Returns:
+        list: Dicts com empresa, ambiente, modelo, serie, numero_inicial e numero_final
+    """
+    valores = {
+        "limite": now_datetime() - timedelta(minutes=idade_minima),
+        "pendente_desde": pendente_desde(),
+    }
+    filtro = ""
+    if empresa:
+        valores["empresa"] = empresa
+        filtro += " AND empresa = %(empresa)s"
+    if ambiente:
+        valores["ambiente"] = ambiente
+        filtro += " AND ambiente = %(ambiente)s"
+
+    return frappe.db.sql(f"""
+        WITH usados AS (
+            SELECT empresa, ambiente, modelo, serie, numero AS inicio, numero AS fim, creation
+            FROM `tabNota Fiscal`
+            WHERE numero > 0{filtro}
+            UNION ALL
+            SELECT empresa, ambiente, modelo, serie, numero_inicial, numero_final, creation
+            FROM `tabInutilizacao Numeracao`
+            WHERE status != 'Erro'
+                AND (status != 'Pendente' OR modified >= %(pendente_desde)s){filtro}
+        ),
+        ordenados AS (
+            SELECT empresa, ambiente, modelo, serie, inicio, creation,
+                MAX(fim) OVER (
+                    PARTITION BY empresa, ambiente, modelo, serie
+                    ORDER BY inicio, fim
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                ) AS fim_anterior
+            FROM usados
+        )
+        SELECT empresa, ambiente, modelo, serie,
+            fim_anterior + 1 AS numero_inicial, inicio - 1 AS numero_final
+        FROM ordenados
+        WHERE inicio > fim_anterior + 1 AND creation < %(limite)s
+        ORDER BY empresa, ambiente, modelo, serie, numero_inicial
+    """, valores, as_dict=True)
+
+
+def inutilizar_lacunas(empresa, idade_minima=IDADE_MINIMA):
+    """
+    Inutiliza as lacunas da numeração de uma empresa, uma faixa por pedido
+
+    Apenas as lacunas do ambiente configurado (o mesmo dos pedidos enviados).
+
+    Args:
+        empresa: Nome da empresa
+        idade_minima: Ver lacunas
+
+    Returns:
+        dict: Quantidade de faixas por status resultante
+    """
+    from erpnext_fiscal_br.services.transmitter import SEFAZTransmitter
+
+    transmitter = SEFAZTransmitter(empresa)
+
+    faixas = lacunas(empresa, idade_minima, transmitter.config.ambiente)
+    resultado = {}
+    if not faixas:
+        return resultado
+
+    for faixa in faixas:
+        inutilizacao = frappe.get_doc({
+            "doctype": "Inutilizacao Numeracao",
+            "empresa": empresa,
+            "ambiente": faixa.ambiente,
+            "modelo": faixa.modelo,
+            "serie": faixa.serie,
+            "numero_inicial": faixa.numero_inicial,
+            "numero_final": faixa.numero_final,
+            "origem": "Automática",
+            "justificativa": JUSTIFICATIVA_AUTOMATICA,
+        })
+        inutilizacao.insert(ignore_permissions=True)
+        inutilizacao.transmitir(transmitter)
+        # Cada faixa respondida pela SEFAZ fica gravada mesmo se a seguinte falhar
+        frappe.db.commit()
+
+        resultado[inutilizacao.status] = resultado.get(inutilizacao.status, 0) + 1
+
+    return resultado
@@ -0,0 +1,183 @@
+"""
+Manifestação do Destinatário - Eventos 210200/210210/210220/210240
+Registra no Ambiente Nacional a manifestação das notas recebidas (Documento
+Recebido), em lotes de até 20 eventos. A Ciência da Operação dos resumos
+novos libera o XML completo, baixado depois pela própria Distribuição DF-e.
+"""
+
+import frappe
+from frappe import _
+from frappe.utils import now_datetime
+
+from erpnext_fiscal_br.services import eventos
+
+# Tipo de manifestação -> (tpEvento, descEvento)
+TIPOS_MANIFESTACAO = {
+    "Confirmação da Operação": ("210200", "Confirmacao da Operacao"),
+    "Ciência da Operação": ("210210", "Ciencia da Operacao"),
+    "Desconhecimento da Operação": ("210220", "Desconhecimento da Operacao"),
+    "Operação não Realizada": ("210240", "Operacao nao Realizada"),
+}
+
+# RecepcaoEvento do Ambiente Nacional por ambiente
+URL_RECEPCAO_EVENTO_AN = {
+    "1": "https://www.nfe.fazenda.gov.br/NFeRecepcaoEvento4/NFeRecepcaoEvento4.asmx",
+    "2": "https://hom1.nfe.fazenda.gov.br/NFeRecepcaoEvento4/NFeRecepcaoEvento4.asmx",
+}
+
+# Órgão de recepção (cOrgao) do Ambiente Nacional
+ORGAO_AN = "91"
+
+# Evento registrado (135), registrado sem vínculo com a NF-e (136) ou já
+# registrado anteriormente (573 - duplicidade)
+CSTAT_REGISTRADO = ("135", "136", "573")
+
+# Resumos manifestados por execução automática (lotes de 20)
+MAX_POR_EXECUCAO = 1000
+
+
+def manifestar(empresa, chaves, tipo, justificativa=None):
+    """
+    Envia a manifestação das notas recebidas, em lotes de até 20 eventos
+
+    Cada Documento Recebido é atualizado (situação da manifestação e evento
+    na tabela de eventos) e confirmado assim que o seu retorno chega.
+
+    Args:
+        empresa: Empresa destinatária
+        chaves: Chaves de acesso (nomes dos Documentos Recebidos)
+        tipo: Uma das chaves de TIPOS_MANIFESTACAO
+        justificativa: Obrigatória para "Operação não Realizada" (15 a 255 caracteres)
+
+    Returns:
+        dict: Quantidade de documentos por status resultante
+    """
+    from erpnext_fiscal_br.services.transmitter import SEFAZTransmitter
+
+    if tipo not in TIPOS_MANIFESTACAO:
+        frappe.throw(_("Tipo de manifestação inválido: {0}").format(tipo))
+
+    codigo, descricao = TIPOS_MANIFESTACAO[tipo]
+    detalhe = f"<descEvento>{descricao}</descEvento>"
+    if codigo == "210240":
+        justificativa = (justificativa or "").strip()
+        if not 15 <= len(justificativa) <= 255:
+            frappe.throw(_("Justificativa deve ter entre 15 e 255 caracteres"))
+        detalhe += f"<xJust>{justificativa}</xJust>"
+
+    chaves = list(dict.fromkeys(chaves))
+    if not chaves:
+        return {}
+
+    transmitter = SEFAZTransmitter(empresa)
+    montados = []
+    for chave in chaves:
+        id_evento, xml = transmitter.montar_evento(chave, codigo, 1, detalhe, orgao=ORGAO_AN)
+        montados.append({"chave": chave, "id_evento": id_evento, "xml": xml})
+
+    ambiente = transmitter.config.get_ambiente_codigo()
+    retornos = eventos.enviar(
+        transmitter,
+        montados,
+        url=URL_RECEPCAO_EVENTO_AN.get(ambiente, URL_RECEPCAO_EVENTO_AN["2"]),
+        autorizador="AN"
+    )
+
+    resultado = {}
+    for chave, retorno in zip(chaves, retornos):
+        status = _registrar(chave, tipo, codigo, descricao, retorno)
+        resultado[status] = resultado.get(status, 0) + 1
+
+    return resultado
+
+
+def _registrar(chave, tipo, codigo, descricao, retorno):
+    """Grava o retorno da manifestação no Documento Recebido e retorna o status"""
+    from erpnext_fiscal_br.services.sefaz_response import serializar_elemento
+
+    cstat = retorno.get("cStat")
+    # Sem retEvento da nota o cStat é o do lote: nunca registrada
+    if retorno.get("eventos") and cstat in CSTAT_REGISTRADO:
+        status = "Registrada"
+    elif cstat in ("", "999") or not retorno.get("eventos"):
+        # Falha de comunicação ou lote rejeitado por inteiro: nova tentativa depois
+        status = "Erro"
+    else:
+        status = "Rejeitada"
+
+    try:
+        doc = frappe.get_doc("Documento Recebido", chave)
+        doc.status_manifestacao = status
+        doc.mensagem_manifestacao = f"[{cstat}] {retorno.get('xMotivo')}" if cstat else retorno.get("xMotivo")
+
+        if status == "Registrada":
+            doc.manifestacao = tipo
+            doc.protocolo_manifestacao = retorno.get("nProt")
+            doc.data_manifestacao = now_datetime()
+
+            if cstat in ("135", "136"):
+                ret_evento = retorno["eventos"][0]
+                doc.aplicar_evento({
+                    "tipo_evento": codigo,
+                    "descricao_evento": descricao,
+                    "sequencia": 1,
+                    "data_evento": doc.data_manifestacao,
+                    "protocolo": retorno.get("nProt"),
+                    "xml": serializar_elemento(ret_evento["elemento"]),
+                })
+
+        doc.flags.ignore_permissions = True
+        doc.flags.ignore_version = True
+        doc.save()
+        frappe.db.commit()
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(
+            f"Erro ao gravar a manifestação {codigo} de {chave} ([{cstat}] {retorno.get('xMotivo')}): {str(e)}",
+            "Manifestação do Destinatário"
+        )
+
+    return status
+
+
+def pendentes_ciencia(empresa, limite=MAX_POR_EXECUCAO):
+    """
+    Resumos autorizados ainda sem manifestação (ou com erro de comunicação)
+
+    Returns:
+        list: Chaves de acesso, das notas mais antigas para as mais novas
+    """
+    return frappe.get_all(
+        "Documento Recebido",
+        filters={
+            "empresa": empresa,
+            "tipo_documento": "Resumo",
+            "situacao": "Autorizada",
+            "manifestacao": ["is", "not set"],
+        },
+        or_filters=[
+            ["status_manifestacao", "is", "not set"],
+            ["status_manifestacao", "=", "Erro"],
+        ],
+        order_by="data_autorizacao asc",
+        limit_page_length=limite,
+        pluck="name"
+    )
+
+
+def manifestar_ciencia_pendentes(empresa, limite=MAX_POR_EXECUCAO):
+    """
+    Manifesta a Ciência da Operação dos resumos novos de uma empresa
+
+    Args:
+        empresa: Empresa destinatária
+        limite: Máximo de documentos nesta execução
+
+    Returns:
+        dict: Quantidade de documentos por status resultante
+    """
+    chaves = pendentes_ciencia(empresa, limite)
+    if not chaves:
+        return {}
+
+    return manifestar(empresa, chaves, "Ciência da Operação")
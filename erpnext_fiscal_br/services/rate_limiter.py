@@ -0,0 +1,321 @@
+"""
+Rate Limiter - Controle de consumo dos Web Services da SEFAZ
+Token bucket no Redis por CNPJ, autorizador e serviço, para evitar o
+bloqueio por consumo indevido (cStat 656)
+"""
+
+import hashlib
+import re
+import time
+from contextlib import contextmanager
+
+import frappe
+from frappe import _
+
+# Balde geral por CNPJ + autorizador: (capacidade, reposição por segundo)
+LIMITE_GERAL = (30, 5.0)
+
+# Baldes por serviço: (capacidade, reposição por segundo)
+LIMITES_SERVICO = {
+    "NfeAutorizacao": (20, 4.0),
+    "NfeRetAutorizacao": (10, 2.0),
+    "RecepcaoEvento": (20, 2.0),
+    "NfeInutilizacao": (5, 0.5),
+    "NfeConsultaProtocolo": (10, 1.0),
+    "NfeStatusServico": (2, 1 / 60),
+    "CadConsultaCadastro": (10, 1.0),
+    "NFeDistribuicaoDFe": (10, 1.0),
+}
+
+# Serviços de consulta: baixa prioridade e respostas reaproveitadas por alguns segundos
+# Formato: {servico: segundos em que uma consulta idêntica reutiliza a resposta}
+SERVICOS_CONSULTA = {
+    "NfeStatusServico": 180,
+    "NfeConsultaProtocolo": 60,
+    "CadConsultaCadastro": 300,
+    "NFeDistribuicaoDFe": 0,
+}
+
+# cStat das respostas de consulta que podem ser reaproveitadas: apenas resultados
+# definitivos (erros, 108/109 e 656 sempre voltam à SEFAZ)
+CSTAT_REAPROVEITAVEL = {
+    "NfeStatusServico": ("107",),
+    "NfeConsultaProtocolo": ("100", "101", "110", "150", "151", "155", "301", "302", "303"),
+    "CadConsultaCadastro": ("111", "112", "259", "264"),
+}
+
+_CSTAT = re.compile(rb"<(?:\w+:)?cStat>\s*(\d+)\s*<")
+
+# Fração do balde geral que consultas não podem consumir (reservada para autorização/eventos)
+RESERVA_PRIORITARIA = 0.3
+
+# Espera máxima por um token antes de desistir (segundos)
+ESPERA_MAXIMA = {"alta": 15, "baixa": 3}
+
+# Tempo de bloqueio após a SEFAZ retornar consumo indevido
+BLOQUEIO_CONSUMO_INDEVIDO = 3600
+
+PREFIXO = "fiscal_br:sefaz"
+
+# Consome um token do balde do serviço e do balde geral de forma atômica
+# KEYS[1] = balde do serviço, KEYS[2] = balde geral
+# ARGV = capacidade_servico, taxa_servico, capacidade_geral, taxa_geral, reserva
+# Retorna {1, 0} se consumiu ou {0, espera_ms}
+LUA_TOKEN_BUCKET = """
+local t = redis.call('TIME')
+local agora = tonumber(t[1]) + tonumber(t[2]) / 1000000
+
+local function repor(chave, capacidade, taxa)
+    local balde = redis.call('HMGET', chave, 'tokens', 'ts')
+    local tokens = tonumber(balde[1])
+    local ts = tonumber(balde[2])
+    if tokens == nil or ts == nil then
+        return capacidade
+    end
+    return math.min(capacidade, tokens + math.max(0, agora - ts) * taxa)
+end
+
+local cap_servico = tonumber(ARGV[1])
+local taxa_servico = tonumber(ARGV[2])
+local cap_geral = tonumber(ARGV[3])
+local taxa_geral = tonumber(ARGV[4])
+local reserva = tonumber(ARGV[5])
+
+local tokens_servico = repor(KEYS[1], cap_servico, taxa_servico)
+local tokens_geral = repor(KEYS[2], cap_geral, taxa_geral)
+
+local consumiu = 0
+local espera = 0
+if tokens_servico >= 1 and tokens_geral - reserva >= 1 then
+    tokens_servico = tokens_servico - 1
+    tokens_geral = tokens_geral - 1
+    consumiu = 1
+else
+    local espera_servico = math.max(0, (1 - tokens_servico) / taxa_servico)
+    local espera_geral = math.max(0, (1 + reserva - tokens_geral) / taxa_geral)
+    espera = math.ceil(math.max(espera_servico, espera_geral) * 1000)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens_servico, 'ts', agora)
+redis.call('HSET', KEYS[2], 'tokens', tokens_geral, 'ts', agora)
+redis.call('EXPIRE', KEYS[1], math.ceil(cap_servico / taxa_servico) + 60)
+redis.call('EXPIRE', KEYS[2], math.ceil(cap_geral / taxa_geral) + 60)
+
+return {consumiu, espera}
+"""
+
+
+class LimiteConsumoExcedido(Exception):
+    """Requisição não enviada para não exceder o limite de consumo da SEFAZ"""
+
+
+class RequisicaoDuplicada(Exception):
+    """Requisição idêntica já está em andamento"""
+
+
+class SEFAZRateLimiter:
+    """Limitador de requisições para um CNPJ em um autorizador"""
+
+    def __init__(self, cnpj, autorizador):
+        """
+        Inicializa o limitador
+
+        Args:
+            cnpj: CNPJ do emitente/consulente
+            autorizador: Autorizador (SP, SVRS, AN...)
+        """
+        self.cnpj = cnpj
+        self.autorizador = autorizador
+        self.limites = _get_limites()
+
+    def _chave(self, *partes):
+        return frappe.cache().make_key(":".join((PREFIXO, self.cnpj, self.autorizador) + partes))
+
+    def _prioridade(self, servico):
+        return "baixa" if servico in SERVICOS_CONSULTA else "alta"
+
+    @contextmanager
+    def requisicao(self, servico, chave_dedup=None):
+        """
+        Reserva a capacidade para uma requisição
+
+        Aguarda um token (até a espera máxima da prioridade do serviço) e,
+        para serviços que alteram estado, impede que a mesma requisição
+        (mesma chave_dedup) seja enviada em paralelo.
+
+        Args:
+            servico: Nome do serviço (ex: NfeAutorizacao)
+            chave_dedup: Identificador lógico da requisição (chave, Id do evento...)
+
+        Raises:
+            LimiteConsumoExcedido: Se não houver capacidade ou o serviço estiver bloqueado
+            RequisicaoDuplicada: Se a mesma requisição já estiver em andamento
+        """
+        self._verificar_bloqueio(servico)
+
+        chave_lock = None
+        if chave_dedup and servico not in SERVICOS_CONSULTA:
+            chave_lock = self._chave("andamento", servico, chave_dedup)
+            if not frappe.cache().set(chave_lock, 1, nx=True, ex=300):
+                self._registrar_metrica(servico, "duplicadas")
+                raise RequisicaoDuplicada(
+                    _("Requisição {0} para {1} já está em andamento").format(servico, chave_dedup)
+                )
+
+        try:
+            self._consumir_token(servico)
+            yield
+        finally:
+            if chave_lock:
+                frappe.cache().delete(chave_lock)
+
+    def _consumir_token(self, servico):
+        """Consome um token do serviço, aguardando se necessário"""
+        prioridade = self._prioridade(servico)
+        capacidade, taxa = self.limites["servicos"].get(servico, LIMITE_GERAL)
+        cap_geral, taxa_geral = self.limites["geral"]
+        reserva = cap_geral * RESERVA_PRIORITARIA if prioridade == "baixa" else 0
+
+        script = frappe.cache().register_script(LUA_TOKEN_BUCKET)
+        chaves = [self._chave("balde", servico), self._chave("balde")]
+
+        limite_espera = time.monotonic() + ESPERA_MAXIMA[prioridade]
+        esperou = 0.0
+
+        while True:
+            consumiu, espera_ms = script(keys=chaves, args=[capacidade, taxa, cap_geral, taxa_geral, reserva])
+            if int(consumiu):
+                if esperou:
+                    self._registrar_metrica(servico, "aguardadas", espera_ms=int(esperou * 1000))
+                return
+
+            espera = int(espera_ms) / 1000
+            if time.monotonic() + espera > limite_espera:
+                self._registrar_metrica(servico, "recusadas")
+                raise LimiteConsumoExcedido(
+                    _("Limite de consumo do serviço {0} atingido para o CNPJ {1}. Tente novamente em instantes.").format(
+                        servico, self.cnpj
+                    )
+                )
+
+            time.sleep(espera)
+            esperou += espera
+
+    def resposta_recente(self, servico, corpo):
+        """
+        Retorna a resposta de uma consulta idêntica feita há pouco, se houver
+
+        Args:
+            servico: Nome do serviço
+            corpo: Corpo da requisição
+
+        Returns:
+            bytes: Resposta em cache ou None
+        """
+        if not SERVICOS_CONSULTA.get(servico):
+            return None
+
+        resposta = frappe.cache().get(self._chave("resposta", servico, _hash(corpo)))
+        if resposta is not None:
+            self._registrar_metrica(servico, "reaproveitadas")
+        return resposta
+
+    def guardar_resposta(self, servico, corpo, resposta):
+        """Guarda a resposta de uma consulta para reaproveitamento, se o cStat for um resultado definitivo"""
+        ttl = SERVICOS_CONSULTA.get(servico)
+        if ttl and _cstat(resposta) in CSTAT_REAPROVEITAVEL.get(servico, ()):
+            frappe.cache().set(self._chave("resposta", servico, _hash(corpo)), resposta, ex=ttl)
+
+    def registrar_consumo_indevido(self, servico):
+        """Bloqueia o serviço localmente pelo mesmo período do bloqueio da SEFAZ (cStat 656)"""
+        frappe.cache().set(self._chave("bloqueio", servico), int(time.time()), ex=BLOQUEIO_CONSUMO_INDEVIDO)
+        self._registrar_metrica(servico, "bloqueios")
+
+    def _verificar_bloqueio(self, servico):
+        ttl = frappe.cache().ttl(self._chave("bloqueio", servico))
+        if ttl and ttl > 0:
+            self._registrar_metrica(servico, "recusadas")
+            raise LimiteConsumoExcedido(
+                _("Serviço {0} bloqueado por consumo indevido para o CNPJ {1}. Liberação em {2} minutos.").format(
+                    servico, self.cnpj, int(ttl / 60) + 1
+                )
+            )
+
+    def _registrar_metrica(self, servico, metrica, espera_ms=0):
+        chave = self._chave("metrica", servico)
+        pipe = frappe.cache().pipeline()
+        pipe.hincrby(chave, metrica, 1)
+        if espera_ms:
+            pipe.hincrby(chave, "espera_ms", espera_ms)
+        pipe.expire(chave, 7 * 24 * 3600)
+        pipe.execute()
+
+
+def _cstat(resposta):
+    """Primeiro cStat da resposta (o do elemento de retorno), sem parse do XML"""
+    if isinstance(resposta, str):
+        resposta = resposta.encode("utf-8")
+    encontrado = _CSTAT.search(resposta or b"")
+    return encontrado.group(1).decode() if encontrado else None
+
+
+def _hash(corpo):
+    if isinstance(corpo, str):
+        corpo = corpo.encode("utf-8")
+    return hashlib.sha1(corpo).hexdigest()
+
+
+def _get_limites():
+    """
+    Retorna os limites, permitindo sobrescrever pelo site_config:
+    "fiscal_br_limites_sefaz": {"geral": [30, 5], "servicos": {"NfeAutorizacao": [20, 4]}}
+    """
+    config = frappe.conf.get("fiscal_br_limites_sefaz") or {}
+
+    servicos = dict(LIMITES_SERVICO)
+    for servico, limite in (config.get("servicos") or {}).items():
+        servicos[servico] = tuple(limite)
+
+    return {
+        "geral": tuple(config.get("geral") or LIMITE_GERAL),
+        "servicos": servicos,
+    }
+
+
+def get_metricas(cnpj=None):
+    """
+    Retorna os contadores de requisições limitadas
+
+    Args:
+        cnpj: Filtra por CNPJ (opcional)
+
+    Returns:
+        list: Um registro por CNPJ/autorizador/serviço
+    """
+    cache = frappe.cache()
+    padrao = cache.make_key(":".join((PREFIXO, cnpj or "*", "*", "metrica", "*")))
+    prefixo = cache.make_key(PREFIXO)
+    if isinstance(prefixo, bytes):
+        prefixo = prefixo.decode()
+
+    chaves = [
+        chave.decode() if isinstance(chave, bytes) else chave
+        for chave in cache.scan_iter(match=padrao, count=500)
+    ]
+
+    # Leitura direta (sem o pickle do RedisWrapper): os contadores são gravados com HINCRBY
+    pipe = cache.pipeline()
+    for chave in chaves:
+        pipe.hgetall(chave)
+
+    metricas = []
+    for chave, valores in zip(chaves, pipe.execute()):
+        _cnpj, autorizador, _m, servico = chave[len(prefixo) + 1:].split(":")
+        metricas.append({
+            "cnpj": _cnpj,
+            "autorizador": autorizador,
+            "servico": servico,
+            **{(k.decode() if isinstance(k, bytes) else k): int(v) for k, v in valores.items()},
+        })
+
+    return sorted(metricas, key=lambda m: (m["cnpj"], m["autorizador"], m["servico"]))
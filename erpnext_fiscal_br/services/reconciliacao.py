@@ -0,0 +1,220 @@
+"""
+Reconciliação - Consulta na SEFAZ as notas presas em "Processando"
+Aplica o protocolo retornado em vez de reenviar a nota
+"""
+
+from datetime import datetime, timedelta
+
+import frappe
+from frappe.utils import now_datetime
+
+# Consultas simultâneas por autorizador
+MAX_CONSULTAS_POR_AUTORIZADOR = 4
+
+# Tempo mínimo em "Processando" antes da consulta (minutos)
+IDADE_MINIMA = 5
+
+# Situação da NFe pelo cStat do retConsSitNFe
+STATUS_POR_CSTAT = {
+    "100": "Autorizada",
+    "150": "Autorizada",
+    "101": "Cancelada",
+    "151": "Cancelada",
+    "155": "Cancelada",
+    "110": "Denegada",
+    "301": "Denegada",
+    "302": "Denegada",
+    "303": "Denegada",
+    # NF-e não consta na base da SEFAZ: volta para a fila de envio
+    "217": "Pendente",
+}
+
+
+def _data_hora(valor):
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def reconciliar_notas_processando(idade_minima=IDADE_MINIMA):
+    """
+    Consulta em paralelo o protocolo das notas em "Processando"
+
+    As consultas são agrupadas por autorizador, com no máximo
+    MAX_CONSULTAS_POR_AUTORIZADOR simultâneas em cada um (além do limitador
+    de consumo). Os XMLs são gravados nas threads; os status das
+    notas e das Sales Invoices são gravados ao final em lote.
+
+    Args:
+        idade_minima: Minutos em "Processando" antes de consultar
+
+    Returns:
+        dict: Quantidade de notas por status resultante
+    """
+    from erpnext_fiscal_br.fiscal_br.doctype.configuracao_fiscal.configuracao_fiscal import ConfiguracaoFiscal
+    from erpnext_fiscal_br.services.resumo_fiscal import CAMPOS_NOTA
+    from erpnext_fiscal_br.services.transmitter import UF_AUTORIZADOR
+    from erpnext_fiscal_br.utils.concurrency import executar_em_paralelo
+
+    notas = frappe.get_all(
+        "Nota Fiscal",
+        filters={
+            "status": "Processando",
+            "chave_acesso": ["is", "set"],
+            "modified": ["<", now_datetime() - timedelta(minutes=idade_minima)]
+        },
+        fields=["name", "chave_acesso", "xml_nfe", "sales_invoice", "numero"] + list(CAMPOS_NOTA)
+    )
+
+    if not notas:
+        return {}
+
+    # Agrupa por autorizador da UF de emissão
+    por_autorizador = {}
+    for empresa in {nota.empresa for nota in notas}:
+        config = ConfiguracaoFiscal.get_config_for_company(empresa)
+        autorizador = UF_AUTORIZADOR.get(config.uf_emissao, "SVRS") if config else None
+        for nota in notas:
+            if nota.empresa == empresa:
+                por_autorizador.setdefault(autorizador, []).append(nota)
+
+    resultados = []
+    for autorizador, notas_autorizador in por_autorizador.items():
+        if not autorizador:
+            continue
+        resultados.extend(executar_em_paralelo(
+            _consultar_nota,
+            notas_autorizador,
+            max_workers=MAX_CONSULTAS_POR_AUTORIZADOR,
+            preparar_thread=dict
+        ))
+
+    return aplicar_resultados(resultados)
+
+
+def _consultar_nota(nota, transmitters):
+    """
+    Consulta uma nota e grava o XML autorizado (executado em thread)
+
+    Args:
+        nota: Registro da Nota Fiscal
+        transmitters: Cache de SEFAZTransmitter por empresa desta thread
+
+    Returns:
+        dict: Campos a atualizar na nota ou None se a situação não mudou
+    """
+    from erpnext_fiscal_br.services.transmitter import SEFAZTransmitter
+
+    if nota.empresa not in transmitters:
+        transmitters[nota.empresa] = SEFAZTransmitter(nota.empresa)
+    transmitter = transmitters[nota.empresa]
+
+    resultado = transmitter.consultar_nfe(nota.chave_acesso)
+    retorno = resultado.get("retorno") or resultado
+    cstat = retorno.get("cStat")
+    status = STATUS_POR_CSTAT.get(cstat)
+
+    if not status:
+        frappe.log_error(
+            f"Reconciliação da nota {nota.name}: [{cstat}] {retorno.get('xMotivo')}",
+            "Reconciliação NFe"
+        )
+        return None
+
+    valores = {
+        "status": status,
+        "codigo_status": cstat,
+        "mensagem_sefaz": retorno.get("xMotivo"),
+    }
+
+    if status == "Pendente":
+        return valores
+
+    prot_nfe = resultado.get("prot_nfe")
+    if prot_nfe is not None:
+        valores["protocolo_autorizacao"] = resultado.get("nProt")
+        valores["data_autorizacao"] = _data_hora(resultado.get("dhRecbto"))
+
+    if status == "Denegada":
+        valores["motivo_rejeicao"] = f"[{cstat}] {retorno.get('xMotivo')}"
+
+    if status == "Autorizada" and prot_nfe is not None and nota.xml_nfe:
+        from erpnext_fiscal_br.services.danfe_cache import url_danfe
+        from erpnext_fiscal_br.services.sefaz_response import serializar_elemento
+
+        nf = frappe.get_doc("Nota Fiscal", nota.name)
+
+        # XML assinado gravado pelo marcador pré-envio da emissão
+        xml_nfe = nf.ler_arquivo("xml_nfe").decode("utf-8")
+
+        nf.salvar_xml(transmitter._montar_proc_nfe(xml_nfe, serializar_elemento(prot_nfe)), "xml_autorizado")
+        valores["xml_autorizado"] = nf.xml_autorizado
+
+        valores["danfe"] = url_danfe(nota.name)
+
+    return valores
+
+
+def aplicar_resultados(resultados):
+    """
+    Grava em lote os resultados da reconciliação
+
+    Args:
+        resultados: Tuplas (nota, valores, erro) de executar_em_paralelo
+
+    Returns:
+        dict: Quantidade de notas por status resultante
+    """
+    atualizacoes_nf = {}
+    atualizacoes_si = {}
+    transicoes = []
+    totais = {}
+
+    for nota, valores, erro in resultados:
+        if erro is not None:
+            frappe.log_error(
+                f"Erro na reconciliação da nota {nota.name}: {str(erro)}",
+                "Reconciliação NFe"
+            )
+            continue
+
+        if not valores:
+            continue
+
+        atualizacoes_nf[nota.name] = valores
+        transicoes.append((nota, dict(nota, status=valores["status"])))
+        totais[valores["status"]] = totais.get(valores["status"], 0) + 1
+
+        if nota.sales_invoice and valores["status"] != "Pendente":
+            atualizacoes_si[nota.sales_invoice] = {
+                "nota_fiscal": nota.name,
+                "chave_nfe": nota.chave_acesso,
+                "status_fiscal": valores["status"],
+                "numero_nfe": nota.numero,
+                "serie_nfe": nota.serie,
+                "protocolo_autorizacao": valores.get("protocolo_autorizacao"),
+                "data_autorizacao": valores.get("data_autorizacao"),
+            }
+
+    if atualizacoes_nf:
+        frappe.db.bulk_update("Nota Fiscal", atualizacoes_nf)
+
+        from erpnext_fiscal_br.services import resumo_fiscal
+
+        resumo_fiscal.atualizar(transicoes)
+
+        # DANFE renderizado em background após o commit (ou no primeiro download)
+        from erpnext_fiscal_br.services.danfe_cache import enfileirar_pre_renderizacao
+
+        for nota, valores, erro in resultados:
+            if erro is None and valores and valores.get("danfe"):
+                enfileirar_pre_renderizacao(nota.name, nota.empresa)
+    if atualizacoes_si:
+        frappe.db.bulk_update("Sales Invoice", atualizacoes_si, update_modified=False)
+
+    frappe.db.commit()
+
+    return totais
@@ -0,0 +1,152 @@
+"""
+Resumo Fiscal Diário
+Quantidade e totais das notas por (empresa, modelo, série, dia, status),
+mantidos a cada mudança de status ou valores da Nota Fiscal. Atende o e-mail
+diário, o resumo do relatório Notas Emitidas e os cartões do workspace sem
+percorrer a tabela de notas.
+"""
+
+from collections import defaultdict
+
+import frappe
+from frappe.utils import cint, flt, getdate, now_datetime
+
+# Totais acumulados de cada nota
+CAMPOS_VALOR = (
+    "valor_total", "valor_produtos", "valor_icms", "valor_icms_st",
+    "valor_ipi", "valor_pis", "valor_cofins",
+)
+
+# Campos da nota que definem a linha do resumo e os totais
+CAMPOS_NOTA = ("empresa", "modelo", "serie", "creation", "status") + CAMPOS_VALOR
+
+
+def _linha(nota):
+    """Chave (empresa, modelo, série, dia, status) da nota no resumo"""
+    return (
+        nota.get("empresa"),
+        str(nota.get("modelo") or ""),
+        cint(nota.get("serie")),
+        getdate(nota.get("creation") or now_datetime()),
+        nota.get("status"),
+    )
+
+
+def atualizar(transicoes):
+    """
+    Aplica ao resumo as mudanças de um conjunto de notas
+
+    Cada nota sai da linha do estado anterior e entra na do estado atual;
+    somente as diferenças são gravadas, em um único comando, na transação
+    corrente.
+
+    Args:
+        transicoes: Pares (anterior, atual) com os CAMPOS_NOTA da nota;
+            anterior None para nota nova, atual None para nota excluída
+    """
+    deltas = defaultdict(lambda: [0] + [0.0] * len(CAMPOS_VALOR))
+
+    for anterior, atual in transicoes:
+        for nota, sinal in ((anterior, -1), (atual, 1)):
+            if not nota or not nota.get("empresa"):
+                continue
+            delta = deltas[_linha(nota)]
+            delta[0] += sinal
+            for i, campo in enumerate(CAMPOS_VALOR, 1):
+                delta[i] += sinal * flt(nota.get(campo))
+
+    deltas = {
+        linha: delta for linha, delta in deltas.items()
+        if delta[0] or any(abs(valor) > 0.001 for valor in delta[1:])
+    }
+    if not deltas:
+        return
+
+    agora = now_datetime()
+    usuario = frappe.session.user
+
+    valores = []
+    for (empresa, modelo, serie, dia, status), delta in deltas.items():
+        valores.append((
+            _nome(empresa, modelo, serie, dia, status), agora, agora, usuario, usuario,
+            empresa, modelo, serie, dia, status, *delta,
+        ))
+
+    colunas = ", ".join(CAMPOS_VALOR)
+    acumular = ", ".join(f"{campo} = {campo} + VALUES({campo})" for campo in ("quantidade",) + CAMPOS_VALOR)
+    marcadores = "(%s)" % ", ".join(["%s"] * (11 + len(CAMPOS_VALOR)))
+
+    frappe.db.sql(f"""
+        INSERT INTO `tabResumo Fiscal Diario`
+            (name, creation, modified, owner, modified_by,
+            empresa, modelo, serie, dia, status, quantidade, {colunas})
+        VALUES {", ".join([marcadores] * len(valores))}
+        ON DUPLICATE KEY UPDATE
+            modified = VALUES(modified), {acumular}
+    """, [v for linha in valores for v in linha])
+
+
+def _nome(empresa, modelo, serie, dia, status):
+    # Mesmo formato do CONCAT_WS de reconstruir (status NULL vira vazio)
+    return f"{empresa}|{modelo}|{serie}|{dia}|{status or ''}"
+
+
+def estado_atual(nota_fiscal):
+    """CAMPOS_NOTA gravados no banco (estado anterior a um UPDATE direto)"""
+    return frappe.db.get_value("Nota Fiscal", nota_fiscal, CAMPOS_NOTA, as_dict=True)
+
+
+def reconstruir(empresa=None):
+    """
+    Recalcula o resumo a partir das notas
+
+    Args:
+        empresa: Limita a uma empresa (padrão: todas)
+    """
+    condicao = "WHERE empresa = %(empresa)s" if empresa else ""
+    colunas = ", ".join(CAMPOS_VALOR)
+    somas = ", ".join(f"COALESCE(SUM({campo}), 0)" for campo in CAMPOS_VALOR)
+
+    frappe.db.sql(f"DELETE FROM `tabResumo Fiscal Diario` {condicao}", {"empresa": empresa})
+    frappe.db.sql(f"""
+        INSERT INTO `tabResumo Fiscal Diario`
+            (name, creation, modified, owner, modified_by,
+            empresa, modelo, serie, dia, status, quantidade, {colunas})
+        SELECT
+            CONCAT_WS('|', empresa, COALESCE(modelo, ''), COALESCE(serie, 0), DATE(creation), COALESCE(status, '')),
+            NOW(), NOW(), %(usuario)s, %(usuario)s,
+            empresa, COALESCE(modelo, ''), COALESCE(serie, 0), DATE(creation), status, COUNT(*), {somas}
+        FROM `tabNota Fiscal`
+        {condicao}
+        GROUP BY empresa, modelo, serie, DATE(creation), status
+    """, {"empresa": empresa, "usuario": frappe.session.user})
+
+
+def totais_por_status(empresa=None, modelo=None, status=None, de=None, ate=None):
+    """
+    Quantidade e totais por status no período (dias inclusivos)
+
+    Returns:
+        list: Linhas com status, quantidade e os CAMPOS_VALOR somados
+    """
+    filtros = {}
+    if empresa:
+        filtros["empresa"] = empresa
+    if modelo:
+        filtros["modelo"] = modelo
+    if status:
+        filtros["status"] = status
+    if de and ate:
+        filtros["dia"] = ["between", [getdate(de), getdate(ate)]]
+    elif de:
+        filtros["dia"] = [">=", getdate(de)]
+    elif ate:
+        filtros["dia"] = ["<=", getdate(ate)]
+
+    return frappe.get_all(
+        "Resumo Fiscal Diario",
+        filters=filtros,
+        fields=["status", "sum(quantidade) as quantidade"] + [f"sum({campo}) as {campo}" for campo in CAMPOS_VALOR],
+        group_by="status",
+        order_by="quantidade desc"
+    )
@@ -0,0 +1,124 @@
+"""
+Parser de respostas da SEFAZ
+Extrai os campos de retorno em uma única passada sobre os bytes da resposta
+"""
+
+from lxml import etree
+
+NS_NFE = "http://www.portalfiscal.inf.br/nfe"
+
+# Campos extraídos do elemento de retorno e de cada protNFe/retEvento
+CAMPOS_RETORNO = (
+    "cStat", "xMotivo", "nProt", "dhRecbto", "chNFe", "cUF", "tpAmb", "nRec",
+    "digVal", "dhRegEvento", "tpEvento", "nSeqEvento", "xEvento", "cOrgao",
+    "tMed", "dhResp",
+)
+
+
+def _tags(nomes):
+    """Retorna as tags com e sem namespace da NFe, mapeadas para o nome local"""
+    mapa = {}
+    for nome in nomes:
+        mapa["{%s}%s" % (NS_NFE, nome)] = nome
+        mapa[nome] = nome
+    return mapa
+
+
+_TAGS_CAMPOS = _tags(CAMPOS_RETORNO)
+_TAGS_GRUPOS = _tags(("protNFe", "retEvento"))
+
+class RespostaInvalida(Exception):
+    """Resposta da SEFAZ sem o elemento de retorno esperado"""
+
+
+def parse_resposta(response, tag_retorno):
+    """
+    Faz o parse de uma resposta SOAP da SEFAZ em uma única passada
+
+    O XML é lido uma vez e apenas os níveis que contêm os campos de retorno
+    são percorridos, sem buscas repetidas na árvore. Os campos do elemento de retorno ficam no nível principal do
+    dicionário. Cada protNFe e cada retEvento viram uma entrada em
+    "protocolos" / "eventos", na ordem do documento, com o elemento
+    original em "elemento" (usado para montar o procNFe sem novo parse).
+    Os campos do primeiro protNFe (ou do primeiro retEvento filho direto do
+    retorno, em lotes de evento) sobrescrevem os do retorno, como no parser
+    anterior.
+
+    Args:
+        response: Resposta da SEFAZ (bytes ou str)
+        tag_retorno: Nome local do elemento de retorno (ex: retEnviNFe)
+
+    Returns:
+        dict: Campos do retorno, "retorno", "protocolos", "eventos" e "prot_nfe"
+
+    Raises:
+        RespostaInvalida: Se o elemento de retorno não for encontrado
+        etree.XMLSyntaxError: Se a resposta não for um XML válido
+    """
+    if isinstance(response, str):
+        response = response.encode("utf-8")
+
+    root = etree.fromstring(response)
+
+    retorno = next(root.iter("{%s}%s" % (NS_NFE, tag_retorno), tag_retorno), None)
+    if retorno is None:
+        raise RespostaInvalida(tag_retorno)
+
+    resultado = {}
+    protocolos = []
+    eventos = []
+
+    for filho in retorno:
+        _ler_filho(filho, resultado, protocolos, eventos, direto=True)
+
+    # Campos do próprio elemento de retorno (ex: cStat 101 do retConsSitNFe de nota cancelada)
+    resultado["retorno"] = dict(resultado)
+
+    # Compatibilidade: o primeiro protocolo/evento do lote prevalece
+    principal = protocolos[0] if protocolos else None
+    if principal is None and eventos and eventos[0]["direto"]:
+        principal = eventos[0]
+
+    if principal is not None:
+        for campo in CAMPOS_RETORNO:
+            if campo in principal:
+                resultado[campo] = principal[campo]
+
+    resultado["protocolos"] = protocolos
+    resultado["eventos"] = eventos
+    resultado["prot_nfe"] = protocolos[0]["elemento"] if protocolos else None
+
+    return resultado
+
+
+def _ler_filho(elem, destino, protocolos, eventos, direto):
+    """Lê um filho do elemento de retorno: campo, protNFe, retEvento ou agrupador (ex: procEventoNFe)"""
+    tag = elem.tag
+    campo = _TAGS_CAMPOS.get(tag)
+    if campo is not None:
+        if elem.text and campo not in destino:
+            destino[campo] = elem.text
+        return
+
+    nome_grupo = _TAGS_GRUPOS.get(tag)
+    if nome_grupo is None:
+        # Agrupadores como procEventoNFe (retConsSitNFe) - desce um nível
+        if direto:
+            for filho in elem:
+                _ler_filho(filho, {}, protocolos, eventos, direto=False)
+        return
+
+    grupo = {"elemento": elem, "direto": direto}
+    (protocolos if nome_grupo == "protNFe" else eventos).append(grupo)
+
+    # protNFe/infProt e retEvento/infEvento
+    for info in elem:
+        for item in info:
+            campo = _TAGS_CAMPOS.get(item.tag)
+            if campo is not None and item.text and campo not in grupo:
+                grupo[campo] = item.text
+
+
+def serializar_elemento(elem):
+    """Serializa um elemento mantido pelo parser (ex: protNFe) como string"""
+    return etree.tostring(elem, encoding="unicode")
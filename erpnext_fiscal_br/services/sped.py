@@ -0,0 +1,438 @@
+"""
+Escrita de arquivos SPED
+Registros delimitados por "|" gravados direto no arquivo de saída, com a
+quantidade de linhas por registro e por bloco contada durante a escrita para
+os registros X990 e o bloco 9, e as consultas das notas do período comuns
+à EFD ICMS/IPI e à EFD-Contribuições
+"""
+
+import shutil
+from itertools import groupby
+
+import frappe
+from frappe.utils import add_days, flt, getdate
+
+# Situação do documento (COD_SIT) por status da nota
+SITUACAO = {
+    "Autorizada": "00",
+    "Cancelada": "02",
+    "Denegada": "04",
+    "Inutilizada": "05",
+}
+
+# NF-e complementar autorizada
+SITUACAO_COMPLEMENTAR = "06"
+
+AMBIENTE_PRODUCAO = "1 - Produção"
+
+# CST do PIS/COFINS com alíquota por unidade de medida: a base é a quantidade
+# do item e a alíquota, em reais por unidade (como no PISQtde/COFINSQtde)
+CST_ALIQUOTA_QUANTIDADE = ("03",)
+
+CAMPOS_ITEM = (
+    "idx", "item_code", "item_name", "unidade", "quantidade", "valor_total", "valor_desconto",
+    "origem", "cst_icms", "cfop", "base_icms", "aliquota_icms", "valor_icms",
+    "base_icms_st", "aliquota_icms_st", "valor_icms_st",
+    "cst_ipi", "codigo_enquadramento_ipi", "base_ipi", "aliquota_ipi", "valor_ipi",
+    "cst_pis", "base_pis", "aliquota_pis", "valor_pis",
+    "cst_cofins", "base_cofins", "aliquota_cofins", "valor_cofins",
+)
+
+# Notas do período (a mesma condição em todas as consultas do arquivo)
+_CONDICOES = """
+    nf.empresa = %(empresa)s
+    AND nf.ambiente = %(ambiente)s
+    AND nf.status IN ('Autorizada', 'Cancelada', 'Denegada')
+    AND nf.data_autorizacao >= %(inicio)s
+    AND nf.data_autorizacao < %(fim)s
+"""
+
+# Códigos do participante (0150), item (0200) e unidade (0190) no banco;
+# codigo_participante, codigo_item e unidade fazem o mesmo no Python
+_PARTICIPANTE = "COALESCE(NULLIF(nf.cliente, ''), nf.cpf_cnpj_destinatario)"
+_ITEM = "COALESCE(NULLIF(it.item_code, ''), it.item_name)"
+_UNIDADE = "UPPER(COALESCE(NULLIF(it.unidade, ''), 'UN'))"
+
+_ITENS_AUTORIZADOS = f"""
+    FROM `tabNota Fiscal` nf
+    INNER JOIN `tabNota Fiscal Item` it ON it.parent = nf.name AND it.parenttype = 'Nota Fiscal'
+    WHERE {_CONDICOES} AND nf.status = 'Autorizada' AND nf.modelo = '55'
+"""
+
+
+class ArquivoSPED:
+    """
+    Arquivo SPED gravado registro a registro
+
+    Só a contagem por tipo de registro fica em memória; as linhas vão para o
+    arquivo assim que são escritas (ISO-8859-1, fim de linha CRLF).
+    """
+
+    def __init__(self, arquivo):
+        """
+        Args:
+            arquivo: Arquivo binário aberto para escrita
+        """
+        self.arquivo = arquivo
+        self.contagem = {}
+        self.linhas = 0
+        self.bloco = None
+        self.linhas_bloco = 0
+
+    def registro(self, *campos):
+        """
+        Grava uma linha
+
+        Args:
+            campos: Código do registro seguido dos campos, já formatados
+        """
+        linha = "|%s|\r\n" % "|".join(_campo(campo) for campo in campos)
+        self.arquivo.write(linha.encode("latin-1", "replace"))
+
+        self.contagem[campos[0]] = self.contagem.get(campos[0], 0) + 1
+        self.linhas += 1
+        self.linhas_bloco += 1
+
+    def abrir_bloco(self, bloco, com_dados=True):
+        """Grava o registro de abertura X001 (0 = bloco com dados, 1 = sem dados)"""
+        self.bloco = bloco
+        self.registro(f"{bloco}001", "0" if com_dados else "1")
+
+    def fechar_bloco(self):
+        """Grava o registro de encerramento X990 com as linhas do bloco"""
+        self.registro(f"{self.bloco}990", self.linhas_bloco + 1)
+        # Linhas gravadas antes do próximo X001 (como o 0000) contam no bloco seguinte
+        self.linhas_bloco = 0
+
+    def incorporar(self, caminho, contagem):
+        """
+        Copia para o arquivo as linhas de um trecho gravado à parte
+
+        Args:
+            caminho: Arquivo de um ArquivoSPED já fechado
+            contagem: Linhas por registro do trecho (ArquivoSPED.contagem)
+        """
+        with open(caminho, "rb") as trecho:
+            shutil.copyfileobj(trecho, self.arquivo)
+
+        for registro, quantidade in contagem.items():
+            self.contagem[registro] = self.contagem.get(registro, 0) + quantidade
+            self.linhas += quantidade
+            self.linhas_bloco += quantidade
+
+    def bloco_vazio(self, bloco):
+        self.abrir_bloco(bloco, com_dados=False)
+        self.fechar_bloco()
+
+    def encerrar(self):
+        """Grava o bloco 9: linhas por registro (9900), do bloco (9990) e do arquivo (9999)"""
+        self.abrir_bloco("9")
+
+        registros = list(self.contagem.items())
+        total_9900 = len(registros) + 3
+        registros += [("9900", total_9900), ("9990", 1), ("9999", 1)]
+
+        for registro, quantidade in registros:
+            self.registro("9900", registro, quantidade)
+
+        # 9001 + 9900s + 9990 + 9999
+        self.registro("9990", total_9900 + 3)
+        self.registro("9999", self.linhas + 1)
+
+
+def parametros(empresa, data_inicial, data_final):
+    """Valores das consultas das notas de produção autorizadas no período (datas inclusivas)"""
+    return {
+        "empresa": empresa,
+        "ambiente": AMBIENTE_PRODUCAO,
+        "inicio": getdate(data_inicial),
+        "fim": add_days(getdate(data_final), 1),
+    }
+
+
+def contar_documentos(valores):
+    return frappe.db.sql(f"SELECT COUNT(*) FROM `tabNota Fiscal` nf WHERE {_CONDICOES}", valores)[0][0]
+
+
+def inutilizadas(valores):
+    """
+    Números inutilizados no período, um por número (poucos; lidos antes dos cursores do servidor)
+
+    Faixas homologadas de Inutilizacao Numeracao, mais as notas "Inutilizada"
+    gravadas uma a uma antes do registro por faixa.
+    """
+    periodo = ["between", [valores["inicio"], add_days(valores["fim"], -1)]]
+
+    numeros = frappe.get_all(
+        "Nota Fiscal",
+        filters={
+            "empresa": valores["empresa"],
+            "ambiente": valores["ambiente"],
+            "status": "Inutilizada",
+            "creation": periodo,
+        },
+        fields=["status", "modelo", "serie", "numero"]
+    )
+
+    for faixa in frappe.get_all(
+        "Inutilizacao Numeracao",
+        filters={
+            "empresa": valores["empresa"],
+            "ambiente": valores["ambiente"],
+            "status": "Homologada",
+            "data_inutilizacao": periodo,
+        },
+        fields=["modelo", "serie", "numero_inicial", "numero_final"]
+    ):
+        numeros.extend(
+            frappe._dict(status="Inutilizada", modelo=faixa.modelo, serie=faixa.serie, numero=numero)
+            for numero in range(faixa.numero_inicial, faixa.numero_final + 1)
+        )
+
+    return sorted(numeros, key=lambda nota: (nota.modelo, nota.serie, nota.numero))
+
+
+def documentos(valores):
+    """
+    Notas do período com os itens, na ordem do índice (empresa, data_autorizacao)
+
+    Uma consulta com cursor do servidor; em memória fica só a nota corrente.
+    Notas canceladas e denegadas vêm sem itens.
+
+    Yields:
+        tuple: (nota, itens ordenados)
+    """
+    campos_item = ", ".join(f"it.{campo} AS item_{campo}" for campo in CAMPOS_ITEM)
+    consulta = f"""
+        SELECT
+            nf.name, nf.modelo, nf.serie, nf.numero, nf.status, nf.chave_acesso,
+            nf.data_autorizacao, nf.tipo_operacao, nf.finalidade, nf.modalidade_frete,
+            {_PARTICIPANTE} AS participante,
+            nf.valor_total, nf.valor_produtos, nf.valor_desconto, nf.valor_frete,
+            nf.valor_seguro, nf.valor_outras_despesas, nf.valor_icms, nf.valor_icms_st,
+            nf.valor_ipi, nf.valor_pis, nf.valor_cofins,
+            {campos_item}
+        FROM `tabNota Fiscal` nf
+        LEFT JOIN `tabNota Fiscal Item` it
+            ON it.parent = nf.name AND it.parenttype = 'Nota Fiscal' AND nf.status = 'Autorizada'
+        WHERE {_CONDICOES}
+        ORDER BY nf.data_autorizacao, nf.name
+    """
+    # As linhas de uma nota chegam juntas: uma por item (ou uma só, sem itens)
+    for _nota, linhas in groupby(iterar_consulta(consulta, valores), key=lambda linha: linha.name):
+        linhas = list(linhas)
+        itens = sorted(
+            (
+                frappe._dict({campo: linha[f"item_{campo}"] for campo in CAMPOS_ITEM})
+                for linha in linhas if linha.item_idx is not None
+            ),
+            key=lambda item: item.idx
+        )
+        yield linhas[0], itens
+
+
+def participantes(valores):
+    """Destinatários das NF-e autorizadas do período (registro 0150)"""
+    consulta = f"""
+        SELECT
+            {_PARTICIPANTE} AS codigo,
+            MAX(nf.cliente_nome) AS nome,
+            MAX(nf.cpf_cnpj_destinatario) AS documento,
+            MAX(nf.ie_destinatario) AS ie,
+            MAX(nf.codigo_pais) AS pais,
+            MAX(nf.codigo_municipio) AS municipio,
+            MAX(nf.logradouro) AS logradouro,
+            MAX(nf.numero_endereco) AS numero,
+            MAX(nf.complemento) AS complemento,
+            MAX(nf.bairro) AS bairro
+        FROM `tabNota Fiscal` nf
+        WHERE {_CONDICOES} AND nf.status = 'Autorizada' AND nf.modelo = '55'
+        GROUP BY codigo
+        ORDER BY codigo
+    """
+    for participante in iterar_consulta(consulta, valores):
+        if participante.codigo:
+            yield participante
+
+
+def registro_0100(arquivo, config):
+    """Contabilista (0100), se informado na Configuração Fiscal"""
+    if config.contador_nome:
+        arquivo.registro(
+            "0100", config.contador_nome[:100], somente_digitos(config.contador_cpf),
+            config.contador_crc, "", "", "", "", "", "", "", "", config.contador_email, ""
+        )
+
+
+def registro_0150(arquivo, participante):
+    pais = somente_digitos(participante.pais) or "1058"
+    brasil = pais == "1058"
+    documento = somente_digitos(participante.documento) if brasil else ""
+
+    arquivo.registro(
+        "0150", codigo_participante(participante.codigo), (participante.nome or "")[:100], pais.zfill(5),
+        documento if len(documento) == 14 else "", documento if len(documento) == 11 else "",
+        somente_digitos(participante.ie), participante.municipio if brasil else "", "",
+        (participante.logradouro or "")[:60], (participante.numero or "")[:10],
+        (participante.complemento or "")[:60], (participante.bairro or "")[:60]
+    )
+
+
+def unidades(valores):
+    """Unidades dos itens das NF-e autorizadas do período (registro 0190)"""
+    consulta = f"SELECT DISTINCT {_UNIDADE} AS unidade {_ITENS_AUTORIZADOS} ORDER BY unidade"
+    for linha in iterar_consulta(consulta, valores):
+        yield linha.unidade
+
+
+def itens(valores):
+    """Itens das NF-e autorizadas do período (registro 0200)"""
+    consulta = f"""
+        SELECT
+            {_ITEM} AS codigo,
+            MAX(it.item_name) AS descricao,
+            MAX({_UNIDADE}) AS unidade,
+            MAX(it.ncm) AS ncm,
+            MAX(it.cest) AS cest
+        {_ITENS_AUTORIZADOS}
+        GROUP BY codigo
+        ORDER BY codigo
+    """
+    yield from iterar_consulta(consulta, valores)
+
+
+def campos_c100(nota, itens=()):
+    """
+    Campos do C100, comuns à EFD ICMS/IPI e à EFD-Contribuições
+
+    Numeração inutilizada leva só modelo, série e número; notas canceladas e
+    denegadas, também a chave de acesso.
+
+    Args:
+        nota: Nota do período (documentos) ou número inutilizado (inutilizadas)
+        itens: Itens da nota autorizada (bases do ICMS e do ICMS ST)
+
+    Returns:
+        list: REG a VL_COFINS_ST (29 campos)
+    """
+    if nota.status == "Inutilizada":
+        return ["C100", "1", "0", "", nota.modelo, SITUACAO["Inutilizada"], nota.serie, nota.numero, *[""] * 21]
+
+    modelo = str(nota.modelo)
+    ind_oper = (nota.tipo_operacao or "1")[0]
+
+    if nota.status != "Autorizada":
+        return [
+            "C100", ind_oper, "0", "", modelo, situacao(nota), nota.serie, nota.numero,
+            nota.chave_acesso, *[""] * 20
+        ]
+
+    return [
+        "C100", ind_oper, "0", codigo_participante(nota.participante) if modelo == "55" else "",
+        modelo, situacao(nota), nota.serie, nota.numero, nota.chave_acesso,
+        data(nota.data_autorizacao), data(nota.data_autorizacao), valor(nota.valor_total), "0",
+        valor(nota.valor_desconto), valor(0), valor(nota.valor_produtos),
+        (nota.modalidade_frete or "9")[0], valor(nota.valor_frete), valor(nota.valor_seguro),
+        valor(nota.valor_outras_despesas), valor(sum(flt(item.base_icms) for item in itens)),
+        valor(nota.valor_icms), valor(sum(flt(item.base_icms_st) for item in itens)),
+        valor(nota.valor_icms_st), valor(nota.valor_ipi), valor(nota.valor_pis),
+        valor(nota.valor_cofins), valor(0), valor(0),
+    ]
+
+
+def campos_c170(numero, item):
+    """
+    Campos do C170 (até COD_CTA), comuns à EFD ICMS/IPI e à EFD-Contribuições
+
+    Returns:
+        list: REG a COD_CTA (37 campos)
+    """
+    ipi = bool(item.cst_ipi)
+
+    return [
+        "C170", numero, codigo_item(item), "", valor(item.quantidade, 5), unidade(item),
+        valor(item.valor_total), valor(item.valor_desconto), "0", cst_icms(item), item.cfop, "",
+        valor(item.base_icms), valor(item.aliquota_icms), valor(item.valor_icms),
+        valor(item.base_icms_st), valor(item.aliquota_icms_st), valor(item.valor_icms_st),
+        "0" if ipi else "", item.cst_ipi, item.codigo_enquadramento_ipi if ipi else "",
+        valor(item.base_ipi) if ipi else "", valor(item.aliquota_ipi) if ipi else "",
+        valor(item.valor_ipi) if ipi else "",
+        *campos_contribuicao(item.cst_pis, item.base_pis, item.aliquota_pis, item.quantidade, item.valor_pis),
+        *campos_contribuicao(
+            item.cst_cofins, item.base_cofins, item.aliquota_cofins, item.quantidade, item.valor_cofins
+        ),
+        "",
+    ]
+
+
+def campos_contribuicao(cst, base, aliquota, quantidade, valor_contribuicao):
+    """
+    CST, VL_BC, ALIQ, QUANT_BC, ALIQ_QUANT e VL do PIS ou da COFINS (C170/C175)
+
+    Com alíquota por unidade de medida, a quantidade e a alíquota em reais
+    ocupam QUANT_BC e ALIQ_QUANT, e a base e a alíquota percentual ficam vazias.
+    """
+    if cst in CST_ALIQUOTA_QUANTIDADE:
+        return [cst, "", "", valor(quantidade, 3), valor(aliquota, 4), valor(valor_contribuicao)]
+    return [cst, valor(base), valor(aliquota, 4), "", "", valor(valor_contribuicao)]
+
+
+def cst_icms(item):
+    """CST do ICMS com a origem da mercadoria (3 dígitos; 4 com CSOSN)"""
+    cst = (item.cst_icms or "").strip()
+    return f"{item.origem or '0'}{cst}" if cst else ""
+
+
+def situacao(nota):
+    """COD_SIT da nota"""
+    if nota.status == "Autorizada" and (nota.finalidade or "").startswith("2"):
+        return SITUACAO_COMPLEMENTAR
+    return SITUACAO[nota.status]
+
+
+def codigo_participante(codigo):
+    return (codigo or "")[:60]
+
+
+def codigo_item(item):
+    return (item.item_code or item.item_name or "")[:60]
+
+
+def unidade(item):
+    return (item.unidade or "UN").upper()[:6]
+
+
+def iterar_consulta(consulta, valores=None):
+    """
+    Percorre o resultado de uma consulta com cursor do servidor
+
+    As linhas são lidas do banco conforme consumidas, sem carregar o resultado
+    na memória. Enquanto a iteração não termina a conexão fica ocupada: nenhuma
+    outra consulta pode ser feita até o fim (ou o fechamento) do gerador.
+
+    Yields:
+        frappe._dict: Linha do resultado
+    """
+    with frappe.db.unbuffered_cursor():
+        yield from frappe.db.sql(consulta, valores, as_dict=True, as_iterator=True)
+
+
+def valor(numero, casas=2):
+    """Número no formato SPED (vírgula decimal, sem separador de milhar)"""
+    return f"{flt(numero):.{casas}f}".replace(".", ",")
+
+
+def data(valor_data):
+    """Data no formato SPED (DDMMAAAA)"""
+    return getdate(valor_data).strftime("%d%m%Y") if valor_data else ""
+
+
+def somente_digitos(texto):
+    return "".join(c for c in str(texto or "") if c.isdigit())
+
+
+def _campo(campo):
+    if campo is None:
+        return ""
+    # "|" e quebras de linha não podem aparecer dentro de um campo
+    return str(campo).replace("|", " ").replace("\r", " ").replace("\n", " ").strip()
@@ -7,11 +7,19 @@ import frappe
 from frappe import _
 from frappe.utils import now_datetime
 from lxml import etree
+import hashlib
 import requests
+import re
 import ssl
 import tempfile
 import os
 
+# Máximo de eventos por lote (envEvento)
+MAX_EVENTOS_LOTE = 20
+
+# Condições de uso da carta de correção (xCondUso)
+CONDICOES_USO_CCE = "A Carta de Correcao e disciplinada pelo paragrafo 1o-A do art. 7o do Convenio S/N, de 15 de dezembro de 1970 e pode ser utilizada para regularizacao de erro ocorrido na emissao de documento fiscal, desde que o erro nao esteja relacionado com: I - as variaveis que determinam o valor do imposto tais como: base de calculo, aliquota, diferenca de preco, quantidade, valor da operacao ou da prestacao; II - a correcao de dados cadastrais que implique mudanca do remetente ou do destinatario; III - a data de emissao ou de saida."
+
 # URLs dos Web Services da SEFAZ por UF e ambiente
 SEFAZ_URLS = {
     "SP": {
@@ -68,6 +76,10 @@ UF_AUTORIZADOR = {
 }
 
 
+class FalhaComunicacao(Exception):
+    """Requisição sem resposta da SEFAZ (timeout ou conexão): pode ter sido processada"""
+
+
 class SEFAZTransmitter:
     """Transmissor de documentos para a SEFAZ"""
     
@@ -82,6 +94,9 @@ class SEFAZTransmitter:
         self.config = self._get_config()
         self.cert_file = None
         self.key_file = None
+        self._limitadores = {}
+        self._ultimo_servico = None
+        self._ultimo_autorizador = None
         self._prepare_certificate()
     
     def _get_config(self):
@@ -144,8 +159,40 @@ class SEFAZTransmitter:
         
         return urls_ambiente.get(servico)
     
-    def _send_request(self, url, xml_body, soap_action):
-        """Envia requisição SOAP para a SEFAZ"""
+    def _get_limitador(self, autorizador=None):
+        """Retorna o limitador de consumo do CNPJ no autorizador (padrão: autorizador da UF)"""
+        from erpnext_fiscal_br.services.rate_limiter import SEFAZRateLimiter
+        
+        autorizador = autorizador or UF_AUTORIZADOR.get(self.config.uf_emissao, "SVRS")
+        if autorizador not in self._limitadores:
+            self._limitadores[autorizador] = SEFAZRateLimiter(self.config.cnpj, autorizador)
+        return self._limitadores[autorizador]
+    
+    def _send_request(self, url, xml_body, soap_action, servico=None, chave_dedup=None, autorizador=None):
+        """
+        Envia requisição SOAP para a SEFAZ
+        
+        Args:
+            url: URL do serviço
+            xml_body: Conteúdo do nfeDadosMsg
+            soap_action: SOAPAction
+            servico: Nome do serviço, para o limitador de consumo
+            chave_dedup: Identificador lógico da requisição (chave, Id do evento...)
+            autorizador: Autorizador do serviço, se diferente do da UF (ex: AN)
+        
+        Returns:
+            bytes: Resposta da SEFAZ
+        """
+        limitador = self._get_limitador(autorizador) if servico else None
+        self._ultimo_servico = servico
+        self._ultimo_autorizador = autorizador
+        
+        # Consultas idênticas feitas há pouco reutilizam a resposta
+        if limitador:
+            resposta = limitador.resposta_recente(servico, xml_body)
+            if resposta is not None:
+                return resposta
+        
         # Envelope SOAP (sem espaços extras para evitar erro de caracteres de edição)
         soap_envelope = f'<?xml version="1.0" encoding="UTF-8"?><soap12:Envelope xmlns:soap12="http://www.w3.org/2003/05/soap-envelope" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema"><soap12:Body>{xml_body}</soap12:Body></soap12:Envelope>'
         
@@ -162,78 +209,66 @@ class SEFAZTransmitter:
             ambiente = self.config.get_ambiente_codigo()
             verify_ssl = ambiente == "1"  # Só verifica em produção
             
-            response = requests.post(
-                url,
-                data=soap_envelope.encode('utf-8'),
-                headers=headers,
-                cert=(self.cert_file.name, self.key_file.name),
-                timeout=timeout,
-                verify=verify_ssl
-            )
+            if limitador:
+                with limitador.requisicao(servico, chave_dedup):
+                    response = self._post(url, soap_envelope, headers, timeout, verify_ssl)
+                limitador.guardar_resposta(servico, xml_body, response.content)
+            else:
+                response = self._post(url, soap_envelope, headers, timeout, verify_ssl)
             
-            response.raise_for_status()
-            return response.text
+            return response.content
             
         except requests.exceptions.SSLError as e:
             frappe.log_error(f"Erro SSL na comunicação com SEFAZ: {str(e)}")
             raise Exception(f"Erro de certificado: {str(e)}")
         
         except requests.exceptions.Timeout:
-            raise Exception("Timeout na comunicação com a SEFAZ")
+            raise FalhaComunicacao("Timeout na comunicação com a SEFAZ")
         
         except requests.exceptions.RequestException as e:
             frappe.log_error(f"Erro na comunicação com SEFAZ: {str(e)}")
-            raise Exception(f"Erro de comunicação: {str(e)}")
+            raise FalhaComunicacao(f"Erro de comunicação: {str(e)}")
+    
+    def _post(self, url, soap_envelope, headers, timeout, verify_ssl):
+        """Executa o POST com o certificado do emitente"""
+        response = requests.post(
+            url,
+            data=soap_envelope.encode('utf-8'),
+            headers=headers,
+            cert=(self.cert_file.name, self.key_file.name),
+            timeout=timeout,
+            verify=verify_ssl
+        )
+        response.raise_for_status()
+        return response
     
     def _parse_response(self, response_xml, tag_retorno):
         """Parse da resposta da SEFAZ"""
+        from erpnext_fiscal_br.services.sefaz_response import parse_resposta, RespostaInvalida
+        
         try:
-            # Remove todos os namespaces para facilitar o parse
-            import re
-            # Remove declarações de namespace
-            clean_xml = re.sub(r'\sxmlns[^=]*="[^"]*"', '', response_xml)
-            # Remove prefixos de namespace nas tags
-            clean_xml = re.sub(r'<(/?)[\w]+:', r'<\1', clean_xml)
-            
-            root = etree.fromstring(clean_xml.encode('utf-8'))
-            
-            # Procura tag de retorno
-            retorno = root.find(f'.//{tag_retorno}')
-            if retorno is None:
-                # Tenta encontrar em qualquer lugar
-                for elem in root.iter():
-                    if elem.tag == tag_retorno or elem.tag.endswith(tag_retorno):
-                        retorno = elem
-                        break
-            
-            if retorno is None:
-                # Log para debug
-                frappe.log_error(f"Tag {tag_retorno} não encontrada na resposta:\n{clean_xml[:2000]}", "SEFAZ Response Debug")
-                return {"cStat": "999", "xMotivo": f"Resposta inválida da SEFAZ - tag {tag_retorno} não encontrada"}
-            
-            resultado = {}
-            
-            # Extrai campos principais
-            for campo in ['cStat', 'xMotivo', 'nProt', 'dhRecbto', 'chNFe', 'cUF', 'tpAmb', 'nRec']:
-                elem = retorno.find(f'.//{campo}')
-                if elem is not None and elem.text:
-                    resultado[campo] = elem.text
-            
-            # Procura protNFe
-            prot_nfe = retorno.find('.//protNFe')
-            if prot_nfe is not None:
-                inf_prot = prot_nfe.find('.//infProt')
-                if inf_prot is not None:
-                    for campo in ['cStat', 'xMotivo', 'nProt', 'dhRecbto', 'chNFe', 'digVal']:
-                        elem = inf_prot.find(f'.//{campo}')
-                        if elem is not None and elem.text:
-                            resultado[campo] = elem.text
-            
-            return resultado
+            resultado = parse_resposta(response_xml, tag_retorno)
+        
+        except RespostaInvalida:
+            # Log para debug
+            frappe.log_error(f"Tag {tag_retorno} não encontrada na resposta:\n{self._trecho_resposta(response_xml)}", "SEFAZ Response Debug")
+            return {"cStat": "999", "xMotivo": f"Resposta inválida da SEFAZ - tag {tag_retorno} não encontrada"}
             
         except Exception as e:
-            frappe.log_error(f"Erro ao parsear resposta SEFAZ: {str(e)}\n{response_xml[:2000]}", "SEFAZ Parse Error")
+            frappe.log_error(f"Erro ao parsear resposta SEFAZ: {str(e)}\n{self._trecho_resposta(response_xml)}", "SEFAZ Parse Error")
             return {"cStat": "999", "xMotivo": f"Erro ao processar resposta: {str(e)}"}
+        
+        # Consumo indevido: a SEFAZ bloqueia o serviço por 1 hora, bloqueia localmente também
+        if resultado.get("cStat") == "656" and self._ultimo_servico:
+            self._get_limitador(self._ultimo_autorizador).registrar_consumo_indevido(self._ultimo_servico)
+        
+        return resultado
+    
+    def _trecho_resposta(self, response_xml, tamanho=2000):
+        """Retorna o início da resposta como texto, para logs"""
+        if isinstance(response_xml, bytes):
+            return response_xml[:tamanho].decode("utf-8", errors="replace")
+        return response_xml[:tamanho]
     
     def consultar_status_servico(self):
         """Consulta status do serviço da SEFAZ"""
@@ -244,7 +279,12 @@ class SEFAZTransmitter:
         
         xml_body = f'<nfeDadosMsg xmlns="http://www.portalfiscal.inf.br/nfe/wsdl/NFeStatusServico4"><consStatServ xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"><tpAmb>{ambiente}</tpAmb><cUF>{uf}</cUF><xServ>STATUS</xServ></consStatServ></nfeDadosMsg>'
         
-        response = self._send_request(url, xml_body, "http://www.portalfiscal.inf.br/nfe/wsdl/NFeStatusServico4/nfeStatusServicoNF")
+        response = self._send_request(
+            url,
+            xml_body,
+            "http://www.portalfiscal.inf.br/nfe/wsdl/NFeStatusServico4/nfeStatusServicoNF",
+            servico="NfeStatusServico"
+        )
         return self._parse_response(response, "retConsStatServ")
     
     def enviar_nfe(self, xml_assinado, modelo="55"):
@@ -273,10 +313,15 @@ class SEFAZTransmitter:
         
         xml_body = f'<nfeDadosMsg xmlns="http://www.portalfiscal.inf.br/nfe/wsdl/NFeAutorizacao4"><enviNFe xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00"><idLote>{id_lote}</idLote><indSinc>1</indSinc>{xml_nfe}</enviNFe></nfeDadosMsg>'
         
+        # Chave de acesso identifica a requisição: a mesma NFe não é enviada duas vezes em paralelo
+        match_chave = re.search(r'Id="NFe(\d{44})"', xml_nfe)
+        
         response = self._send_request(
             url, 
             xml_body, 
-            "http://www.portalfiscal.inf.br/nfe/wsdl/NFeAutorizacao4/nfeAutorizacaoLote"
+            "http://www.portalfiscal.inf.br/nfe/wsdl/NFeAutorizacao4/nfeAutorizacaoLote",
+            servico="NfeAutorizacao",
+            chave_dedup=match_chave.group(1) if match_chave else None
         )
         
         resultado = self._parse_response(response, "retEnviNFe")
@@ -285,18 +330,13 @@ class SEFAZTransmitter:
         if resultado.get("cStat") == "103":  # Lote recebido com sucesso
             recibo = resultado.get("nRec")
             if recibo:
-                return self.consultar_recibo(recibo, modelo)
-        
-        # Extrai XML processado se autorizado
-        if resultado.get("cStat") in ["100", "150"]:
-            try:
-                root = etree.fromstring(response.encode('utf-8'))
-                proc_nfe = root.find('.//{http://www.portalfiscal.inf.br/nfe}protNFe')
-                if proc_nfe is not None:
-                    # Monta procNFe
-                    resultado["xml_proc"] = self._montar_proc_nfe(xml_assinado, etree.tostring(proc_nfe, encoding='unicode'))
-            except:
-                pass
+                resultado = self.consultar_recibo(recibo, modelo)
+        
+        # Monta procNFe com o protNFe já extraído pelo parser
+        if resultado.get("cStat") in ["100", "150"] and resultado.get("prot_nfe") is not None:
+            resultado["xml_proc"] = self._montar_proc_nfe(
+                xml_assinado, etree.tostring(resultado["prot_nfe"], encoding='unicode')
+            )
         
         return resultado
     
@@ -311,7 +351,9 @@ class SEFAZTransmitter:
         response = self._send_request(
             url,
             xml_body,
-            "http://www.portalfiscal.inf.br/nfe/wsdl/NFeRetAutorizacao4/nfeRetAutorizacaoLote"
+            "http://www.portalfiscal.inf.br/nfe/wsdl/NFeRetAutorizacao4/nfeRetAutorizacaoLote",
+            servico="NfeRetAutorizacao",
+            chave_dedup=recibo
         )
         
         return self._parse_response(response, "retConsReciNFe")
@@ -327,7 +369,8 @@ class SEFAZTransmitter:
         response = self._send_request(
             url,
             xml_body,
-            "http://www.portalfiscal.inf.br/nfe/wsdl/NFeConsultaProtocolo4/nfeConsultaNF"
+            "http://www.portalfiscal.inf.br/nfe/wsdl/NFeConsultaProtocolo4/nfeConsultaNF",
+            servico="NfeConsultaProtocolo"
         )
         
         return self._parse_response(response, "retConsSitNFe")
@@ -346,35 +389,14 @@ class SEFAZTransmitter:
         """
         from erpnext_fiscal_br.services.signer import XMLSigner
         
-        url = self._get_url("RecepcaoEvento")
-        
-        ambiente = self.config.get_ambiente_codigo()
-        cnpj = self.config.cnpj
-        
-        # Monta evento de cancelamento
-        data_evento = now_datetime().strftime("%Y-%m-%dT%H:%M:%S-03:00")
-        id_evento = f"ID110111{chave_acesso}01"
-        
-        xml_evento = f'<?xml version="1.0" encoding="UTF-8"?><evento xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.00"><infEvento Id="{id_evento}"><cOrgao>{self.config.codigo_uf}</cOrgao><tpAmb>{ambiente}</tpAmb><CNPJ>{cnpj}</CNPJ><chNFe>{chave_acesso}</chNFe><dhEvento>{data_evento}</dhEvento><tpEvento>110111</tpEvento><nSeqEvento>1</nSeqEvento><verEvento>1.00</verEvento><detEvento versao="1.00"><descEvento>Cancelamento</descEvento><nProt>{protocolo}</nProt><xJust>{justificativa}</xJust></detEvento></infEvento></evento>'
+        id_evento, xml_evento = self.montar_evento(
+            chave_acesso, "110111", 1, detalhe_cancelamento(protocolo, justificativa)
+        )
         
         # Assina evento
         signer = XMLSigner(self.empresa)
-        xml_assinado = signer.sign(xml_evento)
-        
-        # Remove declaração XML
-        if xml_assinado.startswith('<?xml'):
-            xml_assinado = xml_assinado.split('?>', 1)[1].strip()
-        
-        id_lote = str(int(now_datetime().timestamp()))
-        xml_body = f'<nfeDadosMsg xmlns="http://www.portalfiscal.inf.br/nfe/wsdl/NFeRecepcaoEvento4"><envEvento xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.00"><idLote>{id_lote}</idLote>{xml_assinado}</envEvento></nfeDadosMsg>'
-        
-        response = self._send_request(
-            url,
-            xml_body,
-            "http://www.portalfiscal.inf.br/nfe/wsdl/NFeRecepcaoEvento4/nfeRecepcaoEvento"
-        )
         
-        return self._parse_response(response, "retEnvEvento")
+        return self.enviar_eventos([(id_evento, signer.sign(xml_evento))])
     
     def carta_correcao(self, chave_acesso, correcao, sequencia=1):
         """
@@ -390,32 +412,83 @@ class SEFAZTransmitter:
         """
         from erpnext_fiscal_br.services.signer import XMLSigner
         
-        url = self._get_url("RecepcaoEvento")
+        id_evento, xml_evento = self.montar_evento(
+            chave_acesso, "110110", sequencia, detalhe_carta_correcao(correcao)
+        )
+        
+        # Assina evento
+        signer = XMLSigner(self.empresa)
+        
+        return self.enviar_eventos([(id_evento, signer.sign(xml_evento))])
+    
+    def montar_evento(self, chave_acesso, tipo_evento, sequencia, detalhe, orgao=None):
+        """
+        Monta o XML (não assinado) de um evento da NF-e
         
+        Args:
+            chave_acesso: Chave de acesso da NFe
+            tipo_evento: Código do evento (tpEvento, ex: 110111)
+            sequencia: Número sequencial do evento (nSeqEvento)
+            detalhe: Conteúdo do detEvento (ex: detalhe_cancelamento)
+            orgao: Órgão de recepção (cOrgao; padrão: UF do emitente, 91 = Ambiente Nacional)
+        
+        Returns:
+            tuple: (Id do evento, XML do evento)
+        """
         ambiente = self.config.get_ambiente_codigo()
         cnpj = self.config.cnpj
         
         data_evento = now_datetime().strftime("%Y-%m-%dT%H:%M:%S-03:00")
-        id_evento = f"ID110110{chave_acesso}{str(sequencia).zfill(2)}"
+        id_evento = f"ID{tipo_evento}{chave_acesso}{str(sequencia).zfill(2)}"
         
-        xCondUso = "A Carta de Correcao e disciplinada pelo paragrafo 1o-A do art. 7o do Convenio S/N, de 15 de dezembro de 1970 e pode ser utilizada para regularizacao de erro ocorrido na emissao de documento fiscal, desde que o erro nao esteja relacionado com: I - as variaveis que determinam o valor do imposto tais como: base de calculo, aliquota, diferenca de preco, quantidade, valor da operacao ou da prestacao; II - a correcao de dados cadastrais que implique mudanca do remetente ou do destinatario; III - a data de emissao ou de saida."
+        xml_evento = f'<?xml version="1.0" encoding="UTF-8"?><evento xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.00"><infEvento Id="{id_evento}"><cOrgao>{orgao or self.config.codigo_uf}</cOrgao><tpAmb>{ambiente}</tpAmb><CNPJ>{cnpj}</CNPJ><chNFe>{chave_acesso}</chNFe><dhEvento>{data_evento}</dhEvento><tpEvento>{tipo_evento}</tpEvento><nSeqEvento>{sequencia}</nSeqEvento><verEvento>1.00</verEvento><detEvento versao="1.00">{detalhe}</detEvento></infEvento></evento>'
         
-        xml_evento = f'<?xml version="1.0" encoding="UTF-8"?><evento xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.00"><infEvento Id="{id_evento}"><cOrgao>{self.config.codigo_uf}</cOrgao><tpAmb>{ambiente}</tpAmb><CNPJ>{cnpj}</CNPJ><chNFe>{chave_acesso}</chNFe><dhEvento>{data_evento}</dhEvento><tpEvento>110110</tpEvento><nSeqEvento>{sequencia}</nSeqEvento><verEvento>1.00</verEvento><detEvento versao="1.00"><descEvento>Carta de Correcao</descEvento><xCorrecao>{correcao}</xCorrecao><xCondUso>{xCondUso}</xCondUso></detEvento></infEvento></evento>'
+        return id_evento, xml_evento
+    
+    def enviar_eventos(self, eventos, url=None, autorizador=None):
+        """
+        Envia um lote de eventos assinados em um único envEvento
         
-        # Assina evento
-        signer = XMLSigner(self.empresa)
-        xml_assinado = signer.sign(xml_evento)
+        Todos os eventos do lote vão para o mesmo autorizador; cada retEvento
+        da resposta fica em "eventos" (ver sefaz_response.parse_resposta).
         
-        if xml_assinado.startswith('<?xml'):
-            xml_assinado = xml_assinado.split('?>', 1)[1].strip()
+        Args:
+            eventos: Lista de tuplas (Id do evento, XML assinado), no máximo MAX_EVENTOS_LOTE
+            url: URL do RecepcaoEvento (padrão: autorizador da UF)
+            autorizador: Autorizador da URL, se diferente do da UF (ex: AN)
         
-        id_lote = str(int(now_datetime().timestamp()))
-        xml_body = f'<nfeDadosMsg xmlns="http://www.portalfiscal.inf.br/nfe/wsdl/NFeRecepcaoEvento4"><envEvento xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.00"><idLote>{id_lote}</idLote>{xml_assinado}</envEvento></nfeDadosMsg>'
+        Returns:
+            dict: Resultado do lote
+        """
+        if not eventos or len(eventos) > MAX_EVENTOS_LOTE:
+            frappe.throw(_("Um lote deve ter de 1 a {0} eventos").format(MAX_EVENTOS_LOTE))
+        
+        url = url or self._get_url("RecepcaoEvento")
+        
+        xmls = []
+        for _id_evento, xml_assinado in eventos:
+            # Remove declaração XML
+            if xml_assinado.startswith('<?xml'):
+                xml_assinado = xml_assinado.split('?>', 1)[1].strip()
+            xmls.append(xml_assinado)
+        
+        ids = sorted(id_evento for id_evento, _xml in eventos)
+        if len(ids) == 1:
+            chave_dedup = ids[0]
+        else:
+            chave_dedup = hashlib.sha1("|".join(ids).encode()).hexdigest()
+        
+        # idLote: até 15 dígitos
+        id_lote = str(int(now_datetime().timestamp() * 1000))[-15:]
+        xml_body = f'<nfeDadosMsg xmlns="http://www.portalfiscal.inf.br/nfe/wsdl/NFeRecepcaoEvento4"><envEvento xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.00"><idLote>{id_lote}</idLote>{"".join(xmls)}</envEvento></nfeDadosMsg>'
         
         response = self._send_request(
             url,
             xml_body,
-            "http://www.portalfiscal.inf.br/nfe/wsdl/NFeRecepcaoEvento4/nfeRecepcaoEvento"
+            "http://www.portalfiscal.inf.br/nfe/wsdl/NFeRecepcaoEvento4/nfeRecepcaoEvento",
+            servico="RecepcaoEvento",
+            chave_dedup=chave_dedup,
+            autorizador=autorizador
         )
         
         return self._parse_response(response, "retEnvEvento")
@@ -459,7 +532,9 @@ class SEFAZTransmitter:
         response = self._send_request(
             url,
             xml_body,
-            "http://www.portalfiscal.inf.br/nfe/wsdl/NFeInutilizacao4/nfeInutilizacaoNF"
+            "http://www.portalfiscal.inf.br/nfe/wsdl/NFeInutilizacao4/nfeInutilizacaoNF",
+            servico="NfeInutilizacao",
+            chave_dedup=id_inut
         )
         
         return self._parse_response(response, "retInutNFe")
@@ -479,3 +554,13 @@ class SEFAZTransmitter:
 </nfeProc>'''
         
         return proc_nfe
+
+
+def detalhe_cancelamento(protocolo, justificativa):
+    """detEvento do cancelamento (110111)"""
+    return f'<descEvento>Cancelamento</descEvento><nProt>{protocolo}</nProt><xJust>{justificativa}</xJust>'
+
+
+def detalhe_carta_correcao(correcao):
+    """detEvento da carta de correção (110110)"""
+    return f'<descEvento>Carta de Correcao</descEvento><xCorrecao>{correcao}</xCorrecao><xCondUso>{CONDICOES_USO_CCE}</xCondUso>'
@@ -111,6 +111,16 @@ class NFValidator:
                 self.errors.append(_("IE do destinatário é obrigatória para contribuinte ICMS"))
             elif self.nf.uf and not validar_inscricao_estadual(self.nf.ie_destinatario, self.nf.uf):
                 self.warnings.append(_("IE do destinatário pode estar inválida"))
+            
+            # Situação cadastral na SEFAZ (somente cache, sem consulta na emissão)
+            if self.nf.uf and self.nf.cpf_cnpj_destinatario:
+                from erpnext_fiscal_br.services.cadastro import verificar_destinatario
+                
+                erros, avisos = verificar_destinatario(
+                    self.nf.uf, self.nf.cpf_cnpj_destinatario, self.nf.ie_destinatario
+                )
+                self.errors.extend(erros)
+                self.warnings.extend(avisos)
     
     def _validate_endereco(self):
         """Valida endereço do destinatário"""
@@ -83,7 +83,8 @@ def retry_pending_notes():
     Tenta reenviar notas pendentes
     Executado a cada hora
     """
-    # Busca notas com status Pendente ou Processando há mais de 5 minutos
+    # Busca notas Pendentes há mais de 5 minutos
+    # (notas em Processando podem ter sido autorizadas: são tratadas por reconciliar_notas_processando)
     from datetime import timedelta
     
     cutoff_time = now_datetime() - timedelta(minutes=5)
@@ -91,12 +92,14 @@ def retry_pending_notes():
     pending_notes = frappe.get_all(
         "Nota Fiscal",
         filters={
-            "status": ["in", ["Pendente", "Processando"]],
+            "status": "Pendente",
             "modified": ["<", cutoff_time]
         },
         fields=["name"]
     )
     
+    from erpnext_fiscal_br.services.rate_limiter import LimiteConsumoExcedido
+    
     for note in pending_notes:
         try:
             nf = frappe.get_doc("Nota Fiscal", note.name)
@@ -113,6 +116,11 @@ def retry_pending_notes():
                 nf.emitir()
                 frappe.db.commit()
                 
+        except LimiteConsumoExcedido:
+            # SEFAZ sem capacidade para este CNPJ: as demais ficam para a próxima execução
+            frappe.db.commit()
+            break
+                
         except Exception as e:
             frappe.log_error(
                 f"Erro ao reenviar nota {note.name}: {str(e)}",
@@ -120,6 +128,22 @@ def retry_pending_notes():
             )
 
 
+def reconciliar_notas_processando():
+    """
+    Enfileira a reconciliação das notas presas em Processando
+    Executado a cada 10 minutos
+    """
+    if not frappe.db.exists("Nota Fiscal", {"status": "Processando"}):
+        return
+    
+    frappe.enqueue(
+        "erpnext_fiscal_br.services.reconciliacao.reconciliar_notas_processando",
+        queue="long",
+        job_id="reconciliar_notas_processando",
+        deduplicate=True
+    )
+
+
 def daily_fiscal_report():
     """
     Gera relatório diário de notas fiscais
@@ -127,17 +151,14 @@ def daily_fiscal_report():
     """
     yesterday = add_days(getdate(), -1)
     
-    # Conta notas por status
-    stats = {}
-    for status in ["Autorizada", "Cancelada", "Rejeitada"]:
-        count = frappe.db.count(
-            "Nota Fiscal",
-            filters={
-                "status": status,
-                "creation": ["between", [yesterday, getdate()]]
-            }
-        )
-        stats[status] = count
+    # Totais por status a partir do resumo fiscal diário
+    from erpnext_fiscal_br.services.resumo_fiscal import totais_por_status
+    
+    stats = {
+        linha.status: int(linha.quantidade)
+        for linha in totais_por_status(de=yesterday, ate=yesterday)
+        if linha.status in ("Autorizada", "Cancelada", "Rejeitada")
+    }
     
     # Se não houver notas, não envia
     total = sum(stats.values())
@@ -176,8 +197,178 @@ def daily_fiscal_report():
 
 def cleanup_old_xml_files():
     """
-    Remove arquivos XML antigos (mais de 5 anos)
-    Executado mensalmente
+    Manutenção do arquivo fiscal de XMLs
+    Executado mensalmente: migra anexos XML antigos, remove os XMLs com prazo de
+    guarda vencido (5 anos), compacta os segmentos e limpa o cache de DANFEs
+    """
+    from erpnext_fiscal_br.services import archive, danfe_cache
+    
+    archive.migrar_anexos_xml(limite=5000)
+    
+    removidos = archive.aplicar_retencao()
+    resultado = archive.compactar()
+    danfe_cache.limpar_cache()
+    
+    if removidos or resultado["segmentos"]:
+        frappe.logger("erpnext_fiscal_br").info(
+            f"Arquivo fiscal: anos removidos {removidos}, "
+            f"{resultado['segmentos']} segmentos compactados, {resultado['bytes_liberados']} bytes liberados"
+        )
+
+
+def inutilizar_lacunas_numeracao():
+    """
+    Enfileira a inutilização das lacunas da numeração das empresas habilitadas
+    Executado diariamente
+    """
+    empresas = frappe.get_all(
+        "Configuracao Fiscal",
+        filters={"inutilizar_lacunas": 1},
+        pluck="empresa"
+    )
+    
+    for empresa in empresas:
+        frappe.enqueue(
+            "erpnext_fiscal_br.tasks.inutilizar_lacunas_empresa",
+            queue="long",
+            job_id=f"inutilizar_lacunas::{empresa}",
+            deduplicate=True,
+            empresa=empresa
+        )
+
+
+def inutilizar_lacunas_empresa(empresa):
+    """Inutiliza as lacunas da numeração de uma empresa"""
+    from erpnext_fiscal_br.services.inutilizacao import inutilizar_lacunas
+    
+    try:
+        resultado = inutilizar_lacunas(empresa)
+    except Exception as e:
+        frappe.log_error(
+            f"Erro ao inutilizar lacunas da empresa {empresa}: {str(e)}",
+            "Inutilização de Lacunas"
+        )
+        return
+    
+    if resultado.get("Rejeitada") or resultado.get("Erro"):
+        frappe.log_error(
+            f"Inutilização de lacunas da empresa {empresa}: {resultado}",
+            "Inutilização de Lacunas"
+        )
+
+
+def sincronizar_distribuicao_dfe():
+    """
+    Enfileira a sincronização da Distribuição DF-e das empresas habilitadas
+    Executado a cada 15 minutos; cada empresa respeita o intervalo exigido pela SEFAZ
     """
-    # Implementação futura
-    pass
+    empresas = frappe.get_all(
+        "Configuracao Fiscal",
+        filters={"sincronizar_dfe": 1},
+        or_filters=[
+            ["proxima_consulta_dfe", "is", "not set"],
+            ["proxima_consulta_dfe", "<=", now_datetime()]
+        ],
+        pluck="empresa"
+    )
+    
+    for empresa in empresas:
+        frappe.enqueue(
+            "erpnext_fiscal_br.tasks.sincronizar_distribuicao_empresa",
+            queue="long",
+            job_id=f"distribuicao_dfe::{empresa}",
+            deduplicate=True,
+            empresa=empresa
+        )
+
+
+def sincronizar_distribuicao_empresa(empresa):
+    """
+    Sincroniza os documentos recebidos de uma empresa a partir do último NSU
+    e, se habilitado, manifesta a Ciência da Operação dos resumos novos
+    """
+    from erpnext_fiscal_br.services.distribuicao import DistribuicaoDFe
+    from erpnext_fiscal_br.services.manifestacao import manifestar_ciencia_pendentes
+    
+    try:
+        DistribuicaoDFe(empresa).sincronizar()
+    except Exception as e:
+        frappe.log_error(
+            f"Erro na distribuição DF-e da empresa {empresa}: {str(e)}",
+            "Distribuição DF-e"
+        )
+    
+    if not frappe.db.get_value("Configuracao Fiscal", {"empresa": empresa}, "manifestar_ciencia"):
+        return
+    
+    try:
+        # Os XMLs completos liberados pela ciência chegam nas próximas sincronizações
+        manifestar_ciencia_pendentes(empresa)
+    except Exception as e:
+        frappe.log_error(
+            f"Erro na manifestação da empresa {empresa}: {str(e)}",
+            "Manifestação do Destinatário"
+        )
+
+
+def indexar_xmls_fiscais():
+    """
+    Enfileira o indexador do Índice Fiscal se houver XMLs arquivados não indexados
+    Executado a cada 10 minutos; notas autorizadas e eventos já o enfileiram na hora
+    """
+    from erpnext_fiscal_br.services import indice_fiscal
+    
+    if frappe.db.exists("Arquivo Fiscal", {"indexado": 0, "tipo": ["in", indice_fiscal.TIPOS_INDEXADOS]}):
+        indice_fiscal.agendar()
+
+
+def atualizar_cadastro_clientes(empresa=None):
+    """
+    Atualiza o cache de situação cadastral (CadConsultaCadastro) dos clientes contribuintes
+    Executado semanalmente
+    """
+    from erpnext_fiscal_br.services.cadastro import atualizar_cadastros
+    from erpnext_fiscal_br.utils.ibge import UF_CODES
+    
+    empresa = empresa or _get_empresa_com_certificado()
+    if not empresa:
+        return
+    
+    # UF do endereço principal ou, sem ele, do primeiro endereço vinculado
+    clientes = frappe.db.sql("""
+        SELECT c.cpf_cnpj, COALESCE(ap.state, MIN(a.state)) AS uf
+        FROM `tabCustomer` c
+        LEFT JOIN `tabAddress` ap ON ap.name = c.customer_primary_address
+        LEFT JOIN `tabDynamic Link` dl
+            ON dl.link_doctype = 'Customer' AND dl.link_name = c.name AND dl.parenttype = 'Address'
+        LEFT JOIN `tabAddress` a ON a.name = dl.parent
+        WHERE c.disabled = 0
+            AND c.contribuinte_icms LIKE '1%%'
+            AND LENGTH(c.cpf_cnpj) = 14
+        GROUP BY c.name, c.cpf_cnpj, ap.state
+    """, as_dict=True)
+    
+    consultas = [
+        (cliente.uf.upper(), cliente.cpf_cnpj)
+        for cliente in clientes
+        if cliente.uf and cliente.uf.upper() in UF_CODES
+    ]
+    
+    resultado = atualizar_cadastros(empresa, consultas)
+    
+    if resultado["erros"] or resultado["limitadas"]:
+        frappe.log_error(
+            f"Atualização do cadastro de clientes: {resultado}",
+            "Consulta Cadastro"
+        )
+
+
+def _get_empresa_com_certificado():
+    """Retorna a primeira empresa com configuração fiscal e certificado válido"""
+    from erpnext_fiscal_br.fiscal_br.doctype.certificado_digital.certificado_digital import CertificadoDigital
+    
+    for empresa in frappe.get_all("Configuracao Fiscal", pluck="empresa"):
+        if CertificadoDigital.get_valid_certificate(empresa):
+            return empresa
+    
+    return None
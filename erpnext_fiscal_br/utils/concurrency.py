@@ -0,0 +1,84 @@
+"""
+Execução paralela de tarefas com conexão própria ao site por thread
+"""
+
+import queue
+import threading
+
+import frappe
+
+
+def executar_em_paralelo(funcao, itens, max_workers=4, preparar_thread=None):
+    """
+    Executa funcao(item, contexto) para cada item em um conjunto de threads
+
+    Cada thread inicializa o site (frappe.init/connect) uma vez, processa itens
+    de uma fila comum e faz commit após cada item. O contexto é criado por
+    preparar_thread() uma vez por thread (ex: um SEFAZTransmitter, que não
+    deve ser compartilhado entre threads).
+
+    Args:
+        funcao: Função chamada com (item, contexto)
+        itens: Lista de itens
+        max_workers: Número máximo de threads
+        preparar_thread: Função sem argumentos que retorna o contexto da thread (opcional)
+
+    Returns:
+        list: Tuplas (item, resultado, erro) na ordem dos itens
+    """
+    itens = list(itens)
+    if not itens:
+        return []
+
+    site = frappe.local.site
+    sites_path = frappe.local.sites_path
+    usuario = frappe.session.user
+
+    fila = queue.Queue()
+    for indice, item in enumerate(itens):
+        fila.put((indice, item))
+
+    resultados = [None] * len(itens)
+
+    def worker():
+        frappe.init(site=site, sites_path=sites_path)
+        try:
+            frappe.connect()
+            frappe.set_user(usuario)
+
+            contexto, erro_contexto = None, None
+            if preparar_thread:
+                try:
+                    contexto = preparar_thread()
+                except Exception as e:
+                    erro_contexto = e
+
+            while True:
+                try:
+                    indice, item = fila.get_nowait()
+                except queue.Empty:
+                    break
+
+                if erro_contexto is not None:
+                    resultados[indice] = (item, None, erro_contexto)
+                    continue
+
+                try:
+                    resultados[indice] = (item, funcao(item, contexto), None)
+                    frappe.db.commit()
+                except Exception as e:
+                    frappe.db.rollback()
+                    resultados[indice] = (item, None, e)
+        finally:
+            frappe.destroy()
+
+    threads = [
+        threading.Thread(target=worker, daemon=True)
+        for _i in range(min(max_workers, len(itens)))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return resultados
@@ -0,0 +1,129 @@
+"""
+Concatenação de PDFs em fluxo
+Junta os DANFEs gerados pelo ReportLab em um único PDF gravando os objetos
+direto no arquivo de saída, sem manter os documentos de entrada em memória
+"""
+
+import re
+
+_REFERENCIA = re.compile(rb"(\d+) 0 R\b")
+_CABECALHO_OBJETO = re.compile(rb"^\s*(\d+) 0 obj")
+_TIPO = re.compile(rb"/Type\s*/(\w+)")
+_PARENT = re.compile(rb"/Parent\s+\d+ 0 R")
+
+# Catálogo e árvore de páginas do PDF final (recriados no fechamento)
+OBJ_CATALOGO = 1
+OBJ_PAGINAS = 2
+
+
+class ConcatenadorPDF:
+    """
+    Grava em um arquivo as páginas de vários PDFs, um de cada vez
+
+    Os objetos de cada PDF de entrada são renumerados e escritos na hora; só
+    as posições dos objetos e a lista de páginas ficam em memória. Suporta a
+    estrutura gerada pelo ReportLab (tabela xref clássica, sem object streams).
+    """
+
+    def __init__(self, arquivo):
+        """
+        Args:
+            arquivo: Arquivo binário aberto para escrita
+        """
+        self.arquivo = arquivo
+        self.posicoes = {}
+        self.paginas = []
+        self.proximo = OBJ_PAGINAS + 1
+
+        self._escrever(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _escrever(self, dados):
+        self.arquivo.write(dados)
+
+    def adicionar(self, pdf):
+        """
+        Acrescenta todas as páginas de um PDF
+
+        Args:
+            pdf: Conteúdo do PDF (bytes)
+        """
+        objetos = _objetos(pdf)
+        base = self.proximo - 1
+
+        def renumerar(trecho):
+            return _REFERENCIA.sub(lambda m: b"%d 0 R" % (int(m.group(1)) + base), trecho)
+
+        for numero, corpo in objetos:
+            # Dicionário antes do stream: só nele há referências a renumerar
+            inicio_stream = corpo.find(b"stream")
+            dicionario = corpo if inicio_stream < 0 else corpo[:inicio_stream]
+
+            tipo = _TIPO.search(dicionario)
+            tipo = tipo.group(1) if tipo else None
+            if tipo in (b"Catalog", b"Pages"):
+                continue
+
+            dicionario = renumerar(dicionario)
+            if tipo == b"Page":
+                dicionario = _PARENT.sub(b"/Parent %d 0 R" % OBJ_PAGINAS, dicionario)
+                self.paginas.append(numero + base)
+
+            novo = numero + base
+            self.posicoes[novo] = self.arquivo.tell()
+            self._escrever(b"%d 0 obj\n" % novo + dicionario)
+            if inicio_stream >= 0:
+                self._escrever(corpo[inicio_stream:])
+            self._escrever(b"\nendobj\n")
+
+            self.proximo = max(self.proximo, novo + 1)
+
+    def fechar(self):
+        """Grava a árvore de páginas, o catálogo e a tabela xref"""
+        kids = b" ".join(b"%d 0 R" % pagina for pagina in self.paginas)
+
+        self.posicoes[OBJ_PAGINAS] = self.arquivo.tell()
+        self._escrever(
+            b"%d 0 obj\n<< /Type /Pages /Count %d /Kids [ %s ] >>\nendobj\n"
+            % (OBJ_PAGINAS, len(self.paginas), kids)
+        )
+        self.posicoes[OBJ_CATALOGO] = self.arquivo.tell()
+        self._escrever(b"%d 0 obj\n<< /Type /Catalog /Pages %d 0 R >>\nendobj\n" % (OBJ_CATALOGO, OBJ_PAGINAS))
+
+        inicio_xref = self.arquivo.tell()
+        linhas = [b"xref\n0 %d\n0000000000 65535 f \n" % self.proximo]
+        for numero in range(1, self.proximo):
+            posicao = self.posicoes.get(numero)
+            # Objetos descartados (catálogos e árvores de páginas de entrada) ficam livres
+            linhas.append(b"%010d 00000 n \n" % posicao if posicao is not None else b"0000000000 65535 f \n")
+        self._escrever(b"".join(linhas))
+        self._escrever(
+            b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (self.proximo, OBJ_CATALOGO, inicio_xref)
+        )
+
+
+def _objetos(pdf):
+    """
+    Lista (número, corpo) dos objetos de um PDF pela tabela xref
+
+    O corpo vai do fim de "N 0 obj" até antes de "endobj", com o stream
+    binário intacto.
+    """
+    inicio_xref = int(pdf[pdf.rindex(b"startxref") + 9:].split()[0])
+
+    linhas = pdf[inicio_xref:].split(b"\n")
+    # "xref", "0 N" e as N entradas de 20 bytes
+    total = int(linhas[1].split()[1])
+    posicoes = sorted(
+        int(linha[:10]) for linha in linhas[2:2 + total] if linha[17:18] == b"n"
+    )
+    posicoes.append(inicio_xref)
+
+    objetos = []
+    for inicio, fim in zip(posicoes, posicoes[1:]):
+        trecho = pdf[inicio:fim]
+        cabecalho = _CABECALHO_OBJETO.match(trecho)
+        corpo = trecho[cabecalho.end():trecho.rindex(b"endobj")].strip(b"\r\n")
+        objetos.append((int(cabecalho.group(1)), b"\n" + corpo))
+
+    return objetos